@@ -298,6 +298,63 @@ export const getAnalyticsOverview = async (
   }
 };
 
+// ===== Learner profile (hồ sơ học tập phía server) =====
+// Đồng bộ đầy đủ một lần, sau đó chỉ gửi sự kiện mới thay vì toàn bộ LearningData
+
+export type LearnerEvent =
+  | ({ type: 'quiz'; id?: string } & Partial<QuizAnalyticsResult> & { topic: string; score: number })
+  | ({ type: 'activity'; id?: string } & Partial<LearningActivity> & { topic: string; duration: number })
+  | { type: 'topics'; id?: string; topics: string[] };
+
+export interface LearnerProfileSummary {
+  learner_id: string;
+  version: number;
+  total_quizzes: number;
+  total_activities: number;
+  topics: number;
+  updated_at: string;
+  applied?: number;
+  duplicates?: number;
+}
+
+/**
+ * Tạo lại hồ sơ phía server từ LearningData đầy đủ (lần đồng bộ đầu tiên)
+ */
+export const syncLearnerProfile = async (
+  learnerId: string,
+  learningData: LearningData
+): Promise<LearnerProfileSummary> => {
+  const response = await apiClient.post<{ status: string; data: LearnerProfileSummary }>(
+    `/api/learners/${encodeURIComponent(learnerId)}/profile`,
+    { learning_data: learningData }
+  );
+  return response.data;
+};
+
+/**
+ * Gửi sự kiện học tập mới (kết quả quiz, activity, topic) vào hồ sơ
+ */
+export const appendLearnerEvents = async (
+  learnerId: string,
+  events: LearnerEvent[]
+): Promise<LearnerProfileSummary> => {
+  const response = await apiClient.post<{ status: string; data: LearnerProfileSummary }>(
+    `/api/learners/${encodeURIComponent(learnerId)}/events`,
+    { events }
+  );
+  return response.data;
+};
+
+/**
+ * Metrics tổng quan đọc từ hồ sơ phía server
+ */
+export const getLearnerOverview = async (learnerId: string): Promise<ProgressMetrics> => {
+  const response = await apiClient.get<{ status: string; data: ProgressMetrics }>(
+    `/api/learners/${encodeURIComponent(learnerId)}/overview`
+  );
+  return response.data;
+};
+
 /**
  * Lấy AI-driven insights về quá trình học tập (với polling)
  */
@@ -343,12 +400,17 @@ export const getTopicInsights = async (
     console.log(`📚 Getting insights for topic: ${topicName}`);
     
     // Tạo job
-    const createResponse = await apiClient.post<JobCreateResponse>(
+    const createResponse = await apiClient.post<JobCreateResponse<TopicInsights>>(
       `/api/analytics/topic/${encodeURIComponent(topicName)}`,
       { learning_data: learningData }
     );
     console.log('✅ Topic insights job created:', createResponse.job_id);
 
+    // Kết quả đã cache: server trả về ngay, không cần poll
+    if (createResponse.status === 'completed' && createResponse.result) {
+      return createResponse.result;
+    }
+
     // Poll cho đến khi hoàn thành
     let attempts = 0;
     while (attempts < POLLING_CONFIG.MAX_ATTEMPTS) {
@@ -399,12 +461,17 @@ export const generateStudyPlan = async (
     console.log('📝 Generating study plan...');
     
     // Tạo job
-    const createResponse = await apiClient.post<JobCreateResponse>(
+    const createResponse = await apiClient.post<JobCreateResponse<StudyPlan>>(
       '/api/analytics/study-plan',
       { learning_data: learningData }
     );
     console.log('✅ Study plan job created:', createResponse.job_id);
 
+    // Kết quả đã cache: server trả về ngay, không cần poll
+    if (createResponse.status === 'completed' && createResponse.result) {
+      return createResponse.result;
+    }
+
     // Poll cho đến khi hoàn thành
     let attempts = 0;
     while (attempts < POLLING_CONFIG.MAX_ATTEMPTS) {
@@ -5,8 +5,18 @@
 
 import apiClient from './apiClient';
 
+/**
+ * Output formats of the analysis: structured JSON, HTML, Markdown, Anki CSV deck or PDF flashcard
+ */
+export type PdfExportFormat = 'json' | 'html' | 'md' | 'csv' | 'pdf';
+
 export interface PdfAnalysisResult {
-  pdf_content: string; // base64 encoded PDF
+  download_url: string; // relative URL of the requested format (GET returns raw bytes, supports Range)
+  download_urls?: Partial<Record<PdfExportFormat, string>>; // every format, rendered on first download
+  format?: PdfExportFormat;
+  filename?: string;
+  size?: number;
+  content_type?: string;
   message?: string;
 }
 
@@ -26,12 +36,16 @@ export interface PdfJobResponse {
 /**
  * Create PDF analysis job - returns job_id immediately
  */
-export const createPdfAnalysisJob = async (file: File | Blob): Promise<string> => {
+export const createPdfAnalysisJob = async (
+  file: File | Blob,
+  format: PdfExportFormat = 'pdf'
+): Promise<string> => {
   try {
     console.log('📊 Creating PDF analysis job...');
 
     const formData = new FormData();
     formData.append('file', file);
+    formData.append('format', format);
 
     const response = await fetch(`${apiClient}/api/analyze-pdf`, {
       method: 'POST',
@@ -146,18 +160,40 @@ export const pollPdfJobStatus = async (
   throw new Error('Polling timeout - maximum attempts reached');
 };
 
+/**
+ * Absolute URL to download the generated PDF of a completed job
+ */
+export const getPdfFileUrl = (result: PdfAnalysisResult, format?: PdfExportFormat): string => {
+  const path = (format && result.download_urls?.[format]) || result.download_url;
+  return `${apiClient}${path}`;
+};
+
+/**
+ * Structured analysis (JSON) of a completed job - no PDF rendering needed
+ */
+export const getPdfAnalysisData = async (result: PdfAnalysisResult): Promise<any> => {
+  const response = await fetch(getPdfFileUrl(result, 'json'), {
+    headers: { 'Accept': 'application/json' },
+  });
+  if (!response.ok) {
+    throw new Error('Failed to get PDF analysis data');
+  }
+  return await response.json();
+};
+
 /**
  * Analyze PDF - complete flow (create job + poll for result)
  */
 export const analyzePdf = async (
   file: File | Blob,
-  onProgress?: (progress: number, message: string) => void
+  onProgress?: (progress: number, message: string) => void,
+  format: PdfExportFormat = 'pdf'
 ): Promise<PdfAnalysisResult> => {
   try {
     console.log('📊 Starting PDF analysis...');
 
     // Step 1: Create job
-    const jobId = await createPdfAnalysisJob(file);
+    const jobId = await createPdfAnalysisJob(file, format);
 
     // Step 2: Poll for result
     const result = await pollPdfJobStatus(jobId, 120, 1000, onProgress);
@@ -174,5 +210,7 @@ export default {
   createPdfAnalysisJob,
   getPdfJobStatus,
   pollPdfJobStatus,
+  getPdfFileUrl,
+  getPdfAnalysisData,
   analyzePdf,
 };
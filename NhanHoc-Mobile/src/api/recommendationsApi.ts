@@ -3,6 +3,7 @@
  * API endpoints cho personalized recommendations system
  */
 
+import { JobCreateResponse } from '../types/api';
 import apiClient from './apiClient';
 
 export interface QuizResult {
@@ -63,6 +64,16 @@ export interface DifficultyAdjustment {
   recommended_difficulty: 'beginner' | 'intermediate' | 'advanced' | 'expert';
   reason: string;
   adjustment_tips: string[];
+  // Chỉ số mà server dùng để quyết định (tính bằng luật cục bộ)
+  signals?: {
+    decision: string;
+    recent_avg: number;
+    std_dev: number;
+    trend_slope: number;
+    projected_score: number;
+    quizzes_considered: number;
+  };
+  enriched?: boolean; // true nếu lời giải thích do AI viết lại
 }
 
 export interface PerformanceMetrics {
@@ -97,9 +108,11 @@ export interface RecommendationsResponse {
 
 export interface JobResponse {
   job_id: string;
-  status: 'pending' | 'completed' | 'failed';
+  status: 'pending' | 'processing' | 'completed' | 'failed';
   message?: string;
   result?: RecommendationsData;
+  // Các phần đã xong khi job đang processing (performance, độ khó có trước; AI trả về sau)
+  partial_result?: Partial<RecommendationsData>;
   error?: string;
 }
 
@@ -161,11 +174,13 @@ export const getJobStatus = async (jobId: string): Promise<JobResponse> => {
 
 /**
  * Poll job status until completed or failed
+ * onPartial được gọi với partial_result mỗi lần poll khi job đang xử lý (hiển thị dần)
  */
 export const pollJobStatus = async (
   jobId: string,
   maxAttempts: number = 60,
-  interval: number = 2000
+  interval: number = 2000,
+  onPartial?: (partial: Partial<RecommendationsData>) => void
 ): Promise<RecommendationsData> => {
   let attempts = 0;
   let consecutiveErrors = 0;
@@ -190,6 +205,10 @@ export const pollJobStatus = async (
         throw new Error(jobData.error || 'Job failed');
       }
 
+      if (jobData.partial_result && onPartial) {
+        onPartial(jobData.partial_result);
+      }
+
       // Job is still pending, wait before next attempt
       console.log(`[Polling] Job still pending, waiting ${interval}ms...`);
       await new Promise(resolve => setTimeout(resolve, interval));
@@ -224,7 +243,8 @@ export const pollJobStatus = async (
  * This function creates a job, polls for completion, and returns the result
  */
 export const getPersonalizedRecommendations = async (
-  learningData: LearningData
+  learningData: LearningData,
+  onPartial?: (partial: Partial<RecommendationsData>) => void
 ): Promise<RecommendationsData> => {
   try {
     console.log('📊 Fetching personalized recommendations...');
@@ -233,7 +253,7 @@ export const getPersonalizedRecommendations = async (
     const jobId = await createRecommendationsJob(learningData);
     
     // Step 2: Poll for result
-    const result = await pollJobStatus(jobId);
+    const result = await pollJobStatus(jobId, 60, 2000, onPartial);
     
     console.log('✅ Recommendations received successfully');
     return result;
@@ -245,21 +265,40 @@ export const getPersonalizedRecommendations = async (
 
 /**
  * Get only next topics recommendations
+ * Server chạy phần này như background job; kết quả đã cache được trả về ngay
  */
 export const getNextTopics = async (
-  learningData: LearningData
+  learningData: LearningData,
+  maxAttempts: number = 60,
+  interval: number = 2000
 ): Promise<NextTopic[]> => {
   try {
-    const response = await apiClient.post<{ status: string; data: { next_topics: NextTopic[] } }>(
+    const createResponse = await apiClient.post<JobCreateResponse<{ next_topics: NextTopic[] }>>(
       '/api/recommendations/next-topics',
       { learning_data: learningData }
     );
 
-    if (response.status === 'success' && response.data) {
-      return response.data.next_topics;
-    } else {
-      throw new Error('Failed to get next topics');
+    if (createResponse.status === 'completed' && createResponse.result) {
+      return createResponse.result.next_topics;
     }
+
+    for (let attempts = 0; attempts < maxAttempts; attempts++) {
+      const jobData = await apiClient.get<{
+        status: 'pending' | 'processing' | 'completed' | 'failed';
+        result?: { next_topics: NextTopic[] };
+        error?: string;
+      }>(`/api/recommendations/next-topics/status/${createResponse.job_id}`);
+
+      if (jobData.status === 'completed' && jobData.result) {
+        return jobData.result.next_topics;
+      }
+      if (jobData.status === 'failed') {
+        throw new Error(jobData.error || 'Failed to get next topics');
+      }
+      await new Promise(resolve => setTimeout(resolve, interval));
+    }
+
+    throw new Error('Polling timeout - maximum attempts reached');
   } catch (error: any) {
     // console.error('❌ Error fetching next topics:', error);
     throw error;
@@ -8,7 +8,9 @@ import { API_BASE_URL } from '../config/api';
 import { colors } from '../constants/theme';
 
 interface PdfAnalysisResult {
-  pdf_content: string; // base64
+  download_url: string; // đường dẫn tải file PDF kết quả (tương đối với API_BASE_URL)
+  filename?: string;
+  size?: number;
   message?: string;
 }
 
@@ -29,7 +31,7 @@ export default function PdfAnalysis() {
   const [error, setError] = useState<string | null>(null);
   const [progress, setProgress] = useState(0);
   const [progressMessage, setProgressMessage] = useState('');
-  const [resultPdfBase64, setResultPdfBase64] = useState<string | null>(null);
+  const [resultPdfUrl, setResultPdfUrl] = useState<string | null>(null);
 
   const pickDocument = async () => {
     try {
@@ -42,7 +44,7 @@ export default function PdfAnalysis() {
         setSelectedFile(result.assets[0]);
         setError(null);
         setIsCompleted(false);
-        setResultPdfBase64(null);
+        setResultPdfUrl(null);
         console.log('📄 File selected:', result.assets[0].name);
       }
     } catch (err) {
@@ -170,7 +172,7 @@ export default function PdfAnalysis() {
           setProgress(100);
           setProgressMessage('Hoàn thành!');
 
-          setResultPdfBase64(jobData.result.pdf_content);
+          setResultPdfUrl(`${API_BASE_URL}${jobData.result.download_url}`);
           setIsCompleted(true);
           setIsAnalyzing(false);
           return;
@@ -211,17 +213,16 @@ export default function PdfAnalysis() {
   };
 
   const downloadResult = async () => {
-    if (!resultPdfBase64 || !selectedFile) return;
+    if (!resultPdfUrl || !selectedFile) return;
 
     try {
       if (Platform.OS === 'web') {
-        // Web: Use Blob and download link
-        const binaryString = atob(resultPdfBase64);
-        const bytes = new Uint8Array(binaryString.length);
-        for (let i = 0; i < binaryString.length; i++) {
-          bytes[i] = binaryString.charCodeAt(i);
+        // Web: Fetch file and use Blob download link
+        const fileResponse = await fetch(resultPdfUrl);
+        if (!fileResponse.ok) {
+          throw new Error('Không thể tải file PDF kết quả');
         }
-        const blob = new Blob([bytes], { type: 'application/pdf' });
+        const blob = await fileResponse.blob();
         const url = URL.createObjectURL(blob);
         const link = document.createElement('a');
         link.href = url;
@@ -236,10 +237,11 @@ export default function PdfAnalysis() {
         const fileName = `analyzed_${selectedFile.name}`;
         const fileUri = `${ExpoFileSystem.documentDirectory}${fileName}`;
         
-        // Write base64 to file
-        await ExpoFileSystem.writeAsStringAsync(fileUri, resultPdfBase64, {
-          encoding: 'base64',
-        });
+        // Download file directly to storage
+        const download = await ExpoFileSystem.downloadAsync(resultPdfUrl, fileUri);
+        if (download.status !== 200) {
+          throw new Error('Không thể tải file PDF kết quả');
+        }
 
         // Check if sharing is available
         const isAvailable = await ExpoSharing.isAvailableAsync();
@@ -267,7 +269,7 @@ export default function PdfAnalysis() {
   const resetAnalysis = () => {
     setSelectedFile(null);
     setIsCompleted(false);
-    setResultPdfBase64(null);
+    setResultPdfUrl(null);
     setError(null);
     setProgress(0);
     setProgressMessage('');
@@ -16,10 +16,13 @@ export interface BaseJobResponse {
   error?: string;
 }
 
-export interface JobCreateResponse {
+export interface JobCreateResponse<T = any> {
   job_id: string;
-  status: 'pending';
-  message: string;
+  status: 'pending' | 'completed';
+  message?: string;
+  // Kết quả đã cache: job hoàn thành ngay, không cần poll
+  result?: T;
+  cached?: boolean;
 }
 
 // ============= Roadmap API Types =============
@@ -2,26 +2,22 @@
 Module xử lý phân tích học tập (Learning Analytics) với AI
 Background jobs support
 """
-from openai import OpenAI
-import os
 from dotenv import load_dotenv
 import json
-from datetime import datetime, timedelta
+from datetime import datetime
 import uuid
-import threading
+import job_store
+import job_scheduler
+import response_cache
+import llm_gateway
+import learning_metrics
 
 load_dotenv()
 
-# Khởi tạo OpenAI client
-client = OpenAI(
-    api_key=os.getenv('OPENAI_API_KEY'),
-    base_url=os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
-)
+MODEL = llm_gateway.DEFAULT_MODEL
 
-MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
-
-# Lưu trữ trạng thái các job trong bộ nhớ
-analytics_job_storage = {}
+# Lưu trữ trạng thái các job (dùng chung giữa các worker)
+analytics_job_storage = job_store.get_store('analytics')
 
 
 def calculate_progress_metrics(learning_data):
@@ -34,76 +30,39 @@ def calculate_progress_metrics(learning_data):
     Returns:
         Dict chứa các metrics: total_time, avg_score, topics_studied, etc.
     """
-    activities = learning_data.get('learning_activities', [])
-    quiz_results = learning_data.get('quiz_results', [])
     time_spent = learning_data.get('time_spent', {})
     
+    # Gom quiz theo topic và các ngày học trong một lượt (xem learning_metrics.py)
+    stats = learning_metrics.aggregate(learning_data)
+    
     # Tính tổng thời gian học (seconds)
     total_time = sum(time_spent.values())
     
-    # Tính điểm trung bình quiz
-    if quiz_results:
-        avg_score = sum(q['score'] for q in quiz_results) / len(quiz_results)
-        total_quizzes = len(quiz_results)
-        passed_quizzes = sum(1 for q in quiz_results if q.get('passed', q['score'] >= 70))
-    else:
-        avg_score = 0
-        total_quizzes = 0
-        passed_quizzes = 0
-    
     # Số lượng topics đã học
     topics_studied = learning_data.get('current_topics', [])
     
     # Phân tích theo từng topic
     topic_breakdown = {}
     for topic in topics_studied:
-        topic_quizzes = [q for q in quiz_results if q['topic'] == topic]
-        topic_time = time_spent.get(topic, 0)
-        
+        topic_stats = stats.topic(topic)
         topic_breakdown[topic] = {
-            'time_spent': topic_time,
-            'quizzes_taken': len(topic_quizzes),
-            'avg_score': sum(q['score'] for q in topic_quizzes) / len(topic_quizzes) if topic_quizzes else 0,
-            'passed': sum(1 for q in topic_quizzes if q.get('passed', q['score'] >= 70))
+            'time_spent': time_spent.get(topic, 0),
+            'quizzes_taken': topic_stats.quizzes,
+            'avg_score': topic_stats.avg_score,
+            'passed': topic_stats.passed
         }
     
-    # Tính streak (số ngày học liên tiếp)
-    dates = set()
-    for activity in activities:
-        if 'date' in activity:
-            dates.add(activity['date'])
-    for quiz in quiz_results:
-        if 'date' in quiz:
-            dates.add(quiz['date'])
-    
-    # Sắp xếp dates và tính streak
-    sorted_dates = sorted(dates, reverse=True)
-    current_streak = 0
-    if sorted_dates:
-        today = datetime.now().date().isoformat()
-        yesterday = (datetime.now().date() - timedelta(days=1)).isoformat()
-        
-        if sorted_dates[0] == today or sorted_dates[0] == yesterday:
-            current_streak = 1
-            for i in range(len(sorted_dates) - 1):
-                date1 = datetime.fromisoformat(sorted_dates[i]).date()
-                date2 = datetime.fromisoformat(sorted_dates[i + 1]).date()
-                if (date1 - date2).days == 1:
-                    current_streak += 1
-                else:
-                    break
-    
     return {
         'total_time_seconds': total_time,
         'total_time_hours': round(total_time / 3600, 2),  # 2 chữ số thập phân để hiển thị chính xác hơn
         'total_time_minutes': round(total_time / 60, 1),  # Thêm phút để dễ thấy
-        'avg_quiz_score': round(avg_score, 1),
-        'total_quizzes': total_quizzes,
-        'passed_quizzes': passed_quizzes,
+        'avg_quiz_score': round(stats.avg_score, 1),
+        'total_quizzes': stats.quiz_count,
+        'passed_quizzes': stats.passed,
         'topics_studied': len(topics_studied),
         'topic_breakdown': topic_breakdown,
-        'current_streak': current_streak,
-        'total_activities': len(activities),
+        'current_streak': stats.current_streak(),
+        'total_activities': stats.activity_count,
     }
 
 
@@ -149,7 +108,8 @@ CHI TIẾT THEO TOPIC:
                 summary += f"\n- {quiz['topic']}: {quiz['score']:.1f}% ({quiz['correct_answers']}/{quiz['total_questions']} câu đúng)"
         
         # Gọi AI để phân tích
-        response = client.chat.completions.create(
+        response = llm_gateway.chat_completion(
+            'analytics.insights',
             model=MODEL,
             messages=[
                 {
@@ -206,9 +166,13 @@ Lưu ý:
         insights = json.loads(response.choices[0].message.content)
         return insights
         
+    except llm_gateway.LLMUnavailableError:
+        # Provider đang sự cố: báo lỗi ngay thay vì trả về dữ liệu mặc định như kết quả thật
+        raise
     except Exception as e:
         print(f"Lỗi khi phân tích patterns: {str(e)}")
         return {
+            "fallback": True,
             "summary": "Chưa đủ dữ liệu để phân tích chi tiết.",
             "strengths": [
                 {
@@ -248,22 +212,26 @@ def get_topic_insights(learning_data, topic_name):
     Returns:
         Dict chứa insights về topic đó
     """
+    # Số liệu tổng của topic lấy từ bản tổng hợp (đủ cả khi learning_data là hồ sơ người học,
+    # khi đó quiz_results chỉ là các quiz gần nhất dùng làm chi tiết cho AI)
+    stats = learning_metrics.aggregate(learning_data)
+    topic_stats = stats.topic(topic_name)
     quiz_results = [q for q in learning_data.get('quiz_results', []) if q['topic'] == topic_name]
-    activities = [a for a in learning_data.get('learning_activities', []) if a.get('topic') == topic_name]
     
-    if not quiz_results and not activities:
+    if not topic_stats.quizzes and topic_name not in stats.topic_time:
         return {
             "message": f"Chưa có dữ liệu cho topic {topic_name}",
             "suggestions": [f"Hãy bắt đầu học {topic_name} ngay!"]
         }
     
     # Tính metrics cho topic
-    total_time = sum(a.get('duration', 0) for a in activities)
-    avg_score = sum(q['score'] for q in quiz_results) / len(quiz_results) if quiz_results else 0
+    total_time = stats.topic_time.get(topic_name, 0)
+    avg_score = topic_stats.avg_score
     
     try:
         # Gọi AI để phân tích topic cụ thể
-        response = client.chat.completions.create(
+        response = llm_gateway.chat_completion(
+            'analytics.topic',
             model=MODEL,
             messages=[
                 {
@@ -284,7 +252,7 @@ Trả lời bằng TIẾNG VIỆT."""
                     "content": f"""Phân tích học tập cho topic: {topic_name}
                     
 Thời gian học: {round(total_time/60, 1)} phút
-Số quiz: {len(quiz_results)}
+Số quiz: {topic_stats.quizzes}
 Điểm trung bình: {avg_score:.1f}%
 
 Chi tiết quiz:
@@ -298,20 +266,23 @@ Chi tiết quiz:
         insights = json.loads(response.choices[0].message.content)
         insights['stats'] = {
             'total_time_minutes': round(total_time/60, 1),
-            'quizzes_taken': len(quiz_results),
+            'quizzes_taken': topic_stats.quizzes,
             'avg_score': round(avg_score, 1)
         }
         
         return insights
         
+    except llm_gateway.LLMUnavailableError:
+        raise
     except Exception as e:
         print(f"Lỗi khi phân tích topic: {str(e)}")
         return {
+            "fallback": True,
             "mastery_level": "Đang học",
             "progress": min(int(avg_score), 100),
             "stats": {
                 'total_time_minutes': round(total_time/60, 1),
-                'quizzes_taken': len(quiz_results),
+                'quizzes_taken': topic_stats.quizzes,
                 'avg_score': round(avg_score, 1)
             }
         }
@@ -329,10 +300,12 @@ def generate_study_plan(learning_data):
     """
     try:
         metrics = calculate_progress_metrics(learning_data)
-        insights = analyze_learning_patterns(learning_data)
+        # Dùng lại insights đã có cho cùng learning_data (job insights hoặc study plan trước đó)
+        insights = get_insights(learning_data)
         
         # Gọi AI để tạo study plan
-        response = client.chat.completions.create(
+        response = llm_gateway.chat_completion(
+            'analytics.study_plan',
             model=MODEL,
             messages=[
                 {
@@ -366,9 +339,12 @@ Insights: {json.dumps(insights, ensure_ascii=False, indent=2)}"""
         study_plan = json.loads(response.choices[0].message.content)
         return study_plan
         
+    except llm_gateway.LLMUnavailableError:
+        raise
     except Exception as e:
         print(f"Lỗi khi tạo study plan: {str(e)}")
         return {
+            "fallback": True,
             "daily_plan": [],
             "weekly_goals": ["Hoàn thành ít nhất 3 quiz", "Học ít nhất 30 phút mỗi ngày"],
             "priority_topics": insights.get('next_focus', 'Tiếp tục học') if 'insights' in locals() else 'Bất kỳ topic nào',
@@ -376,21 +352,51 @@ Insights: {json.dumps(insights, ensure_ascii=False, indent=2)}"""
         }
 
 
-def process_analytics_insights_job(job_id, learning_data):
-    """Xử lý analytics insights job trong background thread"""
+def job_cache_key(learning_data, job_type, **params):
+    """Cache key / fingerprint của job analytics theo learning_data (và tham số như tên topic)"""
+    return response_cache.make_key(MODEL, learning_data, job=job_type, **params)
+
+
+def get_insights(learning_data):
+    """AI insights của learning_data, lấy từ response cache nếu đã phân tích gần đây"""
+    cache_key = job_cache_key(learning_data, 'insights')
+    cached = response_cache.get(cache_key, namespace='analytics')
+    if cached is not None:
+        return cached
+    insights = analyze_learning_patterns(learning_data)
+    if not insights.get('fallback'):
+        response_cache.put(cache_key, insights, namespace='analytics')
+    return insights
+
+
+# Loại job analytics -> hàm tính kết quả (chạy trong pool worker 'analytics')
+ANALYTICS_JOBS = {
+    'insights': analyze_learning_patterns,
+    'topic': get_topic_insights,
+    'study_plan': generate_study_plan,
+}
+
+
+def process_analytics_job(job_id, job_type, cache_key, *args):
+    """Xử lý analytics job trong background thread, lưu kết quả vào response cache"""
     try:
-        print(f"[Analytics Job {job_id}] Bắt đầu xử lý...")
-        analytics_job_storage[job_id]['status'] = 'processing'
-        analytics_job_storage[job_id]['updated_at'] = datetime.now().isoformat()
+        print(f"[Analytics Job {job_id}] Bắt đầu xử lý {job_type}...")
+        analytics_job_storage.update(job_id, status='processing', updated_at=datetime.now().isoformat())
+        
+        result = ANALYTICS_JOBS[job_type](*args)
         
-        # Gọi hàm phân tích
-        result = analyze_learning_patterns(learning_data)
+        # Kết quả dự phòng (AI lỗi) không được cache để lần sau gọi lại AI
+        if not result.get('fallback'):
+            response_cache.put(cache_key, result, namespace='analytics')
         
         # Cập nhật kết quả
-        analytics_job_storage[job_id]['status'] = 'completed'
-        analytics_job_storage[job_id]['result'] = result
-        analytics_job_storage[job_id]['updated_at'] = datetime.now().isoformat()
-        analytics_job_storage[job_id]['completed_at'] = datetime.now().isoformat()
+        analytics_job_storage.update(
+            job_id,
+            status='completed',
+            result=result,
+            updated_at=datetime.now().isoformat(),
+            completed_at=datetime.now().isoformat()
+        )
         
         print(f"[Analytics Job {job_id}] Hoàn thành!")
         
@@ -398,49 +404,81 @@ def process_analytics_insights_job(job_id, learning_data):
         print(f"[Analytics Job {job_id}] Lỗi: {str(e)}")
         import traceback
         traceback.print_exc()
-        analytics_job_storage[job_id]['status'] = 'failed'
-        analytics_job_storage[job_id]['error'] = str(e)
-        analytics_job_storage[job_id]['updated_at'] = datetime.now().isoformat()
+        analytics_job_storage.update(job_id, status='failed', error=str(e), updated_at=datetime.now().isoformat())
 
 
-def create_analytics_insights_job(learning_data):
+def _create_analytics_job(job_type, cache_key, *args):
     """
-    Tạo analytics insights job và trả về job_id ngay lập tức
-    
-    Args:
-        learning_data: Dict chứa learning data
-    
-    Returns:
-        String job_id
+    Tạo analytics job và trả về job_id ngay lập tức
+    Cache hit: job hoàn thành ngay (không vào hàng đợi); trùng job đang chạy: gộp vào job đó
     """
     job_id = str(uuid.uuid4())
     
-    # Khởi tạo job
-    analytics_job_storage[job_id] = {
+    job = {
         'job_id': job_id,
+        'job_type': job_type,
         'status': 'pending',
-        'learning_data': learning_data,
         'created_at': datetime.now().isoformat(),
         'updated_at': datetime.now().isoformat(),
         'result': None,
         'error': None
     }
     
-    # Chạy xử lý trong background thread
-    thread = threading.Thread(
-        target=process_analytics_insights_job,
-        args=(job_id, learning_data)
-    )
-    thread.daemon = True
-    thread.start()
+    cached = response_cache.get(cache_key, namespace='analytics')
+    if cached is not None:
+        job.update(status='completed', result=cached, completed_at=job['updated_at'], cached=True)
+        analytics_job_storage.create(job_id, job)
+        print(f"[Analytics Job {job_id}] Cache hit ({job_type}), hoàn thành ngay")
+        return job_id
+    
+    leader_id = analytics_job_storage.create(job_id, job, fingerprint=cache_key)
+    if leader_id:
+        print(f"[Analytics Job {job_id}] Gộp vào job đang chạy {leader_id}")
+        return job_id
+    
+    # Đưa job vào hàng đợi của scheduler (pool worker cố định, hàng đợi giới hạn)
+    try:
+        llm_gateway.ensure_available()
+        job_scheduler.submit('analytics', process_analytics_job, job_id, job_type, cache_key, *args)
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError):
+        analytics_job_storage.delete(job_id)
+        raise
     
-    print(f"[Analytics Job {job_id}] Đã tạo và bắt đầu background processing")
+    print(f"[Analytics Job {job_id}] Đã tạo ({job_type}) và đưa vào hàng đợi")
     
     return job_id
 
 
-def get_analytics_job_status(job_id):
-    """Lấy trạng thái của analytics job"""
-    if job_id not in analytics_job_storage:
-        return None
-    return analytics_job_storage[job_id]
+def create_analytics_insights_job(learning_data):
+    """
+    Tạo analytics insights job và trả về job_id ngay lập tức
+    
+    Args:
+        learning_data: Dict chứa learning data
+    
+    Returns:
+        String job_id
+    """
+    return _create_analytics_job('insights', job_cache_key(learning_data, 'insights'), learning_data)
+
+
+def create_topic_insights_job(learning_data, topic_name):
+    """Tạo job phân tích một topic (get_topic_insights), trả về job_id"""
+    return _create_analytics_job(
+        'topic', job_cache_key(learning_data, 'topic', topic=topic_name), learning_data, topic_name
+    )
+
+
+def create_study_plan_job(learning_data):
+    """Tạo job tạo study plan (generate_study_plan), trả về job_id"""
+    return _create_analytics_job('study_plan', job_cache_key(learning_data, 'study_plan'), learning_data)
+
+
+def get_analytics_job_status(job_id, wait=0, since=None):
+    """
+    Lấy trạng thái của analytics job
+    Nếu wait > 0: chờ tối đa wait giây đến khi job kết thúc hoặc thay đổi so với since (long-poll)
+    """
+    if wait:
+        return analytics_job_storage.wait(job_id, wait, since=since)
+    return analytics_job_storage.get(job_id)
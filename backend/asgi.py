@@ -0,0 +1,243 @@
+"""
+ASGI entrypoint - chế độ phục vụ async
+Chạy với uvicorn worker: SERVE_MODE=asgi (xem gunicorn_config.py), hoặc khi dev:
+    uvicorn asgi:app --port 5000
+
+Các route chủ yếu là chờ I/O được xử lý native bằng asyncio, một process giữ được hàng nghìn
+request đang chờ mà không tốn một thread cho mỗi request:
+- GET  /api/<loại job>/status/<job_id>   (kể cả long-poll ?wait=&since=)
+- GET  /api/jobs/<job_id>/events         (SSE)
+- POST /api/chat/stream                  (SSE, gọi OpenAI bằng AsyncOpenAI)
+Các route còn lại (tạo job, upload PDF, route đồng bộ...) được chuyển cho Flask app
+trong base.py qua asgiref WsgiToAsgi, response giữ nguyên như chế độ WSGI.
+"""
+import asyncio
+import json
+import re
+import time
+from urllib.parse import parse_qs
+from asgiref.wsgi import WsgiToAsgi
+import base
+import roadmap
+import quiz
+import generativeResources
+import chatbot
+import analytics
+import pdfAnalysis
+import recommendations
+import job_store
+import llm_gateway
+
+flask_app = WsgiToAsgi(base.api)
+
+# Tiền tố status route -> JobStore (giống các route /status của base.py)
+STATUS_ROUTES = {
+    '/api/roadmap/status/': roadmap.job_storage,
+    '/api/quiz/status/': quiz.job_storage,
+    '/api/generate-resource/status/': generativeResources.job_storage,
+    '/api/chat/status/': chatbot.chat_job_storage,
+    '/api/analytics/insights/status/': analytics.analytics_job_storage,
+    '/api/analyze-pdf/status/': pdfAnalysis.pdf_job_storage,
+    '/api/analytics/topic/status/': analytics.analytics_job_storage,
+    '/api/analytics/study-plan/status/': analytics.analytics_job_storage,
+    '/api/recommendations/personalized/status/': recommendations.recommendations_job_storage,
+    '/api/recommendations/next-topics/status/': recommendations.recommendations_job_storage,
+    '/api/recommendations/learning-path/status/': recommendations.recommendations_job_storage,
+    '/api/recommendations/difficulty/status/': recommendations.recommendations_job_storage,
+}
+
+# Status route cần payload riêng (mặc định base.build_job_status)
+STATUS_BUILDERS = {
+    '/api/analyze-pdf/status/': base.build_pdf_job_status,
+}
+
+EVENTS_ROUTE = re.compile(r'^/api/jobs/([^/]+)/events$')
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+
+def _cors_headers(scope):
+    """Header CORS cho các route native (cùng danh sách origin với flask_cors)"""
+    origin = dict(scope['headers']).get(b'origin', b'').decode('latin-1')
+    if origin in base.CORS_ORIGINS:
+        return [(b'access-control-allow-origin', origin.encode('latin-1')), (b'vary', b'Origin')]
+    return []
+
+
+async def _send_json(scope, send, body, status=200, headers=()):
+    data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json; charset=utf-8'),
+            (b'content-length', str(len(data)).encode('latin-1')),
+            *headers,
+            *_cors_headers(scope),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': data})
+
+
+async def _read_json(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return json.loads(body or b'{}')
+
+
+async def _send_stream(scope, receive, send, events):
+    """Gửi SSE từ async generator events, dừng sớm nếu client ngắt kết nối"""
+    await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS + _cors_headers(scope)})
+
+    async def pump():
+        async for chunk in events:
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(disconnected())]
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    if tasks[0] in done:
+        tasks[0].result()
+
+
+async def job_status(scope, receive, send, store, job_id, build_status=base.build_job_status):
+    """Status route async: long-poll bằng JobStore.async_wait, không giữ thread khi chờ"""
+    args = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    try:
+        wait = float(args.get('wait', ['0'])[0])
+    except ValueError:
+        wait = 0.0
+    wait = max(0.0, min(wait, base.MAX_LONG_POLL_WAIT))
+    since = args.get('since', [None])[0]
+
+    if wait:
+        job = await store.async_wait(job_id, wait, since=since)
+    else:
+        job = await asyncio.to_thread(store.get, job_id)
+
+    if job is None:
+        await _send_json(scope, send, {"error": "Không tìm thấy job"}, 404)
+        return
+    await _send_json(scope, send, build_status(job))
+
+
+async def job_events(scope, receive, send, job_id):
+    """SSE trạng thái job (giống /api/jobs/<job_id>/events của base.py)"""
+    store, job = await asyncio.to_thread(job_store.find_job, job_id)
+    if job is None:
+        await _send_json(scope, send, {"error": "Không tìm thấy job"}, 404)
+        return
+
+    async def generate():
+        current = job
+        deadline = time.time() + base.SSE_MAX_DURATION
+        while True:
+            if current is None:
+                yield base.format_sse('error', {"error": "Không tìm thấy job"})
+                return
+
+            yield base.format_sse('status', base.build_job_status(current), event_id=current['updated_at'])
+
+            if current['status'] in job_store.FINISHED_STATUSES or time.time() > deadline:
+                return
+
+            since = current['updated_at']
+            while True:
+                current = await store.async_wait(job_id, base.SSE_HEARTBEAT_INTERVAL, since=since)
+                if current is None or current['updated_at'] != since or current['status'] in job_store.FINISHED_STATUSES:
+                    break
+                if time.time() > deadline:
+                    return
+                yield ": heartbeat\n\n"
+
+    await _send_stream(scope, receive, send, generate())
+
+
+async def chat_stream(scope, receive, send):
+    """Chat streaming bằng AsyncOpenAI (giống /api/chat/stream của base.py)"""
+    try:
+        req = await _read_json(receive)
+    except ValueError:
+        await _send_json(scope, send, {"error": "JSON không hợp lệ"}, 400)
+        return
+    messages = req.get("messages", [])
+    user_data = req.get("userData", {})
+
+    if not messages:
+        await _send_json(scope, send, {"error": "Thiếu messages"}, 400)
+        return
+
+    async def generate():
+        parts = []
+        try:
+            async for delta in chatbot.chat_with_ai_astream(messages, user_data):
+                parts.append(delta)
+                yield base.format_sse('delta', {'content': delta})
+            yield base.format_sse('done', {'result': ''.join(parts)})
+        except Exception as e:
+            print(f"Lỗi trong chat stream: {str(e)}")
+            yield base.format_sse('error', {'error': str(e)})
+
+    await _send_stream(scope, receive, send, generate())
+
+
+def _route(method, path):
+    """Tìm handler native cho request, None nếu chuyển cho Flask"""
+    if method == 'GET':
+        for prefix, store in STATUS_ROUTES.items():
+            if path.startswith(prefix) and path[len(prefix):] and '/' not in path[len(prefix):]:
+                job_id = path[len(prefix):]
+                build_status = STATUS_BUILDERS.get(prefix, base.build_job_status)
+                return lambda scope, receive, send: job_status(scope, receive, send, store, job_id, build_status)
+        match = EVENTS_ROUTE.match(path)
+        if match:
+            return lambda scope, receive, send: job_events(scope, receive, send, match.group(1))
+    if method == 'POST' and path == '/api/chat/stream':
+        return chat_stream
+    return None
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI application"""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+
+    handler = _route(scope.get('method'), scope.get('path', '')) if scope['type'] == 'http' else None
+    if handler is None:
+        await flask_app(scope, receive, send)
+        return
+
+    try:
+        await handler(scope, receive, send)
+    except llm_gateway.LLMUnavailableError as e:
+        await _send_json(
+            scope, send,
+            {"error": "Dịch vụ AI đang tạm thời gián đoạn. Vui lòng thử lại sau.", "retry_after": e.retry_after},
+            503,
+            [(b'retry-after', str(e.retry_after).encode('latin-1'))]
+        )
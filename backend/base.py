@@ -1,11 +1,23 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, send_file
 import roadmap
 import quiz
 import generativeResources
 import chatbot
+import job_scheduler
+import job_store
+import response_cache
+import pdf_cache
+import pdf_exports
+import llm_gateway
+import learner_profile
+import learning_metrics
 from flask_cors import CORS
 import os
 import sys
+import json
+import io
+import time
+import hashlib
 from dotenv import load_dotenv
 
 # ===== CRITICAL: Đảm bảo UTF-8 encoding cho Heroku =====
@@ -18,10 +30,8 @@ if sys.platform.startswith('linux') or os.getenv('DYNO'):  # Heroku detection
     
     # Reconfigure streams
     if sys.stdout.encoding != 'utf-8':
-        import io
         sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
     if sys.stderr.encoding != 'utf-8':
-        import io
         sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
     
     print("✓ Heroku UTF-8 encoding configured")
@@ -30,6 +40,21 @@ if sys.platform.startswith('linux') or os.getenv('DYNO'):  # Heroku detection
 
 load_dotenv()
 
+# Long-poll / SSE
+MAX_LONG_POLL_WAIT = float(os.getenv('MAX_LONG_POLL_WAIT', 30))
+SSE_HEARTBEAT_INTERVAL = float(os.getenv('SSE_HEARTBEAT_INTERVAL', 15))
+SSE_MAX_DURATION = float(os.getenv('SSE_MAX_DURATION', 600))
+
+# Thời gian (giây) client được cache file PDF kết quả (nội dung theo job_id không đổi)
+PDF_FILE_MAX_AGE = int(os.getenv('PDF_FILE_MAX_AGE', 3600))
+
+# Origin được phép gọi API (dùng cho flask_cors và các route native của asgi.py)
+CORS_ORIGINS = [
+    "http://localhost:3000",
+    "https://nhan-hoc.vercel.app",
+    "https://nhanhoc-ca30a6361738.herokuapp.com"
+]
+
 api = Flask(__name__)
 
 # Đảm bảo JSON response sử dụng UTF-8
@@ -38,22 +63,178 @@ api.config['JSONIFY_MIMETYPE'] = 'application/json; charset=utf-8'
 
 # Cấu hình CORS cho production
 CORS(api, 
-     origins=[
-         "http://localhost:3000",
-         "https://nhan-hoc.vercel.app",
-         "https://nhanhoc-ca30a6361738.herokuapp.com"
-     ],
-     methods=["GET", "POST", "OPTIONS"],
-     allow_headers=["Content-Type", "Authorization"],
+     origins=CORS_ORIGINS,
+     methods=["GET", "POST", "DELETE", "OPTIONS"],
+     allow_headers=["Content-Type", "Authorization", "Range", "If-None-Match"],
+     expose_headers=["Content-Length", "Content-Range", "Accept-Ranges", "ETag", "Content-Disposition"],
      supports_credentials=False
 )
 
 
+@api.errorhandler(job_scheduler.QueueFullError)
+def handle_queue_full(e):
+    """Hàng đợi job đầy: trả về 503 kèm Retry-After để client thử lại sau"""
+    return {
+        "error": "Hệ thống đang quá tải. Vui lòng thử lại sau.",
+        "job_type": e.job_type,
+        "retry_after": e.retry_after
+    }, 503, {"Retry-After": str(e.retry_after)}
+
+
+@api.errorhandler(llm_gateway.LLMUnavailableError)
+def handle_llm_unavailable(e):
+    """Circuit breaker của LLM đang mở: trả về 503 ngay thay vì giữ thread chờ provider"""
+    return {
+        "error": "Dịch vụ AI đang tạm thời gián đoạn. Vui lòng thử lại sau.",
+        "retry_after": e.retry_after
+    }, 503, {"Retry-After": str(e.retry_after)}
+
+
+@api.errorhandler(learning_metrics.LearningDataError)
+def handle_profile_error(e):
+    """learner_id / sự kiện / learning_data không hợp lệ"""
+    return {"error": str(e)}, 400
+
+
+@api.errorhandler(learner_profile.ProfileNotFoundError)
+def handle_profile_not_found(e):
+    """Chưa có hồ sơ: client gửi lại learning_data đầy đủ qua POST /api/learners/<id>/profile"""
+    return {"error": str(e), "learner_id": e.learner_id}, 404
+
+
+def request_learning_data(req):
+    """
+    learning_data của request analytics/recommendations:
+    có learner_id thì lấy từ hồ sơ phía server (learner_profile.py), ngược lại dùng learning_data trong body
+    ('aggregate' trong body bị bỏ: số liệu tổng luôn tính lại từ dữ liệu gốc)
+    """
+    if req.get("learner_id"):
+        return learner_profile.load_learning_data(req["learner_id"])
+    learning_data = req.get("learning_data") or {}
+    if not isinstance(learning_data, dict):
+        raise learning_metrics.LearningDataError("learning_data phải là object")
+    return {k: v for k, v in learning_data.items() if k != "aggregate"}
+
+
+def long_poll_args():
+    """
+    Đọc tham số long-poll của các status route:
+    ?wait=<giây> chờ đến khi job kết thúc, ?since=<updated_at> trả về ngay khi job có thay đổi mới
+    """
+    wait = request.args.get("wait", 0, type=float)
+    return {
+        "wait": max(0.0, min(wait, MAX_LONG_POLL_WAIT)),
+        "since": request.args.get("since")
+    }
+
+
+def build_job_status(job):
+    """Tạo payload trạng thái job dùng chung cho các status route và SSE"""
+    response = {
+        "job_id": job['job_id'],
+        "status": job['status'],
+        "created_at": job['created_at'],
+        "updated_at": job['updated_at']
+    }
+    
+    if 'progress' in job:
+        response['progress'] = job['progress']
+        response['progress_message'] = job.get('progress_message', '')
+    
+    if job['status'] == 'processing' and job.get('partial_result'):
+        response['partial_result'] = job['partial_result']
+    
+    if job['status'] == 'completed':
+        response['result'] = job['result']
+        response['completed_at'] = job.get('completed_at')
+    elif job['status'] == 'failed':
+        response['error'] = job.get('error', 'Unknown error')
+    
+    return response
+
+
+def job_created_response(job, message, build_status=build_job_status):
+    """
+    Response của route tạo job: job đã hoàn thành ngay (cache hit, hoặc gộp vào job đã xong)
+    thì trả luôn kết quả (payload như route /status) với 200, ngược lại 202 để client poll route /status
+    """
+    if job['status'] == 'completed':
+        return {**build_status(job), "cached": bool(job.get('cached'))}, 200
+    return {
+        "job_id": job['job_id'],
+        "status": job['status'],
+        "message": message
+    }, 202
+
+
+def format_sse(event, data, event_id=None):
+    """Định dạng một Server-Sent Event (data là dict, encode JSON UTF-8)"""
+    payload = json.dumps(data, ensure_ascii=False)
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event}\ndata: {payload}\n\n"
+
+
 @api.route("/", methods=["GET"])
 def health_check():
     return {"status": "ok", "message": "AI Learning Platform API is running"}, 200
 
 
+@api.route("/api/jobs/metrics", methods=["GET"])
+def get_job_metrics():
+    """Metrics của các pool job: độ sâu hàng đợi, số job đang chạy, bị từ chối..."""
+    return {
+        "pid": os.getpid(),
+        "scheduler": job_scheduler.get_metrics(),
+        "job_store": job_store.get_metrics(),
+        "response_cache": response_cache.get_metrics(),
+        "pdf_cache": pdf_cache.get_metrics(),
+        "llm": llm_gateway.get_metrics()
+    }, 200
+
+
+@api.route("/api/jobs/<job_id>/events", methods=["GET"])
+def stream_job_events(job_id):
+    """
+    Server-Sent Events: gửi trạng thái job mỗi khi job thay đổi cho đến khi kết thúc
+    Thay cho việc client poll /status/<job_id> mỗi 2 giây
+    """
+    store, job = job_store.find_job(job_id)
+    if job is None:
+        return {"error": "Không tìm thấy job"}, 404
+    
+    def generate():
+        current = job
+        deadline = time.time() + SSE_MAX_DURATION
+        while True:
+            if current is None:
+                yield format_sse('error', {"error": "Không tìm thấy job"})
+                return
+            
+            yield format_sse('status', build_job_status(current), event_id=current['updated_at'])
+            
+            if current['status'] in job_store.FINISHED_STATUSES or time.time() > deadline:
+                return
+            
+            # Chờ thay đổi tiếp theo, gửi heartbeat để giữ kết nối qua proxy
+            since = current['updated_at']
+            while True:
+                current = store.wait(job_id, SSE_HEARTBEAT_INTERVAL, since=since)
+                if current is None or current['updated_at'] != since or current['status'] in job_store.FINISHED_STATUSES:
+                    break
+                if time.time() > deadline:
+                    return
+                yield ": heartbeat\n\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
 @api.route("/api/roadmap", methods=["POST"])
 def get_roadmap():
     """Tạo job roadmap và trả về job_id ngay lập tức"""
@@ -65,35 +246,22 @@ def get_roadmap():
         knowledge_level=req.get("knowledge_level", "Absolute Beginner"),
     )
 
-    return {
-        "job_id": job_id,
-        "status": "pending",
-        "message": "Đang xử lý roadmap của bạn. Vui lòng đợi..."
-    }, 202
+    # Cache hit: job đã hoàn thành, trả luôn kết quả thay vì bắt client poll
+    return job_created_response(
+        roadmap.get_job_status(job_id),
+        "Đang xử lý roadmap của bạn. Vui lòng đợi..."
+    )
 
 
 @api.route("/api/roadmap/status/<job_id>", methods=["GET"])
 def get_roadmap_status(job_id):
     """Kiểm tra trạng thái của job"""
-    job = roadmap.get_job_status(job_id)
+    job = roadmap.get_job_status(job_id, **long_poll_args())
     
     if job is None:
         return {"error": "Không tìm thấy job"}, 404
     
-    response = {
-        "job_id": job['job_id'],
-        "status": job['status'],
-        "created_at": job['created_at'],
-        "updated_at": job['updated_at']
-    }
-    
-    if job['status'] == 'completed':
-        response['result'] = job['result']
-        response['completed_at'] = job.get('completed_at')
-    elif job['status'] == 'failed':
-        response['error'] = job.get('error', 'Unknown error')
-    
-    return response, 200
+    return build_job_status(job), 200
 
 
 @api.route("/api/quiz", methods=["POST"])
@@ -113,35 +281,22 @@ def get_quiz():
     print(f"Đang tạo quiz job với {num_questions} câu hỏi...")
     job_id = quiz.get_quiz(course, topic, subtopic, description, num_questions)
     
-    return {
-        "job_id": job_id,
-        "status": "pending",
-        "message": "Đang tạo bài kiểm tra. Vui lòng đợi..."
-    }, 202
+    # Cache hit: job đã hoàn thành, trả luôn kết quả thay vì bắt client poll
+    return job_created_response(
+        quiz.get_job_status(job_id),
+        "Đang tạo bài kiểm tra. Vui lòng đợi..."
+    )
 
 
 @api.route("/api/quiz/status/<job_id>", methods=["GET"])
 def get_quiz_status(job_id):
     """Kiểm tra trạng thái của quiz job"""
-    job = quiz.get_job_status(job_id)
+    job = quiz.get_job_status(job_id, **long_poll_args())
     
     if job is None:
         return {"error": "Không tìm thấy job"}, 404
     
-    response = {
-        "job_id": job['job_id'],
-        "status": job['status'],
-        "created_at": job['created_at'],
-        "updated_at": job['updated_at']
-    }
-    
-    if job['status'] == 'completed':
-        response['result'] = job['result']
-        response['completed_at'] = job.get('completed_at')
-    elif job['status'] == 'failed':
-        response['error'] = job.get('error', 'Unknown error')
-    
-    return response, 200
+    return build_job_status(job), 200
 
 
 # @api.route("/api/translate", methods=["POST"])
@@ -174,35 +329,22 @@ def generative_resource():
     print(f"Đang tạo resource job cho {req_data['course']}")
     job_id = generativeResources.generate_resources(**req_data)
     
-    return {
-        "job_id": job_id,
-        "status": "pending",
-        "message": "Đang tạo tài nguyên. Vui lòng đợi..."
-    }, 202
+    # Cache hit: job đã hoàn thành, trả luôn kết quả thay vì bắt client poll
+    return job_created_response(
+        generativeResources.get_job_status(job_id),
+        "Đang tạo tài nguyên. Vui lòng đợi..."
+    )
 
 
 @api.route("/api/generate-resource/status/<job_id>", methods=["GET"])
 def get_resource_status(job_id):
     """Kiểm tra trạng thái của resource job"""
-    job = generativeResources.get_job_status(job_id)
+    job = generativeResources.get_job_status(job_id, **long_poll_args())
     
     if job is None:
         return {"error": "Không tìm thấy job"}, 404
     
-    response = {
-        "job_id": job['job_id'],
-        "status": job['status'],
-        "created_at": job['created_at'],
-        "updated_at": job['updated_at']
-    }
-    
-    if job['status'] == 'completed':
-        response['result'] = job['result']
-        response['completed_at'] = job.get('completed_at')
-    elif job['status'] == 'failed':
-        response['error'] = job.get('error', 'Unknown error')
-    
-    return response, 200
+    return build_job_status(job), 200
 
 
 @api.route("/api/chat", methods=["POST", "OPTIONS"])
@@ -230,33 +372,129 @@ def chat():
             "message": "Đang xử lý tin nhắn của bạn. Vui lòng đợi..."
         }, 202
         
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError):
+        raise
     except Exception as e:
         print(f"Lỗi trong chat endpoint: {str(e)}")
         return {"error": str(e)}, 500
 
 
+@api.route("/api/chat/stream", methods=["POST", "OPTIONS"])
+def chat_stream():
+    """
+    Chat streaming: trả về từng đoạn text qua Server-Sent Events ngay khi AI sinh ra
+    event: delta  data: {"content": "..."}
+    event: done   data: {"result": "<toàn bộ câu trả lời>"}
+    event: error  data: {"error": "..."}
+    """
+    if request.method == "OPTIONS":
+        return "", 200
+    
+    req = request.get_json()
+    messages = req.get("messages", [])
+    user_data = req.get("userData", {})
+    
+    if not messages:
+        return {"error": "Thiếu messages"}, 400
+    
+    def generate():
+        parts = []
+        try:
+            for delta in chatbot.chat_with_ai_stream(messages, user_data):
+                parts.append(delta)
+                yield format_sse('delta', {'content': delta})
+            yield format_sse('done', {'result': ''.join(parts)})
+        except Exception as e:
+            print(f"Lỗi trong chat stream: {str(e)}")
+            yield format_sse('error', {'error': str(e)})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
 @api.route("/api/chat/status/<job_id>", methods=["GET"])
 def get_chat_status(job_id):
     """Kiểm tra trạng thái của chat job"""
-    job = chatbot.get_chat_job_status(job_id)
+    job = chatbot.get_chat_job_status(job_id, **long_poll_args())
     
     if job is None:
         return {"error": "Không tìm thấy job"}, 404
     
-    response = {
-        "job_id": job['job_id'],
-        "status": job['status'],
-        "created_at": job['created_at'],
-        "updated_at": job['updated_at']
-    }
+    return build_job_status(job), 200
+
+
+# ===== LEARNER PROFILE ENDPOINTS =====
+
+@api.route("/api/learners/<learner_id>/events", methods=["POST", "OPTIONS"])
+def append_learner_events(learner_id):
+    """
+    Thêm sự kiện học tập (kết quả quiz, activity, topic mới) vào hồ sơ phía server
+    Body: {"events": [...]} hoặc {"event": {...}}; các endpoint analytics/recommendations
+    sau đó chỉ cần {"learner_id": ...} thay vì toàn bộ learning_data
+    """
+    if request.method == "OPTIONS":
+        return {}, 200
     
-    if job['status'] == 'completed':
-        response['result'] = job['result']
-        response['completed_at'] = job.get('completed_at')
-    elif job['status'] == 'failed':
-        response['error'] = job.get('error', 'Unknown error')
+    req = request.get_json(silent=True) or {}
+    events = req.get("events")
+    if events is None and "event" in req:
+        events = [req["event"]]
     
-    return response, 200
+    profile, applied, duplicates = learner_profile.append_events(learner_id, events)
+    
+    return {
+        "status": "success",
+        "data": {
+            **learner_profile.summary(profile),
+            "applied": applied,
+            "duplicates": duplicates
+        }
+    }, 200
+
+
+@api.route("/api/learners/<learner_id>/profile", methods=["GET", "POST", "DELETE", "OPTIONS"])
+def learner_profile_route(learner_id):
+    """
+    GET: thông tin hồ sơ; POST {"learning_data": {...}}: tạo lại hồ sơ từ dữ liệu đầy đủ
+    (lần đồng bộ đầu tiên); DELETE: xóa hồ sơ
+    """
+    if request.method == "OPTIONS":
+        return {}, 200
+    
+    if request.method == "DELETE":
+        if not learner_profile.delete_profile(learner_id):
+            return {"error": "Không tìm thấy hồ sơ"}, 404
+        return {"status": "success"}, 200
+    
+    if request.method == "POST":
+        req = request.get_json(silent=True) or {}
+        profile = learner_profile.replace_profile(learner_id, req.get("learning_data"))
+    else:
+        profile = learner_profile.get_profile(learner_id)
+        if profile is None:
+            raise learner_profile.ProfileNotFoundError(learner_id)
+    
+    return {
+        "status": "success",
+        "data": learner_profile.summary(profile)
+    }, 200
+
+
+@api.route("/api/learners/<learner_id>/overview", methods=["GET"])
+def get_learner_overview(learner_id):
+    """Metrics tổng quan đọc từ hồ sơ (không quét lại lịch sử học tập)"""
+    learning_data = learner_profile.load_learning_data(learner_id)
+    
+    return {
+        "status": "success",
+        "data": analytics.calculate_progress_metrics(learning_data)
+    }, 200
 
 
 # ===== ANALYTICS ENDPOINTS =====
@@ -270,7 +508,7 @@ def get_analytics_overview():
     
     try:
         req = request.get_json()
-        learning_data = req.get("learning_data", {})
+        learning_data = request_learning_data(req)
         
         metrics = analytics.calculate_progress_metrics(learning_data)
         
@@ -279,6 +517,8 @@ def get_analytics_overview():
             "data": metrics
         }, 200
         
+    except learning_metrics.LearningDataError:
+        raise
     except Exception as e:
         print(f"Lỗi trong analytics overview: {str(e)}")
         return {"error": str(e)}, 500
@@ -286,23 +526,24 @@ def get_analytics_overview():
 
 @api.route("/api/analytics/insights", methods=["POST", "OPTIONS"])
 def get_analytics_insights():
-    """Tạo job phân tích AI insights và trả về job_id"""
+    """Tạo job phân tích AI insights và trả về job_id (kết quả đã cache thì trả về ngay)"""
     if request.method == "OPTIONS":
         return {}, 200
     
     try:
         req = request.get_json()
-        learning_data = req.get("learning_data", {})
+        learning_data = request_learning_data(req)
         
         # Tạo background job
         job_id = analytics.create_analytics_insights_job(learning_data)
         
-        return {
-            "job_id": job_id,
-            "status": "pending",
-            "message": "Đang phân tích learning patterns. Vui lòng đợi..."
-        }, 202
+        return job_created_response(
+            analytics.get_analytics_job_status(job_id),
+            "Đang phân tích learning patterns. Vui lòng đợi..."
+        )
         
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError, learning_metrics.LearningDataError):
+        raise
     except Exception as e:
         print(f"Lỗi trong analytics insights: {str(e)}")
         return {"error": str(e)}, 500
@@ -311,71 +552,84 @@ def get_analytics_insights():
 @api.route("/api/analytics/insights/status/<job_id>", methods=["GET"])
 def get_analytics_insights_status(job_id):
     """Kiểm tra trạng thái của analytics insights job"""
-    job = analytics.get_analytics_job_status(job_id)
+    job = analytics.get_analytics_job_status(job_id, **long_poll_args())
     
     if job is None:
         return {"error": "Không tìm thấy job"}, 404
     
-    response = {
-        "job_id": job['job_id'],
-        "status": job['status'],
-        "created_at": job['created_at'],
-        "updated_at": job['updated_at']
-    }
-    
-    if job['status'] == 'completed':
-        response['result'] = job['result']
-        response['completed_at'] = job.get('completed_at')
-    elif job['status'] == 'failed':
-        response['error'] = job.get('error', 'Unknown error')
-    
-    return response, 200
+    return build_job_status(job), 200
 
 
 @api.route("/api/analytics/topic/<topic_name>", methods=["POST", "OPTIONS"])
 def get_topic_insights(topic_name):
-    """Lấy insights chi tiết cho một topic cụ thể"""
+    """Tạo job phân tích chi tiết một topic (kết quả đã cache thì trả về ngay)"""
     if request.method == "OPTIONS":
         return {}, 200
     
     try:
         req = request.get_json()
-        learning_data = req.get("learning_data", {})
+        learning_data = request_learning_data(req)
         
-        topic_data = analytics.get_topic_insights(learning_data, topic_name)
+        job_id = analytics.create_topic_insights_job(learning_data, topic_name)
         
-        return {
-            "status": "success",
-            "data": topic_data
-        }, 200
+        return job_created_response(
+            analytics.get_analytics_job_status(job_id),
+            f"Đang phân tích topic {topic_name}. Vui lòng đợi..."
+        )
         
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError, learning_metrics.LearningDataError):
+        raise
     except Exception as e:
         print(f"Lỗi trong topic insights: {str(e)}")
         return {"error": str(e)}, 500
 
 
+@api.route("/api/analytics/topic/status/<job_id>", methods=["GET"])
+def get_topic_insights_status(job_id):
+    """Kiểm tra trạng thái của topic insights job"""
+    job = analytics.get_analytics_job_status(job_id, **long_poll_args())
+    
+    if job is None:
+        return {"error": "Không tìm thấy job"}, 404
+    
+    return build_job_status(job), 200
+
+
 @api.route("/api/analytics/study-plan", methods=["POST", "OPTIONS"])
 def generate_study_plan():
-    """Tạo study plan dựa trên analytics"""
+    """Tạo job tạo study plan dựa trên analytics (kết quả đã cache thì trả về ngay)"""
     if request.method == "OPTIONS":
         return {}, 200
     
     try:
         req = request.get_json()
-        learning_data = req.get("learning_data", {})
+        learning_data = request_learning_data(req)
         
-        study_plan = analytics.generate_study_plan(learning_data)
+        job_id = analytics.create_study_plan_job(learning_data)
         
-        return {
-            "status": "success",
-            "data": study_plan
-        }, 200
+        return job_created_response(
+            analytics.get_analytics_job_status(job_id),
+            "Đang tạo study plan. Vui lòng đợi..."
+        )
         
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError, learning_metrics.LearningDataError):
+        raise
     except Exception as e:
         print(f"Lỗi trong study plan: {str(e)}")
         return {"error": str(e)}, 500
 
 
+@api.route("/api/analytics/study-plan/status/<job_id>", methods=["GET"])
+def get_study_plan_status(job_id):
+    """Kiểm tra trạng thái của study plan job"""
+    job = analytics.get_analytics_job_status(job_id, **long_poll_args())
+    
+    if job is None:
+        return {"error": "Không tìm thấy job"}, 404
+    
+    return build_job_status(job), 200
+
+
 # ===== PDF ANALYSIS ENDPOINTS =====
 import pdfAnalysis
 
@@ -386,9 +640,19 @@ def analyze_pdf():
         return {}, 200
     
     try:
-        result = pdfAnalysis.phân_tích_pdf()
-        return result
+        body, status = pdfAnalysis.phân_tích_pdf()
+        if 'job_id' not in body:
+            return body, status
+        
+        # Cache hit: job đã hoàn thành, trả luôn trạng thái kèm download_url thay vì bắt client poll
+        return job_created_response(
+            pdfAnalysis.get_pdf_job_status(body['job_id']),
+            body['message'],
+            build_pdf_job_status
+        )
         
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError):
+        raise
     except Exception as e:
         print(f"Lỗi trong PDF analysis: {str(e)}")
         import traceback
@@ -396,29 +660,94 @@ def analyze_pdf():
         return {"error": str(e)}, 500
 
 
+def pdf_file_url(job_id, output_format):
+    """Đường dẫn tải file kết quả của PDF job (định dạng PDF giữ URL cũ không có query)"""
+    url = f"/api/analyze-pdf/{job_id}/file"
+    return url if output_format == pdf_exports.DEFAULT_FORMAT else f"{url}?format={output_format}"
+
+
+def build_pdf_job_status(job):
+    """
+    Payload trạng thái PDF job
+    Không kèm nội dung file, chỉ có download_url (định dạng đã chọn khi upload) và download_urls
+    (mọi định dạng, render khi tải lần đầu) trỏ đến /api/analyze-pdf/<job_id>/file
+    """
+    response = build_job_status(job)
+    if job['status'] == 'completed' and response.get('result'):
+        output_format = job.get('output_format', pdf_exports.DEFAULT_FORMAT)
+        result = dict(response['result'])
+        result.pop('pdf_content', None)
+        if result.get('format', pdf_exports.DEFAULT_FORMAT) != output_format:
+            # Job gộp yêu cầu định dạng khác job gốc: file được render khi tải, chưa biết kích thước
+            result.pop('size', None)
+            result.pop('etag', None)
+            result.update(
+                format=output_format,
+                filename=pdf_exports.export_filename(job.get('filename', ''), output_format),
+                content_type=pdf_exports.EXPORT_FORMATS[output_format].content_type
+            )
+        result['download_url'] = pdf_file_url(job['job_id'], output_format)
+        result['download_urls'] = {name: pdf_file_url(job['job_id'], name) for name in pdf_exports.EXPORT_FORMATS}
+        response['result'] = result
+    return response
+
+
 @api.route("/api/analyze-pdf/status/<job_id>", methods=["GET"])
 def get_pdf_analysis_status(job_id):
     """Kiểm tra trạng thái của PDF analysis job"""
-    job = pdfAnalysis.get_pdf_job_status(job_id)
+    job = pdfAnalysis.get_pdf_job_status(job_id, **long_poll_args())
     
     if job is None:
         return jsonify({"error": "Không tìm thấy job"}), 404
     
-    response = {
-        "job_id": job['job_id'],
-        "status": job['status'],
-        "created_at": job['created_at'],
-        "updated_at": job['updated_at']
-    }
+    # Đảm bảo response được encode UTF-8 đúng cách
+    return jsonify(build_pdf_job_status(job)), 200
+
+
+@api.route("/api/analyze-pdf/<job_id>/file", methods=["GET"])
+def download_pdf_analysis_file(job_id):
+    """
+    Tải file kết quả của job đã hoàn thành (bytes thô, không qua JSON/base64)
+    ?format=pdf|json|html|md|csv (mặc định định dạng đã chọn khi upload); định dạng chưa có được render
+    từ bản phân tích ở lần tải đầu tiên rồi lưu lại cùng job
+    Hỗ trợ Content-Length, ETag/If-None-Match (304) và Range (206) để tải tiếp khi mất kết nối
+    """
+    job = pdfAnalysis.get_pdf_job_status(job_id)
     
-    if job['status'] == 'completed':
-        response['result'] = job['result']
-        response['completed_at'] = job.get('completed_at')
-    elif job['status'] == 'failed':
-        response['error'] = job.get('error', 'Unknown error')
+    if job is None:
+        return jsonify({"error": "Không tìm thấy job"}), 404
     
-    # Đảm bảo response được encode UTF-8 đúng cách
-    return jsonify(response), 200
+    output_format = (request.args.get('format') or job.get('output_format', pdf_exports.DEFAULT_FORMAT)).lower()
+    if output_format not in pdf_exports.EXPORT_FORMATS:
+        return jsonify({"error": f"Định dạng không hợp lệ, chỉ hỗ trợ: {', '.join(pdf_exports.EXPORT_FORMATS)}"}), 400
+    if job['status'] != 'completed':
+        return jsonify({"error": "Job chưa hoàn thành", "status": job['status']}), 409
+    
+    try:
+        content = pdfAnalysis.get_export(job_id, output_format)
+    except Exception as e:
+        print(f"Lỗi khi render kết quả PDF job: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+    if content is None:
+        return jsonify({"error": "File kết quả không còn được lưu trữ"}), 404
+    
+    result = job.get('result') or {}
+    same_format = result.get('format', pdf_exports.DEFAULT_FORMAT) == output_format
+    response = send_file(
+        io.BytesIO(content),
+        mimetype=pdf_exports.EXPORT_FORMATS[output_format].content_type,
+        download_name=(
+            result.get('filename') if same_format and result.get('filename')
+            else pdf_exports.export_filename(job.get('filename', job_id), output_format)
+        ),
+        conditional=True,
+        etag=(result.get('etag') if same_format else None) or hashlib.sha256(content).hexdigest()[:32],
+        max_age=PDF_FILE_MAX_AGE
+    )
+    # Nội dung theo job_id không đổi nhưng là dữ liệu riêng của người dùng
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
 import recommendations
 
 # ===== PERSONALIZED RECOMMENDATIONS ENDPOINTS =====
@@ -437,7 +766,7 @@ def get_personalized_recommendations():
     
     try:
         req = request.get_json()
-        learning_data = req.get("learning_data", {})
+        learning_data = request_learning_data(req)
         
         # Tạo background job
         job_id = recommendations.create_recommendations_job(learning_data)
@@ -448,6 +777,8 @@ def get_personalized_recommendations():
             "message": "Đang phân tích và tạo recommendations. Vui lòng đợi..."
         }, 202
         
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError, learning_metrics.LearningDataError):
+        raise
     except Exception as e:
         print(f"Lỗi trong personalized recommendations: {str(e)}")
         import traceback
@@ -458,92 +789,114 @@ def get_personalized_recommendations():
 @api.route("/api/recommendations/personalized/status/<job_id>", methods=["GET"])
 def get_personalized_recommendations_status(job_id):
     """Kiểm tra trạng thái của recommendations job"""
-    job = recommendations.get_recommendations_job_status(job_id)
+    job = recommendations.get_recommendations_job_status(job_id, **long_poll_args())
     
     if job is None:
         return {"error": "Không tìm thấy job"}, 404
     
-    response = {
-        "job_id": job['job_id'],
-        "status": job['status'],
-        "created_at": job['created_at'],
-        "updated_at": job['updated_at']
-    }
-    
-    if job['status'] == 'completed':
-        response['result'] = job['result']
-        response['completed_at'] = job.get('completed_at')
-    elif job['status'] == 'failed':
-        response['error'] = job.get('error', 'Unknown error')
-    
-    return response, 200
+    return build_job_status(job), 200
 
 
 @api.route("/api/recommendations/next-topics", methods=["POST", "OPTIONS"])
 def get_next_topics():
-    """Chỉ lấy next topics recommendations"""
+    """Tạo job chỉ tính next topics (kết quả đã cache thì trả về ngay)"""
     if request.method == "OPTIONS":
         return {}, 200
     
     try:
         req = request.get_json()
-        learning_data = req.get("learning_data", {})
+        learning_data = request_learning_data(req)
         
-        performance = recommendations.analyze_performance(learning_data)
-        result = recommendations.recommend_next_topics(learning_data, performance)
+        job_id = recommendations.create_recommendation_part_job('next_topics', learning_data)
         
-        return {
-            "status": "success",
-            "data": result
-        }, 200
+        return job_created_response(
+            recommendations.get_recommendations_job_status(job_id),
+            "Đang tạo next topics. Vui lòng đợi..."
+        )
         
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError, learning_metrics.LearningDataError):
+        raise
     except Exception as e:
         print(f"Lỗi trong next topics: {str(e)}")
         return {"error": str(e)}, 500
 
 
+@api.route("/api/recommendations/next-topics/status/<job_id>", methods=["GET"])
+def get_next_topics_status(job_id):
+    """Kiểm tra trạng thái của next topics job"""
+    job = recommendations.get_recommendations_job_status(job_id, **long_poll_args())
+    
+    if job is None:
+        return {"error": "Không tìm thấy job"}, 404
+    
+    return build_job_status(job), 200
+
+
 @api.route("/api/recommendations/learning-path", methods=["POST", "OPTIONS"])
 def get_learning_path():
-    """Chỉ lấy learning path"""
+    """Tạo job chỉ tính learning path (kết quả đã cache thì trả về ngay)"""
     if request.method == "OPTIONS":
         return {}, 200
     
     try:
         req = request.get_json()
-        learning_data = req.get("learning_data", {})
+        learning_data = request_learning_data(req)
         
-        performance = recommendations.analyze_performance(learning_data)
-        result = recommendations.generate_learning_path(learning_data, performance)
+        job_id = recommendations.create_recommendation_part_job('learning_path', learning_data)
         
-        return {
-            "status": "success",
-            "data": result
-        }, 200
+        return job_created_response(
+            recommendations.get_recommendations_job_status(job_id),
+            "Đang tạo learning path. Vui lòng đợi..."
+        )
         
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError, learning_metrics.LearningDataError):
+        raise
     except Exception as e:
         print(f"Lỗi trong learning path: {str(e)}")
         return {"error": str(e)}, 500
 
 
+@api.route("/api/recommendations/learning-path/status/<job_id>", methods=["GET"])
+def get_learning_path_status(job_id):
+    """Kiểm tra trạng thái của learning path job"""
+    job = recommendations.get_recommendations_job_status(job_id, **long_poll_args())
+    
+    if job is None:
+        return {"error": "Không tìm thấy job"}, 404
+    
+    return build_job_status(job), 200
+
+
 @api.route("/api/recommendations/difficulty", methods=["POST", "OPTIONS"])
 def get_difficulty_adjustment():
-    """Chỉ lấy difficulty adjustment"""
+    """Tạo job chỉ tính difficulty adjustment (kết quả đã cache thì trả về ngay)"""
     if request.method == "OPTIONS":
         return {}, 200
     
     try:
         req = request.get_json()
-        learning_data = req.get("learning_data", {})
+        learning_data = request_learning_data(req)
         
-        performance = recommendations.analyze_performance(learning_data)
-        result = recommendations.adjust_difficulty(learning_data, performance)
+        job_id = recommendations.create_recommendation_part_job('difficulty', learning_data)
         
-        return {
-            "status": "success",
-            "data": result
-        }, 200
+        return job_created_response(
+            recommendations.get_recommendations_job_status(job_id),
+            "Đang tạo difficulty adjustment. Vui lòng đợi..."
+        )
         
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError, learning_metrics.LearningDataError):
+        raise
     except Exception as e:
         print(f"Lỗi trong difficulty adjustment: {str(e)}")
         return {"error": str(e)}, 500
 
+
+@api.route("/api/recommendations/difficulty/status/<job_id>", methods=["GET"])
+def get_difficulty_adjustment_status(job_id):
+    """Kiểm tra trạng thái của difficulty adjustment job"""
+    job = recommendations.get_recommendations_job_status(job_id, **long_poll_args())
+    
+    if job is None:
+        return {"error": "Không tìm thấy job"}, 404
+    
+    return build_job_status(job), 200
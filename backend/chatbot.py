@@ -1,20 +1,19 @@
 import os
-from openai import OpenAI
-import json
+import time
 import uuid
-import threading
 from datetime import datetime
+import job_store
+import job_scheduler
+import llm_gateway
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-    base_url=os.environ.get("OPENAI_BASE_URL")
-)
+# Lưu trữ trạng thái các job (dùng chung giữa các worker)
+chat_job_storage = job_store.get_store('chat')
 
-# Lưu trữ trạng thái các job trong bộ nhớ
-chat_job_storage = {}
+# Khoảng thời gian tối thiểu (giây) giữa hai lần ghi partial_result vào job store khi streaming
+CHAT_STREAM_FLUSH_INTERVAL = float(os.getenv('CHAT_STREAM_FLUSH_INTERVAL', 0.3))
 
 def create_context_prompt(user_data):
     """Tạo context prompt từ dữ liệu của user"""
@@ -70,22 +69,10 @@ def chat_with_ai_sync(messages, user_data=None):
         String response từ AI
     """
     try:
-        # Tạo context prompt
-        context_prompt = create_context_prompt(user_data or {})
-        
-        # Thêm system message với context
-        system_message = {
-            "role": "system",
-            "content": context_prompt
-        }
-        
-        # Kết hợp system message với messages
-        full_messages = [system_message] + messages
-        
         # Gọi OpenAI API
-        response = client.chat.completions.create(
-            model=os.environ.get("OPENAI_MODEL", "gpt-5-nano-2025-08-07"),
-            messages=full_messages,
+        response = llm_gateway.chat_completion(
+            'chat',
+            messages=build_chat_messages(messages, user_data),
             temperature=0.7
         )
         
@@ -95,29 +82,92 @@ def chat_with_ai_sync(messages, user_data=None):
         print(f"Lỗi khi gọi OpenAI API: {str(e)}")
         raise e
 
+def build_chat_messages(messages, user_data=None):
+    """Kết hợp system message (context của user) với lịch sử hội thoại"""
+    # Thêm system message với context
+    system_message = {
+        "role": "system",
+        "content": create_context_prompt(user_data or {})
+    }
+    
+    return [system_message] + messages
+
+def chat_with_ai_stream(messages, user_data=None):
+    """
+    Chat với AI ở chế độ streaming
+    
+    Args:
+        messages: List of message objects [{"role": "user/assistant", "content": "..."}]
+        user_data: Dict chứa roadmaps, quizStats, resources của user
+    
+    Yields:
+        Từng đoạn text (delta) ngay khi OpenAI trả về
+    """
+    stream = llm_gateway.chat_completion(
+        'chat.stream',
+        messages=build_chat_messages(messages, user_data),
+        temperature=0.7,
+        stream=True
+    )
+    
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+async def chat_with_ai_astream(messages, user_data=None):
+    """Giống chat_with_ai_stream() nhưng dùng AsyncOpenAI (chế độ ASGI)"""
+    stream = await llm_gateway.achat_completion(
+        'chat.stream',
+        messages=build_chat_messages(messages, user_data),
+        temperature=0.7,
+        stream=True
+    )
+    
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
 def process_chat_job(job_id, messages, user_data):
     """Xử lý chat job trong background thread"""
     try:
         print(f"[Chat Job {job_id}] Bắt đầu xử lý...")
-        chat_job_storage[job_id]['status'] = 'processing'
-        chat_job_storage[job_id]['updated_at'] = datetime.now().isoformat()
+        chat_job_storage.update(job_id, status='processing', updated_at=datetime.now().isoformat())
         
-        # Gọi AI để chat
-        result = chat_with_ai_sync(messages, user_data)
+        # Gọi AI ở chế độ streaming, ghi dần partial_result để client poll/SSE thấy tiến độ
+        parts = []
+        last_flush = time.time()
+        for delta in chat_with_ai_stream(messages, user_data):
+            parts.append(delta)
+            if time.time() - last_flush >= CHAT_STREAM_FLUSH_INTERVAL:
+                chat_job_storage.update(
+                    job_id,
+                    partial_result=''.join(parts),
+                    updated_at=datetime.now().isoformat()
+                )
+                last_flush = time.time()
+        result = ''.join(parts)
         
         # Cập nhật kết quả
-        chat_job_storage[job_id]['status'] = 'completed'
-        chat_job_storage[job_id]['result'] = result
-        chat_job_storage[job_id]['updated_at'] = datetime.now().isoformat()
-        chat_job_storage[job_id]['completed_at'] = datetime.now().isoformat()
+        chat_job_storage.update(
+            job_id,
+            status='completed',
+            result=result,
+            partial_result=None,
+            updated_at=datetime.now().isoformat(),
+            completed_at=datetime.now().isoformat()
+        )
         
         print(f"[Chat Job {job_id}] Hoàn thành!")
         
     except Exception as e:
         print(f"[Chat Job {job_id}] Lỗi: {str(e)}")
-        chat_job_storage[job_id]['status'] = 'failed'
-        chat_job_storage[job_id]['error'] = str(e)
-        chat_job_storage[job_id]['updated_at'] = datetime.now().isoformat()
+        chat_job_storage.update(job_id, status='failed', error=str(e), updated_at=datetime.now().isoformat())
 
 def chat_with_ai(messages, user_data=None):
     """
@@ -133,31 +183,32 @@ def chat_with_ai(messages, user_data=None):
     job_id = str(uuid.uuid4())
     
     # Khởi tạo job
-    chat_job_storage[job_id] = {
+    chat_job_storage.create(job_id, {
         'job_id': job_id,
         'status': 'pending',
-        'messages': messages,
-        'user_data': user_data,
         'created_at': datetime.now().isoformat(),
         'updated_at': datetime.now().isoformat(),
         'result': None,
         'error': None
-    }
+    })
     
-    # Chạy xử lý trong background thread
-    thread = threading.Thread(
-        target=process_chat_job,
-        args=(job_id, messages, user_data)
-    )
-    thread.daemon = True
-    thread.start()
+    # Đưa job vào hàng đợi của scheduler (pool worker cố định, hàng đợi giới hạn)
+    try:
+        llm_gateway.ensure_available()
+        job_scheduler.submit('chat', process_chat_job, job_id, messages, user_data)
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError):
+        chat_job_storage.delete(job_id)
+        raise
     
-    print(f"[Chat Job {job_id}] Đã tạo và bắt đầu background processing")
+    print(f"[Chat Job {job_id}] Đã tạo và đưa vào hàng đợi")
     
     return job_id
 
-def get_chat_job_status(job_id):
-    """Lấy trạng thái của chat job"""
-    if job_id not in chat_job_storage:
-        return None
-    return chat_job_storage[job_id]
+def get_chat_job_status(job_id, wait=0, since=None):
+    """
+    Lấy trạng thái của chat job
+    Nếu wait > 0: chờ tối đa wait giây đến khi job kết thúc hoặc thay đổi so với since (long-poll)
+    """
+    if wait:
+        return chat_job_storage.wait(job_id, wait, since=since)
+    return chat_job_storage.get(job_id)
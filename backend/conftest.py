@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Fixture dùng chung cho các test: job store và response cache riêng cho từng test,
+client LLM giả (cùng giao diện chat.completions.create của OpenAI, không gọi mạng)
+"""
+
+import sys
+import os
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import job_store
+import response_cache
+import llm_gateway
+
+
+def completion(content):
+    """Response giống ChatCompletion của OpenAI"""
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def chunk(delta):
+    """Một chunk của stream giống ChatCompletionChunk"""
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+
+
+class FakeLLM:
+    """
+    Client LLM giả: reply(kwargs) trả về nội dung (str), hoặc list các đoạn khi stream=True;
+    reply ném lỗi, hoặc một phần tử của list là Exception, để giả lập lỗi upstream
+    """
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = []
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        content = self.reply(kwargs)
+        if kwargs.get('stream'):
+            return self._stream(content)
+        return completion(content)
+
+    @staticmethod
+    def _stream(parts):
+        for part in parts:
+            if isinstance(part, Exception):
+                raise part
+            yield chunk(part)
+
+
+class AsyncFakeLLM(FakeLLM):
+    """
+    FakeLLM cho AsyncOpenAI (chế độ ASGI): reply có thể là coroutine function,
+    và các đoạn của stream có thể là async iterable (giả lập provider trả chậm)
+    """
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        content = self.reply(kwargs)
+        if hasattr(content, '__await__'):
+            content = await content
+        if kwargs.get('stream'):
+            return self._astream(content)
+        return completion(content)
+
+    @staticmethod
+    async def _astream(parts):
+        if not hasattr(parts, '__aiter__'):
+            parts = AsyncFakeLLM._aiter(parts)
+        async for part in parts:
+            if isinstance(part, Exception):
+                raise part
+            yield chunk(part)
+
+    @staticmethod
+    async def _aiter(parts):
+        for part in parts:
+            yield part
+
+
+@pytest.fixture
+def memory_store():
+    """Job store trong bộ nhớ, trả lại backend cũ sau test"""
+    previous = job_store._backend
+    backend = job_store.MemoryBackend()
+    job_store.configure(backend)
+    yield backend
+    job_store.configure(previous)
+
+
+@pytest.fixture
+def isolated_cache(tmp_path, monkeypatch):
+    """Response cache rỗng (file SQLite tạm) cho từng test"""
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_ENABLED', True)
+    monkeypatch.setattr(response_cache, '_memory', OrderedDict())
+    monkeypatch.setattr(response_cache, '_disk', response_cache._DiskTier(str(tmp_path / 'cache.db')))
+    monkeypatch.setattr(response_cache, '_stats', {})
+    return response_cache
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """
+    install(reply, asynchronous=False): thay client của llm_gateway bằng FakeLLM,
+    circuit breaker và thống kê mới cho từng test
+    """
+    monkeypatch.setattr(llm_gateway, 'breaker', llm_gateway.CircuitBreaker(threshold=5, cooldown=30))
+    monkeypatch.setattr(llm_gateway, '_stats', {})
+    monkeypatch.setattr(llm_gateway, '_client', None)
+    monkeypatch.setattr(llm_gateway, '_client_pid', None)
+    monkeypatch.setattr(llm_gateway, '_async_override', None)
+    # Backoff không chờ thật
+    monkeypatch.setattr(llm_gateway, 'LLM_BACKOFF_BASE', 0.001)
+    monkeypatch.setattr(llm_gateway, 'LLM_BACKOFF_MAX', 0.001)
+
+    def install(reply, asynchronous=False):
+        if asynchronous:
+            client = AsyncFakeLLM(reply)
+            llm_gateway.configure(async_client=client)
+        else:
+            client = FakeLLM(reply)
+            llm_gateway.configure(client=client)
+        return client
+
+    return install
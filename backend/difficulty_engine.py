@@ -0,0 +1,164 @@
+"""
+Module đánh giá trình độ và đề xuất độ khó bằng luật cục bộ (không gọi AI)
+Trước đây adjust_difficulty gửi điểm trung bình, xu hướng và vài điểm gần nhất cho AI kèm
+chính các ngưỡng phân loại trong prompt. Module này áp dụng trực tiếp các ngưỡng đó và thống kê
+đơn giản trên lịch sử điểm (trung bình gần đây, độ dốc xu hướng, độ lệch chuẩn): trình độ theo xu hướng
+(điểm ước tính ở bài mới nhất) cao/thấp hơn trình độ chung thì tăng/giảm một mức. Lời giải
+thích lấy từ mẫu câu tiếng Việt. Kết quả xác định (cùng input -> cùng output), tính trong vài µs.
+
+Ngưỡng trình độ (theo điểm trung bình):
+beginner < 70 <= intermediate < 85 <= advanced < 95 <= expert
+"""
+
+LEVELS = ('beginner', 'intermediate', 'advanced', 'expert')
+
+# Điểm tối thiểu của từng trình độ
+LEVEL_THRESHOLDS = {
+    'beginner': 0,
+    'intermediate': 70,
+    'advanced': 85,
+    'expert': 95,
+}
+
+LEVEL_NAMES = {
+    'beginner': 'Cơ bản',
+    'intermediate': 'Trung cấp',
+    'advanced': 'Nâng cao',
+    'expert': 'Chuyên gia',
+}
+
+# Số bài gần nhất tối thiểu để đề xuất thay đổi độ khó
+MIN_SCORES = 3
+# Độ lệch chuẩn (điểm) tối đa để coi là ổn định / tối thiểu để coi là dao động mạnh
+STABLE_STD = 8
+VOLATILE_STD = 15
+# Độ dốc xu hướng (điểm mỗi bài) được coi là tăng / giảm rõ rệt
+TREND_SLOPE = 3
+
+REASONS = {
+    'insufficient': "Mới có {count} bài quiz gần đây nên chưa đủ dữ liệu để thay đổi độ khó. "
+                    "Hãy giữ mức {current} và làm thêm quiz để đánh giá chính xác hơn.",
+    'up': "Điểm gần đây của bạn đạt trung bình {recent_avg}% và {consistency}. "
+          "Bạn đã sẵn sàng chuyển từ mức {current} lên {recommended}.",
+    'down': "Điểm gần đây giảm còn trung bình {recent_avg}%{trend_note}. "
+            "Tạm thời chuyển về mức {recommended} để củng cố kiến thức trước khi tăng độ khó.",
+    'hold_volatile': "Điểm gần đây dao động khá mạnh (độ lệch {std_dev} điểm, trung bình {recent_avg}%). "
+                     "Giữ mức {current} cho đến khi kết quả ổn định hơn.",
+    'hold_declining': "Điểm gần đây đang giảm (khoảng {slope_abs} điểm mỗi bài, trung bình {recent_avg}%). "
+                      "Giữ mức {current} và ôn lại kiến thức nền trước khi làm bài mới.",
+    'hold_top': "Bạn đang ở mức cao nhất ({current}) với điểm trung bình gần đây {recent_avg}%. "
+                "Hãy duy trì phong độ và thử các chủ đề mới.",
+    'hold': "Điểm gần đây trung bình {recent_avg}% phù hợp với mức {current}. "
+            "Tiếp tục luyện tập ở độ khó hiện tại để củng cố kiến thức.",
+}
+
+TIPS = {
+    'insufficient': ["Làm thêm ít nhất {missing} bài quiz để hệ thống đánh giá chính xác hơn",
+                     "Thử quiz ở nhiều chủ đề khác nhau"],
+    'up': ["Bắt đầu với 1-2 quiz ở mức {recommended} trước khi chuyển hẳn",
+           "Xem lại câu sai sau mỗi bài để không bỏ sót kiến thức nền"],
+    'down': ["Ôn lại các khái niệm cơ bản của những chủ đề điểm thấp",
+             "Làm lại các quiz cũ cho đến khi đạt trên 70%"],
+    'hold_volatile': ["Ôn bài trước khi làm quiz để kết quả ổn định hơn",
+                      "Học đều đặn mỗi ngày thay vì dồn vào một lúc"],
+    'hold_declining': ["Ôn lại các khái niệm cơ bản của những chủ đề điểm thấp",
+                       "Nghỉ ngơi hợp lý và làm quiz khi đã ôn bài"],
+    'hold_top': ["Thử thách bản thân với các chủ đề nâng cao mới",
+                 "Chia sẻ kiến thức hoặc giải thích lại cho người khác để ghi nhớ lâu hơn"],
+    'hold': ["Tập trung cải thiện các chủ đề còn yếu",
+             "Đặt mục tiêu đạt trên {next_threshold}% để lên mức tiếp theo"],
+}
+
+
+def classify_level(score):
+    """Trình độ tương ứng với điểm (0-100)"""
+    level = LEVELS[0]
+    for name in LEVELS:
+        if score >= LEVEL_THRESHOLDS[name]:
+            level = name
+    return level
+
+
+def _slope(scores):
+    """Độ dốc hồi quy tuyến tính của điểm theo thứ tự bài (điểm mỗi bài)"""
+    n = len(scores)
+    if n < 2:
+        return 0.0
+    mean_x = (n - 1) / 2
+    mean_y = sum(scores) / n
+    covariance = sum((i - mean_x) * (score - mean_y) for i, score in enumerate(scores))
+    variance = sum((i - mean_x) ** 2 for i in range(n))
+    return covariance / variance
+
+
+def _shift(level, steps):
+    index = min(max(LEVELS.index(level) + steps, 0), len(LEVELS) - 1)
+    return LEVELS[index]
+
+
+def assess(avg_score, scores):
+    """
+    Đánh giá trình độ và đề xuất độ khó
+
+    Args:
+        avg_score: Điểm trung bình của tất cả quiz
+        scores: Điểm các quiz gần nhất, cũ -> mới
+
+    Returns:
+        Dict cùng dạng với kết quả AI trước đây (current_level, recommended_difficulty,
+        reason, adjustment_tips) kèm 'signals' là các chỉ số đã dùng để quyết định
+    """
+    scores = list(scores)
+    current = classify_level(avg_score)
+    recent_avg = sum(scores) / len(scores) if scores else avg_score
+    std_dev = (sum((score - recent_avg) ** 2 for score in scores) / len(scores)) ** 0.5 if scores else 0.0
+    slope = _slope(scores)
+    # Điểm ước tính ở bài mới nhất theo đường xu hướng (trung bình gần đây + xu hướng)
+    latest = recent_avg + slope * (len(scores) - 1) / 2 if scores else avg_score
+    # Chênh lệch giữa trình độ hiện tại theo xu hướng và trình độ chung
+    gap = LEVELS.index(classify_level(latest)) - LEVELS.index(current)
+
+    if len(scores) < MIN_SCORES:
+        decision = 'insufficient'
+    elif std_dev >= VOLATILE_STD and abs(slope) < TREND_SLOPE:
+        decision = 'hold_volatile'
+    elif gap > 0 and (std_dev <= STABLE_STD or slope >= TREND_SLOPE) and current != LEVELS[-1]:
+        decision = 'up'
+    elif gap < 0 and slope <= 0 and current != LEVELS[0]:
+        decision = 'down'
+    elif slope <= -TREND_SLOPE:
+        decision = 'hold_declining'
+    elif current == LEVELS[-1]:
+        decision = 'hold_top'
+    else:
+        decision = 'hold'
+    recommended = _shift(current, {'up': 1, 'down': -1}.get(decision, 0))
+
+    next_level = _shift(recommended, 1)
+    values = {
+        'count': len(scores),
+        'missing': max(MIN_SCORES - len(scores), 1),
+        'current': LEVEL_NAMES[current],
+        'recommended': LEVEL_NAMES[recommended],
+        'recent_avg': round(recent_avg, 1),
+        'std_dev': round(std_dev, 1),
+        'consistency': "kết quả ổn định" if std_dev <= STABLE_STD else "đang tiến bộ rõ rệt",
+        'slope_abs': abs(round(slope, 1)),
+        'trend_note': f" (giảm khoảng {abs(round(slope, 1))} điểm mỗi bài)" if slope <= -TREND_SLOPE else "",
+        'next_threshold': LEVEL_THRESHOLDS[next_level],
+    }
+
+    return {
+        'current_level': current,
+        'recommended_difficulty': recommended,
+        'reason': REASONS[decision].format(**values),
+        'adjustment_tips': [tip.format(**values) for tip in TIPS[decision]],
+        'signals': {
+            'decision': decision,
+            'recent_avg': values['recent_avg'],
+            'std_dev': values['std_dev'],
+            'trend_slope': round(slope, 2),
+            'projected_score': round(latest, 1),
+            'quizzes_considered': len(scores),
+        },
+    }
@@ -4,28 +4,24 @@ Install the OpenAI Python SDK
 $ pip install openai
 """
 
-import os
-from openai import OpenAI
 from dotenv import load_dotenv
 import uuid
-import threading
 from datetime import datetime
+import job_store
+import job_scheduler
+import response_cache
+import llm_gateway
 
 load_dotenv()
 
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-    base_url=os.environ.get("OPENAI_BASE_URL")
-)
+# Lưu trữ trạng thái các job (dùng chung giữa các worker)
+job_storage = job_store.get_store('resource')
 
-# Lưu trữ trạng thái các job trong bộ nhớ
-job_storage = {}
 
-
-def generate_resources_sync(course, knowledge_level, description, time):
-    """Hàm tạo resources đồng bộ (blocking)"""
-    response = client.chat.completions.create(
-        model=os.environ.get("OPENAI_MODEL", "gpt-5-nano-2025-08-07"),
+def build_resources_request(course, knowledge_level, description, time):
+    """Tạo tham số gọi OpenAI cho resource (dùng chung cho việc gọi API và cache key)"""
+    return dict(
+        model=llm_gateway.DEFAULT_MODEL,
         messages=[
             {
                 "role": "system",
@@ -38,8 +34,21 @@ def generate_resources_sync(course, knowledge_level, description, time):
         ]
     )
 
+
+def generate_resources_sync(course, knowledge_level, description, time, check_cache=True):
+    """Hàm tạo resources đồng bộ (blocking), kết quả được lưu vào response cache"""
+    request = build_resources_request(course, knowledge_level, description, time)
+    cache_key = response_cache.make_key(**request)
+    if check_cache:
+        cached = response_cache.get(cache_key, namespace='resource')
+        if cached is not None:
+            return cached
+
+    response = llm_gateway.chat_completion('resource', **request)
+
     result = response.choices[0].message.content
     print(result)
+    response_cache.put(cache_key, result, namespace='resource')
     return result
 
 
@@ -47,25 +56,25 @@ def process_resource_job(job_id, course, knowledge_level, description, time):
     """Xử lý job tạo resource trong background thread"""
     try:
         print(f"[Resource Job {job_id}] Bắt đầu xử lý...")
-        job_storage[job_id]['status'] = 'processing'
-        job_storage[job_id]['updated_at'] = datetime.now().isoformat()
+        job_storage.update(job_id, status='processing', updated_at=datetime.now().isoformat())
         
-        # Tạo resource
-        result = generate_resources_sync(course, knowledge_level, description, time)
+        # Tạo resource (generate_resources đã kiểm tra cache trước khi đưa vào hàng đợi)
+        result = generate_resources_sync(course, knowledge_level, description, time, check_cache=False)
         
         # Cập nhật kết quả
-        job_storage[job_id]['status'] = 'completed'
-        job_storage[job_id]['result'] = result
-        job_storage[job_id]['updated_at'] = datetime.now().isoformat()
-        job_storage[job_id]['completed_at'] = datetime.now().isoformat()
+        job_storage.update(
+            job_id,
+            status='completed',
+            result=result,
+            updated_at=datetime.now().isoformat(),
+            completed_at=datetime.now().isoformat()
+        )
         
         print(f"[Resource Job {job_id}] Hoàn thành!")
         
     except Exception as e:
         print(f"[Resource Job {job_id}] Lỗi: {str(e)}")
-        job_storage[job_id]['status'] = 'failed'
-        job_storage[job_id]['error'] = str(e)
-        job_storage[job_id]['updated_at'] = datetime.now().isoformat()
+        job_storage.update(job_id, status='failed', error=str(e), updated_at=datetime.now().isoformat())
 
 
 def generate_resources(course, knowledge_level, description, time):
@@ -73,7 +82,7 @@ def generate_resources(course, knowledge_level, description, time):
     job_id = str(uuid.uuid4())
     
     # Khởi tạo job
-    job_storage[job_id] = {
+    job = {
         'job_id': job_id,
         'status': 'pending',
         'course': course,
@@ -86,21 +95,42 @@ def generate_resources(course, knowledge_level, description, time):
         'error': None
     }
     
-    # Chạy xử lý trong background thread
-    thread = threading.Thread(
-        target=process_resource_job,
-        args=(job_id, course, knowledge_level, description, time)
+    # Cache hit: job hoàn thành ngay, không cần đưa vào hàng đợi
+    cache_key = response_cache.make_key(**build_resources_request(course, knowledge_level, description, time))
+    cached = response_cache.get(
+        cache_key,
+        namespace='resource'
     )
-    thread.daemon = True
-    thread.start()
+    if cached is not None:
+        job.update(status='completed', result=cached, completed_at=job['updated_at'], cached=True)
+        job_storage.create(job_id, job)
+        print(f"[Resource Job {job_id}] Cache hit, hoàn thành ngay")
+        return job_id
+    
+    # Đã có job giống hệt đang chạy: gộp vào job đó thay vì gọi lại OpenAI
+    leader_id = job_storage.create(job_id, job, fingerprint=cache_key)
+    if leader_id:
+        print(f"[Resource Job {job_id}] Gộp vào job đang chạy {leader_id}")
+        return job_id
+    
+    # Đưa job vào hàng đợi của scheduler (pool worker cố định, hàng đợi giới hạn)
+    try:
+        llm_gateway.ensure_available()
+        job_scheduler.submit('resource', process_resource_job, job_id, course, knowledge_level, description, time)
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError):
+        job_storage.delete(job_id)
+        raise
     
-    print(f"[Resource Job {job_id}] Đã tạo và bắt đầu background processing")
+    print(f"[Resource Job {job_id}] Đã tạo và đưa vào hàng đợi")
     
     return job_id
 
 
-def get_job_status(job_id):
-    """Lấy trạng thái của job"""
-    if job_id not in job_storage:
-        return None
-    return job_storage[job_id]
+def get_job_status(job_id, wait=0, since=None):
+    """
+    Lấy trạng thái của job
+    Nếu wait > 0: chờ tối đa wait giây đến khi job kết thúc hoặc thay đổi so với since (long-poll)
+    """
+    if wait:
+        return job_storage.wait(job_id, wait, since=since)
+    return job_storage.get(job_id)
@@ -10,9 +10,21 @@ import multiprocessing
 bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
 backlog = 2048
 
+# Chế độ phục vụ:
+# - wsgi (mặc định): Flask app base:api với worker gthread
+# - asgi: asgi:app với uvicorn worker, status/long-poll/SSE/chat stream chạy bằng asyncio
+SERVE_MODE = os.getenv('SERVE_MODE', 'wsgi').lower()
+wsgi_app = 'asgi:app' if SERVE_MODE == 'asgi' else 'base:api'
+
 # Worker processes
+# Trạng thái job nằm trong job_store (sqlite/redis) nên request /status có thể vào bất kỳ worker nào
 workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
-worker_class = 'sync'
+# gthread: mỗi worker có nhiều thread để long-poll (?wait=) và SSE không chiếm trọn một process
+worker_class = os.getenv(
+    'GUNICORN_WORKER_CLASS',
+    'uvicorn.workers.UvicornWorker' if SERVE_MODE == 'asgi' else 'gthread'
+)
+threads = int(os.getenv('GUNICORN_THREADS', 32))
 worker_connections = 1000
 timeout = 120
 keepalive = 2
@@ -0,0 +1,172 @@
+"""
+Module điều phối background job
+Mỗi loại job có một pool worker thread cố định và hàng đợi giới hạn thay vì
+tạo một threading.Thread mới cho mỗi request. Khi hàng đợi đầy, submit() ném
+QueueFullError để API trả về 503 kèm Retry-After (backpressure).
+
+Cấu hình qua biến môi trường theo loại job, ví dụ:
+- JOB_WORKERS_ROADMAP=4      số worker thread của pool roadmap
+- JOB_QUEUE_SIZE_ROADMAP=50  số job tối đa được xếp hàng chờ
+"""
+import os
+import math
+import queue
+import threading
+import time
+import traceback
+
+# Cấu hình mặc định (workers, queue_size) cho từng loại job
+DEFAULT_POOL_CONFIG = {
+    'roadmap': (4, 50),
+    'quiz': (4, 50),
+    'resource': (4, 50),
+    'chat': (8, 100),
+    'analytics': (4, 50),
+    'recommendations': (2, 20),
+    'pdf': (2, 10),
+}
+
+# Retry-After tối thiểu/tối đa (giây) trả về cho client khi hàng đợi đầy
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+
+
+class QueueFullError(Exception):
+    """Hàng đợi của loại job đã đầy, client nên thử lại sau retry_after giây"""
+
+    def __init__(self, job_type, retry_after):
+        super().__init__(f"Hàng đợi job '{job_type}' đã đầy")
+        self.job_type = job_type
+        self.retry_after = retry_after
+
+
+class WorkerPool:
+    """Pool worker thread cố định đọc job từ một hàng đợi giới hạn"""
+
+    def __init__(self, job_type, workers, queue_size):
+        self.job_type = job_type
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._threads = []
+
+        # Metrics
+        self.active = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_run_time = 0.0
+        self.total_wait_time = 0.0
+
+    def _ensure_started(self):
+        # Khởi động worker lazy (sau khi gunicorn fork) để mỗi process có thread riêng
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"{self.job_type}-worker-{i}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, fn, *args, **kwargs):
+        """Đưa job vào hàng đợi, ném QueueFullError nếu hàng đợi đầy"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((fn, args, kwargs, time.time()))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise QueueFullError(self.job_type, self.retry_after())
+        with self._lock:
+            self.submitted += 1
+
+    def _worker_loop(self):
+        while True:
+            fn, args, kwargs, enqueued_at = self._queue.get()
+            started_at = time.time()
+            with self._lock:
+                self.active += 1
+                self.total_wait_time += started_at - enqueued_at
+            succeeded = False
+            try:
+                fn(*args, **kwargs)
+                succeeded = True
+            except Exception as e:
+                # Các hàm process_*_job tự ghi lỗi vào job store, đây chỉ là lưới an toàn
+                print(f"[Scheduler {self.job_type}] Lỗi không được xử lý: {str(e)}")
+                traceback.print_exc()
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.total_run_time += time.time() - started_at
+                    if succeeded:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+                self._queue.task_done()
+
+    def retry_after(self):
+        """Ước lượng số giây đến khi có chỗ trống dựa trên thời gian chạy trung bình"""
+        with self._lock:
+            finished = self.completed + self.failed
+            avg_run_time = self.total_run_time / finished if finished else 5.0
+        depth = self._queue.qsize()
+        estimate = math.ceil(avg_run_time * (depth + 1) / max(self.workers, 1))
+        return max(MIN_RETRY_AFTER, min(MAX_RETRY_AFTER, estimate))
+
+    def stats(self):
+        """Metrics của pool: độ sâu hàng đợi, số job đang chạy, bị từ chối..."""
+        with self._lock:
+            finished = self.completed + self.failed
+            started = finished + self.active
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'queue_depth': self._queue.qsize(),
+                'active': self.active,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_run_time': round(self.total_run_time / finished, 3) if finished else 0,
+                'avg_wait_time': round(self.total_wait_time / started, 3) if started else 0,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(job_type):
+    """Lấy (hoặc tạo) pool của một loại job"""
+    pool = _pools.get(job_type)
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        if job_type not in _pools:
+            default_workers, default_queue_size = DEFAULT_POOL_CONFIG.get(job_type, (2, 20))
+            key = job_type.upper()
+            workers = int(os.getenv(f'JOB_WORKERS_{key}', default_workers))
+            queue_size = int(os.getenv(f'JOB_QUEUE_SIZE_{key}', default_queue_size))
+            _pools[job_type] = WorkerPool(job_type, workers, queue_size)
+        return _pools[job_type]
+
+
+def submit(job_type, fn, *args, **kwargs):
+    """Đưa job vào pool của job_type, ném QueueFullError khi hàng đợi đầy"""
+    get_pool(job_type).submit(fn, *args, **kwargs)
+
+
+def get_metrics():
+    """Metrics của tất cả pool đã được dùng trong process này"""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {job_type: pool.stats() for job_type, pool in pools.items()}
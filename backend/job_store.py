@@ -0,0 +1,1072 @@
+"""
+Module lưu trữ trạng thái job dùng chung giữa các worker
+Thay thế các dict job_storage trong bộ nhớ của từng module để mọi gunicorn worker
+(và mọi dyno khi dùng Redis) đều trả lời được request /status/<job_id>
+
+Backend được chọn qua biến môi trường JOB_STORE_BACKEND:
+- memory: dict trong process (chỉ đúng khi chạy 1 worker, dùng cho dev)
+- sqlite: file SQLite chế độ WAL, dùng chung cho các worker trên cùng máy (mặc định)
+- redis:  server Redis (hoặc fake tương thích giao thức Redis), dùng chung giữa nhiều dyno
+
+Chính sách lưu giữ (retention): job đã kết thúc (completed/failed) bị xóa sau TTL
+của loại job (JOB_TTL_<NAMESPACE>, mặc định JOB_TTL_DEFAULT), và khi tổng dung lượng
+vượt JOB_STORE_MAX_BYTES thì các job đã kết thúc ít được truy cập nhất bị xóa trước (LRU).
+Job pending/processing không có thay đổi nào quá JOB_STALE_AFTER_<NAMESPACE> giây (worker chết
+giữa chừng, job gốc không bao giờ bỏ giữ fingerprint) bị đánh dấu failed, sau đó được dọn như job đã kết thúc.
+Việc dọn dẹp chạy trong một background thread mỗi JOB_SWEEP_INTERVAL giây.
+
+Thông báo khi job thay đổi: mỗi lần create/update, backend phát thông báo cho job đó
+(trong process qua threading.Event, giữa các process qua pub/sub với Redis hoặc poll
+ngắn với SQLite). JobStore.wait() dựa trên thông báo này để phục vụ long-poll và SSE;
+JobStore.async_wait() là bản asyncio dùng cho chế độ ASGI (asgi.py).
+
+Gộp job trùng (single-flight): job được tạo kèm fingerprint của input. Nếu đã có job
+cùng fingerprint đang pending/processing (ở bất kỳ worker nào dùng chung backend), job mới
+chỉ ghi leader_job_id và lấy trạng thái/kết quả từ job đó thay vì gọi lại OpenAI.
+
+Blob: job có thể gắn dữ liệu nhị phân (JobStore.put_blob/get_blob, ví dụ file PDF kết quả),
+lưu nguyên bytes ngoài JSON của job để các lần đọc/ghi trạng thái không phải encode lại.
+"""
+import os
+import json
+import asyncio
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+JOB_STORE_BACKEND = os.getenv('JOB_STORE_BACKEND', 'sqlite').lower()
+JOB_STORE_PATH = os.getenv('JOB_STORE_PATH', os.path.join(tempfile.gettempdir(), 'nhan_hoc_jobs.db'))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+REDIS_PREFIX = os.getenv('JOB_STORE_REDIS_PREFIX', 'nhanhoc:jobs')
+
+# Retention
+JOB_TTL_DEFAULT = int(os.getenv('JOB_TTL_DEFAULT', 3600))
+DEFAULT_TTLS = {
+    'pdf': 900,    # Kết quả PDF rất lớn, client tải về ngay sau khi hoàn thành
+    'chat': 1800,
+}
+JOB_STORE_MAX_BYTES = int(os.getenv('JOB_STORE_MAX_BYTES', 100 * 1024 * 1024))
+JOB_SWEEP_INTERVAL = int(os.getenv('JOB_SWEEP_INTERVAL', 60))
+
+FINISHED_STATUSES = ('completed', 'failed')
+
+# Chỉ ghi lại thời điểm truy cập khi đã cũ hơn ngưỡng này (giảm số lần ghi khi client poll)
+ACCESS_TOUCH_INTERVAL = 1.0
+
+# Chu kỳ đọc lại job khi chờ (SQLite không có cơ chế thông báo giữa các process)
+JOB_WAIT_POLL_INTERVAL = float(os.getenv('JOB_WAIT_POLL_INTERVAL', 0.5))
+
+# Single-flight: bật/tắt và thời gian giữ khóa tối đa (phòng khi worker chết giữa chừng)
+JOB_SINGLE_FLIGHT = os.getenv('JOB_SINGLE_FLIGHT', '1') == '1'
+JOB_FLIGHT_TTL = int(os.getenv('JOB_FLIGHT_TTL', 900))
+
+# Thời gian tối đa (giây) một job pending/processing được phép không có thay đổi nào trước khi bị
+# đánh dấu failed; mặc định bằng JOB_FLIGHT_TTL (lúc đó khóa single-flight của job cũng đã hết hạn)
+JOB_STALE_AFTER_DEFAULT = int(os.getenv('JOB_STALE_AFTER_DEFAULT', JOB_FLIGHT_TTL))
+
+# Các field job gộp (follower) lấy từ job gốc (leader)
+FOLLOWED_FIELDS = ('status', 'result', 'error', 'updated_at', 'completed_at')
+
+
+def get_ttl(namespace):
+    """TTL (giây) của job đã kết thúc theo loại job"""
+    return int(os.getenv(f'JOB_TTL_{namespace.upper()}', DEFAULT_TTLS.get(namespace, JOB_TTL_DEFAULT)))
+
+
+def get_stale_after(namespace):
+    """Thời gian (giây) không có thay đổi sau đó job chưa kết thúc bị coi là bị bỏ dở"""
+    return int(os.getenv(f'JOB_STALE_AFTER_{namespace.upper()}', JOB_STALE_AFTER_DEFAULT))
+
+
+def _encode(job):
+    return json.dumps(job, ensure_ascii=False)
+
+
+def _finished_at(job, now):
+    return now if job.get('status') in FINISHED_STATUSES else None
+
+
+class Notifier:
+    """Đánh thức các thread đang chờ một job cụ thể trong process hiện tại"""
+
+    def __init__(self):
+        self._waiters = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, key, event=None):
+        event = event or threading.Event()
+        with self._lock:
+            self._waiters.setdefault(key, set()).add(event)
+        return event
+
+    def unsubscribe(self, key, event):
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if waiters is not None:
+                waiters.discard(event)
+                if not waiters:
+                    del self._waiters[key]
+
+    def notify(self, key):
+        with self._lock:
+            for event in self._waiters.get(key, ()):
+                event.set()
+
+    def waiting(self):
+        """Số thread đang chờ"""
+        with self._lock:
+            return sum(len(waiters) for waiters in self._waiters.values())
+
+
+class _AsyncEvent:
+    """Cầu nối Notifier (gọi set() từ thread bất kỳ) với asyncio.Event của một event loop"""
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def set(self):
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # Event loop đã đóng (worker đang tắt)
+            pass
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class MemoryBackend:
+    """Backend lưu job trong dict của process hiện tại"""
+
+    # Mọi update đều xảy ra trong process nên không cần poll khi chờ
+    poll_interval = None
+
+    def __init__(self):
+        self._jobs = {}
+        # (namespace, job_id) -> [size, finished_at, accessed_at, updated_at]
+        self._meta = {}
+        # (namespace, fingerprint) -> (job_id, expires_at)
+        self._flights = {}
+        # (namespace, job_id) -> {name: bytes}
+        self._blobs = {}
+        self._lock = threading.Lock()
+        self.notifier = Notifier()
+
+    def publish(self, namespace, job_id):
+        self.notifier.notify((namespace, job_id))
+
+    def create(self, namespace, job_id, job):
+        now = time.time()
+        with self._lock:
+            self._jobs[(namespace, job_id)] = dict(job)
+            self._meta[(namespace, job_id)] = [len(_encode(job).encode('utf-8')), _finished_at(job, now), now, now]
+
+    def get(self, namespace, job_id):
+        with self._lock:
+            job = self._jobs.get((namespace, job_id))
+            if job is None:
+                return None
+            self._meta[(namespace, job_id)][2] = time.time()
+            return dict(job)
+
+    def update(self, namespace, job_id, fields):
+        now = time.time()
+        with self._lock:
+            job = self._jobs.get((namespace, job_id))
+            if job is None:
+                return None
+            job.update(fields)
+            meta = self._meta[(namespace, job_id)]
+            meta[0] = len(_encode(job).encode('utf-8')) + sum(
+                len(blob) for blob in self._blobs.get((namespace, job_id), {}).values()
+            )
+            meta[1] = meta[1] or _finished_at(job, now)
+            meta[2] = meta[3] = now
+            return dict(job)
+
+    def delete(self, namespace, job_id):
+        self.delete_many([(namespace, job_id)])
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._jobs.pop(key, None)
+                self._meta.pop(key, None)
+                self._blobs.pop(key, None)
+
+    def put_blob(self, namespace, job_id, name, data):
+        """Gắn dữ liệu nhị phân vào job (tính vào dung lượng của job), False nếu job không tồn tại"""
+        with self._lock:
+            meta = self._meta.get((namespace, job_id))
+            if meta is None:
+                return False
+            blobs = self._blobs.setdefault((namespace, job_id), {})
+            meta[0] += len(data) - len(blobs.get(name, b''))
+            blobs[name] = bytes(data)
+            return True
+
+    def get_blob(self, namespace, job_id, name):
+        with self._lock:
+            return self._blobs.get((namespace, job_id), {}).get(name)
+
+    def finished_entries(self):
+        """Danh sách (namespace, job_id, size, finished_at, accessed_at) của job đã kết thúc"""
+        with self._lock:
+            return [(ns, job_id, size, finished_at, accessed_at)
+                    for (ns, job_id), (size, finished_at, accessed_at, _) in self._meta.items()
+                    if finished_at is not None]
+
+    def unfinished_entries(self):
+        """Danh sách (namespace, job_id, thời điểm ghi cuối) của job chưa kết thúc"""
+        with self._lock:
+            return [(ns, job_id, updated_at)
+                    for (ns, job_id), (_, finished_at, _, updated_at) in self._meta.items()
+                    if finished_at is None]
+
+    def usage(self):
+        """(số job, tổng số bytes) đang được lưu"""
+        with self._lock:
+            return len(self._meta), sum(meta[0] for meta in self._meta.values())
+
+    def claim_flight(self, namespace, fingerprint, job_id, ttl):
+        """Giữ fingerprint cho job_id nếu chưa có ai giữ, trả về job_id đang giữ"""
+        now = time.time()
+        with self._lock:
+            owner = self._flights.get((namespace, fingerprint))
+            if owner is None or owner[1] < now:
+                owner = (job_id, now + ttl)
+                self._flights[(namespace, fingerprint)] = owner
+            return owner[0]
+
+    def release_flight(self, namespace, fingerprint, job_id):
+        """Bỏ giữ fingerprint (chỉ khi job_id đang giữ)"""
+        with self._lock:
+            owner = self._flights.get((namespace, fingerprint))
+            if owner is not None and owner[0] == job_id:
+                del self._flights[(namespace, fingerprint)]
+
+
+class SQLiteBackend:
+    """
+    Backend lưu job trong file SQLite chế độ WAL
+    Mỗi thread (và mỗi process sau khi fork) dùng connection riêng
+    """
+
+    COLUMNS = {
+        'size': 'INTEGER NOT NULL DEFAULT 0',
+        'finished_at': 'REAL',
+        'accessed_at': 'REAL NOT NULL DEFAULT 0',
+    }
+
+    poll_interval = JOB_WAIT_POLL_INTERVAL
+
+    def __init__(self, path=JOB_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self.notifier = Notifier()
+
+    def publish(self, namespace, job_id):
+        # Chỉ đánh thức được thread trong process này, worker khác tự poll theo poll_interval
+        self.notifier.notify((namespace, job_id))
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and getattr(self._local, 'pid', None) == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS jobs (
+                            namespace TEXT NOT NULL,
+                            job_id TEXT NOT NULL,
+                            data TEXT NOT NULL,
+                            updated_at REAL NOT NULL,
+                            PRIMARY KEY (namespace, job_id)
+                        )
+                    """)
+                    # Bổ sung cột retention cho file DB tạo từ phiên bản cũ
+                    existing = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+                    for column, definition in self.COLUMNS.items():
+                        if column not in existing:
+                            conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {definition}')
+                    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at)')
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS blobs (
+                            namespace TEXT NOT NULL,
+                            job_id TEXT NOT NULL,
+                            name TEXT NOT NULL,
+                            data BLOB NOT NULL,
+                            PRIMARY KEY (namespace, job_id, name)
+                        )
+                    """)
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS flights (
+                            namespace TEXT NOT NULL,
+                            fingerprint TEXT NOT NULL,
+                            job_id TEXT NOT NULL,
+                            expires_at REAL NOT NULL,
+                            PRIMARY KEY (namespace, fingerprint)
+                        )
+                    """)
+                    self._initialized = True
+        return conn
+
+    def create(self, namespace, job_id, job):
+        conn = self._connect()
+        data = _encode(job)
+        now = time.time()
+        conn.execute(
+            'INSERT OR REPLACE INTO jobs (namespace, job_id, data, updated_at, size, finished_at, accessed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (namespace, job_id, data, now, len(data.encode('utf-8')), _finished_at(job, now), now)
+        )
+
+    def get(self, namespace, job_id):
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT data, finished_at, accessed_at FROM jobs WHERE namespace = ? AND job_id = ?',
+            (namespace, job_id)
+        ).fetchone()
+        if row is None:
+            return None
+        data, finished_at, accessed_at = row
+        now = time.time()
+        # Chỉ job đã kết thúc mới tham gia LRU nên chỉ cần ghi thời điểm truy cập cho chúng
+        if finished_at is not None and now - accessed_at > ACCESS_TOUCH_INTERVAL:
+            conn.execute(
+                'UPDATE jobs SET accessed_at = ? WHERE namespace = ? AND job_id = ?',
+                (now, namespace, job_id)
+            )
+        return json.loads(data)
+
+    def update(self, namespace, job_id, fields):
+        conn = self._connect()
+        # BEGIN IMMEDIATE giữ write lock trong lúc đọc - sửa - ghi để không mất update của worker khác
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT data, finished_at FROM jobs WHERE namespace = ? AND job_id = ?',
+                (namespace, job_id)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            job = json.loads(row[0])
+            job.update(fields)
+            data = _encode(job)
+            now = time.time()
+            blob_size = conn.execute(
+                'SELECT COALESCE(SUM(LENGTH(data)), 0) FROM blobs WHERE namespace = ? AND job_id = ?',
+                (namespace, job_id)
+            ).fetchone()[0]
+            conn.execute(
+                'UPDATE jobs SET data = ?, updated_at = ?, size = ?, finished_at = ?, accessed_at = ? '
+                'WHERE namespace = ? AND job_id = ?',
+                (data, now, len(data.encode('utf-8')) + blob_size, row[1] or _finished_at(job, now), now,
+                 namespace, job_id)
+            )
+            conn.execute('COMMIT')
+            return job
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, namespace, job_id):
+        self.delete_many([(namespace, job_id)])
+
+    def delete_many(self, keys):
+        conn = self._connect()
+        conn.executemany('DELETE FROM jobs WHERE namespace = ? AND job_id = ?', keys)
+        conn.executemany('DELETE FROM blobs WHERE namespace = ? AND job_id = ?', keys)
+
+    def put_blob(self, namespace, job_id, name, data):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute(
+                'SELECT 1 FROM jobs WHERE namespace = ? AND job_id = ?', (namespace, job_id)
+            ).fetchone() is None:
+                conn.execute('COMMIT')
+                return False
+            old = conn.execute(
+                'SELECT LENGTH(data) FROM blobs WHERE namespace = ? AND job_id = ? AND name = ?',
+                (namespace, job_id, name)
+            ).fetchone()
+            conn.execute(
+                'INSERT OR REPLACE INTO blobs (namespace, job_id, name, data) VALUES (?, ?, ?, ?)',
+                (namespace, job_id, name, sqlite3.Binary(data))
+            )
+            conn.execute(
+                'UPDATE jobs SET size = size + ? WHERE namespace = ? AND job_id = ?',
+                (len(data) - (old[0] if old else 0), namespace, job_id)
+            )
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get_blob(self, namespace, job_id, name):
+        row = self._connect().execute(
+            'SELECT data FROM blobs WHERE namespace = ? AND job_id = ? AND name = ?',
+            (namespace, job_id, name)
+        ).fetchone()
+        return bytes(row[0]) if row is not None else None
+
+    def finished_entries(self):
+        conn = self._connect()
+        return conn.execute(
+            'SELECT namespace, job_id, size, finished_at, accessed_at FROM jobs WHERE finished_at IS NOT NULL'
+        ).fetchall()
+
+    def unfinished_entries(self):
+        conn = self._connect()
+        return conn.execute(
+            'SELECT namespace, job_id, updated_at FROM jobs WHERE finished_at IS NULL'
+        ).fetchall()
+
+    def usage(self):
+        conn = self._connect()
+        count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM jobs').fetchone()
+        return count, total
+
+    def claim_flight(self, namespace, fingerprint, job_id, ttl):
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'DELETE FROM flights WHERE namespace = ? AND fingerprint = ? AND expires_at < ?',
+                (namespace, fingerprint, now)
+            )
+            conn.execute(
+                'INSERT OR IGNORE INTO flights (namespace, fingerprint, job_id, expires_at) VALUES (?, ?, ?, ?)',
+                (namespace, fingerprint, job_id, now + ttl)
+            )
+            owner = conn.execute(
+                'SELECT job_id FROM flights WHERE namespace = ? AND fingerprint = ?',
+                (namespace, fingerprint)
+            ).fetchone()[0]
+            conn.execute('COMMIT')
+            return owner
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def release_flight(self, namespace, fingerprint, job_id):
+        self._connect().execute(
+            'DELETE FROM flights WHERE namespace = ? AND fingerprint = ? AND job_id = ?',
+            (namespace, fingerprint, job_id)
+        )
+
+
+class RedisBackend:
+    """
+    Backend lưu job trong Redis, mỗi job là một hash, mỗi field được encode JSON
+    Có thể truyền client tương thích redis-py (ví dụ fakeredis.FakeRedis()) để test
+
+    Metadata retention nằm trong 3 hash chung (member = "namespace:job_id"):
+    <prefix>:meta:size, <prefix>:meta:finished, <prefix>:meta:accessed.
+    Job đã kết thúc còn được đặt EXPIRE theo TTL để Redis tự dọn khi không có sweeper.
+    Blob của job nằm trong hash <prefix>:blobs:<namespace>:<job_id> (field = tên blob, giá trị là
+    bytes thô), tổng dung lượng blob của job được ghi trong <prefix>:meta:blob_size.
+
+    Thay đổi của job được publish lên kênh <prefix>:events:<namespace>:<job_id>; mỗi process
+    có một listener thread (psubscribe) chuyển thông báo đến Notifier cục bộ.
+    """
+
+    # Poll dự phòng trong trường hợp mất kết nối pub/sub
+    poll_interval = 5.0
+
+    def __init__(self, client=None, url=REDIS_URL, prefix=REDIS_PREFIX):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self._size_key = f"{prefix}:meta:size"
+        self._finished_key = f"{prefix}:meta:finished"
+        self._accessed_key = f"{prefix}:meta:accessed"
+        self._blob_size_key = f"{prefix}:meta:blob_size"
+        self._events_prefix = f"{prefix}:events:"
+        self.notifier = Notifier()
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def publish(self, namespace, job_id):
+        self.notifier.notify((namespace, job_id))
+        self.client.publish(self._events_prefix + self._member(namespace, job_id), '1')
+
+    def start_listening(self):
+        """Khởi động listener pub/sub của process (lazy, lần đầu có thread chờ job)"""
+        if self._listener is not None:
+            return
+        with self._listener_lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='job-store-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self._events_prefix + '*')
+                for message in pubsub.listen():
+                    channel = message.get('channel')
+                    if isinstance(channel, bytes):
+                        channel = channel.decode('utf-8')
+                    namespace, _, job_id = channel[len(self._events_prefix):].partition(':')
+                    self.notifier.notify((namespace, job_id))
+            except Exception as e:
+                print(f"[Job Store] Mất kết nối pub/sub, thử lại: {str(e)}")
+                time.sleep(1)
+
+    def _key(self, namespace, job_id):
+        return f"{self.prefix}:{namespace}:{job_id}"
+
+    def _blob_key(self, namespace, job_id):
+        return f"{self.prefix}:blobs:{namespace}:{job_id}"
+
+    @staticmethod
+    def _member(namespace, job_id):
+        return f"{namespace}:{job_id}"
+
+    @staticmethod
+    def _field_name(key):
+        return key.decode('utf-8') if isinstance(key, bytes) else key
+
+    @classmethod
+    def _decode(cls, raw):
+        if not raw:
+            return None
+        return {cls._field_name(k): json.loads(v) for k, v in raw.items()}
+
+    @staticmethod
+    def _encode_fields(fields):
+        return {k: _encode(v) for k, v in fields.items()}
+
+    def create(self, namespace, job_id, job):
+        key = self._key(namespace, job_id)
+        member = self._member(namespace, job_id)
+        encoded = self._encode_fields(job)
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping=encoded)
+        pipe.hset(self._size_key, member, sum(len(v.encode('utf-8')) for v in encoded.values()))
+        pipe.hset(self._accessed_key, member, now)
+        if job.get('status') in FINISHED_STATUSES:
+            pipe.hset(self._finished_key, member, now)
+            pipe.expire(key, get_ttl(namespace))
+        pipe.execute()
+
+    def get(self, namespace, job_id):
+        job = self._decode(self.client.hgetall(self._key(namespace, job_id)))
+        if job is not None and job.get('status') in FINISHED_STATUSES:
+            self.client.hset(self._accessed_key, self._member(namespace, job_id), time.time())
+        return job
+
+    def update(self, namespace, job_id, fields):
+        from redis.exceptions import WatchError
+        key = self._key(namespace, job_id)
+        member = self._member(namespace, job_id)
+        encoded = self._encode_fields(fields)
+        finished = fields.get('status') in FINISHED_STATUSES
+        # WATCH/MULTI: job bị xóa (sweep/delete) giữa lúc đọc và ghi thì không tạo lại hash thiếu field/TTL
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    raw = pipe.hgetall(key)
+                    if not raw:
+                        return None
+                    blob_size = pipe.hget(self._blob_size_key, member)
+                    job = self._decode(raw)
+                    job.update(self._decode(encoded))
+                    size = sum(len(v) for k, v in raw.items() if self._field_name(k) not in encoded)
+                    size += sum(len(v.encode('utf-8')) for v in encoded.values()) + int(blob_size or 0)
+                    now = time.time()
+                    pipe.multi()
+                    pipe.hset(key, mapping=encoded)
+                    pipe.hset(self._size_key, member, size)
+                    pipe.hset(self._accessed_key, member, now)
+                    if finished:
+                        pipe.hsetnx(self._finished_key, member, now)
+                        pipe.expire(key, get_ttl(namespace))
+                        pipe.expire(self._blob_key(namespace, job_id), get_ttl(namespace))
+                    pipe.execute()
+                    return job
+                except WatchError:
+                    continue
+
+    def delete(self, namespace, job_id):
+        self.delete_many([(namespace, job_id)])
+
+    def delete_many(self, keys):
+        if not keys:
+            return
+        members = [self._member(ns, job_id) for ns, job_id in keys]
+        pipe = self.client.pipeline()
+        pipe.delete(*[self._key(ns, job_id) for ns, job_id in keys])
+        pipe.delete(*[self._blob_key(ns, job_id) for ns, job_id in keys])
+        for meta_key in (self._size_key, self._finished_key, self._accessed_key, self._blob_size_key):
+            pipe.hdel(meta_key, *members)
+        pipe.execute()
+
+    def put_blob(self, namespace, job_id, name, data):
+        from redis.exceptions import WatchError
+        key = self._key(namespace, job_id)
+        blob_key = self._blob_key(namespace, job_id)
+        member = self._member(namespace, job_id)
+        # Cùng lý do với update(): không ghi blob mồ côi cho job vừa bị xóa
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key, blob_key)
+                    if not pipe.exists(key):
+                        return False
+                    delta = len(data) - pipe.hstrlen(blob_key, name)
+                    ttl = pipe.ttl(key)
+                    pipe.multi()
+                    pipe.hset(blob_key, name, bytes(data))
+                    pipe.hincrby(self._size_key, member, delta)
+                    pipe.hincrby(self._blob_size_key, member, delta)
+                    if ttl and ttl > 0:
+                        pipe.expire(blob_key, ttl)
+                    pipe.execute()
+                    return True
+                except WatchError:
+                    continue
+
+    def get_blob(self, namespace, job_id, name):
+        return self.client.hget(self._blob_key(namespace, job_id), name)
+
+    def finished_entries(self):
+        pipe = self.client.pipeline()
+        pipe.hgetall(self._finished_key)
+        pipe.hgetall(self._size_key)
+        pipe.hgetall(self._accessed_key)
+        finished, sizes, accessed = pipe.execute()
+        entries = []
+        for member, finished_at in finished.items():
+            name = member.decode('utf-8') if isinstance(member, bytes) else member
+            namespace, _, job_id = name.partition(':')
+            entries.append((
+                namespace,
+                job_id,
+                int(sizes.get(member, 0)),
+                float(finished_at),
+                float(accessed.get(member, finished_at))
+            ))
+        return entries
+
+    def unfinished_entries(self):
+        # meta:accessed của job chưa kết thúc chỉ được ghi khi create/update (get() chỉ ghi cho job đã
+        # kết thúc) nên chính là thời điểm ghi cuối
+        pipe = self.client.pipeline()
+        pipe.hkeys(self._size_key)
+        pipe.hgetall(self._finished_key)
+        pipe.hgetall(self._accessed_key)
+        members, finished, accessed = pipe.execute()
+        entries = []
+        for member in members:
+            if member in finished:
+                continue
+            name = member.decode('utf-8') if isinstance(member, bytes) else member
+            namespace, _, job_id = name.partition(':')
+            entries.append((namespace, job_id, float(accessed.get(member, 0))))
+        return entries
+
+    def usage(self):
+        sizes = self.client.hvals(self._size_key)
+        return len(sizes), sum(int(size) for size in sizes)
+
+    def _flight_key(self, namespace, fingerprint):
+        return f"{self.prefix}:flight:{namespace}:{fingerprint}"
+
+    def claim_flight(self, namespace, fingerprint, job_id, ttl):
+        key = self._flight_key(namespace, fingerprint)
+        for _ in range(2):
+            if self.client.set(key, job_id, nx=True, ex=ttl):
+                return job_id
+            owner = self.client.get(key)
+            if owner is not None:
+                return owner.decode('utf-8') if isinstance(owner, bytes) else owner
+        return job_id
+
+    def release_flight(self, namespace, fingerprint, job_id):
+        key = self._flight_key(namespace, fingerprint)
+        owner = self.client.get(key)
+        if isinstance(owner, bytes):
+            owner = owner.decode('utf-8')
+        if owner == job_id:
+            self.client.delete(key)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name=JOB_STORE_BACKEND):
+    """Tạo backend theo tên cấu hình"""
+    if name == 'memory':
+        return MemoryBackend()
+    if name == 'sqlite':
+        return SQLiteBackend()
+    if name == 'redis':
+        return RedisBackend()
+    raise ValueError(f"JOB_STORE_BACKEND không hợp lệ: {name}")
+
+
+def get_backend():
+    """Lấy backend dùng chung của process (khởi tạo lazy)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+                print(f"[Job Store] Sử dụng backend: {type(_backend).__name__}")
+                _start_sweeper()
+    return _backend
+
+
+def configure(backend):
+    """Thay backend dùng chung (ví dụ RedisBackend(client=fakeredis.FakeRedis()) khi test)"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+# ===== RETENTION =====
+
+_retention_stats = {
+    'expired_jobs': 0,
+    'expired_bytes': 0,
+    'evicted_jobs': 0,
+    'evicted_bytes': 0,
+    'sweeps': 0,
+    'coalesced_jobs': 0,
+    'stale_jobs': 0,
+}
+_stats_lock = threading.Lock()
+_sweeper_thread = None
+
+
+def sweep(backend=None, max_bytes=None, now=None):
+    """
+    Dọn job: đánh dấu failed các job chưa kết thúc bị bỏ dở (quá JOB_STALE_AFTER không có thay đổi),
+    xóa job đã kết thúc quá TTL, sau đó nếu tổng dung lượng vẫn vượt max_bytes thì xóa các job
+    đã kết thúc ít được truy cập nhất (LRU)
+
+    Returns:
+        Dict số job bị đánh dấu failed và số job/bytes bị xóa trong lần dọn này
+    """
+    backend = backend or get_backend()
+    max_bytes = JOB_STORE_MAX_BYTES if max_bytes is None else max_bytes
+    now = time.time() if now is None else now
+
+    stale = 0
+    for namespace, job_id, updated_at in backend.unfinished_entries():
+        if now - updated_at > get_stale_after(namespace) and _fail_stale(backend, namespace, job_id):
+            stale += 1
+
+    entries = backend.finished_entries()
+    expired = [e for e in entries if now - e[3] > get_ttl(e[0])]
+    backend.delete_many([(e[0], e[1]) for e in expired])
+
+    evicted = []
+    _, total_bytes = backend.usage()
+    if total_bytes > max_bytes:
+        expired_keys = {(e[0], e[1]) for e in expired}
+        remaining = sorted((e for e in entries if (e[0], e[1]) not in expired_keys), key=lambda e: e[4])
+        for entry in remaining:
+            if total_bytes <= max_bytes:
+                break
+            evicted.append(entry)
+            total_bytes -= entry[2]
+        backend.delete_many([(e[0], e[1]) for e in evicted])
+
+    result = {
+        'stale_jobs': stale,
+        'expired_jobs': len(expired),
+        'expired_bytes': sum(e[2] for e in expired),
+        'evicted_jobs': len(evicted),
+        'evicted_bytes': sum(e[2] for e in evicted),
+    }
+    with _stats_lock:
+        for key, value in result.items():
+            _retention_stats[key] += value
+        _retention_stats['sweeps'] += 1
+    return result
+
+
+def _fail_stale(backend, namespace, job_id):
+    """Đánh dấu failed một job bị bỏ dở và bỏ giữ fingerprint để request sau tạo được job mới"""
+    job = backend.get(namespace, job_id)
+    if job is None or job.get('status') in FINISHED_STATUSES:
+        return False
+    job = backend.update(namespace, job_id, {
+        'status': 'failed',
+        'error': f'Job không có tiến triển quá {get_stale_after(namespace)} giây, có thể worker đã dừng',
+        'updated_at': datetime.now().isoformat(),
+    })
+    if job is None:
+        return False
+    backend.publish(namespace, job_id)
+    if job.get('fingerprint'):
+        backend.release_flight(namespace, job['fingerprint'], job_id)
+    print(f"[Job Store] Job {namespace}:{job_id} bị bỏ dở, đánh dấu failed")
+    return True
+
+
+def _sweeper_loop():
+    while True:
+        time.sleep(JOB_SWEEP_INTERVAL)
+        try:
+            result = sweep()
+            if result['stale_jobs']:
+                print(f"[Job Store] Đã đánh dấu failed {result['stale_jobs']} job bị bỏ dở")
+            if result['expired_jobs'] or result['evicted_jobs']:
+                print(f"[Job Store] Đã dọn {result['expired_jobs']} job hết hạn, "
+                      f"{result['evicted_jobs']} job LRU ({result['expired_bytes'] + result['evicted_bytes']} bytes)")
+        except Exception as e:
+            print(f"[Job Store] Lỗi khi dọn job: {str(e)}")
+
+
+def _start_sweeper():
+    global _sweeper_thread
+    if _sweeper_thread is None and JOB_SWEEP_INTERVAL > 0:
+        _sweeper_thread = threading.Thread(target=_sweeper_loop, name='job-store-sweeper', daemon=True)
+        _sweeper_thread.start()
+
+
+def get_metrics():
+    """Metrics của job store: số job/bytes đang giữ và đã bị dọn"""
+    backend = get_backend()
+    retained_jobs, retained_bytes = backend.usage()
+    with _stats_lock:
+        stats = dict(_retention_stats)
+    stats.update({
+        'backend': type(backend).__name__,
+        'retained_jobs': retained_jobs,
+        'retained_bytes': retained_bytes,
+        'max_bytes': JOB_STORE_MAX_BYTES,
+        'waiting': backend.notifier.waiting(),
+    })
+    return stats
+
+
+class JobStore:
+    """Kho job của một loại job (namespace), thay cho dict job_storage của từng module"""
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+
+    def create(self, job_id, job, fingerprint=None):
+        """
+        Lưu job mới
+
+        Args:
+            fingerprint: Hash của input đã chuẩn hóa; nếu có job cùng fingerprint đang chạy
+                         thì job mới được gộp vào job đó (single-flight)
+
+        Returns:
+            job_id của job gốc nếu job mới được gộp (không cần đưa vào hàng đợi), ngược lại None
+        """
+        backend = get_backend()
+        if fingerprint and JOB_SINGLE_FLIGHT:
+            job = dict(job, fingerprint=fingerprint)
+        backend.create(self.namespace, job_id, job)
+        backend.publish(self.namespace, job_id)
+
+        if not job.get('fingerprint') or job.get('status') in FINISHED_STATUSES:
+            return None
+        leader_id = self._claim_flight(fingerprint, job_id)
+        if leader_id == job_id:
+            return None
+        self.update(job_id, leader_job_id=leader_id, fingerprint=None)
+        with _stats_lock:
+            _retention_stats['coalesced_jobs'] += 1
+        return leader_id
+
+    def _claim_flight(self, fingerprint, job_id):
+        backend = get_backend()
+        for _ in range(2):
+            owner = backend.claim_flight(self.namespace, fingerprint, job_id, JOB_FLIGHT_TTL)
+            if owner == job_id:
+                return job_id
+            leader = backend.get(self.namespace, owner)
+            if leader is not None and leader.get('status') not in FINISHED_STATUSES:
+                return owner
+            # Job gốc đã kết thúc/bị xóa nhưng chưa bỏ giữ fingerprint (worker chết giữa chừng)
+            backend.release_flight(self.namespace, fingerprint, owner)
+        return job_id
+
+    def get(self, job_id):
+        """Lấy bản sao của job, None nếu không tồn tại (job gộp trả về trạng thái của job gốc)"""
+        job = get_backend().get(self.namespace, job_id)
+        if job is not None and job.get('leader_job_id') and job.get('status') not in FINISHED_STATUSES:
+            return self._follow(job)
+        return job
+
+    def _follow(self, job):
+        """Lấy trạng thái từ job gốc; khi job gốc kết thúc thì chép kết quả vào job gộp"""
+        leader = get_backend().get(self.namespace, job['leader_job_id'])
+        if leader is None:
+            return self.update(
+                job['job_id'],
+                status='failed',
+                error='Job gốc đã bị xóa trước khi hoàn thành',
+                updated_at=datetime.now().isoformat()
+            ) or job
+        fields = {field: leader.get(field) for field in FOLLOWED_FIELDS if field in leader}
+        if leader.get('status') in FINISHED_STATUSES:
+            return self.update(job['job_id'], **fields) or job
+        job.update(fields)
+        return job
+
+    def update(self, job_id, **fields):
+        """Cập nhật các field của job, trả về job sau khi cập nhật hoặc None nếu không tồn tại"""
+        backend = get_backend()
+        job = backend.update(self.namespace, job_id, fields)
+        if job is not None:
+            backend.publish(self.namespace, job_id)
+            # Job gốc kết thúc: bỏ giữ fingerprint để request sau tạo job mới (hoặc dùng cache)
+            if fields.get('status') in FINISHED_STATUSES and job.get('fingerprint'):
+                backend.release_flight(self.namespace, job['fingerprint'], job_id)
+        return job
+
+    def wait(self, job_id, timeout, since=None):
+        """
+        Chờ tối đa timeout giây cho đến khi job kết thúc (completed/failed),
+        hoặc nếu có since: cho đến khi updated_at của job khác since
+
+        Returns:
+            Job mới nhất (có thể vẫn đang chạy nếu hết timeout), None nếu không tồn tại
+        """
+        backend = get_backend()
+        if hasattr(backend, 'start_listening'):
+            backend.start_listening()
+        keys = [(self.namespace, job_id)]
+        deadline = time.time() + timeout
+        event = backend.notifier.subscribe(keys[0])
+        try:
+            while True:
+                job = self.get(job_id)
+                if self._wait_done(job, since, keys, event):
+                    return job
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return job
+                if backend.poll_interval is not None:
+                    remaining = min(remaining, backend.poll_interval)
+                event.wait(remaining)
+                event.clear()
+        finally:
+            for key in keys:
+                backend.notifier.unsubscribe(key, event)
+
+    async def async_wait(self, job_id, timeout, since=None):
+        """Giống wait() nhưng chờ bằng asyncio, không giữ thread trong lúc chờ (chế độ ASGI)"""
+        backend = get_backend()
+        if hasattr(backend, 'start_listening'):
+            backend.start_listening()
+        keys = [(self.namespace, job_id)]
+        deadline = time.time() + timeout
+        event = backend.notifier.subscribe(keys[0], _AsyncEvent(asyncio.get_running_loop()))
+        try:
+            while True:
+                job = await asyncio.to_thread(self.get, job_id)
+                if self._wait_done(job, since, keys, event):
+                    return job
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return job
+                if backend.poll_interval is not None:
+                    remaining = min(remaining, backend.poll_interval)
+                await event.wait(remaining)
+                event.clear()
+        finally:
+            for key in keys:
+                backend.notifier.unsubscribe(key, event)
+
+    def _wait_done(self, job, since, keys, event):
+        """Điều kiện dừng chờ của wait()/async_wait(); job gộp thì chờ thêm thông báo của job gốc"""
+        if job is None or job.get('status') in FINISHED_STATUSES:
+            return True
+        if since is not None and job.get('updated_at') != since:
+            return True
+        if job.get('leader_job_id') and len(keys) == 1:
+            keys.append((self.namespace, job['leader_job_id']))
+            get_backend().notifier.subscribe(keys[1], event)
+        return False
+
+    def put_blob(self, job_id, name, data):
+        """
+        Gắn dữ liệu nhị phân (ví dụ file PDF kết quả) vào job, lưu nguyên bytes không encode base64
+        Blob có cùng vòng đời với job: bị xóa cùng job và được tính vào dung lượng khi dọn LRU
+
+        Returns:
+            False nếu job không tồn tại
+        """
+        return get_backend().put_blob(self.namespace, job_id, name, data)
+
+    def get_blob(self, job_id, name):
+        """Đọc blob của job (job gộp đọc blob của job gốc), None nếu không có"""
+        backend = get_backend()
+        data = backend.get_blob(self.namespace, job_id, name)
+        if data is None:
+            job = backend.get(self.namespace, job_id)
+            if job is not None and job.get('leader_job_id'):
+                data = backend.get_blob(self.namespace, job['leader_job_id'], name)
+        return data
+
+    def delete(self, job_id):
+        """Xóa job (và bỏ giữ fingerprint nếu job đang giữ)"""
+        backend = get_backend()
+        job = backend.get(self.namespace, job_id)
+        if job is not None and job.get('fingerprint'):
+            backend.release_flight(self.namespace, job['fingerprint'], job_id)
+        backend.delete(self.namespace, job_id)
+
+    def __contains__(self, job_id):
+        return self.get(job_id) is not None
+
+
+_stores = {}
+
+
+def get_store(namespace):
+    """Lấy JobStore theo namespace (mỗi module một namespace)"""
+    if namespace not in _stores:
+        _stores[namespace] = JobStore(namespace)
+    return _stores[namespace]
+
+
+def find_job(job_id):
+    """Tìm job theo job_id trong tất cả namespace, trả về (store, job) hoặc (None, None)"""
+    for store in list(_stores.values()):
+        job = store.get(job_id)
+        if job is not None:
+            return store, job
+    return None, None
@@ -0,0 +1,416 @@
+"""
+Module hồ sơ học tập của người học lưu phía server (cập nhật tăng dần)
+Trước đây mọi endpoint analytics/recommendations nhận toàn bộ learning_data (mọi activity,
+quiz, thời gian học) trong từng request và tính lại từ đầu. Với hồ sơ người học, app chỉ gửi
+sự kiện mới (một kết quả quiz, một activity) qua API append-events; server cộng dồn vào bản
+tổng hợp (learning_metrics.LearningAggregate: tổng/số bài/số bài đạt theo topic, các ngày học
+để tính streak, điểm các quiz gần nhất) nên metrics tổng quan chỉ cần đọc hồ sơ, không quét lại.
+
+Hồ sơ (dict JSON) gồm:
+- aggregate:          LearningAggregate.to_dict()
+- time_spent:         {topic: giây}
+- current_topics:     danh sách topic đang học
+- recent_quizzes / recent_activities: PROFILE_RECENT_ITEMS mục gần nhất (chi tiết gửi cho AI)
+- event_ids:          id của PROFILE_EVENT_IDS sự kiện gần nhất (bỏ qua sự kiện gửi lại khi retry)
+- version:            số sự kiện đã áp dụng
+
+Sự kiện (append_events):
+- {"type": "quiz", "topic", "score", "passed"?, "correct_answers"?, "total_questions"?, "date"?, ...}
+- {"type": "activity", "topic", "duration" (giây), "date"?, ...}: cộng duration vào time_spent của topic
+- {"type": "topics", "topics": [...]}: thêm topic vào current_topics
+Mỗi sự kiện có thể kèm "id" (do client tạo) để gửi lại an toàn.
+
+Backend chọn qua LEARNER_PROFILE_BACKEND (memory | sqlite | redis, mặc định giống JOB_STORE_BACKEND).
+Mỗi lần ghi là một read-modify-write nguyên tử (khóa trong process, BEGIN IMMEDIATE với SQLite,
+WATCH/MULTI với Redis) nên các worker ghi đồng thời vào cùng hồ sơ không làm mất sự kiện.
+Hồ sơ không có TTL.
+"""
+import os
+import re
+import json
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime
+import job_store
+import learning_metrics
+
+LEARNER_PROFILE_BACKEND = os.getenv('LEARNER_PROFILE_BACKEND', job_store.JOB_STORE_BACKEND).lower()
+LEARNER_PROFILE_PATH = os.getenv(
+    'LEARNER_PROFILE_PATH',
+    os.path.join(tempfile.gettempdir(), 'nhan_hoc_profiles.db')
+)
+LEARNER_PROFILE_REDIS_PREFIX = os.getenv('LEARNER_PROFILE_REDIS_PREFIX', 'nhanhoc:profiles')
+
+# Số quiz/activity gần nhất giữ nguyên chi tiết trong hồ sơ
+PROFILE_RECENT_ITEMS = int(os.getenv('PROFILE_RECENT_ITEMS', 50))
+# Số id sự kiện gần nhất được nhớ để bỏ qua sự kiện trùng
+PROFILE_EVENT_IDS = int(os.getenv('PROFILE_EVENT_IDS', 500))
+# Số sự kiện tối đa trong một request
+PROFILE_MAX_EVENTS = int(os.getenv('PROFILE_MAX_EVENTS', 500))
+
+EVENT_TYPES = ('quiz', 'activity', 'topics')
+
+LEARNER_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.:@-]{1,128}$')
+
+
+class ProfileError(learning_metrics.LearningDataError):
+    """learner_id, sự kiện hoặc learning_data gửi lên không hợp lệ"""
+
+
+class ProfileNotFoundError(ProfileError):
+    """Chưa có hồ sơ cho learner_id"""
+
+    def __init__(self, learner_id):
+        super().__init__(f"Chưa có hồ sơ học tập cho learner_id {learner_id}")
+        self.learner_id = learner_id
+
+
+def _encode(profile):
+    return json.dumps(profile, ensure_ascii=False)
+
+
+class MemoryBackend:
+    """Backend lưu hồ sơ trong dict của process hiện tại (chỉ dùng cho dev/test)"""
+
+    def __init__(self):
+        self._profiles = {}
+        self._lock = threading.Lock()
+
+    def get(self, learner_id):
+        with self._lock:
+            raw = self._profiles.get(learner_id)
+        return json.loads(raw) if raw is not None else None
+
+    def update(self, learner_id, apply):
+        """Đọc hồ sơ, gọi apply(hồ sơ hoặc None) -> hồ sơ mới và ghi lại trong cùng một khóa"""
+        with self._lock:
+            raw = self._profiles.get(learner_id)
+            profile = apply(json.loads(raw) if raw is not None else None)
+            self._profiles[learner_id] = _encode(profile)
+            return profile
+
+    def delete(self, learner_id):
+        with self._lock:
+            return self._profiles.pop(learner_id, None) is not None
+
+
+class SQLiteBackend:
+    """Backend lưu hồ sơ trong file SQLite chế độ WAL, mỗi thread/process dùng connection riêng"""
+
+    def __init__(self, path=LEARNER_PROFILE_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and getattr(self._local, 'pid', None) == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS profiles (
+                learner_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, learner_id):
+        row = self._connect().execute(
+            'SELECT data FROM profiles WHERE learner_id = ?', (learner_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, learner_id, apply):
+        conn = self._connect()
+        # BEGIN IMMEDIATE giữ khóa ghi từ lúc đọc để worker khác không ghi đè giữa chừng
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT data FROM profiles WHERE learner_id = ?', (learner_id,)).fetchone()
+            profile = apply(json.loads(row[0]) if row else None)
+            conn.execute(
+                'INSERT OR REPLACE INTO profiles (learner_id, data, updated_at) VALUES (?, ?, ?)',
+                (learner_id, _encode(profile), datetime.now().timestamp())
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return profile
+
+    def delete(self, learner_id):
+        cursor = self._connect().execute('DELETE FROM profiles WHERE learner_id = ?', (learner_id,))
+        return cursor.rowcount > 0
+
+
+class RedisBackend:
+    """
+    Backend lưu hồ sơ trong Redis, mỗi hồ sơ là một key <prefix>:<learner_id> (JSON)
+    Ghi bằng transaction lạc quan (WATCH/MULTI), thử lại khi hồ sơ bị worker khác ghi cùng lúc
+    """
+
+    def __init__(self, client=None, url=job_store.REDIS_URL, prefix=LEARNER_PROFILE_REDIS_PREFIX):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, learner_id):
+        return f"{self.prefix}:{learner_id}"
+
+    def get(self, learner_id):
+        raw = self.client.get(self._key(learner_id))
+        return json.loads(raw) if raw is not None else None
+
+    def update(self, learner_id, apply):
+        from redis.exceptions import WatchError
+        key = self._key(learner_id)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    profile = apply(json.loads(raw) if raw is not None else None)
+                    pipe.multi()
+                    pipe.set(key, _encode(profile))
+                    pipe.execute()
+                    return profile
+                except WatchError:
+                    continue
+
+    def delete(self, learner_id):
+        return self.client.delete(self._key(learner_id)) > 0
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name=LEARNER_PROFILE_BACKEND):
+    """Tạo backend theo tên cấu hình"""
+    if name == 'memory':
+        return MemoryBackend()
+    if name == 'sqlite':
+        return SQLiteBackend()
+    if name == 'redis':
+        return RedisBackend()
+    raise ValueError(f"LEARNER_PROFILE_BACKEND không hợp lệ: {name}")
+
+
+def get_backend():
+    """Lấy backend dùng chung của process (khởi tạo lazy)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+                print(f"[Learner Profile] Sử dụng backend: {type(_backend).__name__}")
+    return _backend
+
+
+def configure(backend):
+    """Thay backend dùng chung (ví dụ RedisBackend(client=fakeredis.FakeRedis()) khi test)"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+# ===== HỒ SƠ =====
+
+def validate_learner_id(learner_id):
+    if not isinstance(learner_id, str) or not LEARNER_ID_PATTERN.match(learner_id):
+        raise ProfileError("learner_id không hợp lệ (1-128 ký tự chữ, số hoặc _ . : @ -)")
+    return learner_id
+
+
+def _new_profile(learner_id):
+    now = datetime.now().isoformat()
+    return {
+        'learner_id': learner_id,
+        'version': 0,
+        'created_at': now,
+        'updated_at': now,
+        'aggregate': learning_metrics.LearningAggregate().to_dict(),
+        'time_spent': {},
+        'current_topics': [],
+        'recent_quizzes': [],
+        'recent_activities': [],
+        'event_ids': [],
+    }
+
+
+def _validate_event(event):
+    """Kiểm tra một sự kiện, trả về bản sao không có field 'type' / 'id'"""
+    if not isinstance(event, dict) or event.get('type') not in EVENT_TYPES:
+        raise ProfileError(f"Sự kiện không hợp lệ, 'type' phải là một trong: {', '.join(EVENT_TYPES)}")
+    kind = event['type']
+    if kind == 'topics':
+        topics = event.get('topics')
+        if not isinstance(topics, list) or not all(isinstance(t, str) for t in topics):
+            raise ProfileError("Sự kiện 'topics' cần danh sách tên topic trong 'topics'")
+    else:
+        if not isinstance(event.get('topic'), str):
+            raise ProfileError(f"Sự kiện '{kind}' cần 'topic'")
+        field = 'score' if kind == 'quiz' else 'duration'
+        value = event.get(field, 0 if kind == 'activity' else None)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ProfileError(f"Sự kiện '{kind}' cần '{field}' là số")
+    return {k: v for k, v in event.items() if k not in ('type', 'id')}
+
+
+def _apply_events(profile, events):
+    """Cộng dồn các sự kiện vào hồ sơ, trả về (số sự kiện đã áp dụng, số sự kiện trùng bị bỏ qua)"""
+    stats = learning_metrics.LearningAggregate.from_dict(profile['aggregate'])
+    seen = set(profile['event_ids'])
+    applied = duplicates = 0
+    for event in events:
+        event_id = event.get('id')
+        if event_id is not None:
+            event_id = str(event_id)
+            if event_id in seen:
+                duplicates += 1
+                continue
+            seen.add(event_id)
+            profile['event_ids'].append(event_id)
+        data = _validate_event(event)
+        if event['type'] == 'quiz':
+            stats.add_quiz(data)
+            profile['recent_quizzes'].append(data)
+        elif event['type'] == 'activity':
+            stats.add_activity(data)
+            topic = data['topic']
+            profile['time_spent'][topic] = profile['time_spent'].get(topic, 0) + data.get('duration', 0)
+            profile['recent_activities'].append(data)
+        else:
+            for topic in data['topics']:
+                if topic not in profile['current_topics']:
+                    profile['current_topics'].append(topic)
+        applied += 1
+    profile['aggregate'] = stats.to_dict()
+    profile['recent_quizzes'] = profile['recent_quizzes'][-PROFILE_RECENT_ITEMS:]
+    profile['recent_activities'] = profile['recent_activities'][-PROFILE_RECENT_ITEMS:]
+    profile['event_ids'] = profile['event_ids'][-PROFILE_EVENT_IDS:]
+    profile['version'] += applied
+    profile['updated_at'] = datetime.now().isoformat()
+    return applied, duplicates
+
+
+def append_events(learner_id, events):
+    """
+    Thêm sự kiện học tập vào hồ sơ (tạo hồ sơ nếu chưa có)
+
+    Args:
+        learner_id: Id người học
+        events: Danh sách sự kiện (xem docstring module)
+
+    Returns:
+        Tuple (hồ sơ sau khi cập nhật, số sự kiện đã áp dụng, số sự kiện trùng)
+
+    Raises:
+        ProfileError: learner_id hoặc sự kiện không hợp lệ (không sự kiện nào được ghi)
+    """
+    validate_learner_id(learner_id)
+    if not isinstance(events, list) or not events:
+        raise ProfileError("Cần ít nhất một sự kiện trong 'events'")
+    if len(events) > PROFILE_MAX_EVENTS:
+        raise ProfileError(f"Tối đa {PROFILE_MAX_EVENTS} sự kiện mỗi request")
+    for event in events:
+        _validate_event(event)
+
+    counts = {}
+
+    def apply(profile):
+        profile = profile or _new_profile(learner_id)
+        counts['applied'], counts['duplicates'] = _apply_events(profile, events)
+        return profile
+
+    profile = get_backend().update(learner_id, apply)
+    return profile, counts['applied'], counts['duplicates']
+
+
+def replace_profile(learner_id, learning_data):
+    """
+    Tạo lại hồ sơ từ learning_data đầy đủ (lần đầu đồng bộ, hoặc khi dữ liệu trên app bị sửa)
+
+    Returns:
+        Hồ sơ mới
+    """
+    validate_learner_id(learner_id)
+    if not isinstance(learning_data, dict):
+        raise ProfileError("Cần 'learning_data'")
+    # Luôn tính lại từ dữ liệu gốc, không tin 'aggregate' do client gửi
+    learning_data = {k: v for k, v in learning_data.items() if k != 'aggregate'}
+    try:
+        stats = learning_metrics.aggregate(learning_data)
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ProfileError(f"learning_data không hợp lệ: {e}")
+
+    def apply(previous):
+        profile = _new_profile(learner_id)
+        if previous is not None:
+            profile['created_at'] = previous['created_at']
+        profile['aggregate'] = stats.to_dict()
+        profile['time_spent'] = dict(learning_data.get('time_spent', {}))
+        profile['current_topics'] = list(learning_data.get('current_topics', []))
+        profile['recent_quizzes'] = list(learning_data.get('quiz_results', [])[-PROFILE_RECENT_ITEMS:])
+        profile['recent_activities'] = list(learning_data.get('learning_activities', [])[-PROFILE_RECENT_ITEMS:])
+        profile['version'] = stats.quiz_count + stats.activity_count
+        return profile
+
+    return get_backend().update(learner_id, apply)
+
+
+def get_profile(learner_id):
+    """Hồ sơ của người học hoặc None nếu chưa có"""
+    validate_learner_id(learner_id)
+    return get_backend().get(learner_id)
+
+
+def delete_profile(learner_id):
+    """Xóa hồ sơ, trả về False nếu không có"""
+    validate_learner_id(learner_id)
+    return get_backend().delete(learner_id)
+
+
+def to_learning_data(profile):
+    """
+    learning_data tương đương để dùng với các hàm analytics/recommendations hiện có
+    quiz_results / learning_activities chỉ là các mục gần nhất; các số liệu tổng là aggregate đã lưu,
+    truyền qua ProfileLearningData để learning_metrics.aggregate() dùng lại thay vì quét danh sách
+    (key 'aggregate' chỉ để cache key của job phân biệt các hồ sơ có cùng các mục gần nhất)
+    """
+    return learning_metrics.ProfileLearningData({
+        'learning_activities': profile['recent_activities'],
+        'quiz_results': profile['recent_quizzes'],
+        'time_spent': profile['time_spent'],
+        'current_topics': profile['current_topics'],
+        'aggregate': profile['aggregate'],
+    }, stored_aggregate=profile['aggregate'])
+
+
+def load_learning_data(learner_id):
+    """learning_data từ hồ sơ của learner_id (ProfileNotFoundError nếu chưa có hồ sơ)"""
+    profile = get_profile(learner_id)
+    if profile is None:
+        raise ProfileNotFoundError(learner_id)
+    return to_learning_data(profile)
+
+
+def summary(profile):
+    """Thông tin ngắn về hồ sơ trả về cho client sau mỗi lần ghi"""
+    stats = profile['aggregate']
+    return {
+        'learner_id': profile['learner_id'],
+        'version': profile['version'],
+        'total_quizzes': stats['quiz_count'],
+        'total_activities': stats.get('activity_count', 0),
+        'topics': len(profile['current_topics']),
+        'updated_at': profile['updated_at'],
+    }
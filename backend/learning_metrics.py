@@ -0,0 +1,262 @@
+"""
+Module tổng hợp dữ liệu học tập một lượt (dùng chung cho analytics.py và recommendations.py)
+Trước đây mỗi topic lại lọc toàn bộ quiz_results ([q for q in quiz_results if q['topic'] == topic]),
+tức O(số topic × số quiz), và vòng tính streak parse lại từng cặp ngày bằng datetime.fromisoformat.
+aggregate() duyệt quiz_results một lần, gom theo topic (số bài, tổng điểm, số bài đạt) và chuyển
+mỗi chuỗi ngày khác nhau thành số ordinal đúng một lần.
+
+Khi bật LEARNING_METRICS_NUMPY và có NumPy, người dùng có nhiều quiz (>= LEARNING_METRICS_NUMPY_MIN)
+được gom bằng mảng cột (điểm, mã topic, đạt/không) và np.bincount, kết quả giống hệt vòng lặp Python.
+Mặc định tắt: dữ liệu đến từ list dict JSON nên chi phí dựng mảng ngang với chính vòng lặp gom.
+
+LearningAggregate cũng cập nhật được từng phần (add_quiz/add_activity) và chuyển qua lại dict JSON
+(to_dict/from_dict): hồ sơ người học phía server (learner_profile.py) lưu sẵn kết quả tổng hợp này
+và truyền vào qua ProfileLearningData; key 'aggregate' trong learning_data do client gửi bị bỏ qua.
+"""
+import os
+import bisect
+from datetime import datetime, date
+
+try:
+    import numpy as np
+except ImportError:  # NumPy là tùy chọn
+    np = None
+
+LEARNING_METRICS_NUMPY = os.getenv('LEARNING_METRICS_NUMPY', '0') == '1'
+LEARNING_METRICS_NUMPY_MIN = int(os.getenv('LEARNING_METRICS_NUMPY_MIN', 2000))
+
+# Điểm đạt mặc định khi quiz không có field 'passed'
+PASS_SCORE = 70
+
+# Số quiz gần nhất dùng để tính xu hướng
+RECENT_QUIZZES = 5
+
+
+class LearningDataError(ValueError):
+    """learning_data hoặc aggregate không hợp lệ"""
+
+
+class ProfileLearningData(dict):
+    """
+    learning_data tạo từ hồ sơ người học phía server (learner_profile.to_learning_data)
+    stored_aggregate là LearningAggregate.to_dict() đã lưu; chỉ có ở object tạo phía server,
+    không thể đến từ JSON của request
+    """
+
+    def __init__(self, data, stored_aggregate):
+        super().__init__(data)
+        self.stored_aggregate = stored_aggregate
+
+
+class TopicStats:
+    """Số bài, tổng điểm và số bài đạt của một topic"""
+    __slots__ = ('quizzes', 'score_sum', 'passed')
+
+    def __init__(self, quizzes=0, score_sum=0, passed=0):
+        self.quizzes = quizzes
+        self.score_sum = score_sum
+        self.passed = passed
+
+    @property
+    def avg_score(self):
+        return self.score_sum / self.quizzes if self.quizzes else 0
+
+
+class LearningAggregate:
+    """Kết quả tổng hợp một lượt của learning_data"""
+
+    def __init__(self, quiz_count=0, score_sum=0, passed=0, topics=None, study_days=None,
+                 recent_scores=None, activity_count=0, topic_time=None):
+        self.quiz_count = quiz_count
+        self.score_sum = score_sum
+        self.passed = passed
+        self.topics = topics or {}                # {topic: TopicStats}
+        self.study_days = study_days or []        # Các ngày có học (date ordinal), tăng dần, không trùng
+        self.recent_scores = recent_scores or []  # Điểm RECENT_QUIZZES quiz gần nhất
+        self.activity_count = activity_count
+        self.topic_time = topic_time or {}        # {topic: tổng duration (giây) của learning_activities}
+
+    @property
+    def avg_score(self):
+        return self.score_sum / self.quiz_count if self.quiz_count else 0
+
+    def topic(self, name):
+        """Thống kê của topic (TopicStats rỗng nếu chưa có quiz nào)"""
+        return self.topics.get(name) or TopicStats()
+
+    def current_streak(self, today=None):
+        """Số ngày học liên tiếp tính đến hôm nay hoặc hôm qua"""
+        if not self.study_days:
+            return 0
+        today = (today or date.today()).toordinal()
+        latest = self.study_days[-1]
+        if latest != today and latest != today - 1:
+            return 0
+        streak = 1
+        for i in range(len(self.study_days) - 1, 0, -1):
+            if self.study_days[i] - self.study_days[i - 1] != 1:
+                break
+            streak += 1
+        return streak
+
+    def add_quiz(self, quiz):
+        """Cộng thêm một kết quả quiz"""
+        score = quiz['score']
+        ok = _is_passed(quiz)
+        self.quiz_count += 1
+        self.score_sum += score
+        self.passed += ok
+        stats = self.topics.get(quiz['topic'])
+        if stats is None:
+            stats = self.topics[quiz['topic']] = TopicStats()
+        stats.quizzes += 1
+        stats.score_sum += score
+        stats.passed += ok
+        self.recent_scores = (self.recent_scores + [score])[-RECENT_QUIZZES:]
+        self._add_day(quiz.get('date'))
+
+    def add_activity(self, activity):
+        """Cộng thêm một learning activity"""
+        self.activity_count += 1
+        topic = activity.get('topic')
+        if topic is not None:
+            self.topic_time[topic] = self.topic_time.get(topic, 0) + activity.get('duration', 0)
+        self._add_day(activity.get('date'))
+
+    def _add_day(self, value):
+        day = _parse_day(value)
+        if day is None:
+            return
+        index = bisect.bisect_left(self.study_days, day)
+        if index == len(self.study_days) or self.study_days[index] != day:
+            self.study_days.insert(index, day)
+
+    def to_dict(self):
+        """Dạng dict JSON (lưu trong hồ sơ người học)"""
+        return {
+            'quiz_count': self.quiz_count,
+            'score_sum': self.score_sum,
+            'passed': self.passed,
+            'topics': {name: [t.quizzes, t.score_sum, t.passed] for name, t in self.topics.items()},
+            'study_days': self.study_days,
+            'recent_scores': self.recent_scores,
+            'activity_count': self.activity_count,
+            'topic_time': self.topic_time,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Tạo lại từ to_dict(), ném LearningDataError nếu dữ liệu thiếu hoặc sai kiểu"""
+        try:
+            return cls(
+                quiz_count=data['quiz_count'],
+                score_sum=data['score_sum'],
+                passed=data['passed'],
+                topics={name: TopicStats(*values) for name, values in data['topics'].items()},
+                study_days=list(data['study_days']),
+                recent_scores=list(data['recent_scores']),
+                activity_count=data.get('activity_count', 0),
+                topic_time=dict(data.get('topic_time', {}))
+            )
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise LearningDataError(f"aggregate không hợp lệ: {e}")
+
+
+def _is_passed(quiz):
+    return bool(quiz.get('passed', quiz['score'] >= PASS_SCORE))
+
+
+def _group_python(quiz_results):
+    topics = {}
+    score_sum = 0
+    passed = 0
+    for quiz in quiz_results:
+        score = quiz['score']
+        ok = _is_passed(quiz)
+        score_sum += score
+        passed += ok
+        stats = topics.get(quiz['topic'])
+        if stats is None:
+            stats = topics[quiz['topic']] = TopicStats()
+        stats.quizzes += 1
+        stats.score_sum += score
+        stats.passed += ok
+    return score_sum, passed, topics
+
+
+def _group_numpy(quiz_results):
+    codes = {}
+    count = len(quiz_results)
+    topic_codes = np.fromiter((codes.setdefault(q['topic'], len(codes)) for q in quiz_results), dtype=np.int64, count=count)
+    scores = np.fromiter((q['score'] for q in quiz_results), dtype=np.float64, count=count)
+    passed = np.fromiter((_is_passed(q) for q in quiz_results), dtype=np.int64, count=count)
+
+    quizzes = np.bincount(topic_codes, minlength=len(codes))
+    score_sums = np.bincount(topic_codes, weights=scores, minlength=len(codes))
+    passed_counts = np.bincount(topic_codes, weights=passed, minlength=len(codes))
+    topics = {
+        name: TopicStats(int(quizzes[code]), float(score_sums[code]), int(passed_counts[code]))
+        for name, code in codes.items()
+    }
+    return float(scores.sum()), int(passed.sum()), topics
+
+
+def _parse_day(value):
+    """Chuỗi ngày ISO -> date ordinal (None nếu không parse được)"""
+    try:
+        return datetime.fromisoformat(value).date().toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def _study_days(learning_data):
+    """Chuyển các ngày có hoạt động/quiz thành date ordinal (mỗi chuỗi ngày chỉ parse một lần)"""
+    raw_dates = {a['date'] for a in learning_data.get('learning_activities', []) if 'date' in a}
+    raw_dates.update(q['date'] for q in learning_data.get('quiz_results', []) if 'date' in q)
+    days = {_parse_day(value) for value in raw_dates}
+    days.discard(None)
+    return sorted(days)
+
+
+def _topic_time(activities):
+    topic_time = {}
+    for activity in activities:
+        topic = activity.get('topic')
+        if topic is not None:
+            topic_time[topic] = topic_time.get(topic, 0) + activity.get('duration', 0)
+    return topic_time
+
+
+def aggregate(learning_data, stored=None):
+    """
+    Tổng hợp learning_data trong một lượt
+
+    Args:
+        learning_data: Dict chứa learning_activities, quiz_results
+        stored: Aggregate đã lưu của hồ sơ người học thì dùng lại, không tính lại
+            (mặc định lấy từ ProfileLearningData; không bao giờ đọc key 'aggregate' của learning_data)
+
+    Returns:
+        LearningAggregate
+    """
+    if stored is None:
+        stored = getattr(learning_data, 'stored_aggregate', None)
+    if stored is not None:
+        return LearningAggregate.from_dict(stored)
+    quiz_results = learning_data.get('quiz_results', [])
+    use_numpy = (
+        np is not None and LEARNING_METRICS_NUMPY
+        and len(quiz_results) >= LEARNING_METRICS_NUMPY_MIN
+    )
+    score_sum, passed, topics = (_group_numpy if use_numpy else _group_python)(quiz_results)
+    activities = learning_data.get('learning_activities', [])
+    return LearningAggregate(
+        quiz_count=len(quiz_results),
+        score_sum=score_sum,
+        passed=passed,
+        topics=topics,
+        study_days=_study_days(learning_data),
+        recent_scores=[q['score'] for q in quiz_results[-RECENT_QUIZZES:]],
+        activity_count=len(activities),
+        topic_time=_topic_time(activities)
+    )
@@ -0,0 +1,500 @@
+"""
+Module gateway gọi LLM dùng chung cho mọi module
+Mỗi process chỉ có một OpenAI client với một pool kết nối HTTP (keep-alive, HTTP/2 nếu
+có thư viện h2), nên socket và TLS session được dùng lại giữa roadmap, quiz, chat, PDF...
+thay vì mỗi module tự tạo client riêng lúc import.
+
+Cấu hình qua biến môi trường:
+- OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL
+- LLM_POOL_SIZE=20            số kết nối tối đa của pool
+- LLM_POOL_KEEPALIVE=20       số kết nối keep-alive được giữ lại
+- LLM_KEEPALIVE_EXPIRY=60     thời gian (giây) giữ kết nối rảnh
+- LLM_CONNECT_TIMEOUT=5       timeout kết nối (giây)
+- LLM_READ_TIMEOUT=120        timeout đọc response (giây)
+- LLM_HTTP2=1                 bật HTTP/2 (cần gói h2)
+
+Chính sách chống lỗi upstream cho mọi lời gọi:
+- Deadline theo endpoint (LLM_DEADLINE_<ENDPOINT>, ví dụ LLM_DEADLINE_CHAT=60), tính cho
+  toàn bộ lời gọi kể cả các lần thử lại; timeout của mỗi lần gọi không vượt quá thời gian còn lại
+- Thử lại với exponential backoff + jitter khi gặp 429/5xx/lỗi kết nối (LLM_MAX_RETRIES),
+  tôn trọng header Retry-After nếu còn kịp deadline
+- Circuit breaker: sau LLM_BREAKER_THRESHOLD lời gọi liên tiếp thất bại vì lỗi upstream (mỗi lời gọi
+  tính một lần dù đã thử lại bao nhiêu lần) thì mở mạch trong
+  LLM_BREAKER_COOLDOWN giây, mọi lời gọi (và việc tạo job mới) bị từ chối ngay bằng
+  LLMUnavailableError thay vì giữ thread chờ provider đang sự cố. Hết cooldown chỉ cho
+  một lời gọi thử (half-open); thành công thì đóng mạch, thất bại thì mở lại.
+  Breaker nằm trong từng process, trạng thái xem ở /api/jobs/metrics.
+- Với stream=True, kết quả của lời gọi chỉ được ghi vào breaker khi stream được đọc hết (hoặc
+  lỗi giữa chừng), và deadline được kiểm tra giữa các chunk. Một lần đọc chunk chờ tối đa
+  timeout đã đặt lúc mở stream, nên stream có thể vượt deadline tối đa một khoảng như vậy.
+
+Chế độ ASGI (asgi.py) dùng achat_completion(): AsyncOpenAI với pool httpx.AsyncClient
+riêng cho từng event loop, cùng chính sách deadline/thử lại/circuit breaker.
+"""
+import os
+import asyncio
+import math
+import weakref
+import random
+import threading
+import time
+import importlib.util
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+from dotenv import load_dotenv
+
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+DEFAULT_MODEL = os.getenv('OPENAI_MODEL', 'gpt-5-nano-2025-08-07')
+
+LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', 20))
+LLM_POOL_KEEPALIVE = int(os.getenv('LLM_POOL_KEEPALIVE', LLM_POOL_SIZE))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', 60))
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', 5))
+LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', 120))
+LLM_HTTP2 = os.getenv('LLM_HTTP2', '1') == '1'
+
+# Deadline (giây) cho toàn bộ lời gọi theo endpoint, tra theo tên đầy đủ rồi tới tiền tố
+# (ví dụ 'recommendations.next_topics' -> 'recommendations')
+LLM_DEADLINE_DEFAULT = float(os.getenv('LLM_DEADLINE_DEFAULT', 90))
+DEFAULT_DEADLINES = {
+    'chat': 60,
+    'chat.stream': 120,
+    'pdf': 180,
+    'recommendations': 15,  # 3 request chạy song song, client chờ kết quả tổng hợp
+}
+
+# Thử lại
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 3))
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', 0.5))
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', 8))
+
+# Circuit breaker
+LLM_BREAKER_THRESHOLD = int(os.getenv('LLM_BREAKER_THRESHOLD', 5))
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', 30))
+
+
+class LLMUnavailableError(Exception):
+    """Provider LLM đang sự cố (circuit breaker mở), client nên thử lại sau retry_after giây"""
+
+    def __init__(self, retry_after):
+        super().__init__("Dịch vụ AI tạm thời không khả dụng")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Circuit breaker 3 trạng thái: closed -> open -> half_open -> closed/open"""
+
+    def __init__(self, threshold=LLM_BREAKER_THRESHOLD, cooldown=LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+        # Metrics
+        self.opened = 0
+        self.rejected = 0
+
+    def _retry_after(self, now):
+        return max(1, math.ceil(self._opened_at + self.cooldown - now))
+
+    def before_call(self):
+        """Ném LLMUnavailableError nếu mạch đang mở (hoặc đã có lời gọi thử đang chạy)"""
+        now = time.time()
+        with self._lock:
+            if self._state == 'open' and now - self._opened_at >= self.cooldown:
+                self._state = 'half_open'
+            if self._state == 'closed':
+                return
+            if self._state == 'half_open' and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+            raise LLMUnavailableError(self._retry_after(now) if self._state == 'open' else 1)
+
+    def ensure_available(self):
+        """Kiểm tra không chiếm lượt gọi thử, dùng trước khi nhận job mới"""
+        now = time.time()
+        with self._lock:
+            if self._state == 'open' and now - self._opened_at < self.cooldown:
+                self.rejected += 1
+                raise LLMUnavailableError(self._retry_after(now))
+
+    def record_success(self):
+        with self._lock:
+            self._state = 'closed'
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == 'half_open' or self._failures >= self.threshold:
+                if self._state != 'open':
+                    self.opened += 1
+                self._state = 'open'
+                self._opened_at = time.time()
+
+    def release(self):
+        """Lời gọi kết thúc mà không phản ánh sức khỏe provider (ví dụ lỗi 400)"""
+        with self._lock:
+            self._probing = False
+
+    def state(self):
+        now = time.time()
+        with self._lock:
+            state = self._state
+            if state == 'open' and now - self._opened_at >= self.cooldown:
+                state = 'half_open'
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'retry_after': self._retry_after(now) if state == 'open' else 0,
+                'threshold': self.threshold,
+                'cooldown': self.cooldown,
+                'opened': self.opened,
+                'rejected': self.rejected,
+            }
+
+
+breaker = CircuitBreaker()
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+# event loop -> AsyncOpenAI (client async gắn với event loop tạo ra nó)
+_async_clients = weakref.WeakKeyDictionary()
+_async_override = None
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def http2_enabled():
+    """HTTP/2 chỉ bật khi được cấu hình và gói h2 đã được cài"""
+    return LLM_HTTP2 and importlib.util.find_spec('h2') is not None
+
+
+def _build_client(http_client_class=httpx.Client, client_class=OpenAI):
+    http_client = http_client_class(
+        http2=http2_enabled(),
+        limits=httpx.Limits(
+            max_connections=LLM_POOL_SIZE,
+            max_keepalive_connections=LLM_POOL_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        follow_redirects=True
+    )
+    print(f"[LLM Gateway] Tạo {client_class.__name__} (pool={LLM_POOL_SIZE}, http2={http2_enabled()}, pid={os.getpid()})")
+    # Thử lại do chat_completion/achat_completion đảm nhận (theo deadline và circuit breaker)
+    return client_class(
+        api_key=OPENAI_API_KEY,
+        base_url=OPENAI_BASE_URL,
+        http_client=http_client,
+        max_retries=0
+    )
+
+
+def get_client():
+    """Lấy OpenAI client dùng chung của process (tạo lại sau khi gunicorn fork)"""
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = _build_client()
+            _client_pid = os.getpid()
+        return _client
+
+
+def get_async_client():
+    """Lấy AsyncOpenAI của event loop đang chạy (mỗi loop một pool kết nối)"""
+    if _async_override is not None:
+        return _async_override
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _build_client(httpx.AsyncClient, AsyncOpenAI)
+        _async_clients[loop] = client
+    return client
+
+
+def configure(client=None, async_client=None):
+    """Thay client dùng chung (ví dụ client giả khi test)"""
+    global _client, _client_pid, _async_override
+    with _client_lock:
+        if client is not None:
+            _client = client
+            _client_pid = os.getpid()
+        if async_client is not None:
+            _async_override = async_client
+
+
+def get_deadline(endpoint):
+    """Deadline (giây) của endpoint: LLM_DEADLINE_<ENDPOINT>, rồi tới tiền tố, rồi mặc định"""
+    names = [endpoint]
+    if '.' in endpoint:
+        names.append(endpoint.split('.', 1)[0])
+    for name in names:
+        value = os.getenv(f"LLM_DEADLINE_{name.upper().replace('.', '_')}")
+        if value is not None:
+            return float(value)
+        if name in DEFAULT_DEADLINES:
+            return float(DEFAULT_DEADLINES[name])
+    return LLM_DEADLINE_DEFAULT
+
+
+def ensure_available():
+    """Ném LLMUnavailableError nếu circuit breaker đang mở (dùng trước khi đưa job vào hàng đợi)"""
+    breaker.ensure_available()
+
+
+def _is_retryable(error):
+    """Lỗi tạm thời của upstream: 429, 5xx, lỗi kết nối/timeout"""
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    status = getattr(error, 'status_code', None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def _retry_after_header(error):
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt, error):
+    """Exponential backoff với full jitter, không ngắn hơn Retry-After của server"""
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+    retry_after = _retry_after_header(error)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _record(endpoint, name, value=1):
+    with _stats_lock:
+        stats = _stats.setdefault(endpoint, {'calls': 0, 'errors': 0, 'retries': 0, 'total_time': 0.0})
+        stats[name] += value
+
+
+def _retry_delay(endpoint, attempt, error, deadline_at):
+    """
+    Xử lý lỗi của một lần gọi
+
+    Returns:
+        Số giây chờ trước lần thử tiếp theo, None nếu không thử lại (ném lỗi)
+    """
+    if not _is_retryable(error):
+        return None
+    delay = _backoff(attempt, error)
+    if attempt >= LLM_MAX_RETRIES or time.time() + delay >= deadline_at:
+        return None
+    _record(endpoint, 'retries')
+    print(f"[LLM Gateway] {endpoint}: lỗi {type(error).__name__}, thử lại lần {attempt + 1} sau {delay:.1f}s")
+    return delay
+
+
+def _record_outcome(error):
+    """
+    Ghi kết quả của cả lời gọi (sau mọi lần thử lại) vào circuit breaker: một lời gọi logic
+    bỏ cuộc vì lỗi upstream chỉ tính là một lỗi, lỗi không phản ánh sức khỏe provider thì chỉ nhả lượt
+    """
+    if _is_retryable(error):
+        breaker.record_failure()
+    else:
+        breaker.release()
+
+
+def _deadline_error(stream):
+    """Lỗi timeout của stream vượt deadline (tính như lỗi upstream, breaker ghi nhận thất bại)"""
+    request = getattr(getattr(stream, 'response', None), 'request', None)
+    if request is None:
+        request = httpx.Request('POST', f"{OPENAI_BASE_URL or 'https://api.openai.com/v1'}/chat/completions")
+    return openai.APITimeoutError(request=request)
+
+
+def _guard_stream(endpoint, stream, deadline_at):
+    """
+    Bọc stream của chat_completion(stream=True): ghi kết quả vào circuit breaker khi stream
+    kết thúc thay vì lúc mở, dừng stream khi vượt deadline của endpoint
+    """
+    settled = False
+    try:
+        for chunk in stream:
+            if time.time() > deadline_at:
+                raise _deadline_error(stream)
+            yield chunk
+        settled = True
+        breaker.record_success()
+    except Exception as e:
+        settled = True
+        _record(endpoint, 'errors')
+        _record_outcome(e)
+        raise
+    finally:
+        if not settled:
+            # Người đọc dừng giữa chừng (client ngắt kết nối): không phản ánh sức khỏe provider
+            breaker.release()
+        close = getattr(stream, 'close', None)
+        if close is not None:
+            close()
+
+
+async def _aguard_stream(endpoint, stream, deadline_at):
+    """Phiên bản async của _guard_stream()"""
+    settled = False
+    try:
+        async for chunk in stream:
+            if time.time() > deadline_at:
+                raise _deadline_error(stream)
+            yield chunk
+        settled = True
+        breaker.record_success()
+    except Exception as e:
+        settled = True
+        _record(endpoint, 'errors')
+        _record_outcome(e)
+        raise
+    finally:
+        if not settled:
+            breaker.release()
+        close = getattr(stream, 'close', None)
+        if close is not None:
+            await close()
+
+
+def chat_completion(endpoint, **kwargs):
+    """
+    Gọi chat.completions.create qua client dùng chung
+
+    Args:
+        endpoint: Tên nơi gọi (roadmap, quiz, chat, analytics.insights...) dùng cho
+                  deadline và thống kê
+        **kwargs: Tham số của chat.completions.create (model mặc định là OPENAI_MODEL)
+
+    Returns:
+        Response của OpenAI; nếu stream=True là iterator các chunk, kết quả được ghi vào
+        circuit breaker khi đọc hết stream
+
+    Raises:
+        LLMUnavailableError: Circuit breaker đang mở
+        openai.APIError: Lỗi từ OpenAI sau khi đã hết số lần thử lại hoặc hết deadline
+    """
+    kwargs.setdefault('model', DEFAULT_MODEL)
+    started_at = time.time()
+    deadline_at = started_at + get_deadline(endpoint)
+    _record(endpoint, 'calls')
+    attempt = 0
+    # Đã qua breaker (có thể đang giữ lượt gọi thử half-open) nhưng chưa ghi kết quả
+    pending = False
+    try:
+        breaker.before_call()
+        pending = True
+        while True:
+            remaining = deadline_at - time.time()
+            try:
+                response = get_client().chat.completions.create(
+                    timeout=min(LLM_READ_TIMEOUT, max(remaining, 0.1)),
+                    **kwargs
+                )
+            except Exception as e:
+                delay = _retry_delay(endpoint, attempt, e, deadline_at)
+                if delay is None:
+                    pending = False
+                    _record_outcome(e)
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            # Stream: kết quả được ghi khi đọc hết stream
+            pending = False
+            if kwargs.get('stream'):
+                return _guard_stream(endpoint, response, deadline_at)
+            breaker.record_success()
+            return response
+    except Exception:
+        _record(endpoint, 'errors')
+        raise
+    finally:
+        if pending:
+            # Lời gọi bị hủy giữa chừng (asyncio.CancelledError khi client ngắt kết nối,
+            # KeyboardInterrupt...): không ghi kết quả nhưng phải nhả lượt gọi thử half-open
+            breaker.release()
+        _record(endpoint, 'total_time', time.time() - started_at)
+
+
+async def achat_completion(endpoint, **kwargs):
+    """Phiên bản async của chat_completion() (AsyncOpenAI, chờ backoff bằng asyncio.sleep)"""
+    kwargs.setdefault('model', DEFAULT_MODEL)
+    started_at = time.time()
+    deadline_at = started_at + get_deadline(endpoint)
+    _record(endpoint, 'calls')
+    attempt = 0
+    # Đã qua breaker (có thể đang giữ lượt gọi thử half-open) nhưng chưa ghi kết quả
+    pending = False
+    try:
+        breaker.before_call()
+        pending = True
+        while True:
+            remaining = deadline_at - time.time()
+            try:
+                response = await get_async_client().chat.completions.create(
+                    timeout=min(LLM_READ_TIMEOUT, max(remaining, 0.1)),
+                    **kwargs
+                )
+            except Exception as e:
+                delay = _retry_delay(endpoint, attempt, e, deadline_at)
+                if delay is None:
+                    pending = False
+                    _record_outcome(e)
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            # Stream: kết quả được ghi khi đọc hết stream
+            pending = False
+            if kwargs.get('stream'):
+                return _aguard_stream(endpoint, response, deadline_at)
+            breaker.record_success()
+            return response
+    except Exception:
+        _record(endpoint, 'errors')
+        raise
+    finally:
+        if pending:
+            # Lời gọi bị hủy giữa chừng (asyncio.CancelledError khi client ngắt kết nối,
+            # KeyboardInterrupt...): không ghi kết quả nhưng phải nhả lượt gọi thử half-open
+            breaker.release()
+        _record(endpoint, 'total_time', time.time() - started_at)
+
+
+def get_metrics():
+    """Cấu hình pool và thống kê số lần gọi/lỗi/thời gian trung bình theo endpoint"""
+    with _stats_lock:
+        endpoints = {endpoint: dict(values) for endpoint, values in _stats.items()}
+    for values in endpoints.values():
+        values['avg_time'] = round(values.pop('total_time') / values['calls'], 3) if values['calls'] else 0
+    return {
+        'pid': os.getpid(),
+        'base_url': OPENAI_BASE_URL,
+        'model': DEFAULT_MODEL,
+        'pool_size': LLM_POOL_SIZE,
+        'http2': http2_enabled(),
+        'connect_timeout': LLM_CONNECT_TIMEOUT,
+        'read_timeout': LLM_READ_TIMEOUT,
+        'max_retries': LLM_MAX_RETRIES,
+        'breaker': breaker.state(),
+        'endpoints': endpoints,
+    }
@@ -2,25 +2,21 @@ from flask import request, send_file
 import os
 import sys
 import json
-import tempfile
-import io
-import PyPDF2
 import uuid
-import threading
-import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import time
-import random
 from datetime import datetime
-from openai import OpenAI
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Table, TableStyle
-from reportlab.lib.enums import TA_JUSTIFY, TA_LEFT, TA_CENTER
-from reportlab.lib import colors
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 from dotenv import load_dotenv
+import job_store
+import job_scheduler
+import llm_gateway
+import pdf_text
+import pdf_cache
+import pdf_render
+import pdf_exports
+# Các hàm tiện ích UTF-8 nay nằm ở pdf_render, import lại để giữ nguyên API của module
+from pdf_render import ensure_utf8, create_paragraph
 
 # ===== CRITICAL: Đảm bảo encoding UTF-8 cho tất cả môi trường =====
 # Thiết lập encoding mặc định
@@ -44,57 +40,78 @@ print(f"[PDF Analysis] Encoding: stdout={sys.stdout.encoding}, stderr={sys.stder
 
 load_dotenv()
 
-# Cấu hình API
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Lưu trữ trạng thái các job (dùng chung giữa các worker)
+pdf_job_storage = job_store.get_store('pdf')
 
-# Lưu trữ trạng thái các job trong bộ nhớ
-pdf_job_storage = {}
+# Số ký tự text tối đa gửi cho AI - trích xuất dừng ngay khi đủ, không đọc hết tài liệu
+PDF_ANALYSIS_MAX_CHARS = int(os.getenv('PDF_ANALYSIS_MAX_CHARS', 15000))
+
+# Phân tích map-reduce cho tài liệu dài: chia text thành chunk ~PDF_CHUNK_TOKENS token,
+# phân tích song song tối đa PDF_MAP_WORKERS chunk (dùng chung mọi job) rồi tổng hợp một lần
+PDF_MAP_REDUCE = os.getenv('PDF_MAP_REDUCE', '1') == '1'
+PDF_CHUNK_TOKENS = int(os.getenv('PDF_CHUNK_TOKENS', 3000))
+PDF_CHARS_PER_TOKEN = float(os.getenv('PDF_CHARS_PER_TOKEN', 3))
+PDF_CHUNK_CHARS = int(PDF_CHUNK_TOKENS * PDF_CHARS_PER_TOKEN)
+PDF_MAX_CHUNKS = int(os.getenv('PDF_MAX_CHUNKS', 12))
+PDF_MAP_WORKERS = int(os.getenv('PDF_MAP_WORKERS', 4))
+
+# Ngân sách ký tự khi trích xuất: đủ cho mọi chunk nếu bật map-reduce, ngược lại chỉ phần gửi AI
+PDF_TEXT_BUDGET = PDF_CHUNK_CHARS * PDF_MAX_CHUNKS if PDF_MAP_REDUCE else PDF_ANALYSIS_MAX_CHARS
+
+# Tỉ lệ thanh tiến độ phân tích dành cho bước map (phần còn lại cho bước reduce)
+PDF_MAP_PROGRESS_SHARE = 0.6
+
+_map_executor = ThreadPoolExecutor(max_workers=PDF_MAP_WORKERS, thread_name_prefix='pdf-map')
+
+# Khoảng thời gian tối thiểu (giây) giữa hai lần ghi progress vào job store
+PDF_PROGRESS_INTERVAL = float(os.getenv('PDF_PROGRESS_INTERVAL', 0.3))
+
+# Độ dài ước tính (ký tự) của JSON phân tích, dùng để quy số token đã nhận ra phần trăm tiến độ
+PDF_EXPECTED_RESPONSE_CHARS = int(os.getenv('PDF_EXPECTED_RESPONSE_CHARS', 6000))
 
 def update_progress(job_id, progress, message=""):
     """Cập nhật progress của job"""
-    if job_id in pdf_job_storage:
-        pdf_job_storage[job_id]['progress'] = progress
-        pdf_job_storage[job_id]['progress_message'] = message
-        pdf_job_storage[job_id]['updated_at'] = datetime.now().isoformat()
+    pdf_job_storage.update(
+        job_id,
+        progress=progress,
+        progress_message=message,
+        updated_at=datetime.now().isoformat()
+    )
 
-def simulate_progress(job_id, start, end, duration, message=""):
-    """Chạy progress bar giả từ start đến end trong khoảng thời gian duration (seconds)"""
-    steps = end - start
-    interval = duration / steps
-    
-    for i in range(steps):
-        current_progress = start + i
-        update_progress(job_id, current_progress, message)
-        time.sleep(interval)
+def stage_progress(job_id, start, end, message=""):
+    """
+    Tạo callback report(done, total) báo tiến độ thật của một giai đoạn
+    Tiến độ done/total được quy về khoảng [start, end] của thanh progress; chỉ ghi vào job store
+    khi phần trăm tăng và cách lần ghi trước ít nhất PDF_PROGRESS_INTERVAL giây (hoặc khi xong giai đoạn)
+    """
+    state = {'progress': start, 'last_write': 0.0}
 
-def ensure_utf8(text):
-    """Đảm bảo text là UTF-8 string"""
-    if isinstance(text, bytes):
-        return text.decode('utf-8', errors='replace')
-    elif isinstance(text, str):
-        return text
-    else:
-        return str(text)
+    def report(done, total):
+        if total <= 0:
+            return
+        progress = start + int((end - start) * min(done, total) / total)
+        finished = done >= total
+        if progress <= state['progress'] and not finished:
+            return
+        now = time.time()
+        if not finished and now - state['last_write'] < PDF_PROGRESS_INTERVAL:
+            return
+        state['progress'] = progress
+        state['last_write'] = now
+        update_progress(job_id, progress, message)
 
-def create_paragraph(text, style):
-    """Tạo Paragraph với text UTF-8 an toàn"""
-    safe_text = ensure_utf8(text)
-    return Paragraph(safe_text, style)
+    return report
 
-def trích_xuất_text_từ_pdf(pdf_path):
-    """Trích xuất nội dung text từ file PDF"""
-    text = ""
+def trích_xuất_text_từ_pdf(pdf_path, max_chars=PDF_TEXT_BUDGET, on_page=None):
+    """
+    Trích xuất nội dung text từ file PDF (đường dẫn, bytes hoặc file-like object)
+    Dừng khi đã đủ max_chars ký tự; tài liệu nhiều trang được trích xuất song song (xem pdf_text.py)
+    """
     try:
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            num_pages = len(pdf_reader.pages)
-            
-            # Trích xuất text từ tất cả các trang
-            for page_num in range(num_pages):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text() + "\n\n"
-            
+        text, pages_read, num_pages = pdf_text.extract_text(pdf_path, max_chars=max_chars, on_page=on_page)
+        if pages_read < num_pages:
+            print(f"[OK] Đã trích xuất text từ {pages_read}/{num_pages} trang (đủ {max_chars} ký tự)")
+        else:
             print(f"[OK] Đã trích xuất text từ {num_pages} trang")
     except Exception as e:
         print(f"Lỗi khi trích xuất PDF: {str(e)}")
@@ -102,15 +119,8 @@ def trích_xuất_text_từ_pdf(pdf_path):
     
     return text
 
-def phân_tích_với_ai(text):
-    """Sử dụng OpenAI để phân tích tài liệu học thuật và tạo insights có cấu trúc"""
-    try:
-        # Đảm bảo text là UTF-8
-        if isinstance(text, bytes):
-            text = text.decode('utf-8', errors='replace')
-        
-        # Ví dụ JSON mẫu
-        example_json = """{
+# Ví dụ JSON mẫu (cấu trúc bắt buộc của bản phân tích)
+EXAMPLE_ANALYSIS_JSON = """{
     "tieu_de": "Ứng dụng Machine Learning trong Chẩn đoán Y tế",
     "tom_tat": "Bài báo này khám phá việc ứng dụng các mô hình deep learning trong phân tích hình ảnh y tế. Nghiên cứu chứng minh rằng mạng neural tích chập có thể đạt độ chính xác 95% trong việc phát hiện ung thư giai đoạn đầu. Nghiên cứu cung cấp một framework để tích hợp AI vào quy trình làm việc lâm sàng trong khi vẫn đảm bảo an toàn bệnh nhân và quyền riêng tư dữ liệu.",
     "muc_tieu_hoc_tap": [
@@ -198,17 +208,27 @@ def phân_tích_với_ai(text):
         }
     }
 }"""
-        
-        prompt = f"""Bạn là một chuyên gia phân tích nghiên cứu học thuật. Hãy phân tích tài liệu học thuật sau đây và cung cấp một bản tổng hợp kiến thức toàn diện BẰNG TIẾNG VIỆT.
 
-Nội dung Tài liệu Học thuật:
-{text[:15000]}
+# Cấu trúc JSON rút gọn cho bước map (phân tích từng phần của tài liệu dài)
+PARTIAL_ANALYSIS_JSON = """{
+    "tom_tat": "3-5 câu tóm tắt nội dung phần này",
+    "thuat_ngu_chinh": {"Thuật ngữ": "Định nghĩa ngắn gọn"},
+    "phat_hien_chinh": ["Phát hiện hoặc luận điểm quan trọng"],
+    "phuong_phap_nghien_cuu": "Phương pháp được mô tả trong phần này (nếu có)",
+    "ung_dung_thuc_te": ["Ứng dụng thực tế được nhắc đến"],
+    "cau_hoi_on_tap": [{"cau_hoi": "...", "tra_loi": "...", "do_kho": "Dễ | Trung bình | Khó"}],
+    "chi_so_chinh": {"Tên chỉ số": "Giá trị"}
+}"""
 
-HƯỚNG DẪN QUAN TRỌNG:
+SYSTEM_PROMPT = "Bạn là một chuyên gia phân tích nghiên cứu học thuật. Bạn PHẢI trả lời chỉ với JSON hợp lệ BẰNG TIẾNG VIỆT. Không bao gồm bất kỳ văn bản nào trước hoặc sau JSON. Không sử dụng markdown code blocks. Bắt đầu phản hồi của bạn bằng { và kết thúc bằng }."
+
+def build_analysis_instructions():
+    """Phần hướng dẫn định dạng JSON dùng chung cho prompt phân tích và prompt tổng hợp"""
+    return f"""HƯỚNG DẪN QUAN TRỌNG:
 1. Bạn PHẢI trả lời chỉ với JSON hợp lệ - không có văn bản giải thích trước hoặc sau
 2. Tuân theo CẤU TRÚC CHÍNH XÁC này (đây là ví dụ hoàn chỉnh):
 
-{example_json}
+{EXAMPLE_ANALYSIS_JSON}
 
 3. Phản hồi của bạn phải bắt đầu bằng {{ và kết thúc bằng }}
 4. Đảm bảo tất cả các chuỗi được escape và quote đúng cách
@@ -217,666 +237,267 @@ HƯỚNG DẪN QUAN TRỌNG:
 
 Bây giờ hãy phân tích tài liệu học thuật ở trên và cung cấp phản hồi của bạn theo CHÍNH XÁC định dạng JSON như ví dụ."""
 
-        response = client.chat.completions.create(
-            model="gpt-5-nano-2025-08-07",
-            messages=[
-                {"role": "system", "content": "Bạn là một chuyên gia phân tích nghiên cứu học thuật. Bạn PHẢI trả lời chỉ với JSON hợp lệ BẰNG TIẾNG VIỆT. Không bao gồm bất kỳ văn bản nào trước hoặc sau JSON. Không sử dụng markdown code blocks. Bắt đầu phản hồi của bạn bằng { và kết thúc bằng }."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7
-        )
-        
-        content = response.choices[0].message.content.strip()
-        
-        # Log response for debugging
-        print(f"Raw AI response (first 200 chars): {content[:200]}")
-        
-        # Remove markdown code blocks if present
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        
-        content = content.strip()
-        
-        # Check if response is empty
-        if not content:
-            raise Exception("AI trả về phản hồi rỗng")
-        
-        # Check if response starts with valid JSON
-        if not content.startswith("{"):
-            print(f"Cảnh báo: Phản hồi không bắt đầu bằng '{{'. First 100 chars: {content[:100]}")
-            json_start = content.find("{")
-            if json_start != -1:
-                content = content[json_start:]
-                print(f"Đã trích xuất JSON bắt đầu từ vị trí {json_start}")
-            else:
-                raise Exception(f"Không tìm thấy JSON object trong phản hồi. Response: {content[:200]}")
-        
-        analysis = json.loads(content)
-        print("[OK] Phân tích AI hoàn tất thành công")
-        return analysis
-        
+# Phiên bản của các artifact trong pdf_cache: đổi prompt, model, cách chia chunk hoặc layout
+# flashcard thì tag đổi theo, kết quả cũ tự động không được dùng lại
+PDF_PROMPT_VERSION = 1
+PDF_RENDER_VERSION = 2
+
+def build_cache_tags():
+    """Tag phiên bản cho từng loại artifact của pdf_cache"""
+    fingerprint = json.dumps([
+        PDF_PROMPT_VERSION, llm_gateway.DEFAULT_MODEL, SYSTEM_PROMPT, EXAMPLE_ANALYSIS_JSON,
+        PARTIAL_ANALYSIS_JSON, PDF_MAP_REDUCE, PDF_ANALYSIS_MAX_CHARS, PDF_CHUNK_CHARS, PDF_MAX_CHUNKS
+    ], ensure_ascii=False)
+    analysis_tag = hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:16]
+    return {
+        'text': str(PDF_TEXT_BUDGET),
+        'analysis': analysis_tag,
+        'flashcard': f'{analysis_tag}-r{PDF_RENDER_VERSION}',
+    }
+
+PDF_CACHE_TAGS = build_cache_tags()
+
+def parse_ai_json(content):
+    """Làm sạch phản hồi AI (markdown, văn bản thừa) và parse thành dict"""
+    content = content.strip()
+    
+    # Log response for debugging
+    print(f"Raw AI response (first 200 chars): {content[:200]}")
+    
+    # Remove markdown code blocks if present
+    if content.startswith("```json"):
+        content = content[7:]
+    if content.startswith("```"):
+        content = content[3:]
+    if content.endswith("```"):
+        content = content[:-3]
+    
+    content = content.strip()
+    
+    # Check if response is empty
+    if not content:
+        raise Exception("AI trả về phản hồi rỗng")
+    
+    # Check if response starts with valid JSON
+    if not content.startswith("{"):
+        print(f"Cảnh báo: Phản hồi không bắt đầu bằng '{{'. First 100 chars: {content[:100]}")
+        json_start = content.find("{")
+        if json_start != -1:
+            content = content[json_start:]
+            print(f"Đã trích xuất JSON bắt đầu từ vị trí {json_start}")
+        else:
+            raise Exception(f"Không tìm thấy JSON object trong phản hồi. Response: {content[:200]}")
+    
+    try:
+        return json.loads(content)
     except json.JSONDecodeError as e:
         print(f"Lỗi JSON decode: {str(e)}")
-        print(f"Failed content (first 500 chars): {content[:500] if 'content' in locals() else 'Không có nội dung'}")
+        print(f"Failed content (first 500 chars): {content[:500]}")
         raise Exception(f"Không thể parse phản hồi AI thành JSON: {str(e)}")
-    except Exception as e:
-        print(f"Lỗi trong phân tích AI: {str(e)}")
-        raise Exception(f"Không thể tạo phân tích AI: {str(e)}")
 
-def tạo_pdf_flashcard(analysis, output_path):
-    """Tạo PDF flashcard kiến thức giáo dục đẹp và toàn diện"""
-    try:
-        # Đăng ký font Unicode hỗ trợ tiếng Việt
-        font_name = 'Arial'
-        font_bold = 'Arial-Bold'
-        font_italic = 'Arial-Italic'
-        
-        # Thử load font từ nhiều nguồn
-        font_loaded = False
-        
-        # 1. Thử Windows fonts
-        if sys.platform.startswith('win'):
-            try:
-                pdfmetrics.registerFont(TTFont('Arial', 'C:/Windows/Fonts/arial.ttf'))
-                pdfmetrics.registerFont(TTFont('Arial-Bold', 'C:/Windows/Fonts/arialbd.ttf'))
-                pdfmetrics.registerFont(TTFont('Arial-Italic', 'C:/Windows/Fonts/ariali.ttf'))
-                font_loaded = True
-                print("[PDF] ✓ Loaded Windows Arial fonts")
-            except Exception as e:
-                print(f"[PDF] Windows fonts not available: {e}")
-        
-        # 2. Thử DejaVu fonts (có sẵn trên nhiều Linux distros)
-        if not font_loaded:
-            try:
-                from reportlab.pdfbase.ttfonts import TTFont
-                import matplotlib.font_manager as fm
-                
-                # Tìm DejaVu Sans font
-                dejavu_path = None
-                for font in fm.findSystemFonts(fontpaths=None, fontext='ttf'):
-                    if 'DejaVuSans.ttf' in font:
-                        dejavu_path = font
-                        break
-                
-                if dejavu_path:
-                    pdfmetrics.registerFont(TTFont('Arial', dejavu_path))
-                    # Dùng cùng font cho bold và italic
-                    pdfmetrics.registerFont(TTFont('Arial-Bold', dejavu_path))
-                    pdfmetrics.registerFont(TTFont('Arial-Italic', dejavu_path))
-                    font_loaded = True
-                    print(f"[PDF] ✓ Loaded DejaVu fonts from {dejavu_path}")
-            except Exception as e:
-                print(f"[PDF] DejaVu fonts not available: {e}")
-        
-        # 3. Fallback: Download và cache fonts
-        if not font_loaded and (sys.platform.startswith('linux') or os.getenv('DYNO')):
-            try:
-                import urllib.request
-                import tempfile
-                
-                fonts_dir = os.path.join(tempfile.gettempdir(), 'nhan_hoc_fonts')
-                os.makedirs(fonts_dir, exist_ok=True)
-                
-                font_urls = {
-                    'Arial': 'https://github.com/matomo-org/travis-scripts/raw/master/fonts/Arial.ttf',
-                    'Arial-Bold': 'https://github.com/matomo-org/travis-scripts/raw/master/fonts/Arial_Bold.ttf',
-                }
-                
-                for font_key, url in font_urls.items():
-                    font_file = os.path.join(fonts_dir, f'{font_key}.ttf')
-                    
-                    # Download nếu chưa có
-                    if not os.path.exists(font_file):
-                        print(f"[PDF] Downloading {font_key} from {url}...")
-                        urllib.request.urlretrieve(url, font_file)
-                        print(f"[PDF] ✓ Downloaded {font_key}")
-                    
-                    pdfmetrics.registerFont(TTFont(font_key, font_file))
-                
-                # Dùng Arial cho italic
-                pdfmetrics.registerFont(TTFont('Arial-Italic', os.path.join(fonts_dir, 'Arial.ttf')))
-                font_loaded = True
-                print("[PDF] ✓ Loaded downloaded fonts")
-                
-            except Exception as e:
-                print(f"[PDF] Font download failed: {e}")
-        
-        # 4. Cuối cùng fallback to Helvetica (không hỗ trợ tiếng Việt tốt)
-        if not font_loaded:
-            font_name = 'Helvetica'
-            font_bold = 'Helvetica-Bold'
-            font_italic = 'Helvetica-Oblique'
-            print("[PDF] ⚠ Fallback to Helvetica (limited Vietnamese support)")
-        
-        # Tạo PDF với encoding UTF-8 - CRITICAL cho Heroku
-        doc = SimpleDocTemplate(
-            output_path, 
-            pagesize=letter,
-            rightMargin=60, 
-            leftMargin=60,
-            topMargin=60, 
-            bottomMargin=40
-        )
-        
-        elements = []
-        styles = getSampleStyleSheet()
-        
-        # ============= CÁC STYLE TÙY CHỈNH =============
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=26,
-            textColor=colors.HexColor('#1a237e'),
-            spaceAfter=10,
-            spaceBefore=20,
-            alignment=TA_CENTER,
-            fontName=font_bold
-        )
-        
-        subtitle_style = ParagraphStyle(
-            'Subtitle',
-            parent=styles['Normal'],
-            fontSize=11,
-            textColor=colors.HexColor('#5e35b1'),
-            spaceAfter=20,
-            alignment=TA_CENTER,
-            fontName=font_italic
-        )
-        
-        section_header_style = ParagraphStyle(
-            'SectionHeader',
-            parent=styles['Heading2'],
-            fontSize=18,
-            textColor=colors.white,
-            spaceAfter=15,
-            spaceBefore=20,
-            fontName=font_bold,
-            backColor=colors.HexColor('#1976d2'),
-            borderPadding=(8, 8, 8, 8),
-            leftIndent=10
-        )
-        
-        body_style = ParagraphStyle(
-            'CustomBody',
-            parent=styles['BodyText'],
-            fontSize=11,
-            textColor=colors.HexColor('#212121'),
-            spaceAfter=12,
-            alignment=TA_JUSTIFY,
-            leading=16,
-            fontName=font_name
-        )
-        
-        highlight_style = ParagraphStyle(
-            'Highlight',
-            parent=styles['BodyText'],
-            fontSize=11,
-            textColor=colors.HexColor('#1565c0'),
-            spaceAfter=10,
-            leftIndent=15,
-            rightIndent=15,
-            backColor=colors.HexColor('#e3f2fd'),
-            borderColor=colors.HexColor('#1976d2'),
-            borderWidth=1,
-            borderPadding=10,
-            leading=15,
-            fontName=font_name
-        )
-        
-        term_style = ParagraphStyle(
-            'Term',
-            parent=styles['BodyText'],
-            fontSize=10,
-            textColor=colors.HexColor('#2e7d32'),
-            spaceAfter=8,
-            leftIndent=20,
-            leading=13,
-            fontName=font_bold
-        )
-        
-        definition_style = ParagraphStyle(
-            'Definition',
-            parent=styles['BodyText'],
-            fontSize=10,
-            textColor=colors.HexColor('#424242'),
-            spaceAfter=10,
-            leftIndent=35,
-            leading=13,
-            fontName=font_name
-        )
-        
-        subsection_style = ParagraphStyle(
-            'Subsection',
-            parent=styles['Heading3'],
-            fontSize=14,
-            textColor=colors.HexColor('#0277bd'),
-            spaceAfter=10,
-            spaceBefore=12,
-            fontName=font_bold
-        )
-        
-        question_style = ParagraphStyle(
-            'Question',
-            parent=styles['BodyText'],
-            fontSize=10,
-            textColor=colors.HexColor('#d32f2f'),
-            spaceAfter=6,
-            fontName=font_bold,
-            leftIndent=15
-        )
-        
-        answer_style = ParagraphStyle(
-            'Answer',
-            parent=styles['BodyText'],
-            fontSize=10,
-            textColor=colors.HexColor('#424242'),
-            spaceAfter=12,
-            leftIndent=25,
-            leading=13,
-            fontName=font_name
-        )
-        
-        # ============= TRANG BÌA =============
-        elements.append(Spacer(1, 40))
-        
-        # Thanh trang trí trên cùng
-        top_bar = Table([['']], colWidths=[doc.width])
-        top_bar.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#1976d2')),
-            ('LINEBELOW', (0, 0), (-1, -1), 4, colors.HexColor('#0d47a1'))
-        ]))
-        elements.append(top_bar)
-        elements.append(Spacer(1, 30))
-        
-        # Tiêu đề
-        title = create_paragraph(f"<b>{ensure_utf8(analysis['tieu_de'])}</b>", title_style)
-        elements.append(title)
-        
-        # Hộp metadata
-        metadata_text = f"""<b>Độ khó:</b> {ensure_utf8(analysis.get('do_kho', 'Trung bình'))} | 
-        <b>Thời gian học:</b> {ensure_utf8(analysis.get('thoi_gian_hoc_uoc_tinh', '30-45 phút'))}"""
-        elements.append(create_paragraph(metadata_text, subtitle_style))
-        elements.append(Spacer(1, 20))
-        
-        # Hộp mục tiêu học tập
-        if analysis.get('muc_tieu_hoc_tap'):
-            obj_data = [[create_paragraph("<b>[1] Mục tiêu Học tập</b>", body_style)]]
-            for obj in analysis['muc_tieu_hoc_tap']:
-                obj_data.append([create_paragraph(f"• {ensure_utf8(obj)}", body_style)])
-            
-            obj_table = Table(obj_data, colWidths=[doc.width])
-            obj_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e8f5e9')),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#f1f8e9')),
-                ('BOX', (0, 0), (-1, -1), 2, colors.HexColor('#388e3c')),
-                ('LEFTPADDING', (0, 0), (-1, -1), 12),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 12),
-                ('TOPPADDING', (0, 0), (-1, -1), 8),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-            ]))
-            elements.append(obj_table)
-            elements.append(Spacer(1, 20))
-        
-        # ============= TÓM TẮT TỔNG QUAN =============
-        elements.append(create_paragraph("[2] Tóm tắt Tổng quan", section_header_style))
-        elements.append(Spacer(1, 5))
-        
-        summary_text = analysis['tom_tat']
-        if isinstance(summary_text, list):
-            summary_text = ' '.join([ensure_utf8(s) for s in summary_text])
-        else:
-            summary_text = ensure_utf8(summary_text)
-        
-        elements.append(create_paragraph(summary_text, highlight_style))
-        elements.append(Spacer(1, 15))
-        
-        # ============= CHỈ SỐ CHÍNH =============
-        if analysis.get('tom_tat_truc_quan', {}).get('chi_so_chinh'):
-            metrics = analysis['tom_tat_truc_quan']['chi_so_chinh']
-            elements.append(create_paragraph("[3] Chỉ số Chính Nhanh", body_style))
-            
-            metric_data = []
-            for key, value in metrics.items():
-                metric_data.append([
-                    create_paragraph(f"<b>{ensure_utf8(key)}</b>", body_style),
-                    create_paragraph(f"<font size=14 color='#1976d2'><b>{ensure_utf8(value)}</b></font>", body_style)
-                ])
-            
-            metric_table = Table(metric_data, colWidths=[doc.width * 0.6, doc.width * 0.4])
-            metric_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#e3f2fd')),
-                ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#1976d2')),
-                ('ALIGN', (1, 0), (1, -1), 'CENTER'),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('LEFTPADDING', (0, 0), (-1, -1), 10),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-                ('TOPPADDING', (0, 0), (-1, -1), 8),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-            ]))
-            elements.append(metric_table)
-            elements.append(Spacer(1, 20))
-        
-        # ============= PHÁT HIỆN CHÍNH =============
-        elements.append(create_paragraph("[4] Phát hiện Chính", section_header_style))
-        elements.append(Spacer(1, 5))
-        
-        findings_data = []
-        for i, finding in enumerate(analysis['phat_hien_chinh'], 1):
-            if i <= 2:
-                bg_color = colors.HexColor('#fff3e0')
+def call_ai_json(endpoint, prompt, temperature=0.7, on_progress=None, expected_chars=None):
+    """
+    Gọi AI với SYSTEM_PROMPT và trả về JSON đã parse
+    Nếu có on_progress: gọi ở chế độ streaming và báo on_progress(số ký tự đã nhận, số ký tự ước tính)
+    """
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+    
+    if on_progress is None:
+        response = llm_gateway.chat_completion(endpoint, messages=messages, temperature=temperature)
+        return parse_ai_json(response.choices[0].message.content)
+    
+    # Streaming: tiến độ theo số token thực nhận được
+    expected_chars = expected_chars or PDF_EXPECTED_RESPONSE_CHARS
+    stream = llm_gateway.chat_completion(endpoint, messages=messages, temperature=temperature, stream=True)
+    parts = []
+    received = 0
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            received += len(delta)
+            # Chưa xong thì không báo quá 95% giai đoạn (độ dài thật chưa biết trước)
+            on_progress(min(received, expected_chars * 0.95), expected_chars)
+    return parse_ai_json(''.join(parts))
+
+def sub_progress(on_progress, start, end):
+    """Quy tiến độ done/total của một bước con về đoạn [start, end] (tỉ lệ 0-1) của on_progress"""
+    if on_progress is None:
+        return None
+    
+    def report(done, total):
+        on_progress(start + (end - start) * min(done, total) / total, 1.0)
+    
+    return report
+
+def chia_text_thành_chunk(text, chunk_chars=None):
+    """
+    Chia text thành các chunk tối đa chunk_chars ký tự (≈ PDF_CHUNK_TOKENS token)
+    Ưu tiên cắt ở ranh giới đoạn/trang, đoạn quá dài mới bị cắt cứng
+    """
+    chunk_chars = chunk_chars or PDF_CHUNK_CHARS
+    chunks = []
+    current = []
+    size = 0
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > chunk_chars:
+            if current:
+                chunks.append("\n\n".join(current))
+                current, size = [], 0
+            chunks.append(paragraph[:chunk_chars])
+            paragraph = paragraph[chunk_chars:]
+        if current and size + len(paragraph) + 2 > chunk_chars:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += len(paragraph) + 2
+    if current and any(p.strip() for p in current):
+        chunks.append("\n\n".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+def phân_tích_chunk(chunk, index, total):
+    """Bước map: trích xuất ý chính của một phần tài liệu thành JSON rút gọn"""
+    prompt = f"""Đây là phần {index + 1}/{total} của một tài liệu học thuật dài.
+
+Nội dung phần này:
+{chunk}
+
+Hãy trích xuất các ý chính CHỈ từ phần này, BẰNG TIẾNG VIỆT, với cấu trúc JSON sau:
+{PARTIAL_ANALYSIS_JSON}
+
+- Chỉ trả lời với JSON hợp lệ, bắt đầu bằng {{ và kết thúc bằng }}
+- Trường nào phần này không có thông tin thì để rỗng ("", [] hoặc {{}})"""
+    return call_ai_json('pdf.map', prompt, temperature=0.3)
+
+def gộp_phân_tích_từng_phần(partials):
+    """Gộp các JSON rút gọn của bước map (theo thứ tự phần), bỏ trùng thuật ngữ/ý"""
+    merged = {
+        'tom_tat': [],
+        'thuat_ngu_chinh': {},
+        'phat_hien_chinh': [],
+        'phuong_phap_nghien_cuu': [],
+        'ung_dung_thuc_te': [],
+        'cau_hoi_on_tap': [],
+        'chi_so_chinh': {},
+    }
+    seen = set()
+    for partial in partials:
+        for key, value in partial.items():
+            if key not in merged or not value:
+                continue
+            if isinstance(merged[key], dict):
+                if isinstance(value, dict):
+                    for name, definition in value.items():
+                        merged[key].setdefault(name, definition)
+            elif isinstance(value, list):
+                for item in value:
+                    marker = (key, json.dumps(item, ensure_ascii=False, sort_keys=True))
+                    if marker not in seen:
+                        seen.add(marker)
+                        merged[key].append(item)
             else:
-                bg_color = colors.white
-            
-            findings_data.append([
-                create_paragraph(f"<b>{i}</b>", body_style),
-                create_paragraph(ensure_utf8(finding), body_style)
-            ])
-        
-        findings_table = Table(findings_data, colWidths=[30, doc.width - 30])
-        findings_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, 1), colors.HexColor('#ff9800')),
-            ('BACKGROUND', (1, 0), (1, 1), colors.HexColor('#fff3e0')),
-            ('BACKGROUND', (0, 2), (-1, -1), colors.white),
-            ('TEXTCOLOR', (0, 0), (0, -1), colors.white),
-            ('ALIGN', (0, 0), (0, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('FONTNAME', (0, 0), (0, -1), font_bold),
-            ('FONTSIZE', (0, 0), (0, -1), 12),
-            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e0e0e0')),
-            ('LEFTPADDING', (0, 0), (-1, -1), 10),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-            ('TOPPADDING', (0, 0), (-1, -1), 8),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ]))
-        elements.append(findings_table)
-        elements.append(Spacer(1, 20))
-        
-        # ============= THUẬT NGỮ & ĐỊNH NGHĨA =============
-        if analysis.get('thuat_ngu_chinh'):
-            elements.append(PageBreak())
-            elements.append(create_paragraph("[5] Thuật ngữ & Định nghĩa Chính", section_header_style))
-            elements.append(Spacer(1, 10))
-            
-            for term, definition in analysis['thuat_ngu_chinh'].items():
-                elements.append(create_paragraph(f"<b>▸ {ensure_utf8(term)}</b>", term_style))
-                elements.append(create_paragraph(ensure_utf8(definition), definition_style))
-            
-            elements.append(Spacer(1, 20))
-        
-        # ============= PHƯƠNG PHÁP =============
-        elements.append(create_paragraph("[6] Phương pháp Nghiên cứu", section_header_style))
-        elements.append(Spacer(1, 5))
-        
-        methodology_text = analysis['phuong_phap_nghien_cuu']
-        if isinstance(methodology_text, list):
-            methodology_text = ' '.join([ensure_utf8(m) for m in methodology_text])
-        else:
-            methodology_text = ensure_utf8(methodology_text)
-        
-        elements.append(create_paragraph(methodology_text, body_style))
-        elements.append(Spacer(1, 20))
-        
-        # ============= ỨNG DỤNG THỰC TẾ =============
-        if analysis.get('ung_dung_thuc_te'):
-            elements.append(create_paragraph("[7] Ứng dụng Thực tế", section_header_style))
-            elements.append(Spacer(1, 5))
-            
-            app_data = []
-            for app in analysis['ung_dung_thuc_te']:
-                app_data.append([
-                    create_paragraph("+", body_style),
-                    create_paragraph(ensure_utf8(app), body_style)
-                ])
-            
-            app_table = Table(app_data, colWidths=[30, doc.width - 30])
-            app_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#e8f5e9')),
-                ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#2e7d32')),
-                ('FONTSIZE', (0, 0), (0, -1), 14),
-                ('FONTNAME', (0, 0), (0, -1), font_bold),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('LEFTPADDING', (0, 0), (-1, -1), 10),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-                ('TOPPADDING', (0, 0), (-1, -1), 8),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-            ]))
-            elements.append(app_table)
-            elements.append(Spacer(1, 20))
-        
-        # ============= Ý NGHĨA =============
-        elements.append(create_paragraph("[8] Ý nghĩa Chính", section_header_style))
-        elements.append(Spacer(1, 5))
+                merged[key].append(value)
+    return merged
+
+def phân_tích_map_reduce(text, on_progress=None):
+    """
+    Phân tích tài liệu dài theo map-reduce
+    - Map: chia text thành các chunk theo ngân sách token, phân tích song song qua pool giới hạn
+    - Reduce: gộp các kết quả từng phần rồi nhờ AI tổng hợp thành đúng cấu trúc EXAMPLE_ANALYSIS_JSON
+    Thời gian gần bằng 2 lần gọi AI (một lượt map song song + một lần reduce) dù tài liệu dài
+    """
+    chunks = chia_text_thành_chunk(text)
+    if len(chunks) > PDF_MAX_CHUNKS:
+        print(f"[PDF] Tài liệu có {len(chunks)} phần, chỉ phân tích {PDF_MAX_CHUNKS} phần đầu")
+        chunks = chunks[:PDF_MAX_CHUNKS]
+    print(f"[PDF] Phân tích map-reduce: {len(chunks)} phần")
+    
+    map_progress = sub_progress(on_progress, 0, PDF_MAP_PROGRESS_SHARE)
+    futures = [
+        _map_executor.submit(phân_tích_chunk, chunk, index, len(chunks))
+        for index, chunk in enumerate(chunks)
+    ]
+    partials = []
+    errors = []
+    for done, future in enumerate(futures, 1):
+        try:
+            partials.append(future.result())
+        except llm_gateway.LLMUnavailableError:
+            for pending in futures:
+                pending.cancel()
+            raise
+        except Exception as e:
+            print(f"[PDF] Lỗi khi phân tích phần {done}: {str(e)}")
+            errors.append(e)
+        if map_progress:
+            map_progress(done, len(futures))
+    
+    if not partials:
+        raise errors[0]
+    
+    merged = gộp_phân_tích_từng_phần(partials)
+    prompt = f"""Bạn là một chuyên gia phân tích nghiên cứu học thuật. Một tài liệu học thuật dài đã được chia thành {len(chunks)} phần và phân tích từng phần. Dưới đây là các ý chính đã gộp từ tất cả các phần (theo thứ tự trong tài liệu):
+
+{json.dumps(merged, ensure_ascii=False)}
+
+Hãy tổng hợp thành một bản tổng hợp kiến thức toàn diện cho TOÀN BỘ tài liệu BẰNG TIẾNG VIỆT: chọn lọc thuật ngữ, phát hiện và câu hỏi ôn tập quan trọng nhất, viết tóm tắt bao quát mọi phần.
+
+{build_analysis_instructions()}"""
+    analysis = call_ai_json(
+        'pdf',
+        prompt,
+        on_progress=sub_progress(on_progress, PDF_MAP_PROGRESS_SHARE, 1.0)
+    )
+    
+    # Bổ sung các trường AI tổng hợp bỏ sót từ kết quả từng phần
+    if merged['thuat_ngu_chinh']:
+        analysis.setdefault('thuat_ngu_chinh', merged['thuat_ngu_chinh'])
+    if merged['phat_hien_chinh']:
+        analysis.setdefault('phat_hien_chinh', merged['phat_hien_chinh'])
+    if merged['cau_hoi_on_tap']:
+        analysis.setdefault('cau_hoi_on_tap', merged['cau_hoi_on_tap'])
+    if merged['ung_dung_thuc_te']:
+        analysis.setdefault('ung_dung_thuc_te', merged['ung_dung_thuc_te'])
+    return analysis
+
+def phân_tích_với_ai(text, on_progress=None):
+    """
+    Sử dụng OpenAI để phân tích tài liệu học thuật và tạo insights có cấu trúc
+    Tài liệu dài hơn PDF_ANALYSIS_MAX_CHARS được phân tích theo map-reduce (nếu bật PDF_MAP_REDUCE)
+    Nếu có on_progress: gọi AI ở chế độ streaming và báo on_progress(done, total)
+    """
+    try:
+        # Đảm bảo text là UTF-8
+        if isinstance(text, bytes):
+            text = text.decode('utf-8', errors='replace')
         
-        implications_text = analysis['y_nghia']
-        if isinstance(implications_text, list):
-            implications_text = ' '.join([ensure_utf8(i) for i in implications_text])
+        if PDF_MAP_REDUCE and len(text) > PDF_ANALYSIS_MAX_CHARS:
+            analysis = phân_tích_map_reduce(text, on_progress)
         else:
-            implications_text = ensure_utf8(implications_text)
-        
-        elements.append(create_paragraph(implications_text, highlight_style))
-        elements.append(Spacer(1, 20))
-        
-        # ============= CÂU HỎI TƯ DUY PHÊ PHÁN =============
-        if analysis.get('cau_hoi_tu_duy_phe_phan'):
-            elements.append(PageBreak())
-            elements.append(create_paragraph("[9] Câu hỏi Tư duy Phê phán", section_header_style))
-            elements.append(Spacer(1, 10))
-            
-            crit_data = [[create_paragraph("<i>Suy ngẫm về những câu hỏi này để hiểu sâu hơn:</i>", body_style)]]
-            for i, q in enumerate(analysis['cau_hoi_tu_duy_phe_phan'], 1):
-                crit_data.append([create_paragraph(f"<b>{i}.</b> {ensure_utf8(q)}", body_style)])
-            
-            crit_table = Table(crit_data, colWidths=[doc.width])
-            crit_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#fff3e0')),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-                ('BOX', (0, 0), (-1, -1), 2, colors.HexColor('#f57c00')),
-                ('LINEBELOW', (0, 0), (-1, 0), 1, colors.HexColor('#f57c00')),
-                ('LEFTPADDING', (0, 0), (-1, -1), 15),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 15),
-                ('TOPPADDING', (0, 0), (-1, -1), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-            ]))
-            elements.append(crit_table)
-            elements.append(Spacer(1, 25))
-        
-        # ============= CÂU HỎI ÔN TẬP =============
-        if analysis.get('cau_hoi_on_tap'):
-            elements.append(create_paragraph("[10] Câu hỏi Tự đánh giá", section_header_style))
-            elements.append(Spacer(1, 10))
-            
-            for i, qa in enumerate(analysis['cau_hoi_on_tap'], 1):
-                difficulty = ensure_utf8(qa.get('do_kho', 'Trung bình'))
-                
-                if difficulty == 'Dễ':
-                    diff_color = '#4caf50'
-                    bg_color = '#e8f5e9'
-                elif difficulty == 'Khó':
-                    diff_color = '#f44336'
-                    bg_color = '#ffebee'
-                else:
-                    diff_color = '#ff9800'
-                    bg_color = '#fff3e0'
-                
-                # Hộp câu hỏi
-                q_data = [
-                    [create_paragraph(f"<b>Câu hỏi {i}</b> <font color='{diff_color}'>[{difficulty}]</font>", body_style)],
-                    [create_paragraph(ensure_utf8(qa['cau_hoi']), body_style)]
-                ]
-                
-                q_table = Table(q_data, colWidths=[doc.width])
-                q_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor(bg_color)),
-                    ('BOX', (0, 0), (-1, -1), 1.5, colors.HexColor(diff_color)),
-                    ('LEFTPADDING', (0, 0), (-1, -1), 12),
-                    ('RIGHTPADDING', (0, 0), (-1, -1), 12),
-                    ('TOPPADDING', (0, 0), (-1, -1), 8),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-                ]))
-                elements.append(q_table)
-                elements.append(Spacer(1, 8))
-                
-                # Hộp trả lời
-                answer_style = ParagraphStyle(
-                    'Answer',
-                    parent=styles['BodyText'],
-                    fontName=font_name,
-                    fontSize=10,
-                    textColor=colors.HexColor('#424242'),
-                    spaceAfter=12,
-                    leftIndent=25,
-                    leading=13
-                )
-                a_data = [[create_paragraph(f"<b>Trả lời:</b> {ensure_utf8(qa['tra_loi'])}", answer_style)]]
-                a_table = Table(a_data, colWidths=[doc.width])
-                a_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f5f5f5')),
-                    ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#bdbdbd')),
-                    ('LEFTPADDING', (0, 0), (-1, -1), 12),
-                    ('RIGHTPADDING', (0, 0), (-1, -1), 12),
-                    ('TOPPADDING', (0, 0), (-1, -1), 8),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-                ]))
-                elements.append(a_table)
-                elements.append(Spacer(1, 15))
-        
-        # ============= BẢN ĐỒ TƯ DUY =============
-        elements.append(PageBreak())
-        elements.append(create_paragraph("[11] Bản đồ Tư duy Khái niệm", section_header_style))
-        elements.append(Spacer(1, 15))
-        
-        # Khái niệm trung tâm
-        central = ensure_utf8(analysis['ban_do_tu_duy']['khai_niem_trung_tam'])
-        central_data = [[create_paragraph(f"<b>{central}</b>", 
-            ParagraphStyle('Central', parent=body_style, fontSize=14, 
-                          alignment=TA_CENTER, textColor=colors.white, fontName=font_bold))]]
-        
-        central_table = Table(central_data, colWidths=[doc.width * 0.6])
-        central_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#1976d2')),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 15),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 15),
-            ('TOPPADDING', (0, 0), (-1, -1), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ('BOX', (0, 0), (-1, -1), 3, colors.HexColor('#0d47a1')),
-        ]))
-        
-        central_wrapper = Table([[central_table]], colWidths=[doc.width])
-        central_wrapper.setStyle(TableStyle([
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
-        elements.append(central_wrapper)
-        elements.append(Spacer(1, 20))
-        
-        # Các nhánh
-        branch_colors = {
-            'blue': '#1976d2',
-            'green': '#388e3c',
-            'orange': '#f57c00',
-            'red': '#d32f2f',
-            'purple': '#7b1fa2',
-            'teal': '#00796b'
-        }
-        
-        for i, branch in enumerate(analysis['ban_do_tu_duy']['nhanh']):
-            color_name = branch.get('mau', list(branch_colors.keys())[i % len(branch_colors)])
-            branch_color = branch_colors.get(color_name, '#1976d2')
-            
-            branch_header = Table([[create_paragraph(f"<b>{ensure_utf8(branch['chu_de'])}</b>", 
-                ParagraphStyle('BranchHeader', parent=body_style, 
-                              textColor=colors.white, fontSize=12, fontName=font_bold))]], 
-                colWidths=[doc.width * 0.7])
-            branch_header.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor(branch_color)),
-                ('LEFTPADDING', (0, 0), (-1, -1), 10),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-                ('TOPPADDING', (0, 0), (-1, -1), 6),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-            ]))
-            elements.append(branch_header)
-            elements.append(Spacer(1, 5))
-            
-            for point in branch['diem']:
-                point_text = create_paragraph(f"  • {ensure_utf8(point)}", body_style)
-                elements.append(point_text)
-            
-            elements.append(Spacer(1, 15))
-        
-        # ============= MẸO HỌC TẬP =============
-        elements.append(PageBreak())
-        elements.append(create_paragraph("[12] Mẹo Học tập & Chiến lược Ghi nhớ", section_header_style))
-        elements.append(Spacer(1, 10))
-        
-        tips_data = [
-            ["[1]", "<b>Ôn tập Lần 1:</b> Trong vòng 24 giờ sau khi đọc flashcard này"],
-            ["[2]", "<b>Ôn tập Lần 2:</b> 3 ngày sau lần ôn đầu tiên"],
-            ["[3]", "<b>Ôn tập Lần 3:</b> 1 tuần sau lần ôn thứ hai"],
-            ["[4]", "<b>Ôn tập Cuối:</b> 2 tuần sau lần ôn thứ ba"],
-            ["[5]", "<b>Gợi nhớ Chủ động:</b> Cố trả lời các câu hỏi mà không nhìn đáp án trước"],
-            ["[6]", "<b>Dạy người khác:</b> Giải thích khái niệm cho đồng học để củng cố hiểu biết"],
-        ]
-        
-        tips_table_data = []
-        for emoji, tip in tips_data:
-            tips_table_data.append([
-                create_paragraph(emoji, body_style),
-                create_paragraph(tip, body_style)
-            ])
-        
-        tips_table = Table(tips_table_data, colWidths=[40, doc.width - 40])
-        tips_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f3e5f5')),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 10),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-            ('TOPPADDING', (0, 0), (-1, -1), 8),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-            ('LINEBELOW', (0, 0), (-1, -2), 1, colors.HexColor('#ce93d8')),
-        ]))
-        elements.append(tips_table)
-        elements.append(Spacer(1, 20))
-        
-        # ============= FOOTER =============
-        elements.append(Spacer(1, 30))
-        footer_style = ParagraphStyle(
-            'Footer',
-            parent=styles['Normal'],
-            fontSize=9,
-            textColor=colors.HexColor('#757575'),
-            alignment=TA_CENTER,
-            fontName=font_name
-        )
-        
-        footer_table = Table([
-            [create_paragraph("─────────────────────────────", footer_style)],
-            [create_paragraph("<b>Nhàn Học - Phân tích Tài liệu</b> | Được hỗ trợ bởi AI", footer_style)],
-            [create_paragraph("Học thông minh, học nhanh hơn, ghi nhớ lâu hơn", footer_style)]
-        ], colWidths=[doc.width])
-        footer_table.setStyle(TableStyle([
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ]))
-        elements.append(footer_table)
+            prompt = f"""Bạn là một chuyên gia phân tích nghiên cứu học thuật. Hãy phân tích tài liệu học thuật sau đây và cung cấp một bản tổng hợp kiến thức toàn diện BẰNG TIẾNG VIỆT.
+
+Nội dung Tài liệu Học thuật:
+{text[:PDF_ANALYSIS_MAX_CHARS]}
+
+{build_analysis_instructions()}"""
+            analysis = call_ai_json('pdf', prompt, on_progress=on_progress)
         
-        # Xây dựng PDF
-        doc.build(elements)
-        print(f"[OK] PDF flashcard kiến thức nâng cao đã được tạo thành công!")
-        print(f"[OK] Output: {output_path}")
+        print("[OK] Phân tích AI hoàn tất thành công")
+        return analysis
         
-    except Exception as e:
-        print(f"Lỗi khi tạo PDF: {str(e)}")
-        import traceback
-        traceback.print_exc()
+    except llm_gateway.LLMUnavailableError:
         raise
+    except Exception as e:
+        print(f"Lỗi trong phân tích AI: {str(e)}")
+        raise Exception(f"Không thể tạo phân tích AI: {str(e)}")
 
 def xử_lý_pdf_đồng_bộ(pdf_path, filename):
-    """Xử lý phân tích PDF đồng bộ - trả về PDF content"""
+    """Xử lý phân tích PDF đồng bộ - pdf_path là đường dẫn hoặc bytes, trả về PDF content"""
     try:
         # Bước 1: Trích xuất text từ PDF
         print("Đang trích xuất text từ PDF...")
@@ -891,23 +512,8 @@ def xử_lý_pdf_đồng_bộ(pdf_path, filename):
         
         # Bước 3: Tạo PDF output
         print("Đang tạo PDF flashcard...")
-        # Tạo file tạm với encoding UTF-8
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf', mode='wb') as temp_output:
-            output_path = temp_output.name
-        
-        tạo_pdf_flashcard(analysis, output_path)
-        
-        # Đọc file PDF đã tạo với binary mode
-        with open(output_path, 'rb') as f:
-            pdf_content = f.read()
-        
-        # Cleanup
-        try:
-            os.unlink(output_path)
-        except Exception as cleanup_error:
-            print(f"Cảnh báo khi cleanup file: {cleanup_error}")
-        
-        return pdf_content
+        # Render thẳng vào bộ nhớ, không qua file tạm (trong process pool nếu bật, xem pdf_workers.py)
+        return pdf_render.render_flashcard(analysis)
         
     except Exception as e:
         print(f"Lỗi trong xử lý PDF: {str(e)}")
@@ -915,120 +521,128 @@ def xử_lý_pdf_đồng_bộ(pdf_path, filename):
         traceback.print_exc()
         raise e
 
-def process_pdf_job(job_id, pdf_path, filename):
-    """Xử lý PDF job trong background thread với progress bar"""
+# Blob của job được đặt tên theo định dạng (xem pdf_exports.EXPORT_FORMATS); blob 'json' là
+# bản phân tích gốc, các định dạng khác được render từ nó khi được yêu cầu lần đầu
+ANALYSIS_BLOB_NAME = 'json'
+
+def save_export_result(job_id, analysis, filename, output_format, content):
+    """
+    Lưu bản phân tích và file kết quả của định dạng được yêu cầu làm blob của job (bytes thô)
+    Trả về metadata dùng làm result của job
+    """
+    analysis_json = content if output_format == ANALYSIS_BLOB_NAME else pdf_exports.render_json(analysis)
+    pdf_job_storage.put_blob(job_id, ANALYSIS_BLOB_NAME, analysis_json)
+    if output_format != ANALYSIS_BLOB_NAME:
+        pdf_job_storage.put_blob(job_id, output_format, content)
+    return {
+        'filename': pdf_exports.export_filename(filename, output_format),
+        'format': output_format,
+        'size': len(content),
+        'etag': hashlib.sha256(content).hexdigest()[:32],
+        'content_type': pdf_exports.EXPORT_FORMATS[output_format].content_type,
+        'encoding': 'utf-8'  # Thêm metadata về encoding
+    }
+
+def get_export(job_id, output_format):
+    """
+    Đọc file kết quả của job đã hoàn thành theo định dạng, None nếu không có
+    Định dạng chưa được render thì render từ bản phân tích của job rồi lưu lại làm blob
+    """
+    content = pdf_job_storage.get_blob(job_id, output_format)
+    if content is not None:
+        return content
+    analysis_json = pdf_job_storage.get_blob(job_id, ANALYSIS_BLOB_NAME)
+    if analysis_json is None:
+        return None
+    print(f"[PDF Job {job_id}] Render định dạng {output_format} lần đầu")
+    content = pdf_exports.EXPORT_FORMATS[output_format].render(json.loads(analysis_json))
+    pdf_job_storage.put_blob(job_id, output_format, content)
+    return content
+
+def process_pdf_job(job_id, pdf_data, filename, digest=None, output_format=pdf_exports.DEFAULT_FORMAT):
+    """
+    Xử lý PDF job trong background thread với progress bar
+    pdf_data: Bytes của file PDF được upload (giữ trong bộ nhớ, không ghi ra file tạm)
+    digest: SHA-256 nội dung PDF - text và JSON phân tích đã cache được dùng lại, kết quả mới được lưu vào pdf_cache
+    output_format: Định dạng kết quả được render trong job (xem pdf_exports.py), các định dạng khác render khi tải
+    """
     try:
         print(f"[PDF Job {job_id}] Bắt đầu xử lý...")
-        pdf_job_storage[job_id]['status'] = 'processing'
-        pdf_job_storage[job_id]['progress'] = 0
-        pdf_job_storage[job_id]['updated_at'] = datetime.now().isoformat()
-        
-        # Progress 0-15%: Đọc file
-        update_progress(job_id, 1, "Đang đọc file PDF...")
-        time.sleep(0.5)
+        pdf_job_storage.update(job_id, status='processing', progress=0, updated_at=datetime.now().isoformat())
         
-        # Bước 1: Trích xuất text từ PDF
-        print("Đang trích xuất text từ PDF...")
-        update_progress(job_id, 5, "Đang trích xuất nội dung...")
-        text = trích_xuất_text_từ_pdf(pdf_path)
+        # Progress 0-25%: Trích xuất text (theo số trang đã đọc)
+        cached_text = pdf_cache.get(digest, 'text', PDF_CACHE_TAGS['text']) if digest else None
+        if cached_text is not None:
+            print(f"[PDF Job {job_id}] Dùng text đã cache")
+            text = cached_text.decode('utf-8')
+        else:
+            update_progress(job_id, 1, "Đang trích xuất nội dung...")
+            print("Đang trích xuất text từ PDF...")
+            text = trích_xuất_text_từ_pdf(
+                pdf_data,
+                on_page=stage_progress(job_id, 1, 25, "Đang trích xuất nội dung...")
+            )
         
         if len(text.strip()) < 100:
             raise Exception('PDF có vẻ rỗng hoặc không đọc được')
+        if digest and cached_text is None:
+            pdf_cache.put(digest, 'text', PDF_CACHE_TAGS['text'], text.encode('utf-8'))
+        
+        # Progress 25-70%: Phân tích với AI (theo số token đã nhận)
+        cached_analysis = pdf_cache.get(digest, 'analysis', PDF_CACHE_TAGS['analysis']) if digest else None
+        if cached_analysis is not None:
+            print(f"[PDF Job {job_id}] Dùng phân tích AI đã cache")
+            analysis = json.loads(cached_analysis)
+        else:
+            update_progress(job_id, 25, "Đang phân tích nội dung với AI...")
+            print("Đang phân tích nội dung với AI...")
+            analysis = phân_tích_với_ai(
+                text,
+                on_progress=stage_progress(job_id, 25, 70, "Đang phân tích nội dung với AI...")
+            )
+            if digest:
+                pdf_cache.put(
+                    digest, 'analysis', PDF_CACHE_TAGS['analysis'],
+                    json.dumps(analysis, ensure_ascii=False).encode('utf-8')
+                )
         
-        # Progress 15-25%: Hoàn thành trích xuất
-        update_progress(job_id, 15, "Đã trích xuất nội dung thành công")
-        time.sleep(0.3)
-        
-        # Progress 25-70%: Phân tích với AI (giả lập chậm)
-        update_progress(job_id, 25, "Đang gửi dữ liệu đến AI...")
-        time.sleep(0.5)
-        
-        # Chạy progress giả trong khi đợi AI
-        progress_thread = threading.Thread(
-            target=simulate_progress,
-            args=(job_id, 30, 65, 3, "Đang phân tích nội dung với AI...")
-        )
-        progress_thread.start()
-        
-        print("Đang phân tích nội dung với AI...")
-        analysis = phân_tích_với_ai(text)
-        
-        # Đợi progress thread hoàn thành
-        progress_thread.join()
-        update_progress(job_id, 70, "Phân tích AI hoàn tất")
-        time.sleep(0.3)
-        
-        # Progress 70-95%: Tạo PDF
-        update_progress(job_id, 75, "Đang tạo PDF flashcard...")
-        time.sleep(0.5)
-        
-        # Chạy progress giả trong khi tạo PDF
-        progress_thread = threading.Thread(
-            target=simulate_progress,
-            args=(job_id, 80, 93, 2, "Đang render PDF...")
-        )
-        progress_thread.start()
-        
-        print("Đang tạo PDF flashcard...")
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf', mode='wb') as temp_output:
-            output_path = temp_output.name
-        
-        tạo_pdf_flashcard(analysis, output_path)
-        
-        # Đọc file PDF đã tạo với binary mode
-        with open(output_path, 'rb') as f:
-            pdf_content = f.read()
-        
-        # Cleanup
-        try:
-            os.unlink(output_path)
-        except Exception as cleanup_error:
-            print(f"Cảnh báo khi cleanup file: {cleanup_error}")
-        
-        # Đợi progress thread hoàn thành
-        progress_thread.join()
-        update_progress(job_id, 95, "Hoàn tất tạo PDF")
-        time.sleep(0.3)
-        
-        # Progress 95-99%: Encode và lưu trữ
-        update_progress(job_id, 97, "Đang lưu kết quả...")
-        
-        # Encode PDF content thành base64 để lưu trữ - Đảm bảo UTF-8 safe
-        pdf_base64 = base64.b64encode(pdf_content).decode('ascii')
-        
-        # Progress 99%: Hoàn thành
-        update_progress(job_id, 99, "Hoàn tất xử lý")
-        time.sleep(0.2)
+        if output_format == 'pdf':
+            # Progress 70-95%: Render PDF (trong process pool nếu bật PDF_PROCESS_OFFLOAD)
+            update_progress(job_id, 70, "Đang tạo PDF flashcard...")
+            print("Đang tạo PDF flashcard...")
+            content = pdf_render.render_flashcard(
+                analysis,
+                on_progress=stage_progress(job_id, 70, 95, "Đang render PDF...")
+            )
+            if digest:
+                pdf_cache.put(digest, 'flashcard', PDF_CACHE_TAGS['flashcard'], content)
+        else:
+            # JSON / HTML / Markdown / CSV: render nhẹ, không cần ReportLab
+            content = pdf_exports.EXPORT_FORMATS[output_format].render(analysis)
         
         # Cập nhật kết quả với UTF-8 encoding
-        pdf_job_storage[job_id]['status'] = 'completed'
-        pdf_job_storage[job_id]['progress'] = 100
-        pdf_job_storage[job_id]['progress_message'] = "Hoàn thành!"
-        pdf_job_storage[job_id]['result'] = {
-            'pdf_content': pdf_base64,
-            'filename': f'phan_tich_{filename}',
-            'encoding': 'utf-8'  # Thêm metadata về encoding
-        }
-        pdf_job_storage[job_id]['updated_at'] = datetime.now().isoformat()
-        pdf_job_storage[job_id]['completed_at'] = datetime.now().isoformat()
+        pdf_job_storage.update(
+            job_id,
+            status='completed',
+            progress=100,
+            progress_message="Hoàn thành!",
+            result=save_export_result(job_id, analysis, filename, output_format, content),
+            updated_at=datetime.now().isoformat(),
+            completed_at=datetime.now().isoformat()
+        )
         
         print(f"[PDF Job {job_id}] Hoàn thành!")
         
     except Exception as e:
         print(f"[PDF Job {job_id}] Lỗi: {str(e)}")
-        pdf_job_storage[job_id]['status'] = 'failed'
-        pdf_job_storage[job_id]['error'] = str(e)
-        pdf_job_storage[job_id]['progress'] = 0
-        pdf_job_storage[job_id]['progress_message'] = f"Lỗi: {str(e)}"
-        pdf_job_storage[job_id]['updated_at'] = datetime.now().isoformat()
-    
-    finally:
-        # Cleanup PDF file
-        try:
-            if os.path.exists(pdf_path):
-                os.unlink(pdf_path)
-        except:
-            pass
+        pdf_job_storage.update(
+            job_id,
+            status='failed',
+            error=str(e),
+            progress=0,
+            progress_message=f"Lỗi: {str(e)}",
+            updated_at=datetime.now().isoformat()
+        )
 
 def phân_tích_pdf():
     """Tạo PDF job và trả về job_id ngay lập tức"""
@@ -1044,36 +658,77 @@ def phân_tích_pdf():
         if not file.filename.endswith('.pdf'):
             return {'error': 'Chỉ chấp nhận file PDF'}, 400
         
-        # Lưu file tạm thời
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_pdf:
-            file.save(temp_pdf.name)
-            pdf_path = temp_pdf.name
+        output_format = (request.form.get('format') or pdf_exports.DEFAULT_FORMAT).lower()
+        if output_format not in pdf_exports.EXPORT_FORMATS:
+            return {'error': f"Định dạng không hợp lệ, chỉ hỗ trợ: {', '.join(pdf_exports.EXPORT_FORMATS)}"}, 400
+        
+        # Đọc upload vào bộ nhớ một lần (Werkzeug đã spool file lớn ra SpooledTemporaryFile)
+        pdf_data = file.read()
+        digest = pdf_cache.content_digest(pdf_data)
         
         # Tạo job ID
         job_id = str(uuid.uuid4())
         
-        # Khởi tạo job
-        pdf_job_storage[job_id] = {
+        job = {
             'job_id': job_id,
             'status': 'pending',
             'progress': 0,
             'progress_message': 'Đang chuẩn bị...',
             'filename': file.filename,
+            'output_format': output_format,
             'created_at': datetime.now().isoformat(),
             'updated_at': datetime.now().isoformat(),
             'result': None,
             'error': None
         }
         
-        # Chạy xử lý trong background thread
-        thread = threading.Thread(
-            target=process_pdf_job,
-            args=(job_id, pdf_path, file.filename)
-        )
-        thread.daemon = True
-        thread.start()
+        # Cache hit: tài liệu này đã được phân tích với cùng prompt/model, hoàn thành ngay
+        # (định dạng PDF cần thêm flashcard đã render, các định dạng khác render ngay từ bản phân tích)
+        cached_analysis = pdf_cache.get(digest, 'analysis', PDF_CACHE_TAGS['analysis'])
+        cached_content = None
+        if cached_analysis is not None and output_format == 'pdf':
+            cached_content = pdf_cache.get(digest, 'flashcard', PDF_CACHE_TAGS['flashcard'])
+        if cached_analysis is not None and (output_format != 'pdf' or cached_content is not None):
+            analysis = json.loads(cached_analysis)
+            if cached_content is None:
+                cached_content = pdf_exports.EXPORT_FORMATS[output_format].render(analysis)
+            pdf_job_storage.create(job_id, job)
+            pdf_job_storage.update(
+                job_id,
+                status='completed',
+                progress=100,
+                progress_message="Hoàn thành!",
+                result=save_export_result(job_id, analysis, file.filename, output_format, cached_content),
+                updated_at=datetime.now().isoformat(),
+                completed_at=datetime.now().isoformat(),
+                cached=True
+            )
+            print(f"[PDF Job {job_id}] Cache hit, hoàn thành ngay")
+            return {
+                'job_id': job_id,
+                'status': 'completed',
+                'message': 'Đã có kết quả phân tích cho tài liệu này'
+            }, 200
+        
+        # Cùng tài liệu đang được phân tích: gộp vào job đó (định dạng khác được render khi tải)
+        leader_id = pdf_job_storage.create(job_id, job, fingerprint=f"{digest}:{PDF_CACHE_TAGS['flashcard']}")
+        if leader_id:
+            print(f"[PDF Job {job_id}] Gộp vào job đang chạy {leader_id}")
+            return {
+                'job_id': job_id,
+                'status': 'pending',
+                'message': 'Đang phân tích PDF của bạn. Vui lòng đợi...'
+            }, 202
+        
+        # Đưa job vào hàng đợi của scheduler (pool worker cố định, hàng đợi giới hạn)
+        try:
+            llm_gateway.ensure_available()
+            job_scheduler.submit('pdf', process_pdf_job, job_id, pdf_data, file.filename, digest, output_format)
+        except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError):
+            pdf_job_storage.delete(job_id)
+            raise
         
-        print(f"[PDF Job {job_id}] Đã tạo và bắt đầu background processing")
+        print(f"[PDF Job {job_id}] Đã tạo và đưa vào hàng đợi")
         
         return {
             'job_id': job_id,
@@ -1081,14 +736,20 @@ def phân_tích_pdf():
             'message': 'Đang phân tích PDF của bạn. Vui lòng đợi...'
         }, 202
         
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError):
+        # Để base.py trả về 503 kèm Retry-After
+        raise
     except Exception as e:
         print(f"Lỗi: {str(e)}")
         import traceback
         traceback.print_exc()
         return {'error': str(e)}, 500
 
-def get_pdf_job_status(job_id):
-    """Lấy trạng thái của PDF job"""
-    if job_id not in pdf_job_storage:
-        return None
-    return pdf_job_storage[job_id]
+def get_pdf_job_status(job_id, wait=0, since=None):
+    """
+    Lấy trạng thái của PDF job
+    Nếu wait > 0: chờ tối đa wait giây đến khi job kết thúc hoặc thay đổi so với since (long-poll)
+    """
+    if wait:
+        return pdf_job_storage.wait(job_id, wait, since=since)
+    return pdf_job_storage.get(job_id)
@@ -0,0 +1,157 @@
+"""
+Module cache kết quả phân tích PDF theo nội dung file (content-addressed)
+Key là SHA-256 của bytes PDF được upload, nên cùng một bộ slide/bài báo upload lại
+không phải trích xuất, gọi AI và render lại.
+
+Mỗi tài liệu là một thư mục PDF_CACHE_DIR/<2 ký tự đầu>/<sha256>/ chứa các artifact:
+- text-<tag>.txt        text đã trích xuất (tag = ngân sách ký tự)
+- analysis-<tag>.json   JSON phân tích (tag = phiên bản prompt/model)
+- flashcard-<tag>.pdf   PDF flashcard đã render (tag = phiên bản prompt/model + layout)
+Thư mục cache dùng chung giữa các worker; tổng dung lượng bị giới hạn bởi PDF_CACHE_MAX_BYTES,
+vượt quá thì xóa các artifact ít được dùng gần đây nhất (theo mtime, được cập nhật khi đọc).
+Dung lượng được đo lại trên thư mục sau mỗi lần ghi (không dựa vào ước tính của riêng process),
+nên giới hạn đúng cả khi nhiều worker cùng ghi; chi phí quét nhỏ so với việc gọi AI/render tạo ra artifact.
+"""
+import os
+import hashlib
+import tempfile
+import threading
+
+PDF_CACHE_ENABLED = os.getenv('PDF_CACHE_ENABLED', '1') == '1'
+PDF_CACHE_DIR = os.getenv('PDF_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'nhan_hoc_pdf_cache'))
+PDF_CACHE_MAX_BYTES = int(os.getenv('PDF_CACHE_MAX_BYTES', 500 * 1024 * 1024))
+
+# Khi dọn cache, xóa đến khi tổng dung lượng còn tỉ lệ này của giới hạn
+EVICT_TARGET_RATIO = 0.9
+
+_lock = threading.Lock()
+_total_bytes = None  # Tổng dung lượng thư mục cache ở lần quét gần nhất
+_stats = {}
+
+
+def content_digest(data):
+    """SHA-256 (hex) của nội dung PDF (bytes hoặc file-like object)"""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(data).hexdigest()
+    digest = hashlib.sha256()
+    position = data.tell()
+    for block in iter(lambda: data.read(1024 * 1024), b''):
+        digest.update(block)
+    data.seek(position)
+    return digest.hexdigest()
+
+
+def _path(digest, artifact, tag):
+    extension = {'text': 'txt', 'analysis': 'json', 'flashcard': 'pdf'}[artifact]
+    return os.path.join(PDF_CACHE_DIR, digest[:2], digest, f'{artifact}-{tag}.{extension}')
+
+
+def _count(artifact, name):
+    with _lock:
+        stats = _stats.setdefault(artifact, {'hits': 0, 'misses': 0, 'stores': 0})
+        stats[name] += 1
+
+
+def get(digest, artifact, tag):
+    """
+    Đọc artifact đã cache
+
+    Args:
+        digest: content_digest() của PDF gốc
+        artifact: 'text' | 'analysis' | 'flashcard'
+        tag: Phiên bản của artifact (đổi prompt/model/layout thì đổi tag)
+
+    Returns:
+        bytes, None nếu miss
+    """
+    if not PDF_CACHE_ENABLED:
+        return None
+    path = _path(digest, artifact, tag)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        # Cập nhật mtime để dọn cache theo LRU
+        os.utime(path)
+    except FileNotFoundError:
+        _count(artifact, 'misses')
+        return None
+    except OSError as e:
+        print(f"[PDF Cache] Lỗi khi đọc cache: {str(e)}")
+        _count(artifact, 'misses')
+        return None
+    _count(artifact, 'hits')
+    return data
+
+
+def put(digest, artifact, tag, data):
+    """Lưu artifact (bytes) vào cache, ghi nguyên tử qua file tạm + os.replace, rồi dọn nếu vượt giới hạn"""
+    if not PDF_CACHE_ENABLED:
+        return
+    path = _path(digest, artifact, tag)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        _count(artifact, 'stores')
+        # Đo lại cả thư mục: các worker khác cũng ghi vào đây
+        evict()
+    except Exception as e:
+        print(f"[PDF Cache] Lỗi khi ghi cache: {str(e)}")
+
+
+def _scan():
+    """Liệt kê các artifact trong cache: [(mtime, size, path)]"""
+    files = []
+    for root, _, names in os.walk(PDF_CACHE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    return files
+
+
+def evict():
+    """Đo dung lượng thư mục cache, vượt giới hạn thì xóa các artifact cũ nhất"""
+    global _total_bytes
+    files = _scan()
+    total = sum(size for _, size, _ in files)
+    if total > PDF_CACHE_MAX_BYTES:
+        target = PDF_CACHE_MAX_BYTES * EVICT_TARGET_RATIO
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+        print(f"[PDF Cache] Đã xóa {removed} artifact, còn {total} bytes")
+    with _lock:
+        _total_bytes = total
+
+
+def get_metrics():
+    """Thống kê hit/miss theo loại artifact và dung lượng cache"""
+    with _lock:
+        stats = {artifact: dict(values) for artifact, values in _stats.items()}
+        total_bytes = _total_bytes
+    for values in stats.values():
+        lookups = values['hits'] + values['misses']
+        values['hit_rate'] = round(values['hits'] / lookups, 3) if lookups else 0
+    return {
+        'enabled': PDF_CACHE_ENABLED,
+        'bytes': total_bytes,
+        'max_bytes': PDF_CACHE_MAX_BYTES,
+        'artifacts': stats,
+    }
@@ -0,0 +1,195 @@
+"""
+Module xuất kết quả phân tích PDF ra nhiều định dạng
+Bản phân tích (dict JSON) là dữ liệu gốc của job; các định dạng khác được render từ nó:
+- json: dữ liệu có cấu trúc (app mobile dùng trực tiếp, không cần render PDF)
+- html: trang HTML độc lập
+- md:   Markdown
+- csv:  bộ thẻ Anki (mặt trước, mặt sau, tag) từ câu hỏi ôn tập và thuật ngữ
+- pdf:  flashcard ReportLab (xem pdf_render.py)
+Mỗi định dạng chỉ được render khi được yêu cầu lần đầu, kết quả được lưu làm blob của job.
+"""
+import io
+import csv
+import json
+import html
+import re
+from collections import namedtuple
+import pdf_render
+from pdf_render import ensure_utf8
+
+ExportFormat = namedtuple('ExportFormat', ['extension', 'content_type', 'render'])
+
+DEFAULT_FORMAT = 'pdf'
+
+# Tag chung của mọi thẻ Anki xuất ra
+ANKI_TAG = 'nhan_hoc'
+
+
+def _text(value):
+    """Nội dung dạng chuỗi hoặc danh sách chuỗi -> một chuỗi"""
+    if isinstance(value, list):
+        return ' '.join(ensure_utf8(v) for v in value)
+    return ensure_utf8(value)
+
+
+def _sections(analysis):
+    """
+    Các phần của bản phân tích theo đúng thứ tự của flashcard PDF
+    Yields (tiêu đề, loại, dữ liệu) với loại: text | list | numbered | pairs | qa | mindmap
+    """
+    if analysis.get('muc_tieu_hoc_tap'):
+        yield "Mục tiêu Học tập", 'list', [ensure_utf8(o) for o in analysis['muc_tieu_hoc_tap']]
+    yield "Tóm tắt Tổng quan", 'text', _text(analysis.get('tom_tat', ''))
+    metrics = analysis.get('tom_tat_truc_quan', {}).get('chi_so_chinh')
+    if metrics:
+        yield "Chỉ số Chính", 'pairs', [(ensure_utf8(k), ensure_utf8(v)) for k, v in metrics.items()]
+    yield "Phát hiện Chính", 'numbered', [ensure_utf8(f) for f in analysis.get('phat_hien_chinh', [])]
+    if analysis.get('thuat_ngu_chinh'):
+        yield "Thuật ngữ & Định nghĩa Chính", 'pairs', [
+            (ensure_utf8(term), ensure_utf8(definition))
+            for term, definition in analysis['thuat_ngu_chinh'].items()
+        ]
+    yield "Phương pháp Nghiên cứu", 'text', _text(analysis.get('phuong_phap_nghien_cuu', ''))
+    if analysis.get('ung_dung_thuc_te'):
+        yield "Ứng dụng Thực tế", 'list', [ensure_utf8(a) for a in analysis['ung_dung_thuc_te']]
+    yield "Ý nghĩa Chính", 'text', _text(analysis.get('y_nghia', ''))
+    if analysis.get('cau_hoi_tu_duy_phe_phan'):
+        yield "Câu hỏi Tư duy Phê phán", 'numbered', [ensure_utf8(q) for q in analysis['cau_hoi_tu_duy_phe_phan']]
+    if analysis.get('cau_hoi_on_tap'):
+        yield "Câu hỏi Tự đánh giá", 'qa', [
+            (ensure_utf8(qa['cau_hoi']), ensure_utf8(qa['tra_loi']), ensure_utf8(qa.get('do_kho', 'Trung bình')))
+            for qa in analysis['cau_hoi_on_tap']
+        ]
+    mind_map = analysis.get('ban_do_tu_duy')
+    if mind_map:
+        yield "Bản đồ Tư duy Khái niệm", 'mindmap', (
+            ensure_utf8(mind_map.get('khai_niem_trung_tam', '')),
+            [(ensure_utf8(b['chu_de']), [ensure_utf8(p) for p in b.get('diem', [])]) for b in mind_map.get('nhanh', [])]
+        )
+
+
+def _metadata(analysis):
+    return (
+        f"Độ khó: {ensure_utf8(analysis.get('do_kho', 'Trung bình'))} | "
+        f"Thời gian học: {ensure_utf8(analysis.get('thoi_gian_hoc_uoc_tinh', '30-45 phút'))}"
+    )
+
+
+def render_json(analysis):
+    return json.dumps(analysis, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+HTML_STYLE = """body{font-family:Arial,"DejaVu Sans",sans-serif;max-width:820px;margin:40px auto;padding:0 20px;color:#212121;line-height:1.6}
+h1{color:#1a237e;text-align:center}h2{background:#1976d2;color:#fff;padding:8px 12px;border-radius:4px}
+.meta{color:#5e35b1;text-align:center;font-style:italic}table{border-collapse:collapse;width:100%}
+td{border:1px solid #e0e0e0;padding:8px 10px;vertical-align:top}td:first-child{font-weight:bold;width:35%}
+.qa{border:1px solid #bdbdbd;border-radius:4px;padding:10px 12px;margin:10px 0}.qa p{margin:4px 0}
+.difficulty{color:#f57c00}.central{font-weight:bold;font-size:1.2em;text-align:center}"""
+
+
+def render_html(analysis):
+    esc = html.escape
+    parts = [
+        '<!DOCTYPE html>',
+        '<html lang="vi"><head><meta charset="utf-8">',
+        f"<title>{esc(ensure_utf8(analysis.get('tieu_de', '')))}</title>",
+        f'<style>{HTML_STYLE}</style></head><body>',
+        f"<h1>{esc(ensure_utf8(analysis.get('tieu_de', '')))}</h1>",
+        f'<p class="meta">{esc(_metadata(analysis))}</p>',
+    ]
+    for title, kind, data in _sections(analysis):
+        parts.append(f'<h2>{esc(title)}</h2>')
+        if kind == 'text':
+            parts.append(f'<p>{esc(data)}</p>')
+        elif kind in ('list', 'numbered'):
+            tag = 'ul' if kind == 'list' else 'ol'
+            parts.append(f'<{tag}>' + ''.join(f'<li>{esc(item)}</li>' for item in data) + f'</{tag}>')
+        elif kind == 'pairs':
+            rows = ''.join(f'<tr><td>{esc(key)}</td><td>{esc(value)}</td></tr>' for key, value in data)
+            parts.append(f'<table>{rows}</table>')
+        elif kind == 'qa':
+            for i, (question, answer, difficulty) in enumerate(data, 1):
+                parts.append(
+                    f'<div class="qa"><p><b>Câu hỏi {i}</b> <span class="difficulty">[{esc(difficulty)}]</span></p>'
+                    f'<p>{esc(question)}</p><p><b>Trả lời:</b> {esc(answer)}</p></div>'
+                )
+        elif kind == 'mindmap':
+            central, branches = data
+            parts.append(f'<p class="central">{esc(central)}</p><ul>')
+            for topic, points in branches:
+                items = ''.join(f'<li>{esc(point)}</li>' for point in points)
+                parts.append(f'<li><b>{esc(topic)}</b><ul>{items}</ul></li>')
+            parts.append('</ul>')
+    parts.append('<footer><p class="meta">Nhàn Học - Phân tích Tài liệu | Được hỗ trợ bởi AI</p></footer>')
+    parts.append('</body></html>')
+    return '\n'.join(parts).encode('utf-8')
+
+
+def render_markdown(analysis):
+    lines = [f"# {ensure_utf8(analysis.get('tieu_de', ''))}", '', f"*{_metadata(analysis)}*"]
+    for title, kind, data in _sections(analysis):
+        lines += ['', f'## {title}', '']
+        if kind == 'text':
+            lines.append(data)
+        elif kind == 'list':
+            lines += [f'- {item}' for item in data]
+        elif kind == 'numbered':
+            lines += [f'{i}. {item}' for i, item in enumerate(data, 1)]
+        elif kind == 'pairs':
+            lines += [f'- **{key}**: {value}' for key, value in data]
+        elif kind == 'qa':
+            for i, (question, answer, difficulty) in enumerate(data, 1):
+                lines += [f'**Câu hỏi {i}** [{difficulty}]: {question}', '', f'> **Trả lời:** {answer}', '']
+        elif kind == 'mindmap':
+            central, branches = data
+            lines.append(f'**{central}**')
+            lines.append('')
+            for topic, points in branches:
+                lines.append(f'- **{topic}**')
+                lines += [f'  - {point}' for point in points]
+    lines += ['', '---', '', '*Nhàn Học - Phân tích Tài liệu | Được hỗ trợ bởi AI*', '']
+    return '\n'.join(lines).encode('utf-8')
+
+
+def _tag(value):
+    """Tag Anki không được chứa khoảng trắng"""
+    return re.sub(r'\s+', '_', value.strip())
+
+
+def render_anki_csv(analysis):
+    """
+    Bộ thẻ Anki dạng CSV: cột Front, Back, Tags
+    Các dòng #... là header mà Anki (2.1.55+) đọc để tự chọn dấu phân cách và cột tag
+    """
+    output = io.StringIO()
+    output.write('#separator:Comma\n#html:false\n#columns:Front,Back,Tags\n#tags column:3\n')
+    writer = csv.writer(output, lineterminator='\n')
+    for qa in analysis.get('cau_hoi_on_tap', []):
+        difficulty = _tag(ensure_utf8(qa.get('do_kho', 'Trung bình')))
+        writer.writerow([
+            ensure_utf8(qa['cau_hoi']),
+            ensure_utf8(qa['tra_loi']),
+            f'{ANKI_TAG} on_tap do_kho::{difficulty}'
+        ])
+    for term, definition in analysis.get('thuat_ngu_chinh', {}).items():
+        writer.writerow([ensure_utf8(term), ensure_utf8(definition), f'{ANKI_TAG} thuat_ngu'])
+    return output.getvalue().encode('utf-8')
+
+
+def render_pdf(analysis):
+    return pdf_render.render_flashcard(analysis)
+
+
+EXPORT_FORMATS = {
+    'json': ExportFormat('json', 'application/json', render_json),
+    'html': ExportFormat('html', 'text/html', render_html),
+    'md': ExportFormat('md', 'text/markdown', render_markdown),
+    'csv': ExportFormat('csv', 'text/csv', render_anki_csv),
+    'pdf': ExportFormat('pdf', 'application/pdf', render_pdf),
+}
+
+
+def export_filename(filename, output_format):
+    """Tên file tải về của kết quả: phan_tich_<tên file gốc>.<phần mở rộng của định dạng>"""
+    stem = filename[:-4] if filename.lower().endswith('.pdf') else filename
+    return f"phan_tich_{stem}.{EXPORT_FORMATS[output_format].extension}"
@@ -0,0 +1,190 @@
+"""
+Module tìm và đăng ký font Unicode (hỗ trợ tiếng Việt) cho ReportLab
+Font chỉ được tìm và đăng ký một lần mỗi process (lazy, có lock), không còn quét toàn bộ
+cây font hệ thống (matplotlib) hay tải font từ Internet mỗi lần render.
+
+Thứ tự tìm font:
+1. Thư mục font đóng gói sẵn PDF_FONT_DIR (mặc định backend/fonts/) - dùng được khi offline
+2. Đường dẫn đã tìm được lần trước, lưu trong PDF_FONT_CACHE_PATH (bỏ qua nếu file không còn)
+3. Các đường dẫn quen thuộc trên Windows / Linux / macOS (Arial, DejaVu Sans, Liberation Sans, Noto Sans)
+4. Quét có giới hạn các thư mục font chuẩn theo tên file ở bước 3
+5. Không tìm được: dùng Helvetica (không hỗ trợ tiếng Việt tốt)
+
+Font được đăng ký dưới tên Arial / Arial-Bold / Arial-Italic (kèm font family để <b>, <i>
+trong Paragraph dùng đúng font) nên các style hiện có không phải đổi.
+"""
+import os
+import sys
+import json
+import tempfile
+import threading
+from collections import namedtuple
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+PDF_FONT_DIR = os.getenv('PDF_FONT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts'))
+PDF_FONT_CACHE_PATH = os.getenv(
+    'PDF_FONT_CACHE_PATH',
+    os.path.join(tempfile.gettempdir(), 'nhan_hoc_fonts.json')
+)
+
+FontSet = namedtuple('FontSet', ['regular', 'bold', 'italic'])
+
+REGISTERED_FONTS = FontSet('Arial', 'Arial-Bold', 'Arial-Italic')
+FALLBACK_FONTS = FontSet('Helvetica', 'Helvetica-Bold', 'Helvetica-Oblique')
+
+# Các bộ font ứng viên theo thứ tự ưu tiên: (regular, bold, italic) theo tên file
+FONT_CANDIDATES = [
+    ('arial.ttf', 'arialbd.ttf', 'ariali.ttf'),
+    ('Arial.ttf', 'Arial Bold.ttf', 'Arial Italic.ttf'),
+    ('Arial.ttf', 'Arial_Bold.ttf', 'Arial_Italic.ttf'),
+    ('DejaVuSans.ttf', 'DejaVuSans-Bold.ttf', 'DejaVuSans-Oblique.ttf'),
+    ('LiberationSans-Regular.ttf', 'LiberationSans-Bold.ttf', 'LiberationSans-Italic.ttf'),
+    ('NotoSans-Regular.ttf', 'NotoSans-Bold.ttf', 'NotoSans-Italic.ttf'),
+]
+
+# Thư mục chứa trực tiếp các file font quen thuộc (kiểm tra bằng os.path.exists, không quét)
+KNOWN_FONT_DIRS = [
+    'C:/Windows/Fonts',
+    '/usr/share/fonts/truetype/dejavu',
+    '/usr/share/fonts/dejavu',
+    '/usr/share/fonts/TTF',
+    '/usr/share/fonts/truetype/liberation',
+    '/usr/share/fonts/truetype/liberation2',
+    '/usr/share/fonts/liberation-sans',
+    '/usr/share/fonts/truetype/noto',
+    '/usr/share/fonts/noto',
+    '/Library/Fonts',
+    '/System/Library/Fonts/Supplemental',
+]
+
+# Thư mục font chuẩn được quét (giới hạn độ sâu) khi không có ở đường dẫn quen thuộc
+SYSTEM_FONT_DIRS = [
+    '/usr/share/fonts',
+    '/usr/local/share/fonts',
+    os.path.expanduser('~/.fonts'),
+    os.path.expanduser('~/.local/share/fonts'),
+    '/app/.fonts',  # Heroku buildpack
+]
+MAX_SCAN_DEPTH = 4
+
+_lock = threading.Lock()
+_fonts = None
+
+
+def _match_in_dir(directory):
+    """Tìm bộ font ứng viên đầu tiên có trong directory, trả về dict đường dẫn hoặc None"""
+    for regular, bold, italic in FONT_CANDIDATES:
+        regular_path = os.path.join(directory, regular)
+        if os.path.exists(regular_path):
+            bold_path = os.path.join(directory, bold)
+            italic_path = os.path.join(directory, italic)
+            return {
+                'regular': regular_path,
+                # Thiếu bold/italic thì dùng chung font regular
+                'bold': bold_path if os.path.exists(bold_path) else regular_path,
+                'italic': italic_path if os.path.exists(italic_path) else regular_path,
+            }
+    return None
+
+
+def _scan_system_dirs():
+    """Quét các thư mục font chuẩn theo tên file ứng viên (không đọc nội dung font)"""
+    for root_dir in SYSTEM_FONT_DIRS:
+        if not os.path.isdir(root_dir):
+            continue
+        base_depth = root_dir.rstrip(os.sep).count(os.sep)
+        for directory, subdirs, _ in os.walk(root_dir):
+            if directory.count(os.sep) - base_depth >= MAX_SCAN_DEPTH:
+                subdirs[:] = []
+            paths = _match_in_dir(directory)
+            if paths:
+                return paths
+    return None
+
+
+def _load_cached_paths():
+    try:
+        with open(PDF_FONT_CACHE_PATH, 'r', encoding='utf-8') as f:
+            paths = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if all(os.path.exists(paths.get(key, '')) for key in FontSet._fields):
+        return paths
+    return None
+
+
+def _save_cached_paths(paths):
+    try:
+        tmp_path = f"{PDF_FONT_CACHE_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(paths, f)
+        os.replace(tmp_path, PDF_FONT_CACHE_PATH)
+    except OSError as e:
+        print(f"[PDF Fonts] Không ghi được cache đường dẫn font: {e}")
+
+
+def resolve_font_paths():
+    """Tìm đường dẫn bộ font Unicode, trả về (dict đường dẫn, nguồn) hoặc (None, None)"""
+    if os.path.isdir(PDF_FONT_DIR):
+        paths = _match_in_dir(PDF_FONT_DIR)
+        if paths:
+            return paths, 'bundled'
+
+    paths = _load_cached_paths()
+    if paths:
+        return paths, 'cache'
+
+    dirs = list(KNOWN_FONT_DIRS)
+    if sys.platform.startswith('win'):
+        dirs.insert(0, os.path.join(os.environ.get('WINDIR', 'C:/Windows'), 'Fonts'))
+    for directory in dirs:
+        paths = _match_in_dir(directory)
+        if paths:
+            break
+    else:
+        paths = _scan_system_dirs()
+
+    if paths:
+        _save_cached_paths(paths)
+        return paths, 'system'
+    return None, None
+
+
+def _register(paths):
+    for name, key in zip(REGISTERED_FONTS, FontSet._fields):
+        pdfmetrics.registerFont(TTFont(name, paths[key]))
+    pdfmetrics.registerFontFamily(
+        REGISTERED_FONTS.regular,
+        normal=REGISTERED_FONTS.regular,
+        bold=REGISTERED_FONTS.bold,
+        italic=REGISTERED_FONTS.italic,
+        boldItalic=REGISTERED_FONTS.bold
+    )
+
+
+def get_fonts():
+    """
+    Lấy bộ font để render PDF (đăng ký với ReportLab ở lần gọi đầu tiên của process)
+
+    Returns:
+        FontSet(regular, bold, italic) - tên font đã đăng ký, hoặc Helvetica nếu không tìm được
+    """
+    global _fonts
+    if _fonts is not None:
+        return _fonts
+    with _lock:
+        if _fonts is None:
+            fonts = FALLBACK_FONTS
+            try:
+                paths, source = resolve_font_paths()
+                if paths:
+                    _register(paths)
+                    fonts = REGISTERED_FONTS
+                    print(f"[PDF Fonts] ✓ Đã đăng ký font ({source}): {paths['regular']}")
+                else:
+                    print("[PDF Fonts] ⚠ Fallback to Helvetica (limited Vietnamese support)")
+            except Exception as e:
+                print(f"[PDF Fonts] Lỗi khi đăng ký font, dùng Helvetica: {e}")
+            _fonts = fonts
+    return _fonts
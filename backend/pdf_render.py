@@ -0,0 +1,322 @@
+"""
+Module render PDF flashcard từ dict phân tích (ReportLab)
+Tách khỏi pdfAnalysis.py để process con của pdf_workers import nhanh (không kéo theo Flask,
+OpenAI, job store): render_flashcard() nhận dict phân tích, trả về bytes PDF, và chạy trong
+process pool khi bật PDF_PROCESS_OFFLOAD để việc dàn trang không giữ GIL của worker web.
+"""
+import io
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Table
+import pdf_templates
+import pdf_workers
+
+
+def ensure_utf8(text):
+    """Đảm bảo text là UTF-8 string"""
+    if isinstance(text, bytes):
+        return text.decode('utf-8', errors='replace')
+    elif isinstance(text, str):
+        return text
+    else:
+        return str(text)
+
+
+def create_paragraph(text, style):
+    """Tạo Paragraph với text UTF-8 an toàn"""
+    safe_text = ensure_utf8(text)
+    return Paragraph(safe_text, style)
+
+
+def tạo_pdf_flashcard(analysis, output_path, on_progress=None):
+    """
+    Tạo PDF flashcard kiến thức giáo dục đẹp và toàn diện
+    output_path: Đường dẫn file hoặc file-like object (ví dụ io.BytesIO) để ghi PDF
+    Nếu có on_progress: báo on_progress(số flowable đã dàn trang, tổng số flowable) trong lúc render
+    """
+    try:
+        # Style, TableStyle và phần tĩnh dựng sẵn một lần mỗi process (xem pdf_templates.py)
+        template = pdf_templates.get_template()
+        styles = template.styles
+        table_styles = template.table_styles
+        width = pdf_templates.CONTENT_WIDTH
+        
+        # Tạo PDF với encoding UTF-8 - CRITICAL cho Heroku
+        doc = SimpleDocTemplate(
+            output_path, 
+            pagesize=pdf_templates.PAGE_SIZE,
+            **pdf_templates.PAGE_MARGINS
+        )
+        
+        elements = []
+        
+        # ============= CÁC STYLE TÙY CHỈNH =============
+        title_style = styles['title']
+        subtitle_style = styles['subtitle']
+        section_header_style = styles['section_header']
+        body_style = styles['body']
+        highlight_style = styles['highlight']
+        term_style = styles['term']
+        definition_style = styles['definition']
+        answer_style = styles['answer']
+        
+        # ============= TRANG BÌA =============
+        elements.append(Spacer(1, 40))
+        
+        # Thanh trang trí trên cùng
+        top_bar = Table([['']], colWidths=[width])
+        top_bar.setStyle(table_styles['top_bar'])
+        elements.append(top_bar)
+        elements.append(Spacer(1, 30))
+        
+        # Tiêu đề
+        title = create_paragraph(f"<b>{ensure_utf8(analysis['tieu_de'])}</b>", title_style)
+        elements.append(title)
+        
+        # Hộp metadata
+        metadata_text = f"""<b>Độ khó:</b> {ensure_utf8(analysis.get('do_kho', 'Trung bình'))} | 
+        <b>Thời gian học:</b> {ensure_utf8(analysis.get('thoi_gian_hoc_uoc_tinh', '30-45 phút'))}"""
+        elements.append(create_paragraph(metadata_text, subtitle_style))
+        elements.append(Spacer(1, 20))
+        
+        # Hộp mục tiêu học tập
+        if analysis.get('muc_tieu_hoc_tap'):
+            obj_data = [[create_paragraph("<b>[1] Mục tiêu Học tập</b>", body_style)]]
+            for obj in analysis['muc_tieu_hoc_tap']:
+                obj_data.append([create_paragraph(f"• {ensure_utf8(obj)}", body_style)])
+            
+            obj_table = Table(obj_data, colWidths=[width])
+            obj_table.setStyle(table_styles['objectives'])
+            elements.append(obj_table)
+            elements.append(Spacer(1, 20))
+        
+        # ============= TÓM TẮT TỔNG QUAN =============
+        elements.append(create_paragraph("[2] Tóm tắt Tổng quan", section_header_style))
+        elements.append(Spacer(1, 5))
+        
+        summary_text = analysis['tom_tat']
+        if isinstance(summary_text, list):
+            summary_text = ' '.join([ensure_utf8(s) for s in summary_text])
+        else:
+            summary_text = ensure_utf8(summary_text)
+        
+        elements.append(create_paragraph(summary_text, highlight_style))
+        elements.append(Spacer(1, 15))
+        
+        # ============= CHỈ SỐ CHÍNH =============
+        if analysis.get('tom_tat_truc_quan', {}).get('chi_so_chinh'):
+            metrics = analysis['tom_tat_truc_quan']['chi_so_chinh']
+            elements.append(create_paragraph("[3] Chỉ số Chính Nhanh", body_style))
+            
+            metric_data = []
+            for key, value in metrics.items():
+                metric_data.append([
+                    create_paragraph(f"<b>{ensure_utf8(key)}</b>", body_style),
+                    create_paragraph(f"<font size=14 color='#1976d2'><b>{ensure_utf8(value)}</b></font>", body_style)
+                ])
+            
+            metric_table = Table(metric_data, colWidths=[width * 0.6, width * 0.4])
+            metric_table.setStyle(table_styles['metrics'])
+            elements.append(metric_table)
+            elements.append(Spacer(1, 20))
+        
+        # ============= PHÁT HIỆN CHÍNH =============
+        elements.append(create_paragraph("[4] Phát hiện Chính", section_header_style))
+        elements.append(Spacer(1, 5))
+        
+        findings_data = []
+        for i, finding in enumerate(analysis['phat_hien_chinh'], 1):
+            findings_data.append([
+                create_paragraph(f"<b>{i}</b>", body_style),
+                create_paragraph(ensure_utf8(finding), body_style)
+            ])
+        
+        findings_table = Table(findings_data, colWidths=[30, width - 30])
+        findings_table.setStyle(table_styles['findings'])
+        elements.append(findings_table)
+        elements.append(Spacer(1, 20))
+        
+        # ============= THUẬT NGỮ & ĐỊNH NGHĨA =============
+        if analysis.get('thuat_ngu_chinh'):
+            elements.append(PageBreak())
+            elements.append(create_paragraph("[5] Thuật ngữ & Định nghĩa Chính", section_header_style))
+            elements.append(Spacer(1, 10))
+            
+            for term, definition in analysis['thuat_ngu_chinh'].items():
+                elements.append(create_paragraph(f"<b>▸ {ensure_utf8(term)}</b>", term_style))
+                elements.append(create_paragraph(ensure_utf8(definition), definition_style))
+            
+            elements.append(Spacer(1, 20))
+        
+        # ============= PHƯƠNG PHÁP =============
+        elements.append(create_paragraph("[6] Phương pháp Nghiên cứu", section_header_style))
+        elements.append(Spacer(1, 5))
+        
+        methodology_text = analysis['phuong_phap_nghien_cuu']
+        if isinstance(methodology_text, list):
+            methodology_text = ' '.join([ensure_utf8(m) for m in methodology_text])
+        else:
+            methodology_text = ensure_utf8(methodology_text)
+        
+        elements.append(create_paragraph(methodology_text, body_style))
+        elements.append(Spacer(1, 20))
+        
+        # ============= ỨNG DỤNG THỰC TẾ =============
+        if analysis.get('ung_dung_thuc_te'):
+            elements.append(create_paragraph("[7] Ứng dụng Thực tế", section_header_style))
+            elements.append(Spacer(1, 5))
+            
+            app_data = []
+            for app in analysis['ung_dung_thuc_te']:
+                app_data.append([
+                    create_paragraph("+", body_style),
+                    create_paragraph(ensure_utf8(app), body_style)
+                ])
+            
+            app_table = Table(app_data, colWidths=[30, width - 30])
+            app_table.setStyle(table_styles['applications'])
+            elements.append(app_table)
+            elements.append(Spacer(1, 20))
+        
+        # ============= Ý NGHĨA =============
+        elements.append(create_paragraph("[8] Ý nghĩa Chính", section_header_style))
+        elements.append(Spacer(1, 5))
+        
+        implications_text = analysis['y_nghia']
+        if isinstance(implications_text, list):
+            implications_text = ' '.join([ensure_utf8(i) for i in implications_text])
+        else:
+            implications_text = ensure_utf8(implications_text)
+        
+        elements.append(create_paragraph(implications_text, highlight_style))
+        elements.append(Spacer(1, 20))
+        
+        # ============= CÂU HỎI TƯ DUY PHÊ PHÁN =============
+        if analysis.get('cau_hoi_tu_duy_phe_phan'):
+            elements.append(PageBreak())
+            elements.append(create_paragraph("[9] Câu hỏi Tư duy Phê phán", section_header_style))
+            elements.append(Spacer(1, 10))
+            
+            crit_data = [[create_paragraph("<i>Suy ngẫm về những câu hỏi này để hiểu sâu hơn:</i>", body_style)]]
+            for i, q in enumerate(analysis['cau_hoi_tu_duy_phe_phan'], 1):
+                crit_data.append([create_paragraph(f"<b>{i}.</b> {ensure_utf8(q)}", body_style)])
+            
+            crit_table = Table(crit_data, colWidths=[width])
+            crit_table.setStyle(table_styles['critical'])
+            elements.append(crit_table)
+            elements.append(Spacer(1, 25))
+        
+        # ============= CÂU HỎI ÔN TẬP =============
+        if analysis.get('cau_hoi_on_tap'):
+            elements.append(create_paragraph("[10] Câu hỏi Tự đánh giá", section_header_style))
+            elements.append(Spacer(1, 10))
+            
+            for i, qa in enumerate(analysis['cau_hoi_on_tap'], 1):
+                difficulty = ensure_utf8(qa.get('do_kho', 'Trung bình'))
+                diff_color, question_table_style = template.question_style(difficulty)
+                
+                # Hộp câu hỏi
+                q_data = [
+                    [create_paragraph(f"<b>Câu hỏi {i}</b> <font color='{diff_color}'>[{difficulty}]</font>", body_style)],
+                    [create_paragraph(ensure_utf8(qa['cau_hoi']), body_style)]
+                ]
+                
+                q_table = Table(q_data, colWidths=[width])
+                q_table.setStyle(question_table_style)
+                elements.append(q_table)
+                elements.append(Spacer(1, 8))
+                
+                # Hộp trả lời
+                a_data = [[create_paragraph(f"<b>Trả lời:</b> {ensure_utf8(qa['tra_loi'])}", answer_style)]]
+                a_table = Table(a_data, colWidths=[width])
+                a_table.setStyle(table_styles['answer'])
+                elements.append(a_table)
+                elements.append(Spacer(1, 15))
+        
+        # ============= BẢN ĐỒ TƯ DUY =============
+        elements.append(PageBreak())
+        elements.append(create_paragraph("[11] Bản đồ Tư duy Khái niệm", section_header_style))
+        elements.append(Spacer(1, 15))
+        
+        # Khái niệm trung tâm
+        central = ensure_utf8(analysis['ban_do_tu_duy']['khai_niem_trung_tam'])
+        central_data = [[create_paragraph(f"<b>{central}</b>", styles['central'])]]
+        
+        central_table = Table(central_data, colWidths=[width * 0.6])
+        central_table.setStyle(table_styles['central'])
+        
+        central_wrapper = Table([[central_table]], colWidths=[width])
+        central_wrapper.setStyle(table_styles['central_wrapper'])
+        elements.append(central_wrapper)
+        elements.append(Spacer(1, 20))
+        
+        # Các nhánh
+        color_names = list(pdf_templates.BRANCH_COLORS)
+        for i, branch in enumerate(analysis['ban_do_tu_duy']['nhanh']):
+            color_name = branch.get('mau', color_names[i % len(color_names)])
+            
+            branch_header = Table([[create_paragraph(f"<b>{ensure_utf8(branch['chu_de'])}</b>", 
+                styles['branch_header'])]], 
+                colWidths=[width * 0.7])
+            branch_header.setStyle(template.branch_style(color_name))
+            elements.append(branch_header)
+            elements.append(Spacer(1, 5))
+            
+            for point in branch['diem']:
+                point_text = create_paragraph(f"  • {ensure_utf8(point)}", body_style)
+                elements.append(point_text)
+            
+            elements.append(Spacer(1, 15))
+        
+        # ============= MẸO HỌC TẬP & FOOTER (phần tĩnh dựng sẵn) =============
+        elements.extend(template.static_sections())
+        
+        # Xây dựng PDF
+        if on_progress is not None:
+            total = len(elements)
+            built = [0]
+
+            def after_flowable(flowable):
+                built[0] += 1
+                on_progress(min(built[0], total - 1), total)
+
+            doc.afterFlowable = after_flowable
+        doc.build(elements)
+        if on_progress is not None:
+            on_progress(total, total)
+        print(f"[OK] PDF flashcard kiến thức nâng cao đã được tạo thành công!")
+        if isinstance(output_path, str):
+            print(f"[OK] Output: {output_path}")
+        
+    except Exception as e:
+        print(f"Lỗi khi tạo PDF: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise
+
+
+def _render_bytes(analysis, on_progress=None):
+    """Render flashcard vào bộ nhớ, trả về bytes PDF (chạy được trong process con)"""
+    output = io.BytesIO()
+    tạo_pdf_flashcard(analysis, output, on_progress=on_progress)
+    return output.getvalue()
+
+
+def render_flashcard(analysis, on_progress=None):
+    """
+    Render PDF flashcard từ dict phân tích
+
+    Args:
+        analysis: Dict phân tích (pickle được)
+        on_progress: Callback on_progress(done, total). Khi render trong process pool chỉ báo
+            lúc bắt đầu và lúc xong (không theo từng flowable)
+
+    Returns:
+        bytes PDF
+    """
+    if not pdf_workers.offload_enabled():
+        return _render_bytes(analysis, on_progress)
+    if on_progress is not None:
+        on_progress(0, 1)
+    pdf_content = pdf_workers.run(_render_bytes, analysis)
+    if on_progress is not None:
+        on_progress(1, 1)
+    return pdf_content
@@ -0,0 +1,338 @@
+"""
+Module template render PDF flashcard (style và các phần tĩnh dựng sẵn)
+Trước đây mỗi lần render đều gọi getSampleStyleSheet(), dựng lại ~12 ParagraphStyle
+(thậm chí một answer_style mới cho từng câu hỏi ôn tập) và một TableStyle mới cho từng bảng.
+Các đối tượng này chỉ phụ thuộc bộ font nên được dựng một lần mỗi process:
+- ParagraphStyle / TableStyle: chỉ được đọc khi dàn trang nên dùng chung giữa các thread
+- Phần tĩnh (mẹo học tập, footer): flowable giữ trạng thái dàn trang (wrap/split) nên được
+  dựng một lần cho mỗi thread render và tái sử dụng giữa các tài liệu của thread đó
+Chi phí render mỗi tài liệu chỉ còn phụ thuộc vào phần nội dung động.
+"""
+import threading
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import Paragraph, Spacer, PageBreak, Table, TableStyle
+from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
+from reportlab.lib import colors
+import pdf_fonts
+
+# Khổ giấy và lề của flashcard (doc.width = khổ giấy trừ lề trái/phải)
+PAGE_SIZE = letter
+PAGE_MARGINS = {'rightMargin': 60, 'leftMargin': 60, 'topMargin': 60, 'bottomMargin': 40}
+CONTENT_WIDTH = PAGE_SIZE[0] - PAGE_MARGINS['leftMargin'] - PAGE_MARGINS['rightMargin']
+
+# Màu hộp câu hỏi ôn tập theo độ khó: (màu viền/nhãn, màu nền)
+DIFFICULTY_COLORS = {
+    'Dễ': ('#4caf50', '#e8f5e9'),
+    'Khó': ('#f44336', '#ffebee'),
+}
+DEFAULT_DIFFICULTY_COLORS = ('#ff9800', '#fff3e0')
+
+# Màu các nhánh bản đồ tư duy
+BRANCH_COLORS = {
+    'blue': '#1976d2',
+    'green': '#388e3c',
+    'orange': '#f57c00',
+    'red': '#d32f2f',
+    'purple': '#7b1fa2',
+    'teal': '#00796b'
+}
+DEFAULT_BRANCH_COLOR = '#1976d2'
+
+STUDY_TIPS = [
+    ("[1]", "<b>Ôn tập Lần 1:</b> Trong vòng 24 giờ sau khi đọc flashcard này"),
+    ("[2]", "<b>Ôn tập Lần 2:</b> 3 ngày sau lần ôn đầu tiên"),
+    ("[3]", "<b>Ôn tập Lần 3:</b> 1 tuần sau lần ôn thứ hai"),
+    ("[4]", "<b>Ôn tập Cuối:</b> 2 tuần sau lần ôn thứ ba"),
+    ("[5]", "<b>Gợi nhớ Chủ động:</b> Cố trả lời các câu hỏi mà không nhìn đáp án trước"),
+    ("[6]", "<b>Dạy người khác:</b> Giải thích khái niệm cho đồng học để củng cố hiểu biết"),
+]
+
+FOOTER_LINES = [
+    "─────────────────────────────",
+    "<b>Nhàn Học - Phân tích Tài liệu</b> | Được hỗ trợ bởi AI",
+    "Học thông minh, học nhanh hơn, ghi nhớ lâu hơn",
+]
+
+_lock = threading.Lock()
+_template = None
+
+
+def _padding(horizontal, vertical):
+    return [
+        ('LEFTPADDING', (0, 0), (-1, -1), horizontal),
+        ('RIGHTPADDING', (0, 0), (-1, -1), horizontal),
+        ('TOPPADDING', (0, 0), (-1, -1), vertical),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), vertical),
+    ]
+
+
+def _build_styles(fonts):
+    font_name, font_bold, font_italic = fonts
+    base = getSampleStyleSheet()
+    styles = {}
+
+    styles['title'] = ParagraphStyle(
+        'CustomTitle',
+        parent=base['Heading1'],
+        fontSize=26,
+        textColor=colors.HexColor('#1a237e'),
+        spaceAfter=10,
+        spaceBefore=20,
+        alignment=TA_CENTER,
+        fontName=font_bold
+    )
+    styles['subtitle'] = ParagraphStyle(
+        'Subtitle',
+        parent=base['Normal'],
+        fontSize=11,
+        textColor=colors.HexColor('#5e35b1'),
+        spaceAfter=20,
+        alignment=TA_CENTER,
+        fontName=font_italic
+    )
+    styles['section_header'] = ParagraphStyle(
+        'SectionHeader',
+        parent=base['Heading2'],
+        fontSize=18,
+        textColor=colors.white,
+        spaceAfter=15,
+        spaceBefore=20,
+        fontName=font_bold,
+        backColor=colors.HexColor('#1976d2'),
+        borderPadding=(8, 8, 8, 8),
+        leftIndent=10
+    )
+    styles['body'] = ParagraphStyle(
+        'CustomBody',
+        parent=base['BodyText'],
+        fontSize=11,
+        textColor=colors.HexColor('#212121'),
+        spaceAfter=12,
+        alignment=TA_JUSTIFY,
+        leading=16,
+        fontName=font_name
+    )
+    styles['highlight'] = ParagraphStyle(
+        'Highlight',
+        parent=base['BodyText'],
+        fontSize=11,
+        textColor=colors.HexColor('#1565c0'),
+        spaceAfter=10,
+        leftIndent=15,
+        rightIndent=15,
+        backColor=colors.HexColor('#e3f2fd'),
+        borderColor=colors.HexColor('#1976d2'),
+        borderWidth=1,
+        borderPadding=10,
+        leading=15,
+        fontName=font_name
+    )
+    styles['term'] = ParagraphStyle(
+        'Term',
+        parent=base['BodyText'],
+        fontSize=10,
+        textColor=colors.HexColor('#2e7d32'),
+        spaceAfter=8,
+        leftIndent=20,
+        leading=13,
+        fontName=font_bold
+    )
+    styles['definition'] = ParagraphStyle(
+        'Definition',
+        parent=base['BodyText'],
+        fontSize=10,
+        textColor=colors.HexColor('#424242'),
+        spaceAfter=10,
+        leftIndent=35,
+        leading=13,
+        fontName=font_name
+    )
+    styles['answer'] = ParagraphStyle(
+        'Answer',
+        parent=base['BodyText'],
+        fontSize=10,
+        textColor=colors.HexColor('#424242'),
+        spaceAfter=12,
+        leftIndent=25,
+        leading=13,
+        fontName=font_name
+    )
+    styles['central'] = ParagraphStyle(
+        'Central',
+        parent=styles['body'],
+        fontSize=14,
+        alignment=TA_CENTER,
+        textColor=colors.white,
+        fontName=font_bold
+    )
+    styles['branch_header'] = ParagraphStyle(
+        'BranchHeader',
+        parent=styles['body'],
+        textColor=colors.white,
+        fontSize=12,
+        fontName=font_bold
+    )
+    styles['footer'] = ParagraphStyle(
+        'Footer',
+        parent=base['Normal'],
+        fontSize=9,
+        textColor=colors.HexColor('#757575'),
+        alignment=TA_CENTER,
+        fontName=font_name
+    )
+    return styles
+
+
+def _build_table_styles(fonts):
+    font_bold = fonts.bold
+    table_styles = {}
+
+    table_styles['top_bar'] = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#1976d2')),
+        ('LINEBELOW', (0, 0), (-1, -1), 4, colors.HexColor('#0d47a1'))
+    ])
+    table_styles['objectives'] = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e8f5e9')),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#f1f8e9')),
+        ('BOX', (0, 0), (-1, -1), 2, colors.HexColor('#388e3c')),
+        *_padding(12, 8),
+    ])
+    table_styles['metrics'] = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#e3f2fd')),
+        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#1976d2')),
+        ('ALIGN', (1, 0), (1, -1), 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        *_padding(10, 8),
+    ])
+    table_styles['findings'] = TableStyle([
+        ('BACKGROUND', (0, 0), (0, 1), colors.HexColor('#ff9800')),
+        ('BACKGROUND', (1, 0), (1, 1), colors.HexColor('#fff3e0')),
+        ('BACKGROUND', (0, 2), (-1, -1), colors.white),
+        ('TEXTCOLOR', (0, 0), (0, -1), colors.white),
+        ('ALIGN', (0, 0), (0, -1), 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('FONTNAME', (0, 0), (0, -1), font_bold),
+        ('FONTSIZE', (0, 0), (0, -1), 12),
+        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e0e0e0')),
+        *_padding(10, 8),
+    ])
+    table_styles['applications'] = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#e8f5e9')),
+        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#2e7d32')),
+        ('FONTSIZE', (0, 0), (0, -1), 14),
+        ('FONTNAME', (0, 0), (0, -1), font_bold),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        *_padding(10, 8),
+    ])
+    table_styles['critical'] = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#fff3e0')),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+        ('BOX', (0, 0), (-1, -1), 2, colors.HexColor('#f57c00')),
+        ('LINEBELOW', (0, 0), (-1, 0), 1, colors.HexColor('#f57c00')),
+        *_padding(15, 10),
+    ])
+    table_styles['answer'] = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f5f5f5')),
+        ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#bdbdbd')),
+        *_padding(12, 8),
+    ])
+    table_styles['central'] = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#1976d2')),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        *_padding(15, 12),
+        ('BOX', (0, 0), (-1, -1), 3, colors.HexColor('#0d47a1')),
+    ])
+    table_styles['central_wrapper'] = TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ])
+    table_styles['tips'] = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f3e5f5')),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        *_padding(10, 8),
+        ('LINEBELOW', (0, 0), (-1, -2), 1, colors.HexColor('#ce93d8')),
+    ])
+    table_styles['footer'] = TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ])
+    return table_styles
+
+
+class FlashcardTemplate:
+    """Style, TableStyle và phần tĩnh của flashcard cho một bộ font"""
+
+    def __init__(self, fonts):
+        self.fonts = fonts
+        self.styles = _build_styles(fonts)
+        self.table_styles = _build_table_styles(fonts)
+        self.question_styles = {
+            colors_pair: TableStyle([
+                ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor(colors_pair[1])),
+                ('BOX', (0, 0), (-1, -1), 1.5, colors.HexColor(colors_pair[0])),
+                *_padding(12, 8),
+            ])
+            for colors_pair in [*DIFFICULTY_COLORS.values(), DEFAULT_DIFFICULTY_COLORS]
+        }
+        self.branch_styles = {
+            color: TableStyle([
+                ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor(color)),
+                *_padding(10, 6),
+            ])
+            for color in set(BRANCH_COLORS.values()) | {DEFAULT_BRANCH_COLOR}
+        }
+        self._local = threading.local()
+
+    def question_style(self, difficulty):
+        """(màu nhãn độ khó, TableStyle hộp câu hỏi) theo độ khó"""
+        colors_pair = DIFFICULTY_COLORS.get(difficulty, DEFAULT_DIFFICULTY_COLORS)
+        return colors_pair[0], self.question_styles[colors_pair]
+
+    def branch_style(self, color_name):
+        """TableStyle tiêu đề nhánh bản đồ tư duy theo tên màu"""
+        return self.branch_styles[BRANCH_COLORS.get(color_name, DEFAULT_BRANCH_COLOR)]
+
+    def _build_static_sections(self):
+        body_style = self.styles['body']
+        footer_style = self.styles['footer']
+
+        tips_table = Table(
+            [[Paragraph(label, body_style), Paragraph(tip, body_style)] for label, tip in STUDY_TIPS],
+            colWidths=[40, CONTENT_WIDTH - 40]
+        )
+        tips_table.setStyle(self.table_styles['tips'])
+
+        footer_table = Table(
+            [[Paragraph(line, footer_style)] for line in FOOTER_LINES],
+            colWidths=[CONTENT_WIDTH]
+        )
+        footer_table.setStyle(self.table_styles['footer'])
+
+        return [
+            PageBreak(),
+            Paragraph("[12] Mẹo Học tập & Chiến lược Ghi nhớ", self.styles['section_header']),
+            Spacer(1, 10),
+            tips_table,
+            Spacer(1, 20),
+            Spacer(1, 30),
+            footer_table,
+        ]
+
+    def static_sections(self):
+        """Mẹo học tập + footer (cuối tài liệu), dựng một lần cho mỗi thread render"""
+        sections = getattr(self._local, 'sections', None)
+        if sections is None:
+            sections = self._local.sections = self._build_static_sections()
+        return sections
+
+
+def get_template():
+    """Template flashcard của process (dựng ở lần gọi đầu tiên, sau khi đăng ký font)"""
+    global _template
+    if _template is not None:
+        return _template
+    with _lock:
+        if _template is None:
+            _template = FlashcardTemplate(pdf_fonts.get_fonts())
+    return _template
@@ -0,0 +1,202 @@
+"""
+Module trích xuất text từ PDF
+- iter_pages(): generator trả về text từng trang theo thứ tự, dừng ngay khi đã đủ max_chars
+  (không phải đọc hết 300 trang khi phân tích chỉ dùng vài chục nghìn ký tự đầu)
+- extract_text(): gom các trang vào list rồi ''.join một lần (tuyến tính), thay vì text += ...
+- Tài liệu lớn (>= PDF_PARALLEL_MIN_PAGES trang) được trích xuất song song theo lô trang
+  bằng process pool (PyPDF2 là code Python thuần, chạy trong thread thì bị GIL giới hạn).
+  Các lô được gửi đi theo cửa sổ trượt và đọc kết quả theo thứ tự, nên vẫn dừng sớm được.
+- Tài liệu ít trang được trích xuất tuần tự trong một process con của cùng pool (PDF_PROCESS_OFFLOAD),
+  để việc parse không giữ GIL của worker web (xem pdf_workers.py).
+
+Module chỉ phụ thuộc PyPDF2 để process con (spawn) import nhanh.
+"""
+import io
+import os
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+import PyPDF2
+import pdf_workers
+
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', 40))
+# Số lô trang trích xuất đồng thời của một tài liệu (các lô chạy trong process pool của pdf_workers,
+# nên thực tế không vượt quá PDF_PROCESS_WORKERS, xem extract_concurrency())
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', pdf_workers.PDF_PROCESS_WORKERS))
+PDF_PAGES_PER_BATCH = int(os.getenv('PDF_PAGES_PER_BATCH', 8))
+
+PAGE_SEPARATOR = "\n\n"
+
+PageText = namedtuple('PageText', ['index', 'total', 'text'])
+
+
+def _open(source):
+    """Mở PdfReader từ đường dẫn, bytes hoặc file-like object"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return PyPDF2.PdfReader(source)
+
+
+def _page_text(reader, index):
+    return reader.pages[index].extract_text() or ''
+
+
+@contextmanager
+def _shared_source(source):
+    """
+    Tham chiếu pickle được tới PDF cho process con: ('path', đường dẫn) hoặc ('shm', (tên, kích thước))
+    Bytes được chia sẻ qua shared memory thay vì pickle cả file cho mỗi lần gửi việc
+    """
+    if isinstance(source, (str, os.PathLike)):
+        yield ('path', os.fspath(source))
+        return
+    data = source.getvalue() if hasattr(source, 'getvalue') else bytes(source)
+    block = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    try:
+        block.buf[:len(data)] = data
+        yield ('shm', (block.name, len(data)))
+    finally:
+        block.close()
+        block.unlink()
+
+
+@contextmanager
+def _open_ref(source_ref):
+    """Chạy trong process con: mở PdfReader từ tham chiếu của _shared_source()"""
+    kind, value = source_ref
+    if kind != 'shm':
+        yield _open(value)
+        return
+    name, size = value
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        yield _open(bytes(block.buf[:size]))
+    finally:
+        block.close()
+
+
+def _extract_range(source_ref, start, stop):
+    """Chạy trong process con: trích xuất text các trang [start, stop)"""
+    with _open_ref(source_ref) as reader:
+        return [_page_text(reader, i) for i in range(start, stop)]
+
+
+def _extract_until(source_ref, max_chars):
+    """Chạy trong process con: trích xuất tuần tự từ trang đầu, dừng khi đủ max_chars ký tự"""
+    texts = []
+    chars = 0
+    with _open_ref(source_ref) as reader:
+        for i in range(len(reader.pages)):
+            texts.append(_page_text(reader, i))
+            chars += len(texts[-1]) + len(PAGE_SEPARATOR)
+            if max_chars is not None and chars >= max_chars:
+                break
+    return texts
+
+
+def _iter_offloaded(source, max_chars):
+    """Trích xuất tuần tự trong một process con, yield text từng trang theo thứ tự"""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    with _shared_source(source) as source_ref:
+        texts = pdf_workers.run(_extract_until, source_ref, max_chars)
+    yield from enumerate(texts)
+
+
+def extract_concurrency():
+    """Số lô trang thực sự chạy song song: giới hạn bởi cả PDF_EXTRACT_WORKERS và kích thước process pool"""
+    return min(PDF_EXTRACT_WORKERS, pdf_workers.PDF_PROCESS_WORKERS)
+
+
+def _iter_parallel(source, total):
+    """Trích xuất song song theo lô, yield text từng trang theo thứ tự"""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    with _shared_source(source) as source_ref:
+        pool = pdf_workers.get_pool()
+        batches = iter(range(0, total, PDF_PAGES_PER_BATCH))
+        pending = deque()
+
+        def submit_next():
+            start = next(batches, None)
+            if start is not None:
+                stop = min(start + PDF_PAGES_PER_BATCH, total)
+                pending.append((start, pool.submit(_extract_range, source_ref, start, stop)))
+
+        try:
+            for _ in range(extract_concurrency()):
+                submit_next()
+            while pending:
+                start, future = pending.popleft()
+                texts = future.result()
+                submit_next()
+                for offset, text in enumerate(texts):
+                    yield start + offset, text
+        finally:
+            # Consumer dừng sớm (đủ ký tự): hủy các lô chưa chạy, chờ lô đang chạy trước khi giải phóng shared memory
+            for _, future in pending:
+                future.cancel()
+            for _, future in pending:
+                if not future.cancelled():
+                    try:
+                        future.result()
+                    except Exception:
+                        pass
+
+
+def iter_pages(source, max_chars=None, parallel=None):
+    """
+    Trích xuất text từng trang theo thứ tự
+
+    Args:
+        source: Đường dẫn file, bytes hoặc file-like object của PDF
+        max_chars: Dừng sau trang làm tổng số ký tự đạt max_chars (None = tất cả các trang)
+        parallel: Ép bật/tắt trích xuất song song (mặc định theo số trang, khi bật PDF_PROCESS_OFFLOAD)
+
+    Yields:
+        PageText(index, total, text)
+    """
+    reader = _open(source)
+    total = len(reader.pages)
+    if parallel is None:
+        parallel = total >= PDF_PARALLEL_MIN_PAGES and extract_concurrency() > 1 and pdf_workers.offload_enabled()
+
+    if parallel:
+        pages = _iter_parallel(source, total)
+    elif pdf_workers.offload_enabled():
+        pages = _iter_offloaded(source, max_chars)
+    else:
+        pages = ((i, _page_text(reader, i)) for i in range(total))
+
+    chars = 0
+    try:
+        for index, text in pages:
+            yield PageText(index, total, text)
+            chars += len(text) + len(PAGE_SEPARATOR)
+            if max_chars is not None and chars >= max_chars:
+                return
+    finally:
+        pages.close()
+
+
+def extract_text(source, max_chars=None, parallel=None, on_page=None):
+    """
+    Trích xuất text của PDF, dừng khi đủ max_chars
+
+    Args:
+        on_page: Callback on_page(pages_done, total) sau mỗi trang (dùng báo tiến độ)
+
+    Returns:
+        (text, pages_read, total_pages)
+    """
+    parts = []
+    pages_read = total = 0
+    for page in iter_pages(source, max_chars=max_chars, parallel=parallel):
+        parts.append(page.text)
+        pages_read, total = page.index + 1, page.total
+        if on_page is not None:
+            on_page(pages_read, total)
+    text = PAGE_SEPARATOR.join(parts)
+    if max_chars is not None:
+        text = text[:max_chars]
+    return text, pages_read, total
@@ -0,0 +1,86 @@
+"""
+Module process pool cho các bước xử lý PDF nặng CPU (parse bằng PyPDF2, dàn trang bằng ReportLab)
+Các bước này là code Python thuần: chạy trong thread nền thì giữ GIL và làm chậm các thread
+xử lý request của cùng worker (ví dụ poll status trong lúc đang render PDF). Khi bật
+PDF_PROCESS_OFFLOAD, chúng được chạy trong một process pool riêng (spawn, PDF_PROCESS_WORKERS
+process cho mỗi worker web): đầu vào là dữ liệu pickle được (bytes PDF, dict phân tích),
+đầu ra là text / bytes PDF, nên thread gọi chỉ chờ kết quả mà không giữ GIL.
+
+Mỗi worker gunicorn có pool riêng nên tổng số process con tối đa là WEB_CONCURRENCY × PDF_PROCESS_WORKERS.
+Process con được tạo khi có việc (spawn, không tạo sẵn), nên worker web không xử lý PDF thì không có
+process con nào. Mặc định là phần CPU của mỗi worker web (số CPU / WEB_CONCURRENCY, làm tròn lên),
+trong khoảng 2-4: ít nhất 2 để tài liệu lớn được trích xuất song song (pdf_text.py) và 2 job PDF
+chạy đồng thời (JOB_WORKERS_PDF mặc định) không phải chờ nhau trên cùng một process.
+
+Module chỉ dùng thư viện chuẩn để process con (spawn) import nhanh.
+"""
+import os
+import math
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+PDF_PROCESS_OFFLOAD = os.getenv('PDF_PROCESS_OFFLOAD', '1') == '1'
+
+
+def _default_process_workers():
+    """Số process con tối đa mặc định của mỗi worker web: phần CPU của worker, trong khoảng 2-4"""
+    cpus = os.cpu_count() or 1
+    # Cùng mặc định với gunicorn_config.py khi không đặt WEB_CONCURRENCY
+    web_workers = int(os.getenv('WEB_CONCURRENCY', cpus * 2 + 1))
+    return max(2, min(4, math.ceil(cpus / max(web_workers, 1))))
+
+
+PDF_PROCESS_WORKERS = int(os.getenv('PDF_PROCESS_WORKERS', _default_process_workers()))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def offload_enabled():
+    """Có chuyển việc nặng CPU sang process pool không (không bao giờ lồng pool trong process con)"""
+    return PDF_PROCESS_OFFLOAD and multiprocessing.parent_process() is None
+
+
+def get_pool():
+    """Process pool PDF (tạo lazy, tạo lại sau khi gunicorn fork)"""
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _discard_pool(pool):
+    """Bỏ pool bị hỏng (process con bị kill/crash) để lần gọi sau tạo pool mới"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def run(fn, *args):
+    """
+    Chạy fn(*args) trong process pool và chờ kết quả
+
+    fn phải là hàm top-level của module nhẹ (pickle được theo tên), args/kết quả phải pickle được.
+    Tắt PDF_PROCESS_OFFLOAD (hoặc đang ở trong process con) thì chạy luôn trong thread hiện tại.
+    """
+    if not offload_enabled():
+        return fn(*args)
+    pool = get_pool()
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        print("[PDF Workers] Process pool bị hỏng, sẽ tạo lại ở lần gọi sau")
+        _discard_pool(pool)
+        raise
@@ -5,34 +5,34 @@ $ pip install openai
 """
 
 import os
-from openai import OpenAI
 from dotenv import load_dotenv
 import json
 import uuid
-import threading
 from datetime import datetime
+import job_store
+import job_scheduler
+import response_cache
+import llm_gateway
 
 load_dotenv()
 
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-    base_url=os.environ.get("OPENAI_BASE_URL")
-)
+# Lưu trữ trạng thái các job (dùng chung giữa các worker)
+job_storage = job_store.get_store('quiz')
 
-# Lưu trữ trạng thái các job trong bộ nhớ
-job_storage = {}
+# Số bộ câu hỏi khác nhau được tạo cho cùng một đầu vào trước khi dùng lại từ cache
+QUIZ_CACHE_VARIANTS = int(os.getenv('QUIZ_CACHE_VARIANTS', 3))
 
 
-def get_quiz_sync(course, topic, subtopic, description, num_questions=5):
-    """Hàm tạo quiz đồng bộ (blocking)"""
+def build_quiz_request(course, topic, subtopic, description, num_questions=5):
+    """Tạo tham số gọi OpenAI cho quiz (dùng chung cho việc gọi API và cache key)"""
     system_instruction = f"""Bạn là một trợ lý AI cung cấp bài kiểm tra để đánh giá sự hiểu biết của người dùng về một chủ đề. Bài kiểm tra sẽ dựa trên chủ đề, chủ đề con và mô tả của chủ đề con để xác định chính xác nội dung cần học. Xuất câu hỏi ở định dạng JSON. Các câu hỏi phải là câu hỏi trắc nghiệm, có thể bao gồm tính toán nếu cần thiết. Tạo CHÍNH XÁC {num_questions} câu hỏi. Bao gồm các câu hỏi yêu cầu suy nghĩ sâu sắc. 
 
 QUAN TRỌNG: answerIndex phải là số nguyên (0, 1, 2, hoặc 3) đại diện cho vị trí của đáp án đúng trong mảng options (bắt đầu từ 0).
 
 Xuất ở định dạng JSON: {{questions:[ {{question: "...", options:["option1", "option2", "option3", "option4"], answerIndex: 0, reason:"..."}}]}}"""
 
-    response = client.chat.completions.create(
-        model=os.environ.get("OPENAI_MODEL", "gpt-5-nano-2025-08-07"),
+    return dict(
+        model=llm_gateway.DEFAULT_MODEL,
         messages=[
             {
                 "role": "system",
@@ -44,6 +44,18 @@ Xuất ở định dạng JSON: {{questions:[ {{question: "...", options:["optio
             }
         ]
     )
+
+
+def get_quiz_sync(course, topic, subtopic, description, num_questions=5, check_cache=True):
+    """Hàm tạo quiz đồng bộ (blocking), kết quả được lưu vào response cache"""
+    request = build_quiz_request(course, topic, subtopic, description, num_questions)
+    cache_key = response_cache.make_key(**request)
+    if check_cache:
+        cached = response_cache.get(cache_key, namespace='quiz', variants=QUIZ_CACHE_VARIANTS)
+        if cached is not None:
+            return cached
+
+    response = llm_gateway.chat_completion('quiz', **request)
     
     result = response.choices[0].message.content
     print(result)
@@ -56,6 +68,7 @@ Xuất ở định dạng JSON: {{questions:[ {{question: "...", options:["optio
                 # Chuyển đổi sang int nếu là string
                 question['answerIndex'] = int(question['answerIndex'])
     
+    response_cache.put(cache_key, quiz_data, namespace='quiz', variants=QUIZ_CACHE_VARIANTS)
     return quiz_data
 
 
@@ -63,25 +76,25 @@ def process_quiz_job(job_id, course, topic, subtopic, description, num_questions
     """Xử lý job tạo quiz trong background thread"""
     try:
         print(f"[Quiz Job {job_id}] Bắt đầu xử lý với {num_questions} câu hỏi...")
-        job_storage[job_id]['status'] = 'processing'
-        job_storage[job_id]['updated_at'] = datetime.now().isoformat()
+        job_storage.update(job_id, status='processing', updated_at=datetime.now().isoformat())
         
-        # Tạo quiz
-        result = get_quiz_sync(course, topic, subtopic, description, num_questions)
+        # Tạo quiz (get_quiz đã kiểm tra cache trước khi đưa vào hàng đợi)
+        result = get_quiz_sync(course, topic, subtopic, description, num_questions, check_cache=False)
         
         # Cập nhật kết quả
-        job_storage[job_id]['status'] = 'completed'
-        job_storage[job_id]['result'] = result
-        job_storage[job_id]['updated_at'] = datetime.now().isoformat()
-        job_storage[job_id]['completed_at'] = datetime.now().isoformat()
+        job_storage.update(
+            job_id,
+            status='completed',
+            result=result,
+            updated_at=datetime.now().isoformat(),
+            completed_at=datetime.now().isoformat()
+        )
         
         print(f"[Quiz Job {job_id}] Hoàn thành!")
         
     except Exception as e:
         print(f"[Quiz Job {job_id}] Lỗi: {str(e)}")
-        job_storage[job_id]['status'] = 'failed'
-        job_storage[job_id]['error'] = str(e)
-        job_storage[job_id]['updated_at'] = datetime.now().isoformat()
+        job_storage.update(job_id, status='failed', error=str(e), updated_at=datetime.now().isoformat())
 
 
 def get_quiz(course, topic, subtopic, description, num_questions=5):
@@ -89,7 +102,7 @@ def get_quiz(course, topic, subtopic, description, num_questions=5):
     job_id = str(uuid.uuid4())
     
     # Khởi tạo job
-    job_storage[job_id] = {
+    job = {
         'job_id': job_id,
         'status': 'pending',
         'course': course,
@@ -103,21 +116,43 @@ def get_quiz(course, topic, subtopic, description, num_questions=5):
         'error': None
     }
     
-    # Chạy xử lý trong background thread
-    thread = threading.Thread(
-        target=process_quiz_job,
-        args=(job_id, course, topic, subtopic, description, num_questions)
+    # Cache hit (đã đủ số biến thể): job hoàn thành ngay, không cần đưa vào hàng đợi
+    cache_key = response_cache.make_key(**build_quiz_request(course, topic, subtopic, description, num_questions))
+    cached = response_cache.get(
+        cache_key,
+        namespace='quiz',
+        variants=QUIZ_CACHE_VARIANTS
     )
-    thread.daemon = True
-    thread.start()
+    if cached is not None:
+        job.update(status='completed', result=cached, completed_at=job['updated_at'], cached=True)
+        job_storage.create(job_id, job)
+        print(f"[Quiz Job {job_id}] Cache hit, hoàn thành ngay")
+        return job_id
+    
+    # Đã có job giống hệt đang chạy: gộp vào job đó thay vì gọi lại OpenAI
+    leader_id = job_storage.create(job_id, job, fingerprint=cache_key)
+    if leader_id:
+        print(f"[Quiz Job {job_id}] Gộp vào job đang chạy {leader_id}")
+        return job_id
+    
+    # Đưa job vào hàng đợi của scheduler (pool worker cố định, hàng đợi giới hạn)
+    try:
+        llm_gateway.ensure_available()
+        job_scheduler.submit('quiz', process_quiz_job, job_id, course, topic, subtopic, description, num_questions)
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError):
+        job_storage.delete(job_id)
+        raise
     
-    print(f"[Quiz Job {job_id}] Đã tạo và bắt đầu background processing với {num_questions} câu hỏi")
+    print(f"[Quiz Job {job_id}] Đã tạo và đưa vào hàng đợi với {num_questions} câu hỏi")
     
     return job_id
 
 
-def get_job_status(job_id):
-    """Lấy trạng thái của job"""
-    if job_id not in job_storage:
-        return None
-    return job_storage[job_id]
+def get_job_status(job_id, wait=0, since=None):
+    """
+    Lấy trạng thái của job
+    Nếu wait > 0: chờ tối đa wait giây đến khi job kết thúc hoặc thay đổi so với since (long-poll)
+    """
+    if wait:
+        return job_storage.wait(job_id, wait, since=since)
+    return job_storage.get(job_id)
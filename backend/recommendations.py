@@ -3,31 +3,38 @@ Module xử lý Personalized Recommendations với AI
 Gợi ý chủ đề tiếp theo, learning path, và điều chỉnh độ khó dựa trên performance
 Tối ưu với parallel processing và background jobs
 """
-from openai import OpenAI
 import os
 from dotenv import load_dotenv
 import json
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import time
 import uuid
-import threading
+import job_store
+import job_scheduler
+import response_cache
+import llm_gateway
+import learning_metrics
+import difficulty_engine
 
 load_dotenv()
 
-# Khởi tạo OpenAI client
-client = OpenAI(
-    api_key=os.getenv('OPENAI_API_KEY'),
-    base_url=os.getenv('OPENAI_BASE_URL', 'https://v98store.com/v1')
-)
+MODEL = llm_gateway.DEFAULT_MODEL
 
-MODEL = os.getenv('OPENAI_MODEL', 'gpt-5-nano-2025-08-07')
+# Độ khó được tính bằng luật cục bộ (difficulty_engine.py); bật để AI viết lại lời giải thích và tips
+DIFFICULTY_LLM_ENRICH = os.getenv('DIFFICULTY_LLM_ENRICH', '0') == '1'
 
-# ThreadPoolExecutor để chạy parallel AI requests
-executor = ThreadPoolExecutor(max_workers=3)
+# Pool dùng chung cho các AI request song song của mọi recommendations job (giới hạn số request
+# đồng thời tới provider thay vì mỗi job tự tạo pool riêng)
+RECOMMENDATIONS_AI_WORKERS = int(os.getenv('RECOMMENDATIONS_AI_WORKERS', 4))
+executor = ThreadPoolExecutor(max_workers=RECOMMENDATIONS_AI_WORKERS, thread_name_prefix='recommendations')
 
-# Lưu trữ trạng thái các job trong bộ nhớ
-recommendations_job_storage = {}
+# Thời gian tối đa (giây) cho cả recommendations job: hết hạn thì bỏ các request chưa xong
+# và dùng kết quả dự phòng cho phần đó
+RECOMMENDATIONS_DEADLINE = float(os.getenv('RECOMMENDATIONS_DEADLINE', 20))
+
+# Lưu trữ trạng thái các job (dùng chung giữa các worker)
+recommendations_job_storage = job_store.get_store('recommendations')
 
 
 def analyze_performance(learning_data):
@@ -50,21 +57,22 @@ def analyze_performance(learning_data):
             'weak_topics': [],
             'total_time_hours': 0,
             'topic_performance': {},
-            'recent_trend': 'insufficient_data'
+            'recent_trend': 'insufficient_data',
+            'score_history': []
         }
     
-    # Tính điểm trung bình
-    avg_score = sum(q['score'] for q in quiz_results) / len(quiz_results)
+    # Gom quiz theo topic trong một lượt (xem learning_metrics.py)
+    stats = learning_metrics.aggregate(learning_data)
+    avg_score = stats.avg_score
     
     # Phân tích theo topic
     topic_performance = {}
     for topic in topics:
-        topic_quizzes = [q for q in quiz_results if q['topic'] == topic]
-        if topic_quizzes:
-            topic_avg = sum(q['score'] for q in topic_quizzes) / len(topic_quizzes)
+        topic_stats = stats.topics.get(topic)
+        if topic_stats:
             topic_performance[topic] = {
-                'avg_score': topic_avg,
-                'quizzes': len(topic_quizzes),
+                'avg_score': topic_stats.avg_score,
+                'quizzes': topic_stats.quizzes,
                 'time_spent': time_spent.get(topic, 0)
             }
     
@@ -86,22 +94,23 @@ def analyze_performance(learning_data):
     weak_topics.sort(key=lambda x: x['score'])
     
     # Tính trend từ quiz gần nhất
-    recent_quizzes = quiz_results[-5:]
+    recent_scores = stats.recent_scores
     recent_trend = 'insufficient_data'
-    if len(recent_quizzes) >= 3:
-        recent_avg = sum(q['score'] for q in recent_quizzes) / len(recent_quizzes)
+    if len(recent_scores) >= 3:
+        recent_avg = sum(recent_scores) / len(recent_scores)
         recent_trend = "improving" if recent_avg > avg_score else "stable"
     
     return {
         'avg_score': round(avg_score, 1),
-        'total_quizzes': len(quiz_results),
+        'total_quizzes': stats.quiz_count,
         'topics_studied': len(topics),
         'strong_topics': strong_topics,
         'weak_topics': weak_topics,
         'total_time_hours': round(sum(time_spent.values()) / 3600, 1),
         'topic_performance': topic_performance,
         'recent_trend': recent_trend,
-        'recent_scores': [q['score'] for q in recent_quizzes[-3:]]
+        'recent_scores': recent_scores[-3:],
+        'score_history': list(recent_scores)
     }
 
 
@@ -128,7 +137,8 @@ def recommend_next_topics(learning_data, performance):
 - Yếu: {weak_topics_str}
 - Xu hướng: {performance.get('recent_trend', 'N/A')}"""
         
-        response = client.chat.completions.create(
+        response = llm_gateway.chat_completion(
+            'recommendations.next_topics',
             model=MODEL,
             messages=[
                 {
@@ -169,11 +179,15 @@ QUY TẮC:
         result = json.loads(response.choices[0].message.content)
         return result
         
+    except llm_gateway.LLMUnavailableError:
+        # Provider đang sự cố: báo lỗi ngay thay vì trả về dữ liệu mặc định như kết quả thật
+        raise
     except Exception as e:
         print(f"Lỗi khi gợi ý topics: {str(e)}")
         import traceback
         traceback.print_exc()
         return {
+            "fallback": True,
             "performance_summary": "Đang phân tích dữ liệu của bạn để đưa ra gợi ý phù hợp.",
             "next_topics": [
                 {
@@ -204,7 +218,8 @@ def generate_learning_path(learning_data, performance):
 - Mạnh: {len(performance['strong_topics'])} topics
 - Cần cải thiện: {len(performance['weak_topics'])} topics"""
         
-        response = client.chat.completions.create(
+        response = llm_gateway.chat_completion(
+            'recommendations.learning_path',
             model=MODEL,
             messages=[
                 {
@@ -245,9 +260,12 @@ QUY TẮC:
         result = json.loads(response.choices[0].message.content)
         return result
         
+    except llm_gateway.LLMUnavailableError:
+        raise
     except Exception as e:
         print(f"Lỗi khi tạo learning path: {str(e)}")
         return {
+            "fallback": True,
             "title": "Lộ trình học tập cá nhân hóa",
             "description": "Lộ trình được thiết kế dựa trên mức độ và mục tiêu của bạn",
             "total_duration": "3-6 tháng",
@@ -266,52 +284,47 @@ QUY TẮC:
 def adjust_difficulty(learning_data, performance):
     """
     Đề xuất điều chỉnh độ khó dựa trên performance
-    Tối ưu context
+    Trình độ và độ khó đề xuất tính bằng luật cục bộ (difficulty_engine.py), không gọi AI;
+    bật DIFFICULTY_LLM_ENRICH thì AI chỉ viết lại lời giải thích và tips
     
     Returns:
         Dict chứa current level, recommended level, reason
     """
+    result = difficulty_engine.assess(
+        performance['avg_score'],
+        performance.get('score_history', performance.get('recent_scores', []))
+    )
+    if DIFFICULTY_LLM_ENRICH:
+        result = enrich_difficulty(result, performance)
+    return result
+
+
+def enrich_difficulty(result, performance):
+    """Nhờ AI viết lại reason / adjustment_tips cho kết quả của difficulty_engine (lỗi thì giữ bản mẫu)"""
     try:
-        avg_score = performance['avg_score']
-        trend = performance['recent_trend']
-        recent_scores = performance.get('recent_scores', [])
-        
-        # Xác định level hiện tại
-        if avg_score >= 90:
-            current_level = 'advanced'
-        elif avg_score >= 75:
-            current_level = 'intermediate'
-        elif avg_score >= 60:
-            current_level = 'beginner'
-        else:
-            current_level = 'beginner'
+        signals = result['signals']
+        context = f"""Kết quả đánh giá (KHÔNG thay đổi):
+- Level hiện tại: {result['current_level']}, độ khó đề xuất: {result['recommended_difficulty']}
+- Điểm TB: {performance['avg_score']}%, TB gần đây: {signals['recent_avg']}%
+- Xu hướng: {signals['trend_slope']} điểm/bài, độ lệch chuẩn: {signals['std_dev']}
+- Điểm gần nhất: {performance.get('score_history', [])}"""
         
-        # Context TỐI ƯU
-        context = f"""Điều chỉnh độ khó:
-- Điểm TB: {avg_score}%, Level: {current_level}
-- Xu hướng: {trend}
-- Điểm gần nhất: {recent_scores}"""
-        
-        response = client.chat.completions.create(
+        response = llm_gateway.chat_completion(
+            'recommendations.difficulty',
             model=MODEL,
             messages=[
                 {
                     "role": "system",
                     "content": """AI Difficulty Specialist.
+Viết lời giải thích cho kết quả đánh giá độ khó đã có.
 
 Trả về JSON:
 {
-  "current_level": "beginner/intermediate/advanced/expert",
-  "recommended_difficulty": "beginner/intermediate/advanced/expert",
   "reason": "Lý do 2 câu",
   "adjustment_tips": ["Tip 1", "Tip 2"]
 }
 
-QUY TẮC:
-- beginner: <70%, intermediate: 70-84%, advanced: 85-94%, expert: ≥95%
-- Điểm cao & ổn định → tăng độ khó
-- Điểm thấp → giữ nguyên/giảm
-- TIẾNG VIỆT"""
+TIẾNG VIỆT, thân thiện, động viên"""
                 },
                 {
                     "role": "user",
@@ -322,23 +335,92 @@ QUY TẮC:
             response_format={"type": "json_object"}
         )
         
-        result = json.loads(response.choices[0].message.content)
-        return result
+        prose = json.loads(response.choices[0].message.content)
+        return {
+            **result,
+            'reason': prose.get('reason') or result['reason'],
+            'adjustment_tips': prose.get('adjustment_tips') or result['adjustment_tips'],
+            'enriched': True
+        }
         
     except Exception as e:
-        print(f"Lỗi khi điều chỉnh difficulty: {str(e)}")
+        # AI chỉ là phần bổ sung: lỗi (kể cả circuit breaker đang mở) thì dùng lời giải thích mẫu
+        print(f"Lỗi khi bổ sung lời giải thích difficulty: {str(e)}")
+        return result
+
+
+def fallback_result(key):
+    """Kết quả dự phòng của một phần recommendations khi AI lỗi hoặc quá deadline"""
+    if key == 'topics':
         return {
-            "current_level": "intermediate",
-            "recommended_difficulty": "intermediate",
-            "reason": "Tiếp tục với độ khó hiện tại để củng cố kiến thức",
-            "adjustment_tips": ["Làm thêm quiz để đánh giá chính xác hơn"]
+            "fallback": True,
+            "performance_summary": "Đang phân tích dữ liệu của bạn",
+            "next_topics": []
         }
+    return {
+        "fallback": True,
+        "title": "Lộ trình học tập",
+        "description": "Đang tạo lộ trình phù hợp",
+        "total_duration": "3-6 tháng",
+        "milestones": []
+    }
 
 
-def get_personalized_recommendations(learning_data):
+def build_general_tips(performance):
+    """General tips dựa trên performance (tính cục bộ)"""
+    general_tips = []
+    
+    if performance['avg_score'] < 70:
+        general_tips.append("Hãy dành nhiều thời gian hơn để ôn lại các concepts cơ bản trước khi học topics mới")
+        general_tips.append("Thử làm lại các quiz cũ để củng cố kiến thức")
+    
+    if performance['topics_studied'] < 3:
+        general_tips.append("Hãy khám phá thêm nhiều topics khác nhau để tìm ra lĩnh vực bạn yêu thích")
+    
+    if performance['total_time_hours'] < 2:
+        general_tips.append("Dành ít nhất 30 phút mỗi ngày để học tập sẽ giúp bạn tiến bộ nhanh hơn")
+    
+    if performance['weak_topics']:
+        general_tips.append("Tập trung vào các topics bạn còn yếu sẽ giúp tăng điểm số tổng thể")
+    
+    if not general_tips:
+        general_tips.append("Bạn đang học tập rất tốt! Hãy tiếp tục duy trì nhịp độ này")
+        general_tips.append("Thử thách bản thân với các topics nâng cao hơn")
+    
+    return general_tips
+
+
+def build_recommendations_result(performance, results):
+    """
+    Ghép kết quả recommendations từ các phần đã có
+    Dùng cho cả kết quả cuối và partial_result (phần chưa xong thì chưa có key tương ứng)
+    """
+    output = {
+        'recommendations': {
+            'general_tips': build_general_tips(performance)
+        },
+        'performance': performance
+    }
+    if 'topics' in results:
+        output['recommendations']['performance_summary'] = results['topics'].get('performance_summary', '')
+        output['next_topics'] = results['topics'].get('next_topics', [])
+    if 'path' in results:
+        output['learning_path'] = results['path']
+    if 'difficulty' in results:
+        output['difficulty_adjustment'] = results['difficulty']
+    return output
+
+
+def get_personalized_recommendations(learning_data, on_partial=None, deadline=None):
     """
     Main function: Tổng hợp tất cả recommendations với PARALLEL PROCESSING
-    Chạy 3 AI requests đồng thời thay vì tuần tự để giảm thời gian response
+    Chạy các AI requests (next topics, learning path) đồng thời trên pool dùng chung; độ khó tính
+    bằng luật cục bộ. Sau `deadline` giây các request chưa xong bị bỏ, phần đó dùng kết quả dự phòng
+    
+    Args:
+        learning_data: Dict chứa learning data
+        on_partial: Callback(partial) được gọi mỗi khi có thêm một phần hoàn thành
+        deadline: Thời gian tối đa (giây) cho toàn bộ recommendations (mặc định RECOMMENDATIONS_DEADLINE)
     
     Returns:
         Dict chứa:
@@ -347,108 +429,98 @@ def get_personalized_recommendations(learning_data):
         - difficulty_adjustment: Điều chỉnh độ khó
         - general_tips: Các tips chung
     """
+    if deadline is None:
+        deadline = RECOMMENDATIONS_DEADLINE
     start_time = time.time()
+    deadline_at = start_time + deadline
     print("🚀 Bắt đầu phân tích recommendations (parallel mode)...")
     
     # Phân tích performance (local, rất nhanh)
     performance = analyze_performance(learning_data)
     print(f"✅ Performance analyzed: {performance['avg_score']}% avg, {performance['total_quizzes']} quizzes")
     
-    # Chạy 3 AI requests PARALLEL thay vì tuần tự
-    # Điều này giảm thời gian từ ~6-9s xuống còn ~2-3s
-    futures = {}
+    # Độ khó tính bằng luật cục bộ (vài µs); bật DIFFICULTY_LLM_ENRICH thì AI viết lại lời giải thích
+    # như một phần chạy song song, bản mẫu là kết quả dự phòng
+    results = {
+        'difficulty': difficulty_engine.assess(
+            performance['avg_score'], performance.get('score_history', [])
+        )
+    }
+    if on_partial:
+        on_partial(build_recommendations_result(performance, results))
     
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        print("⚡ Submitting 3 parallel AI requests...")
-        
-        # Submit tất cả requests cùng lúc
-        futures['topics'] = executor.submit(recommend_next_topics, learning_data, performance)
-        futures['path'] = executor.submit(generate_learning_path, learning_data, performance)
-        futures['difficulty'] = executor.submit(adjust_difficulty, learning_data, performance)
-        
-        # Đợi tất cả hoàn thành và lấy kết quả
-        results = {}
-        for key, future in futures.items():
+    # Chạy các AI requests PARALLEL thay vì tuần tự
+    futures = {
+        executor.submit(recommend_next_topics, learning_data, performance): 'topics',
+        executor.submit(generate_learning_path, learning_data, performance): 'path',
+    }
+    if DIFFICULTY_LLM_ENRICH:
+        futures[executor.submit(enrich_difficulty, results['difficulty'], performance)] = 'difficulty'
+    print(f"⚡ Submitted {len(futures)} parallel AI requests...")
+    
+    pending = set(futures)
+    while pending:
+        remaining = deadline_at - time.time()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            key = futures[future]
             try:
-                results[key] = future.result(timeout=15)  # Timeout 15s cho mỗi request
+                results[key] = future.result()
                 print(f"✅ {key} completed")
             except Exception as e:
                 print(f"❌ Error in {key}: {str(e)}")
                 import traceback
                 traceback.print_exc()  # In full traceback để debug
-                
-                # Fallback nếu có lỗi
-                if key == 'topics':
-                    results[key] = {
-                        "performance_summary": "Đang phân tích dữ liệu của bạn",
-                        "next_topics": []
-                    }
-                elif key == 'path':
-                    results[key] = {
-                        "title": "Lộ trình học tập",
-                        "description": "Đang tạo lộ trình phù hợp",
-                        "total_duration": "3-6 tháng",
-                        "milestones": []
-                    }
-                else:  # difficulty
-                    results[key] = {
-                        "current_level": "intermediate",
-                        "recommended_difficulty": "intermediate",
-                        "reason": "Đang phân tích",
-                        "adjustment_tips": []
-                    }
-    
-    # General tips dựa trên performance
-    general_tips = []
-    
-    if performance['avg_score'] < 70:
-        general_tips.append("Hãy dành nhiều thời gian hơn để ôn lại các concepts cơ bản trước khi học topics mới")
-        general_tips.append("Thử làm lại các quiz cũ để củng cố kiến thức")
-    
-    if performance['topics_studied'] < 3:
-        general_tips.append("Hãy khám phá thêm nhiều topics khác nhau để tìm ra lĩnh vực bạn yêu thích")
-    
-    if performance['total_time_hours'] < 2:
-        general_tips.append("Dành ít nhất 30 phút mỗi ngày để học tập sẽ giúp bạn tiến bộ nhanh hơn")
+                if key != 'difficulty':
+                    results[key] = fallback_result(key)
+        if done and on_partial and pending:
+            on_partial(build_recommendations_result(performance, results))
     
-    if performance['weak_topics']:
-        general_tips.append("Tập trung vào các topics bạn còn yếu sẽ giúp tăng điểm số tổng thể")
-    
-    if not general_tips:
-        general_tips.append("Bạn đang học tập rất tốt! Hãy tiếp tục duy trì nhịp độ này")
-        general_tips.append("Thử thách bản thân với các topics nâng cao hơn")
+    # Quá deadline: không chờ các request còn lại (request chưa chạy thì bị hủy để trả chỗ trong pool,
+    # request đang chạy tự kết thúc theo deadline của llm_gateway)
+    for future in pending:
+        future.cancel()
+        key = futures[future]
+        print(f"⏱️ {key} quá deadline {deadline}s, dùng kết quả dự phòng")
+        if key != 'difficulty':
+            results[key] = fallback_result(key)
     
+    result = build_recommendations_result(performance, results)
     elapsed_time = time.time() - start_time
+    result['processing_time'] = round(elapsed_time, 2)
     print(f"🎉 Recommendations completed in {elapsed_time:.2f}s (parallel mode)")
     
-    return {
-        'recommendations': {
-            'performance_summary': results['topics'].get('performance_summary', ''),
-            'general_tips': general_tips
-        },
-        'next_topics': results['topics'].get('next_topics', []),
-        'learning_path': results['path'],
-        'difficulty_adjustment': results['difficulty'],
-        'performance': performance,
-        'processing_time': round(elapsed_time, 2)
-    }
+    return result
 
 
 def process_recommendations_job(job_id, learning_data):
     """Xử lý recommendations job trong background thread"""
     try:
         print(f"[Recommendations Job {job_id}] Bắt đầu xử lý...")
-        recommendations_job_storage[job_id]['status'] = 'processing'
-        recommendations_job_storage[job_id]['updated_at'] = datetime.now().isoformat()
+        recommendations_job_storage.update(job_id, status='processing', updated_at=datetime.now().isoformat())
+        
+        # Ghi partial_result mỗi khi có thêm một phần xong để client hiển thị dần
+        def on_partial(partial):
+            recommendations_job_storage.update(
+                job_id,
+                partial_result=partial,
+                updated_at=datetime.now().isoformat()
+            )
         
         # Gọi hàm xử lý recommendations
-        result = get_personalized_recommendations(learning_data)
+        result = get_personalized_recommendations(learning_data, on_partial=on_partial)
         
         # Cập nhật kết quả
-        recommendations_job_storage[job_id]['status'] = 'completed'
-        recommendations_job_storage[job_id]['result'] = result
-        recommendations_job_storage[job_id]['updated_at'] = datetime.now().isoformat()
-        recommendations_job_storage[job_id]['completed_at'] = datetime.now().isoformat()
+        recommendations_job_storage.update(
+            job_id,
+            status='completed',
+            result=result,
+            partial_result=None,
+            updated_at=datetime.now().isoformat(),
+            completed_at=datetime.now().isoformat()
+        )
         
         print(f"[Recommendations Job {job_id}] Hoàn thành!")
         
@@ -456,9 +528,7 @@ def process_recommendations_job(job_id, learning_data):
         print(f"[Recommendations Job {job_id}] Lỗi: {str(e)}")
         import traceback
         traceback.print_exc()
-        recommendations_job_storage[job_id]['status'] = 'failed'
-        recommendations_job_storage[job_id]['error'] = str(e)
-        recommendations_job_storage[job_id]['updated_at'] = datetime.now().isoformat()
+        recommendations_job_storage.update(job_id, status='failed', error=str(e), updated_at=datetime.now().isoformat())
 
 
 def create_recommendations_job(learning_data):
@@ -474,31 +544,138 @@ def create_recommendations_job(learning_data):
     job_id = str(uuid.uuid4())
     
     # Khởi tạo job
-    recommendations_job_storage[job_id] = {
+    recommendations_job_storage.create(job_id, {
         'job_id': job_id,
         'status': 'pending',
-        'learning_data': learning_data,
+        'created_at': datetime.now().isoformat(),
+        'updated_at': datetime.now().isoformat(),
+        'result': None,
+        'error': None
+    })
+    
+    # Đưa job vào hàng đợi của scheduler (pool worker cố định, hàng đợi giới hạn)
+    try:
+        llm_gateway.ensure_available()
+        job_scheduler.submit('recommendations', process_recommendations_job, job_id, learning_data)
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError):
+        recommendations_job_storage.delete(job_id)
+        raise
+    
+    print(f"[Recommendations Job {job_id}] Đã tạo và đưa vào hàng đợi")
+    
+    return job_id
+
+
+# Job cho từng phần recommendations (route next-topics / learning-path / difficulty)
+# Loại job -> hàm tính kết quả từ (learning_data, performance)
+RECOMMENDATION_PARTS = {
+    'next_topics': recommend_next_topics,
+    'learning_path': generate_learning_path,
+    'difficulty': adjust_difficulty,
+}
+
+
+def part_cache_key(part, performance):
+    """Cache key / fingerprint của một phần recommendations (prompt chỉ phụ thuộc vào performance)"""
+    return response_cache.make_key(MODEL, performance, job=part)
+
+
+def process_recommendation_part_job(job_id, part, cache_key, learning_data, performance):
+    """Xử lý job một phần recommendations trong background thread, lưu kết quả vào response cache"""
+    try:
+        print(f"[Recommendations Job {job_id}] Bắt đầu xử lý {part}...")
+        recommendations_job_storage.update(job_id, status='processing', updated_at=datetime.now().isoformat())
+        
+        result = RECOMMENDATION_PARTS[part](learning_data, performance)
+        
+        # Kết quả dự phòng (AI lỗi) không được cache để lần sau gọi lại AI
+        if not result.get('fallback'):
+            response_cache.put(cache_key, result, namespace='recommendations')
+        
+        recommendations_job_storage.update(
+            job_id,
+            status='completed',
+            result=result,
+            updated_at=datetime.now().isoformat(),
+            completed_at=datetime.now().isoformat()
+        )
+        
+        print(f"[Recommendations Job {job_id}] Hoàn thành!")
+        
+    except Exception as e:
+        print(f"[Recommendations Job {job_id}] Lỗi: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        recommendations_job_storage.update(job_id, status='failed', error=str(e), updated_at=datetime.now().isoformat())
+
+
+def create_recommendation_part_job(part, learning_data):
+    """
+    Tạo job cho một phần recommendations và trả về job_id ngay lập tức
+    Cache hit: job hoàn thành ngay (không vào hàng đợi); trùng job đang chạy: gộp vào job đó
+    
+    Args:
+        part: 'next_topics' | 'learning_path' | 'difficulty'
+        learning_data: Dict chứa learning data
+    
+    Returns:
+        String job_id
+    """
+    performance = analyze_performance(learning_data)
+    cache_key = part_cache_key(part, performance)
+    job_id = str(uuid.uuid4())
+    
+    job = {
+        'job_id': job_id,
+        'job_type': part,
+        'status': 'pending',
         'created_at': datetime.now().isoformat(),
         'updated_at': datetime.now().isoformat(),
         'result': None,
         'error': None
     }
     
-    # Chạy xử lý trong background thread
-    thread = threading.Thread(
-        target=process_recommendations_job,
-        args=(job_id, learning_data)
-    )
-    thread.daemon = True
-    thread.start()
+    if part == 'difficulty' and not DIFFICULTY_LLM_ENRICH:
+        # Luật cục bộ: tính ngay, job hoàn thành luôn mà không vào hàng đợi
+        job.update(
+            status='completed',
+            result=adjust_difficulty(learning_data, performance),
+            completed_at=job['updated_at']
+        )
+        recommendations_job_storage.create(job_id, job)
+        return job_id
+    
+    cached = response_cache.get(cache_key, namespace='recommendations')
+    if cached is not None:
+        job.update(status='completed', result=cached, completed_at=job['updated_at'], cached=True)
+        recommendations_job_storage.create(job_id, job)
+        print(f"[Recommendations Job {job_id}] Cache hit ({part}), hoàn thành ngay")
+        return job_id
+    
+    leader_id = recommendations_job_storage.create(job_id, job, fingerprint=cache_key)
+    if leader_id:
+        print(f"[Recommendations Job {job_id}] Gộp vào job đang chạy {leader_id}")
+        return job_id
+    
+    try:
+        llm_gateway.ensure_available()
+        job_scheduler.submit(
+            'recommendations', process_recommendation_part_job, job_id, part, cache_key, learning_data, performance
+        )
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError):
+        recommendations_job_storage.delete(job_id)
+        raise
     
-    print(f"[Recommendations Job {job_id}] Đã tạo và bắt đầu background processing")
+    print(f"[Recommendations Job {job_id}] Đã tạo ({part}) và đưa vào hàng đợi")
     
     return job_id
 
 
-def get_recommendations_job_status(job_id):
-    """Lấy trạng thái của recommendations job"""
-    if job_id not in recommendations_job_storage:
-        return None
-    return recommendations_job_storage[job_id]
+def get_recommendations_job_status(job_id, wait=0, since=None):
+    """
+    Lấy trạng thái của recommendations job
+    Nếu wait > 0: chờ tối đa wait giây đến khi job kết thúc hoặc thay đổi so với since (long-poll)
+    """
+    if wait:
+        return recommendations_job_storage.wait(job_id, wait, since=since)
+    return recommendations_job_storage.get(job_id)
@@ -0,0 +1,203 @@
+"""
+Module cache kết quả LLM theo nội dung request (content-addressed)
+Key là SHA-256 của (model, messages, tham số) sau khi chuẩn hóa, nên các request
+giống hệt nhau (ví dụ roadmap "Machine Learning" / "4 weeks" / "Absolute Beginner")
+không phải gọi lại OpenAI.
+
+Hai tầng cache:
+- memory: LRU trong process (RESPONSE_CACHE_MEMORY_ITEMS mục)
+- disk:   file SQLite dùng chung giữa các worker (RESPONSE_CACHE_PATH)
+Mục cache hết hạn sau RESPONSE_CACHE_TTL giây.
+
+Chính sách biến thể (variants): với variants=N, N lần đầu luôn là miss để tạo N
+kết quả khác nhau, sau đó mỗi lần hit trả về ngẫu nhiên một trong N biến thể
+(dùng cho quiz để người học không nhận mãi một bộ câu hỏi).
+"""
+import os
+import json
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import hashlib
+import unicodedata
+from collections import OrderedDict
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', '1') == '1'
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 7 * 24 * 3600))
+RESPONSE_CACHE_MEMORY_ITEMS = int(os.getenv('RESPONSE_CACHE_MEMORY_ITEMS', 256))
+RESPONSE_CACHE_PATH = os.getenv(
+    'RESPONSE_CACHE_PATH',
+    os.path.join(tempfile.gettempdir(), 'nhan_hoc_response_cache.db')
+)
+
+# Xóa các mục hết hạn trên disk sau mỗi số lần ghi này
+DISK_PURGE_EVERY = 100
+
+
+def _normalize(value):
+    """Chuẩn hóa Unicode (NFC) và khoảng trắng của mọi chuỗi trong request"""
+    if isinstance(value, str):
+        return ' '.join(unicodedata.normalize('NFC', value).split())
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def make_key(model, messages, **params):
+    """Tạo cache key từ model, messages và các tham số gọi API"""
+    payload = json.dumps(
+        _normalize({'model': model, 'messages': messages, 'params': params}),
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _DiskTier:
+    """Tầng cache SQLite, mỗi thread/process dùng connection riêng"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and getattr(self._local, 'pid', None) == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                entries TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, now):
+        row = self._connect().execute(
+            'SELECT entries, created_at FROM responses WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or now - row[1] > RESPONSE_CACHE_TTL:
+            return None
+        return row[0], row[1]
+
+    def put(self, key, entries, created_at):
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO responses (key, entries, created_at) VALUES (?, ?, ?)',
+            (key, entries, created_at)
+        )
+        self._writes += 1
+        if self._writes % DISK_PURGE_EVERY == 0:
+            conn.execute('DELETE FROM responses WHERE created_at < ?', (time.time() - RESPONSE_CACHE_TTL,))
+
+
+_memory = OrderedDict()  # key -> (entries_json, created_at)
+_lock = threading.Lock()
+_disk = _DiskTier(RESPONSE_CACHE_PATH)
+_stats = {}
+
+
+def _count(namespace, name):
+    with _lock:
+        stats = _stats.setdefault(namespace, {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0})
+        stats[name] += 1
+
+
+def _load(key, now):
+    """Đọc danh sách biến thể (JSON) từ memory rồi disk, trả về (entries_json, created_at, tier)"""
+    with _lock:
+        item = _memory.get(key)
+        if item is not None:
+            if now - item[1] <= RESPONSE_CACHE_TTL:
+                _memory.move_to_end(key)
+                return item[0], item[1], 'memory'
+            del _memory[key]
+
+    item = _disk.get(key, now)
+    if item is None:
+        return None, None, None
+    _remember(key, item[0], item[1])
+    return item[0], item[1], 'disk'
+
+
+def _remember(key, entries, created_at):
+    with _lock:
+        _memory[key] = (entries, created_at)
+        _memory.move_to_end(key)
+        while len(_memory) > RESPONSE_CACHE_MEMORY_ITEMS:
+            _memory.popitem(last=False)
+
+
+def get(key, namespace='default', variants=1):
+    """
+    Lấy kết quả đã cache
+
+    Args:
+        key: Cache key từ make_key()
+        namespace: Tên nhóm để thống kê hit/miss (roadmap, quiz, resource...)
+        variants: Số biến thể cần có trước khi bắt đầu dùng lại kết quả
+
+    Returns:
+        Kết quả đã cache (một biến thể ngẫu nhiên), None nếu miss
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    try:
+        entries, _, tier = _load(key, time.time())
+    except Exception as e:
+        print(f"[Response Cache] Lỗi khi đọc cache: {str(e)}")
+        entries, tier = None, None
+
+    if entries is not None:
+        values = json.loads(entries)
+        if len(values) >= variants:
+            _count(namespace, f'{tier}_hits')
+            return random.choice(values)
+
+    _count(namespace, 'misses')
+    return None
+
+
+def put(key, value, namespace='default', variants=1):
+    """Lưu kết quả vào cache (thêm vào danh sách biến thể nếu variants > 1)"""
+    if not RESPONSE_CACHE_ENABLED:
+        return
+    try:
+        now = time.time()
+        entries, created_at, _ = _load(key, now)
+        values = json.loads(entries) if entries is not None else []
+        values = (values + [value])[-variants:]
+        created_at = created_at if values[:-1] else now
+        encoded = json.dumps(values, ensure_ascii=False)
+        _remember(key, encoded, created_at)
+        _disk.put(key, encoded, created_at)
+        _count(namespace, 'stores')
+    except Exception as e:
+        print(f"[Response Cache] Lỗi khi ghi cache: {str(e)}")
+
+
+def get_metrics():
+    """Thống kê hit/miss của cache theo namespace"""
+    with _lock:
+        stats = {namespace: dict(values) for namespace, values in _stats.items()}
+        memory_items = len(_memory)
+    for values in stats.values():
+        lookups = values['memory_hits'] + values['disk_hits'] + values['misses']
+        values['hit_rate'] = round((values['memory_hits'] + values['disk_hits']) / lookups, 3) if lookups else 0
+    return {
+        'enabled': RESPONSE_CACHE_ENABLED,
+        'memory_items': memory_items,
+        'ttl': RESPONSE_CACHE_TTL,
+        'namespaces': stats,
+    }
@@ -1,28 +1,24 @@
-import os
-from openai import OpenAI
 import json
 from dotenv import load_dotenv
 import uuid
-import threading
 from datetime import datetime
+import job_store
+import job_scheduler
+import response_cache
+import llm_gateway
 
 
 load_dotenv()
 
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-    base_url=os.environ.get("OPENAI_BASE_URL")
-)
+# Lưu trữ trạng thái các job (dùng chung giữa các worker)
+job_storage = job_store.get_store('roadmap')
 
-# Lưu trữ trạng thái các job trong bộ nhớ
-job_storage = {}
-
-def create_roadmap_sync(topic, time, knowledge_level):
-    """Hàm tạo roadmap đồng bộ (blocking)"""
+def build_roadmap_request(topic, time, knowledge_level):
+    """Tạo tham số gọi OpenAI cho roadmap (dùng chung cho việc gọi API và cache key)"""
     system_instruction = 'Bạn là một trợ lý AI cung cấp lộ trình học tập được cá nhân hóa tốt dựa trên đầu vào của người dùng. Bạn phải cung cấp các chủ đề con để học với mô tả ngắn gọn về chủ đề con cho biết chính xác nội dung cần học và mỗi chủ đề con sẽ mất bao nhiêu thời gian. Dành nhiều thời gian hơn cho các chủ đề con đòi hỏi nhiều sự hiểu biết hơn. Một điều quan trọng nữa, đảm bảo giữ tất cả các khóa ở dạng chữ thường \nVí dụ đầu ra:\n{\n  "tuần 1": {\n    "chủ đề":"Giới thiệu về Python",\n    "các chủ đề con":[\n      {\n        "chủ đề con":"Bắt đầu với Python",\n        "thời gian":"10 phút",\n        "mô tả":"Học Hello world trong python"\n      },\n      {\n        "chủ đề con":"Kiểu dữ liệu trong Python",\n        "thời gian":"1 giờ",\n        "mô tả":"Tìm hiểu về int, string, boolean, array, dict và ép kiểu dữ liệu"\n      },\n     {\n        "chủ đề con":"Câu lệnh điều kiện trong Python",\n        "thời gian":"30 phút",\n        "mô tả":"Tìm hiểu về toán tử so sánh, câu lệnh if elif else"\n      },\n      {\n        "chủ đề con":"Vòng lặp",\n        "thời gian":"30 phút",\n        "mô tả":"Tìm hiểu về vòng lặp for, vòng lặp while, continue và break"\n      },\n      {\n        "chủ đề con":"Lập trình hướng đối tượng trong Python",\n        "thời gian":"4 giờ",\n        "mô tả":"Tìm hiểu về lớp, đối tượng, kế thừa, đa hình và các khái niệm OOP"\n      },\n    ]\n  }\n}\n Đảm bảo giữ tất cả các khóa ở dạng chữ thường như subtopics, topic, time, etc.'
 
-    response = client.chat.completions.create(
-        model=os.environ.get("OPENAI_MODEL", "gpt-5-nano-2025-08-07"),
+    return dict(
+        model=llm_gateway.DEFAULT_MODEL,
         messages=[
             {
                 "role": "system",
@@ -34,41 +30,54 @@ def create_roadmap_sync(topic, time, knowledge_level):
             }
         ]
     )
+
+def create_roadmap_sync(topic, time, knowledge_level, check_cache=True):
+    """Hàm tạo roadmap đồng bộ (blocking), kết quả được lưu vào response cache"""
+    request = build_roadmap_request(topic, time, knowledge_level)
+    cache_key = response_cache.make_key(**request)
+    if check_cache:
+        cached = response_cache.get(cache_key, namespace='roadmap')
+        if cached is not None:
+            return cached
+
+    response = llm_gateway.chat_completion('roadmap', **request)
     
     result = response.choices[0].message.content
     print(result)
-    return json.loads(result)
+    roadmap_data = json.loads(result)
+    response_cache.put(cache_key, roadmap_data, namespace='roadmap')
+    return roadmap_data
 
 def process_roadmap_job(job_id, topic, time, knowledge_level):
     """Xử lý job tạo roadmap trong background thread"""
     try:
         print(f"[Job {job_id}] Bắt đầu xử lý...")
-        job_storage[job_id]['status'] = 'processing'
-        job_storage[job_id]['updated_at'] = datetime.now().isoformat()
+        job_storage.update(job_id, status='processing', updated_at=datetime.now().isoformat())
         
-        # Tạo roadmap
-        result = create_roadmap_sync(topic, time, knowledge_level)
+        # Tạo roadmap (create_roadmap đã kiểm tra cache trước khi đưa vào hàng đợi)
+        result = create_roadmap_sync(topic, time, knowledge_level, check_cache=False)
         
         # Cập nhật kết quả
-        job_storage[job_id]['status'] = 'completed'
-        job_storage[job_id]['result'] = result
-        job_storage[job_id]['updated_at'] = datetime.now().isoformat()
-        job_storage[job_id]['completed_at'] = datetime.now().isoformat()
+        job_storage.update(
+            job_id,
+            status='completed',
+            result=result,
+            updated_at=datetime.now().isoformat(),
+            completed_at=datetime.now().isoformat()
+        )
         
         print(f"[Job {job_id}] Hoàn thành!")
         
     except Exception as e:
         print(f"[Job {job_id}] Lỗi: {str(e)}")
-        job_storage[job_id]['status'] = 'failed'
-        job_storage[job_id]['error'] = str(e)
-        job_storage[job_id]['updated_at'] = datetime.now().isoformat()
+        job_storage.update(job_id, status='failed', error=str(e), updated_at=datetime.now().isoformat())
 
 def create_roadmap(topic, time, knowledge_level):
     """Tạo job và trả về job_id ngay lập tức"""
     job_id = str(uuid.uuid4())
     
     # Khởi tạo job
-    job_storage[job_id] = {
+    job = {
         'job_id': job_id,
         'status': 'pending',
         'topic': topic,
@@ -80,20 +89,41 @@ def create_roadmap(topic, time, knowledge_level):
         'error': None
     }
     
-    # Chạy xử lý trong background thread
-    thread = threading.Thread(
-        target=process_roadmap_job,
-        args=(job_id, topic, time, knowledge_level)
+    # Cache hit: job hoàn thành ngay, không cần đưa vào hàng đợi
+    cache_key = response_cache.make_key(**build_roadmap_request(topic, time, knowledge_level))
+    cached = response_cache.get(
+        cache_key,
+        namespace='roadmap'
     )
-    thread.daemon = True
-    thread.start()
+    if cached is not None:
+        job.update(status='completed', result=cached, completed_at=job['updated_at'], cached=True)
+        job_storage.create(job_id, job)
+        print(f"[Job {job_id}] Cache hit, hoàn thành ngay")
+        return job_id
+    
+    # Đã có job giống hệt đang chạy: gộp vào job đó thay vì gọi lại OpenAI
+    leader_id = job_storage.create(job_id, job, fingerprint=cache_key)
+    if leader_id:
+        print(f"[Job {job_id}] Gộp vào job đang chạy {leader_id}")
+        return job_id
+    
+    # Đưa job vào hàng đợi của scheduler (pool worker cố định, hàng đợi giới hạn)
+    try:
+        llm_gateway.ensure_available()
+        job_scheduler.submit('roadmap', process_roadmap_job, job_id, topic, time, knowledge_level)
+    except (job_scheduler.QueueFullError, llm_gateway.LLMUnavailableError):
+        job_storage.delete(job_id)
+        raise
     
-    print(f"[Job {job_id}] Đã tạo và bắt đầu background processing")
+    print(f"[Job {job_id}] Đã tạo và đưa vào hàng đợi")
     
     return job_id
 
-def get_job_status(job_id):
-    """Lấy trạng thái của job"""
-    if job_id not in job_storage:
-        return None
-    return job_storage[job_id]
+def get_job_status(job_id, wait=0, since=None):
+    """
+    Lấy trạng thái của job
+    Nếu wait > 0: chờ tối đa wait giây đến khi job kết thúc hoặc thay đổi so với since (long-poll)
+    """
+    if wait:
+        return job_storage.wait(job_id, wait, since=since)
+    return job_storage.get(job_id)
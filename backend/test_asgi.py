@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Test asgi.py: status route và long-poll native, SSE trạng thái job, chat stream bằng AsyncOpenAI
+và client ngắt kết nối giữa chừng (lượt gọi thử của circuit breaker phải được nhả)
+Gọi thẳng ASGI app với receive/send giả, không cần server
+"""
+
+import sys
+import os
+import json
+import asyncio
+from datetime import datetime
+
+import pytest
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, os.path.dirname(__file__))
+
+pytest.importorskip('asgiref')
+
+import asgi
+import roadmap
+import llm_gateway
+
+
+class Response:
+    def __init__(self, messages):
+        start = messages[0]
+        self.status = start['status']
+        self.headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in start['headers']}
+        self.body = b''.join(message.get('body', b'') for message in messages[1:]).decode('utf-8')
+
+    def json(self):
+        return json.loads(self.body)
+
+    def events(self):
+        """Danh sách (event, data) của response SSE"""
+        events = []
+        for block in self.body.split('\n\n'):
+            lines = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+            if 'event' in lines:
+                events.append((lines['event'], json.loads(lines['data'])))
+        return events
+
+
+async def request(method, path, body=None, query='', disconnect_when=None):
+    """
+    Gửi một request tới asgi.app
+    disconnect_when(message): trả True khi muốn client ngắt kết nối sau message vừa gửi
+    """
+    messages = []
+    disconnect = asyncio.Event()
+    pending_body = [json.dumps(body).encode('utf-8') if body is not None else b'']
+
+    async def receive():
+        if pending_body:
+            return {'type': 'http.request', 'body': pending_body.pop(), 'more_body': False}
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+        if disconnect_when is not None and disconnect_when(message):
+            disconnect.set()
+
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode('utf-8'),
+        'root_path': '',
+        'query_string': query.encode('latin-1'),
+        'headers': [(b'content-type', b'application/json')],
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 12345),
+    }
+    await asgi.app(scope, receive, send)
+    # Cho các task bị hủy (stream của client đã ngắt) chạy xong phần dọn dẹp
+    for _ in range(5):
+        await asyncio.sleep(0)
+    return Response(messages)
+
+
+def new_job(job_id, status='pending'):
+    now = datetime.now().isoformat()
+    job = {'job_id': job_id, 'status': status, 'created_at': now, 'updated_at': now, 'result': None, 'error': None}
+    roadmap.job_storage.create(job_id, job)
+
+
+def finish_job(job_id):
+    roadmap.job_storage.update(
+        job_id, status='completed', result={'tuần 1': 'Python'}, updated_at=datetime.now().isoformat()
+    )
+
+
+def test_status_route_is_served_natively(memory_store):
+    new_job('a', status='processing')
+
+    response = asyncio.run(request('GET', '/api/roadmap/status/a'))
+    missing = asyncio.run(request('GET', '/api/roadmap/status/missing'))
+
+    assert response.status == 200
+    assert response.json()['status'] == 'processing'
+    assert missing.status == 404
+
+
+def test_long_poll_returns_when_job_finishes(memory_store):
+    new_job('a', status='processing')
+
+    async def poll():
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, finish_job, 'a')
+        return await request('GET', '/api/roadmap/status/a', query='wait=5')
+
+    response = asyncio.run(poll())
+
+    assert response.json()['status'] == 'completed'
+    assert response.json()['result'] == {'tuần 1': 'Python'}
+
+
+def test_job_events_stream_until_finished(memory_store):
+    new_job('a', status='processing')
+
+    async def listen():
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, finish_job, 'a')
+        return await request('GET', '/api/jobs/a/events')
+
+    response = asyncio.run(listen())
+
+    assert response.headers['content-type'].startswith('text/event-stream')
+    assert [data['status'] for _, data in response.events()] == ['processing', 'completed']
+
+
+def test_other_routes_are_forwarded_to_flask():
+    response = asyncio.run(request('GET', '/'))
+
+    assert response.status == 200
+    assert response.json()['status'] == 'ok'
+
+
+def test_chat_stream_sends_deltas_then_done(fake_llm):
+    fake_llm(lambda kwargs: ['Xin ', 'chào'], asynchronous=True)
+
+    response = asyncio.run(request('POST', '/api/chat/stream', body={'messages': [{'role': 'user', 'content': 'hi'}]}))
+
+    assert response.events() == [
+        ('delta', {'content': 'Xin '}),
+        ('delta', {'content': 'chào'}),
+        ('done', {'result': 'Xin chào'}),
+    ]
+    assert llm_gateway.breaker.state()['consecutive_failures'] == 0
+
+
+def test_chat_stream_requires_messages(fake_llm):
+    response = asyncio.run(request('POST', '/api/chat/stream', body={'messages': []}))
+
+    assert response.status == 400
+
+
+@pytest.mark.parametrize('disconnect_at', ['before_first_token', 'mid_stream'])
+def test_client_disconnect_releases_half_open_probe(fake_llm, disconnect_at):
+    async def slow_reply(kwargs):
+        if disconnect_at == 'before_first_token':
+            await asyncio.sleep(10)
+        return slow_parts()
+
+    async def slow_parts():
+        yield 'Xin '
+        await asyncio.sleep(10)
+        yield 'chào'
+
+    fake_llm(slow_reply, asynchronous=True)
+    breaker = llm_gateway.breaker
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+    breaker._opened_at -= breaker.cooldown
+
+    if disconnect_at == 'before_first_token':
+        def disconnect_when(message):
+            return message['type'] == 'http.response.start'
+    else:
+        def disconnect_when(message):
+            return b'delta' in message.get('body', b'')
+
+    asyncio.run(request(
+        'POST', '/api/chat/stream',
+        body={'messages': [{'role': 'user', 'content': 'hi'}]},
+        disconnect_when=disconnect_when
+    ))
+
+    assert breaker.state()['state'] == 'half_open'
+    # Không bị kẹt ở trạng thái "đang có lời gọi thử": lời gọi sau vẫn được thử
+    breaker.before_call()
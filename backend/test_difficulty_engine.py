@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Test difficulty_engine: ngưỡng trình độ (70/85/95), xu hướng, điểm ước tính và các quyết định độ khó
+"""
+
+import sys
+import os
+
+import pytest
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import difficulty_engine
+
+
+@pytest.mark.parametrize('score, level', [
+    (0, 'beginner'),
+    (69.9, 'beginner'),
+    (70, 'intermediate'),
+    (84.9, 'intermediate'),
+    (85, 'advanced'),
+    (94.9, 'advanced'),
+    (95, 'expert'),
+    (100, 'expert'),
+])
+def test_classify_level_thresholds(score, level):
+    assert difficulty_engine.classify_level(score) == level
+
+
+def test_slope():
+    assert difficulty_engine._slope([60, 70, 80]) == pytest.approx(10)
+    assert difficulty_engine._slope([75, 75, 75, 75]) == 0
+    assert difficulty_engine._slope([90, 80, 70, 60]) == pytest.approx(-10)
+    assert difficulty_engine._slope([80]) == 0
+
+
+@pytest.mark.parametrize('avg_score, scores, decision, current, recommended', [
+    # Chưa đủ số bài gần đây
+    (80, [90, 92], 'insufficient', 'intermediate', 'intermediate'),
+    # Ổn định ở mức cao hơn trình độ chung
+    (80, [88, 89, 90, 89, 90], 'up', 'intermediate', 'advanced'),
+    # Dao động hơn ngưỡng ổn định nhưng đang tăng rõ rệt
+    (72, [70, 76, 82, 88, 94], 'up', 'intermediate', 'advanced'),
+    # Giảm xuống dưới trình độ chung
+    (80, [70, 65, 60, 55, 50], 'down', 'intermediate', 'beginner'),
+    # Dao động mạnh, không có xu hướng
+    (75, [50, 100, 50, 100, 50], 'hold_volatile', 'intermediate', 'intermediate'),
+    # Đang giảm nhưng vẫn trong trình độ hiện tại
+    (80, [92, 88, 84, 80, 76], 'hold_declining', 'intermediate', 'intermediate'),
+    # Đã ở mức thấp nhất thì không giảm thêm
+    (50, [60, 55, 50, 45, 40], 'hold_declining', 'beginner', 'beginner'),
+    # Đã ở mức cao nhất
+    (97, [96, 97, 98, 97, 96], 'hold_top', 'expert', 'expert'),
+    # Phù hợp với trình độ hiện tại
+    (78, [78, 77, 79, 78, 78], 'hold', 'intermediate', 'intermediate'),
+])
+def test_assess_decisions(avg_score, scores, decision, current, recommended):
+    result = difficulty_engine.assess(avg_score, scores)
+
+    assert result['signals']['decision'] == decision
+    assert result['current_level'] == current
+    assert result['recommended_difficulty'] == recommended
+    # Mẫu câu đã điền đủ giá trị
+    assert result['reason'] and '{' not in result['reason']
+    assert len(result['adjustment_tips']) == 2
+    assert all(tip and '{' not in tip for tip in result['adjustment_tips'])
+
+
+def test_signals_project_latest_score_from_trend():
+    scores = [70, 76, 82, 88, 94]
+    signals = difficulty_engine.assess(72, scores)['signals']
+
+    assert signals['recent_avg'] == 82
+    assert signals['trend_slope'] == 6
+    # Trung bình gần đây + độ dốc × nửa số khoảng giữa các bài
+    assert signals['projected_score'] == 82 + 6 * 2
+    assert signals['std_dev'] == pytest.approx(8.5, abs=0.05)
+    assert signals['quizzes_considered'] == 5
+
+
+def test_assess_without_scores_uses_average():
+    result = difficulty_engine.assess(88, [])
+
+    assert result['current_level'] == 'advanced'
+    assert result['recommended_difficulty'] == 'advanced'
+    assert result['signals']['projected_score'] == 88
+    assert result['signals']['decision'] == 'insufficient'
+
+
+def test_assess_is_deterministic():
+    scores = [65, 72, 80, 77, 85]
+    assert difficulty_engine.assess(74, scores) == difficulty_engine.assess(74, list(scores))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Test job_scheduler: pool worker cố định, hàng đợi giới hạn và backpressure
+(QueueFullError -> HTTP 503 kèm Retry-After, job không được giữ lại trong store)
+"""
+
+import sys
+import os
+import threading
+
+import pytest
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import job_scheduler
+import base
+
+
+@pytest.fixture
+def pool():
+    pool = job_scheduler.WorkerPool('test', workers=1, queue_size=1)
+    release = threading.Event()
+    yield pool, release
+    release.set()
+
+
+def test_full_queue_raises_with_retry_after(pool):
+    pool, release = pool
+    started = threading.Event()
+
+    def blocking():
+        started.set()
+        release.wait(5)
+
+    pool.submit(blocking)
+    assert started.wait(5)
+    pool.submit(blocking)
+
+    with pytest.raises(job_scheduler.QueueFullError) as error:
+        pool.submit(blocking)
+
+    assert error.value.job_type == 'test'
+    assert job_scheduler.MIN_RETRY_AFTER <= error.value.retry_after <= job_scheduler.MAX_RETRY_AFTER
+    stats = pool.stats()
+    assert (stats['active'], stats['queue_depth'], stats['submitted'], stats['rejected']) == (1, 1, 2, 1)
+
+
+def test_pool_records_completed_and_failed_jobs():
+    pool = job_scheduler.WorkerPool('test', workers=1, queue_size=2)
+    done = threading.Event()
+
+    def failing():
+        raise RuntimeError('lỗi')
+
+    pool.submit(failing)
+    pool.submit(done.set)
+    assert done.wait(5)
+    pool._queue.join()
+
+    stats = pool.stats()
+    assert (stats['completed'], stats['failed'], stats['active']) == (1, 1, 0)
+
+
+def test_pool_size_is_configurable(monkeypatch):
+    monkeypatch.setattr(job_scheduler, '_pools', {})
+    monkeypatch.setenv('JOB_WORKERS_ROADMAP', '7')
+    monkeypatch.setenv('JOB_QUEUE_SIZE_ROADMAP', '3')
+
+    pool = job_scheduler.get_pool('roadmap')
+
+    assert (pool.workers, pool.queue_size) == (7, 3)
+    assert job_scheduler.get_pool('roadmap') is pool
+
+
+def test_full_queue_returns_503_and_drops_job(monkeypatch, memory_store, isolated_cache, fake_llm):
+    fake_llm(lambda kwargs: '{}')
+
+    def full(job_type, *args, **kwargs):
+        raise job_scheduler.QueueFullError(job_type, 12)
+
+    monkeypatch.setattr(job_scheduler, 'submit', full)
+
+    response = base.api.test_client().post('/api/roadmap', json={'topic': 'Python'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '12'
+    assert response.get_json()['job_type'] == 'roadmap'
+    # Job bị từ chối không còn trong store (và không giữ fingerprint của request sau)
+    assert memory_store.usage() == (0, 0)
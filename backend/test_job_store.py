@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Test job_store: lưu/cập nhật job, retention (TTL, LRU, job bị bỏ dở) và gộp job trùng (single-flight)
+Chạy với cả 3 backend; backend Redis dùng fakeredis (bỏ qua nếu chưa cài)
+"""
+
+import sys
+import os
+import time
+
+import pytest
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import job_store
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def backend(request, tmp_path, monkeypatch):
+    if request.param == 'memory':
+        backend = job_store.MemoryBackend()
+    elif request.param == 'sqlite':
+        backend = job_store.SQLiteBackend(str(tmp_path / 'jobs.db'))
+    else:
+        fakeredis = pytest.importorskip('fakeredis')
+        backend = job_store.RedisBackend(client=fakeredis.FakeRedis())
+    # Ghi thời điểm truy cập ở mọi lần get để test LRU không phải chờ
+    monkeypatch.setattr(job_store, 'ACCESS_TOUCH_INTERVAL', 0)
+    previous = job_store._backend
+    job_store.configure(backend)
+    yield backend
+    job_store.configure(previous)
+
+
+def new_job(job_id, status='pending', **fields):
+    return {'job_id': job_id, 'status': status, 'result': None, 'error': None, **fields}
+
+
+def test_create_get_update(backend):
+    store = job_store.get_store('roadmap')
+    store.create('a', new_job('a'))
+
+    assert store.get('a')['status'] == 'pending'
+    job = store.update('a', status='completed', result={'week 1': 'Tiếng Việt'})
+    assert job['status'] == 'completed'
+    assert store.get('a')['result'] == {'week 1': 'Tiếng Việt'}
+    assert store.get('missing') is None
+    assert store.update('missing', status='failed') is None
+
+
+def test_update_after_delete_does_not_recreate_job(backend):
+    store = job_store.get_store('quiz')
+    store.create('a', new_job('a'))
+    store.delete('a')
+
+    assert store.update('a', status='completed') is None
+    assert store.get('a') is None
+    assert backend.usage() == (0, 0)
+
+
+def test_sweep_expires_finished_jobs_after_ttl(backend, monkeypatch):
+    store = job_store.get_store('roadmap')
+    store.create('done', new_job('done', status='completed'))
+    store.create('running', new_job('running', status='processing'))
+    ttl = job_store.get_ttl('roadmap')
+    monkeypatch.setenv('JOB_STALE_AFTER_ROADMAP', str(ttl * 2))
+
+    assert job_store.sweep(backend, now=time.time() + ttl - 10)['expired_jobs'] == 0
+    result = job_store.sweep(backend, now=time.time() + ttl + 10)
+
+    assert result['expired_jobs'] == 1
+    assert store.get('done') is None
+    # Job chưa kết thúc (và chưa quá hạn bỏ dở) không bị xóa
+    assert store.get('running')['status'] == 'processing'
+
+
+def test_sweep_evicts_least_recently_used_when_over_max_bytes(backend):
+    store = job_store.get_store('quiz')
+    for job_id in ('a', 'b', 'c'):
+        store.create(job_id, new_job(job_id, status='completed', result='x' * 100))
+        time.sleep(0.01)
+    time.sleep(0.01)
+    store.get('a')
+
+    _, total_bytes = backend.usage()
+    result = job_store.sweep(backend, max_bytes=total_bytes - 1)
+
+    assert result['evicted_jobs'] == 1
+    assert store.get('b') is None
+    assert store.get('a') is not None
+    assert store.get('c') is not None
+
+
+def test_blob_counts_towards_size_and_is_deleted_with_job(backend):
+    store = job_store.get_store('pdf')
+    store.create('a', new_job('a'))
+    _, before = backend.usage()
+
+    assert store.put_blob('a', 'file', b'%PDF' * 10)
+    assert store.get_blob('a', 'file') == b'%PDF' * 10
+    assert backend.usage()[1] == before + 40
+
+    store.delete('a')
+    assert store.get_blob('a', 'file') is None
+    assert not store.put_blob('a', 'file', b'x')
+
+
+def test_single_flight_coalesces_duplicate_jobs(backend):
+    store = job_store.get_store('roadmap')
+    assert store.create('leader', new_job('leader'), fingerprint='fp') is None
+    assert store.create('follower', new_job('follower'), fingerprint='fp') == 'leader'
+
+    store.update('leader', status='processing')
+    assert store.get('follower')['status'] == 'processing'
+
+    store.update('leader', status='completed', result={'ok': True})
+    follower = store.get('follower')
+    assert follower['status'] == 'completed'
+    assert follower['result'] == {'ok': True}
+
+    # Job gốc đã kết thúc: job mới cùng fingerprint tự chạy thay vì gộp
+    assert store.create('next', new_job('next'), fingerprint='fp') is None
+
+
+def test_follower_fails_when_leader_is_deleted(backend):
+    store = job_store.get_store('quiz')
+    store.create('leader', new_job('leader'), fingerprint='fp')
+    store.create('follower', new_job('follower'), fingerprint='fp')
+    store.delete('leader')
+
+    assert store.get('follower')['status'] == 'failed'
+
+
+def test_sweep_fails_stale_unfinished_jobs_and_releases_flight(backend):
+    store = job_store.get_store('resource')
+    store.create('stuck', new_job('stuck'), fingerprint='fp')
+    stale_after = job_store.get_stale_after('resource')
+
+    assert job_store.sweep(backend, now=time.time() + stale_after - 10)['stale_jobs'] == 0
+    result = job_store.sweep(backend, now=time.time() + stale_after + 10)
+
+    assert result['stale_jobs'] == 1
+    job = store.get('stuck')
+    assert job['status'] == 'failed'
+    assert job['error']
+    assert store.create('retry', new_job('retry'), fingerprint='fp') is None
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Test learner_profile: cộng dồn sự kiện, bỏ qua sự kiện gửi lại (event id), ghi đồng thời
+và learning_data tạo từ hồ sơ. Chạy với cả 3 backend; Redis dùng fakeredis (bỏ qua nếu chưa cài)
+"""
+
+import sys
+import os
+import threading
+
+import pytest
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import learner_profile
+import learning_metrics
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        backend = learner_profile.MemoryBackend()
+    elif request.param == 'sqlite':
+        backend = learner_profile.SQLiteBackend(str(tmp_path / 'profiles.db'))
+    else:
+        fakeredis = pytest.importorskip('fakeredis')
+        backend = learner_profile.RedisBackend(client=fakeredis.FakeRedis())
+    previous = learner_profile._backend
+    learner_profile.configure(backend)
+    yield backend
+    learner_profile.configure(previous)
+
+
+def quiz(topic, score, day=1, event_id=None):
+    event = {'type': 'quiz', 'topic': topic, 'score': score, 'date': f'2026-01-{day:02d}'}
+    if event_id is not None:
+        event['id'] = event_id
+    return event
+
+
+def test_append_events_accumulates_aggregate(backend):
+    profile, applied, duplicates = learner_profile.append_events('u1', [
+        quiz('Python', 80, day=1),
+        quiz('Python', 60, day=2),
+        quiz('SQL', 90, day=2),
+        {'type': 'activity', 'topic': 'Python', 'duration': 600, 'date': '2026-01-03'},
+        {'type': 'topics', 'topics': ['Python', 'SQL']},
+    ])
+
+    assert (applied, duplicates) == (5, 0)
+    stats = learning_metrics.LearningAggregate.from_dict(profile['aggregate'])
+    assert stats.quiz_count == 3
+    assert stats.avg_score == pytest.approx(230 / 3)
+    assert stats.passed == 2
+    assert stats.topic('Python').quizzes == 2
+    assert len(stats.study_days) == 3
+    assert profile['time_spent'] == {'Python': 600}
+    assert profile['current_topics'] == ['Python', 'SQL']
+    assert learner_profile.summary(profile)['total_quizzes'] == 3
+
+
+def test_resent_events_are_ignored(backend):
+    batch = [quiz('Python', 70, event_id='e1'), quiz('Python', 90, event_id='e2')]
+    learner_profile.append_events('u1', batch)
+
+    profile, applied, duplicates = learner_profile.append_events('u1', batch + [quiz('SQL', 50, event_id='e3')])
+
+    assert (applied, duplicates) == (1, 2)
+    assert profile['aggregate']['quiz_count'] == 3
+    assert profile['version'] == 3
+
+
+def test_invalid_event_rejects_whole_batch(backend):
+    with pytest.raises(learner_profile.ProfileError):
+        learner_profile.append_events('u1', [quiz('Python', 70), {'type': 'quiz', 'topic': 'SQL'}])
+
+    assert learner_profile.get_profile('u1') is None
+
+
+def test_invalid_learner_id(backend):
+    with pytest.raises(learner_profile.ProfileError):
+        learner_profile.append_events('bad id/..', [quiz('Python', 70)])
+    # Lỗi dữ liệu học tập nói chung được API trả về 400
+    assert issubclass(learner_profile.ProfileError, learning_metrics.LearningDataError)
+
+
+def test_concurrent_appends_do_not_lose_events(backend):
+    threads = [
+        threading.Thread(
+            target=lambda worker=worker: [
+                learner_profile.append_events('u1', [quiz('Python', 50 + worker, event_id=f'{worker}-{i}')])
+                for i in range(10)
+            ]
+        )
+        for worker in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    profile = learner_profile.get_profile('u1')
+    assert profile['aggregate']['quiz_count'] == 80
+    assert profile['aggregate']['score_sum'] == sum((50 + worker) * 10 for worker in range(8))
+    assert profile['version'] == 80
+
+
+def test_learning_data_uses_stored_aggregate_beyond_recent_window(backend, monkeypatch):
+    monkeypatch.setattr(learner_profile, 'PROFILE_RECENT_ITEMS', 3)
+    learner_profile.append_events('u1', [quiz('Python', score) for score in (10, 20, 30, 40, 50)])
+
+    learning_data = learner_profile.load_learning_data('u1')
+
+    assert len(learning_data['quiz_results']) == 3
+    stats = learning_metrics.aggregate(learning_data)
+    assert stats.quiz_count == 5
+    assert stats.avg_score == 30
+
+
+def test_client_supplied_aggregate_is_ignored(backend):
+    fake = {'quiz_count': 5, 'score_sum': 500, 'passed': 5, 'topics': {}, 'study_days': [], 'recent_scores': []}
+    learning_data = {'quiz_results': [quiz('Python', 10)], 'learning_activities': [], 'aggregate': fake}
+
+    assert learning_metrics.aggregate(learning_data).avg_score == 10
+    profile = learner_profile.replace_profile('u1', learning_data)
+    assert profile['aggregate']['quiz_count'] == 1
+    assert profile['aggregate']['score_sum'] == 10
+
+
+def test_malformed_stored_aggregate_raises_learning_data_error():
+    with pytest.raises(learning_metrics.LearningDataError):
+        learning_metrics.LearningAggregate.from_dict({})
+
+
+def test_missing_profile(backend):
+    with pytest.raises(learner_profile.ProfileNotFoundError):
+        learner_profile.load_learning_data('nobody')
+    assert learner_profile.delete_profile('nobody') is False
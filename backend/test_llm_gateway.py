@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Test llm_gateway: một client (một pool kết nối) cho mỗi process, deadline theo endpoint,
+thử lại khi lỗi upstream và circuit breaker (kể cả khi gọi ở chế độ stream hoặc bị hủy giữa chừng)
+"""
+
+import sys
+import os
+import time
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import llm_gateway
+
+
+@pytest.fixture
+def fresh_client(monkeypatch):
+    monkeypatch.setattr(llm_gateway, '_client', None)
+    monkeypatch.setattr(llm_gateway, '_client_pid', None)
+    monkeypatch.setattr(llm_gateway, 'OPENAI_API_KEY', 'test')
+
+
+def test_client_is_shared_within_a_process(fresh_client):
+    client = llm_gateway.get_client()
+
+    assert llm_gateway.get_client() is client
+    assert client.max_retries == 0
+
+
+def test_client_is_rebuilt_after_fork(fresh_client, monkeypatch):
+    client = llm_gateway.get_client()
+    monkeypatch.setattr(llm_gateway.os, 'getpid', lambda: -1)
+
+    assert llm_gateway.get_client() is not client
+
+
+def test_all_calls_go_through_configured_client(fake_llm):
+    client = fake_llm(lambda kwargs: 'xin chào')
+
+    response = llm_gateway.chat_completion('chat', messages=[{'role': 'user', 'content': 'hi'}])
+
+    assert response.choices[0].message.content == 'xin chào'
+    assert client.calls[0]['model'] == llm_gateway.DEFAULT_MODEL
+    assert llm_gateway.get_metrics()['endpoints']['chat']['calls'] == 1
+
+
+def test_deadline_lookup(monkeypatch):
+    monkeypatch.setenv('LLM_DEADLINE_ANALYTICS', '42')
+
+    assert llm_gateway.get_deadline('analytics.insights') == 42
+    assert llm_gateway.get_deadline('chat') == llm_gateway.DEFAULT_DEADLINES['chat']
+    assert llm_gateway.get_deadline('recommendations.next_topics') == llm_gateway.DEFAULT_DEADLINES['recommendations']
+    assert llm_gateway.get_deadline('roadmap') == llm_gateway.LLM_DEADLINE_DEFAULT
+
+
+# ===== Deadline, thử lại và circuit breaker =====
+
+REQUEST = httpx.Request('POST', 'https://api.openai.com/v1/chat/completions')
+MESSAGES = [{'role': 'user', 'content': 'hi'}]
+
+
+def server_error(status=503, headers=None):
+    response = httpx.Response(status, request=REQUEST, headers=headers)
+    return openai.APIStatusError('upstream', response=response, body=None)
+
+
+def replies(*outcomes):
+    """reply() trả lần lượt từng kết quả, phần tử là Exception thì ném ra"""
+    outcomes = iter(outcomes)
+
+    def reply(kwargs):
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return reply
+
+
+def open_breaker(breaker, cooled_down=False):
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+    if cooled_down:
+        breaker._opened_at -= breaker.cooldown
+
+
+def test_breaker_opens_after_threshold_and_rejects():
+    breaker = llm_gateway.CircuitBreaker(threshold=3, cooldown=30)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state()['state'] == 'closed'
+
+    breaker.before_call()
+    breaker.record_failure()
+
+    with pytest.raises(llm_gateway.LLMUnavailableError) as error:
+        breaker.before_call()
+    assert 1 <= error.value.retry_after <= 30
+    with pytest.raises(llm_gateway.LLMUnavailableError):
+        breaker.ensure_available()
+    assert breaker.state()['state'] == 'open'
+    assert (breaker.opened, breaker.rejected) == (1, 2)
+
+
+def test_half_open_admits_one_probe():
+    breaker = llm_gateway.CircuitBreaker(threshold=2, cooldown=30)
+    open_breaker(breaker, cooled_down=True)
+    breaker.ensure_available()
+
+    breaker.before_call()
+    with pytest.raises(llm_gateway.LLMUnavailableError) as error:
+        breaker.before_call()
+    assert error.value.retry_after == 1
+
+    breaker.record_success()
+    assert breaker.state()['state'] == 'closed'
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_and_release_frees_probe():
+    breaker = llm_gateway.CircuitBreaker(threshold=2, cooldown=30)
+    open_breaker(breaker, cooled_down=True)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state()['state'] == 'open'
+    assert breaker.opened == 2
+
+    breaker._opened_at -= breaker.cooldown
+    breaker.before_call()
+    breaker.release()
+    breaker.before_call()
+
+
+def test_retries_transient_errors_then_succeeds(fake_llm):
+    client = fake_llm(replies(server_error(503), server_error(429), 'ok'))
+
+    response = llm_gateway.chat_completion('roadmap', messages=MESSAGES)
+
+    assert response.choices[0].message.content == 'ok'
+    assert len(client.calls) == 3
+    assert llm_gateway.get_metrics()['endpoints']['roadmap']['retries'] == 2
+    assert llm_gateway.breaker.state()['consecutive_failures'] == 0
+
+
+def test_exhausted_retries_count_as_one_breaker_failure(fake_llm, monkeypatch):
+    monkeypatch.setattr(llm_gateway, 'LLM_MAX_RETRIES', 3)
+    client = fake_llm(replies(*[server_error(500)] * 4))
+
+    with pytest.raises(openai.APIStatusError):
+        llm_gateway.chat_completion('roadmap', messages=MESSAGES)
+
+    assert len(client.calls) == 4
+    assert llm_gateway.breaker.state()['consecutive_failures'] == 1
+    assert llm_gateway.get_metrics()['endpoints']['roadmap']['errors'] == 1
+
+
+def test_client_errors_are_not_retried_or_counted(fake_llm):
+    client = fake_llm(replies(server_error(400)))
+
+    with pytest.raises(openai.APIStatusError):
+        llm_gateway.chat_completion('roadmap', messages=MESSAGES)
+
+    assert len(client.calls) == 1
+    assert llm_gateway.breaker.state()['consecutive_failures'] == 0
+
+
+def test_open_breaker_rejects_without_calling_provider(fake_llm):
+    client = fake_llm(replies('ok'))
+    open_breaker(llm_gateway.breaker)
+
+    with pytest.raises(llm_gateway.LLMUnavailableError):
+        llm_gateway.chat_completion('roadmap', messages=MESSAGES)
+    with pytest.raises(llm_gateway.LLMUnavailableError):
+        llm_gateway.ensure_available()
+    assert client.calls == []
+
+
+def test_retry_is_skipped_when_it_would_miss_the_deadline(fake_llm, monkeypatch):
+    monkeypatch.setenv('LLM_DEADLINE_ROADMAP', '0.5')
+    client = fake_llm(replies(server_error(503, headers={'retry-after': '2'}), 'ok'))
+
+    with pytest.raises(openai.APIStatusError):
+        llm_gateway.chat_completion('roadmap', messages=MESSAGES)
+
+    assert len(client.calls) == 1
+    # Timeout của lần gọi không vượt quá thời gian còn lại của deadline
+    assert client.calls[0]['timeout'] <= 0.5
+
+
+def test_backoff_respects_retry_after_header():
+    assert llm_gateway._backoff(0, server_error(429, headers={'retry-after': '3'})) >= 3
+    assert llm_gateway._backoff(0, server_error(429)) <= llm_gateway.LLM_BACKOFF_BASE
+
+
+# ===== Stream: kết quả ghi vào breaker khi đọc hết stream =====
+
+def test_stream_success_is_recorded_when_consumed(fake_llm):
+    fake_llm(lambda kwargs: ['Xin ', 'chào'])
+    llm_gateway.breaker.record_failure()
+
+    stream = llm_gateway.chat_completion('chat.stream', messages=MESSAGES, stream=True)
+    first = next(stream)
+    assert first.choices[0].delta.content == 'Xin '
+    assert llm_gateway.breaker.state()['consecutive_failures'] == 1
+
+    assert [chunk.choices[0].delta.content for chunk in stream] == ['chào']
+    assert llm_gateway.breaker.state()['consecutive_failures'] == 0
+
+
+def test_mid_stream_failure_counts_against_breaker(fake_llm):
+    fake_llm(lambda kwargs: ['Xin ', openai.APIConnectionError(request=REQUEST)])
+
+    stream = llm_gateway.chat_completion('chat.stream', messages=MESSAGES, stream=True)
+    with pytest.raises(openai.APIConnectionError):
+        list(stream)
+
+    assert llm_gateway.breaker.state()['consecutive_failures'] == 1
+    assert llm_gateway.get_metrics()['endpoints']['chat.stream']['errors'] == 1
+
+
+def test_stream_is_stopped_at_the_endpoint_deadline(fake_llm, monkeypatch):
+    monkeypatch.setenv('LLM_DEADLINE_CHAT_STREAM', '0.1')
+
+    def slow(kwargs):
+        yield 'Xin '
+        time.sleep(0.2)
+        yield 'chào'
+
+    fake_llm(slow)
+    stream = llm_gateway.chat_completion('chat.stream', messages=MESSAGES, stream=True)
+
+    with pytest.raises(openai.APITimeoutError):
+        list(stream)
+    assert llm_gateway.breaker.state()['consecutive_failures'] == 1
+
+
+def test_abandoned_stream_releases_half_open_probe(fake_llm):
+    fake_llm(lambda kwargs: ['Xin ', 'chào'])
+    open_breaker(llm_gateway.breaker, cooled_down=True)
+
+    stream = llm_gateway.chat_completion('chat.stream', messages=MESSAGES, stream=True)
+    next(stream)
+    stream.close()
+
+    assert llm_gateway.breaker.state()['state'] == 'half_open'
+    llm_gateway.breaker.before_call()
+
+
+# ===== Lời gọi bị hủy (client ngắt kết nối ở chế độ ASGI) =====
+
+def test_cancelled_async_probe_releases_breaker(fake_llm):
+    async def hang(kwargs):
+        await asyncio.sleep(10)
+        return 'ok'
+
+    fake_llm(hang, asynchronous=True)
+    open_breaker(llm_gateway.breaker, cooled_down=True)
+
+    async def cancel_probe():
+        task = asyncio.ensure_future(llm_gateway.achat_completion('chat.stream', messages=MESSAGES, stream=True))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+
+    assert llm_gateway.breaker.state()['state'] == 'half_open'
+    # Lượt gọi thử đã được nhả: lời gọi sau được thử thay vì bị từ chối mãi
+    llm_gateway.breaker.before_call()
+
+
+def test_cancelled_async_retry_wait_releases_breaker(fake_llm, monkeypatch):
+    monkeypatch.setattr(llm_gateway, '_backoff', lambda attempt, error: 5)
+    fake_llm(replies(server_error(503), 'ok'), asynchronous=True)
+    open_breaker(llm_gateway.breaker, cooled_down=True)
+
+    async def cancel_during_backoff():
+        task = asyncio.ensure_future(llm_gateway.achat_completion('roadmap', messages=MESSAGES))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_during_backoff())
+
+    llm_gateway.breaker.before_call()
+
+
+def test_interrupted_sync_call_releases_breaker(fake_llm):
+    def interrupted(kwargs):
+        raise KeyboardInterrupt
+
+    fake_llm(interrupted)
+    open_breaker(llm_gateway.breaker, cooled_down=True)
+
+    with pytest.raises(KeyboardInterrupt):
+        llm_gateway.chat_completion('roadmap', messages=MESSAGES)
+
+    llm_gateway.breaker.before_call()
+
+
+def test_cancelled_async_stream_releases_breaker(fake_llm):
+    async def slow_parts():
+        yield 'Xin '
+        await asyncio.sleep(10)
+        yield 'chào'
+
+    fake_llm(lambda kwargs: slow_parts(), asynchronous=True)
+    open_breaker(llm_gateway.breaker, cooled_down=True)
+
+    async def consume():
+        stream = await llm_gateway.achat_completion('chat.stream', messages=MESSAGES, stream=True)
+        async for _ in stream:
+            pass
+
+    async def cancel_mid_stream():
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_mid_stream())
+
+    llm_gateway.breaker.before_call()
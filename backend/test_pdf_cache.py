@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Test pdf_cache: key theo SHA-256 nội dung, giới hạn dung lượng khi nhiều worker cùng ghi,
+và upload lại tài liệu đã phân tích trả kết quả ngay (200 kèm download_url)
+"""
+
+import sys
+import os
+import io
+import json
+import time
+
+import pytest
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pdf_cache
+import pdfAnalysis
+import base
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_cache, 'PDF_CACHE_ENABLED', True)
+    monkeypatch.setattr(pdf_cache, 'PDF_CACHE_DIR', str(tmp_path / 'pdf_cache'))
+    monkeypatch.setattr(pdf_cache, '_total_bytes', None)
+    monkeypatch.setattr(pdf_cache, '_stats', {})
+    return tmp_path / 'pdf_cache'
+
+
+def test_digest_of_bytes_and_file_objects_match():
+    data = b'%PDF-1.4 ' * 1000
+    stream = io.BytesIO(data)
+
+    assert pdf_cache.content_digest(stream) == pdf_cache.content_digest(data)
+    assert stream.tell() == 0
+
+
+def test_put_then_get():
+    digest = pdf_cache.content_digest(b'%PDF')
+    assert pdf_cache.get(digest, 'analysis', 'v1') is None
+
+    pdf_cache.put(digest, 'analysis', 'v1', b'{"tieu_de": "A"}')
+
+    assert pdf_cache.get(digest, 'analysis', 'v1') == b'{"tieu_de": "A"}'
+    # Đổi phiên bản prompt/model: miss
+    assert pdf_cache.get(digest, 'analysis', 'v2') is None
+    stats = pdf_cache.get_metrics()['artifacts']['analysis']
+    assert (stats['hits'], stats['misses'], stats['stores']) == (1, 2, 1)
+
+
+def test_least_recently_used_artifacts_are_evicted(monkeypatch):
+    monkeypatch.setattr(pdf_cache, 'PDF_CACHE_MAX_BYTES', 250)
+    digests = [pdf_cache.content_digest(bytes([i])) for i in range(3)]
+    for i, digest in enumerate(digests[:2]):
+        pdf_cache.put(digest, 'text', 'v1', b'x' * 100)
+        os.utime(pdf_cache._path(digest, 'text', 'v1'), (time.time() - 100 + i, time.time() - 100 + i))
+    pdf_cache.get(digests[0], 'text', 'v1')
+
+    pdf_cache.put(digests[2], 'text', 'v1', b'x' * 100)
+
+    assert pdf_cache.get(digests[1], 'text', 'v1') is None
+    assert pdf_cache.get(digests[0], 'text', 'v1') is not None
+    assert pdf_cache.get(digests[2], 'text', 'v1') is not None
+    assert pdf_cache.get_metrics()['bytes'] <= 250
+
+
+def test_writes_from_other_workers_count_towards_limit(monkeypatch):
+    monkeypatch.setattr(pdf_cache, 'PDF_CACHE_MAX_BYTES', 1000)
+    pdf_cache.put(pdf_cache.content_digest(b'a'), 'text', 'v1', b'x' * 100)
+    # Worker khác ghi vào cùng thư mục: process này không biết qua ước tính riêng
+    for i in range(5):
+        digest = pdf_cache.content_digest(bytes([i]) * 2)
+        path = pdf_cache._path(digest, 'flashcard', 'v1')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'y' * 200)
+        os.utime(path, (time.time() - 100, time.time() - 100))
+
+    pdf_cache.put(pdf_cache.content_digest(b'b'), 'text', 'v1', b'x' * 100)
+
+    assert pdf_cache.get_metrics()['bytes'] <= 1000
+    assert sum(size for _, size, _ in pdf_cache._scan()) <= 1000
+
+
+def test_repeat_upload_completes_immediately_with_download_url(memory_store):
+    pdf_data = b'%PDF-1.4 slide bai giang'
+    digest = pdf_cache.content_digest(pdf_data)
+    analysis = {'tieu_de': 'Bài giảng', 'tom_tat': 'Tóm tắt'}
+    pdf_cache.put(digest, 'analysis', pdfAnalysis.PDF_CACHE_TAGS['analysis'], json.dumps(analysis).encode('utf-8'))
+
+    response = base.api.test_client().post(
+        '/api/analyze-pdf',
+        data={'file': (io.BytesIO(pdf_data), 'slides.pdf'), 'format': 'json'},
+        content_type='multipart/form-data'
+    )
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['status'] == 'completed'
+    assert body['cached'] is True
+    assert body['result']['download_url'] == f"/api/analyze-pdf/{body['job_id']}/file?format=json"
+    assert 'pdf_content' not in body['result']
+
+    download = base.api.test_client().get(body['result']['download_url'])
+    assert download.status_code == 200
+    assert json.loads(download.data)['tieu_de'] == 'Bài giảng'
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Test endpoint tải file kết quả /api/analyze-pdf/<job_id>/file: bytes thô kèm Content-Length,
+ETag/If-None-Match (304), Range (206) và status payload chỉ mang download_url
+"""
+
+import sys
+import os
+import json
+from datetime import datetime
+
+import pytest
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pdfAnalysis
+import base
+
+CONTENT = b'%PDF-1.4\n' + bytes(range(256)) * 40
+
+
+@pytest.fixture
+def client(memory_store):
+    return base.api.test_client()
+
+
+def create_job(job_id, status='completed', output_format='pdf'):
+    now = datetime.now().isoformat()
+    pdfAnalysis.pdf_job_storage.create(job_id, {
+        'job_id': job_id,
+        'status': 'pending',
+        'filename': 'bai giang.pdf',
+        'output_format': output_format,
+        'created_at': now,
+        'updated_at': now,
+        'result': None,
+        'error': None,
+    })
+    if status == 'completed':
+        analysis = {'tieu_de': 'Bài giảng', 'tom_tat': 'Tóm tắt'}
+        result = pdfAnalysis.save_export_result(job_id, analysis, 'bai giang.pdf', output_format, CONTENT)
+        pdfAnalysis.pdf_job_storage.update(job_id, status='completed', result=result, completed_at=now)
+
+
+def test_download_returns_raw_bytes(client):
+    create_job('a')
+
+    response = client.get('/api/analyze-pdf/a/file')
+
+    assert response.status_code == 200
+    assert response.data == CONTENT
+    assert response.headers['Content-Type'] == 'application/pdf'
+    assert response.headers['Content-Length'] == str(len(CONTENT))
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert 'bai giang.pdf' in response.headers['Content-Disposition']
+    assert 'private' in response.headers['Cache-Control']
+
+
+def test_status_payload_carries_only_download_url(client):
+    create_job('a')
+
+    body = client.get('/api/analyze-pdf/status/a').get_json()
+
+    assert body['result']['download_url'] == '/api/analyze-pdf/a/file'
+    assert body['result']['size'] == len(CONTENT)
+    assert 'pdf_content' not in body['result']
+    assert len(json.dumps(body)) < 1500
+
+
+def test_etag_revalidation_returns_304(client):
+    create_job('a')
+    etag = client.get('/api/analyze-pdf/a/file').headers['ETag']
+
+    response = client.get('/api/analyze-pdf/a/file', headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_range_request_returns_partial_content(client):
+    create_job('a')
+
+    response = client.get('/api/analyze-pdf/a/file', headers={'Range': 'bytes=100-199'})
+    tail = client.get('/api/analyze-pdf/a/file', headers={'Range': 'bytes=-10'})
+
+    assert response.status_code == 206
+    assert response.data == CONTENT[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(CONTENT)}'
+    assert response.headers['Content-Length'] == '100'
+    assert tail.data == CONTENT[-10:]
+
+
+def test_unsatisfiable_range_returns_416(client):
+    create_job('a')
+
+    response = client.get('/api/analyze-pdf/a/file', headers={'Range': f'bytes={len(CONTENT) + 10}-'})
+
+    assert response.status_code == 416
+
+
+def test_other_format_is_rendered_on_first_download(client):
+    create_job('a')
+
+    response = client.get('/api/analyze-pdf/a/file?format=json')
+
+    assert response.status_code == 200
+    assert json.loads(response.data)['tieu_de'] == 'Bài giảng'
+    assert pdfAnalysis.pdf_job_storage.get_blob('a', 'json') == response.data
+
+
+def test_download_errors(client):
+    create_job('pending', status='pending')
+
+    assert client.get('/api/analyze-pdf/missing/file').status_code == 404
+    assert client.get('/api/analyze-pdf/pending/file').status_code == 409
+    create_job('a')
+    assert client.get('/api/analyze-pdf/a/file?format=docx').status_code == 400
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Test phân tích map-reduce cho PDF dài: chia chunk theo ngân sách ký tự, gộp kết quả từng phần,
+bước map song song và bước reduce tổng hợp (client LLM giả, không gọi mạng)
+"""
+
+import sys
+import os
+import re
+import json
+
+import openai
+import httpx
+import pytest
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pdfAnalysis
+
+FINAL = {
+    'tieu_de': 'Tài liệu',
+    'tom_tat': 'Tóm tắt toàn bộ tài liệu',
+    'cau_hoi_on_tap': [{'cau_hoi': 'Câu hỏi?', 'tra_loi': 'Trả lời'}],
+}
+
+
+def paragraphs(count, size=80):
+    return [f"Đoạn {i}: " + 'x' * size for i in range(count)]
+
+
+def map_reduce_llm(fake_llm, fail_parts=()):
+    """LLM giả: bước map trả ý chính của phần i, bước reduce trả FINAL (stream nếu được yêu cầu)"""
+
+    def reply(kwargs):
+        prompt = kwargs['messages'][-1]['content']
+        match = re.search(r'Đây là phần (\d+)/(\d+)', prompt)
+        if match:
+            index = int(match.group(1))
+            if index in fail_parts:
+                response = httpx.Response(400, request=httpx.Request('POST', 'https://api.openai.com'))
+                raise openai.BadRequestError('bad request', response=response, body=None)
+            content = json.dumps({
+                'tom_tat': f'Ý chính phần {index}',
+                'thuat_ngu_chinh': {f'thuật ngữ {index}': 'định nghĩa', 'chung': f'từ phần {index}'},
+                'phat_hien_chinh': ['phát hiện chung', f'phát hiện {index}'],
+            }, ensure_ascii=False)
+        else:
+            content = json.dumps(FINAL, ensure_ascii=False)
+        if kwargs.get('stream'):
+            return [content[i:i + 50] for i in range(0, len(content), 50)]
+        return content
+
+    return fake_llm(reply)
+
+
+def test_chunks_respect_budget_and_keep_all_text():
+    text = "\n\n".join(paragraphs(20))
+
+    chunks = pdfAnalysis.chia_text_thành_chunk(text, chunk_chars=300)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 300 for chunk in chunks)
+    # Cắt ở ranh giới đoạn: không đoạn nào bị tách
+    assert "\n\n".join(chunks) == text
+
+
+def test_oversized_paragraph_is_hard_split():
+    text = 'y' * 750
+
+    chunks = pdfAnalysis.chia_text_thành_chunk(text, chunk_chars=300)
+
+    assert [len(chunk) for chunk in chunks] == [300, 300, 150]
+    assert ''.join(chunks) == text
+
+
+def test_merge_partials_dedupes_and_keeps_order():
+    merged = pdfAnalysis.gộp_phân_tích_từng_phần([
+        {'tom_tat': 'A', 'thuat_ngu_chinh': {'x': '1'}, 'phat_hien_chinh': ['p', 'q']},
+        {'tom_tat': 'B', 'thuat_ngu_chinh': {'x': '2', 'y': '3'}, 'phat_hien_chinh': ['q', 'r'], 'la': 'bỏ qua'},
+        {'tom_tat': '', 'cau_hoi_on_tap': [{'cau_hoi': 'c'}, {'cau_hoi': 'c'}]},
+    ])
+
+    assert merged['tom_tat'] == ['A', 'B']
+    assert merged['thuat_ngu_chinh'] == {'x': '1', 'y': '3'}
+    assert merged['phat_hien_chinh'] == ['p', 'q', 'r']
+    assert merged['cau_hoi_on_tap'] == [{'cau_hoi': 'c'}]
+    assert 'la' not in merged
+
+
+def test_long_document_is_fully_covered(fake_llm, monkeypatch):
+    monkeypatch.setattr(pdfAnalysis, 'PDF_CHUNK_CHARS', 300)
+    monkeypatch.setattr(pdfAnalysis, 'PDF_ANALYSIS_MAX_CHARS', 500)
+    client = map_reduce_llm(fake_llm)
+    text = "\n\n".join(paragraphs(20))
+    chunk_count = len(pdfAnalysis.chia_text_thành_chunk(text))
+    progress = []
+
+    analysis = pdfAnalysis.phân_tích_với_ai(text, on_progress=lambda done, total: progress.append(done / total))
+
+    map_calls = [call for call in client.calls if 'Đây là phần' in call['messages'][-1]['content']]
+    assert len(map_calls) == chunk_count
+    # Mọi đoạn của tài liệu đều được gửi cho bước map
+    sent = ''.join(call['messages'][-1]['content'] for call in map_calls)
+    assert all(paragraph in sent for paragraph in paragraphs(20))
+    assert len(client.calls) == chunk_count + 1
+
+    # Bước reduce nhận ý chính đã gộp của mọi phần
+    reduce_prompt = client.calls[-1]['messages'][-1]['content']
+    assert all(f'Ý chính phần {i}' in reduce_prompt for i in range(1, chunk_count + 1))
+    assert analysis['tom_tat'] == FINAL['tom_tat']
+    # Trường AI tổng hợp bỏ sót được lấy từ kết quả từng phần
+    assert analysis['thuat_ngu_chinh']['chung'] == 'từ phần 1'
+    assert analysis['phat_hien_chinh'][0] == 'phát hiện chung'
+    assert progress == sorted(progress)
+    assert progress[-1] <= 1.0
+
+
+def test_failed_chunks_are_skipped(fake_llm, monkeypatch):
+    monkeypatch.setattr(pdfAnalysis, 'PDF_CHUNK_CHARS', 300)
+    client = map_reduce_llm(fake_llm, fail_parts=(2,))
+
+    analysis = pdfAnalysis.phân_tích_map_reduce("\n\n".join(paragraphs(20)))
+
+    assert analysis['tieu_de'] == FINAL['tieu_de']
+    assert 'Ý chính phần 2' not in client.calls[-1]['messages'][-1]['content']
+
+
+def test_all_chunks_failing_raises(fake_llm, monkeypatch):
+    monkeypatch.setattr(pdfAnalysis, 'PDF_CHUNK_CHARS', 300)
+    map_reduce_llm(fake_llm, fail_parts=range(1, 100))
+
+    with pytest.raises(openai.BadRequestError):
+        pdfAnalysis.phân_tích_map_reduce("\n\n".join(paragraphs(20)))
+
+
+def test_chunk_count_is_capped(fake_llm, monkeypatch):
+    monkeypatch.setattr(pdfAnalysis, 'PDF_CHUNK_CHARS', 300)
+    monkeypatch.setattr(pdfAnalysis, 'PDF_MAX_CHUNKS', 2)
+    client = map_reduce_llm(fake_llm)
+
+    pdfAnalysis.phân_tích_map_reduce("\n\n".join(paragraphs(20)))
+
+    assert len(client.calls) == 3
+
+
+def test_short_document_uses_single_call(fake_llm):
+    client = map_reduce_llm(fake_llm)
+
+    analysis = pdfAnalysis.phân_tích_với_ai("\n\n".join(paragraphs(3)))
+
+    assert len(client.calls) == 1
+    assert analysis == FINAL
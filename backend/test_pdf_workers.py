@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Test kích thước process pool mặc định (pdf_workers) và điều kiện bật trích xuất song song
+theo số trang của pdf_text.iter_pages
+"""
+
+import sys
+import os
+import io
+
+import PyPDF2
+import pytest
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pdf_workers
+import pdf_text
+
+
+def blank_pdf(pages):
+    writer = PyPDF2.PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=72, height=72)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('cpus, web_concurrency, expected', [
+    (1, None, 2),
+    (2, None, 2),
+    (8, None, 2),
+    (32, None, 2),
+    (8, '2', 4),
+    (8, '3', 3),
+    (32, '4', 4),
+])
+def test_default_pool_size(monkeypatch, cpus, web_concurrency, expected):
+    monkeypatch.setattr(pdf_workers.os, 'cpu_count', lambda: cpus)
+    if web_concurrency is None:
+        monkeypatch.delenv('WEB_CONCURRENCY', raising=False)
+    else:
+        monkeypatch.setenv('WEB_CONCURRENCY', web_concurrency)
+
+    assert pdf_workers._default_process_workers() == expected
+
+
+@pytest.fixture
+def extraction_modes(monkeypatch):
+    """Ghi lại cách iter_pages trích xuất (song song, tuần tự trong process con) thay vì chạy thật"""
+    modes = []
+
+    def parallel(source, total):
+        modes.append('parallel')
+        yield from ()
+
+    def offloaded(source, max_chars):
+        modes.append('offloaded')
+        yield from ()
+
+    monkeypatch.setattr(pdf_text, '_iter_parallel', parallel)
+    monkeypatch.setattr(pdf_text, '_iter_offloaded', offloaded)
+    monkeypatch.setattr(pdf_workers, 'PDF_PROCESS_OFFLOAD', True)
+    monkeypatch.setattr(pdf_text, 'PDF_PARALLEL_MIN_PAGES', 5)
+    return modes
+
+
+def test_large_document_is_extracted_in_parallel_by_default(extraction_modes, monkeypatch):
+    monkeypatch.setattr(pdf_workers, 'PDF_PROCESS_WORKERS', pdf_workers._default_process_workers())
+    monkeypatch.setattr(pdf_text, 'PDF_EXTRACT_WORKERS', pdf_workers.PDF_PROCESS_WORKERS)
+
+    list(pdf_text.iter_pages(blank_pdf(5)))
+    list(pdf_text.iter_pages(blank_pdf(4)))
+
+    assert extraction_modes == ['parallel', 'offloaded']
+
+
+@pytest.mark.parametrize('process_workers, extract_workers', [(1, 4), (4, 1)])
+def test_parallel_extraction_follows_configured_pool(extraction_modes, monkeypatch, process_workers, extract_workers):
+    monkeypatch.setattr(pdf_workers, 'PDF_PROCESS_WORKERS', process_workers)
+    monkeypatch.setattr(pdf_text, 'PDF_EXTRACT_WORKERS', extract_workers)
+
+    list(pdf_text.iter_pages(blank_pdf(5)))
+
+    assert pdf_text.extract_concurrency() == 1
+    assert extraction_modes == ['offloaded']
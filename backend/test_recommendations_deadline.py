@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Test recommendations chạy song song có deadline: kết quả từng phần được ghi dần vào job
+(partial_result), request quá RECOMMENDATIONS_DEADLINE bị bỏ và thay bằng kết quả dự phòng,
+các AI request chạy trên pool dùng chung (client LLM giả, không gọi mạng)
+"""
+
+import sys
+import os
+import json
+import time
+import threading
+
+import pytest
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import recommendations
+
+LEARNING_DATA = {
+    'quiz_results': [
+        {'topic': 'Python', 'score': 90},
+        {'topic': 'SQL', 'score': 50},
+        {'topic': 'Python', 'score': 85},
+    ],
+    'time_spent': {'Python': 3600, 'SQL': 1800},
+    'current_topics': ['Python', 'SQL'],
+}
+
+TOPICS = {'performance_summary': 'Tiến bộ tốt', 'next_topics': [{'topic': 'Django'}]}
+PATH = {'title': 'Lộ trình Python', 'milestones': [{'title': 'Milestone 1'}]}
+
+
+@pytest.fixture
+def gated_llm(fake_llm):
+    """
+    LLM giả trả TOPICS/PATH theo system prompt; request learning path chờ path_gate
+    (mặc định mở) để giả lập provider trả chậm
+    """
+    path_gate = threading.Event()
+    path_gate.set()
+    threads = []
+
+    def reply(kwargs):
+        threads.append(threading.current_thread().name)
+        if 'Learning Path Designer' in kwargs['messages'][0]['content']:
+            path_gate.wait(5)
+            return json.dumps(PATH, ensure_ascii=False)
+        return json.dumps(TOPICS, ensure_ascii=False)
+
+    client = fake_llm(reply)
+    client.path_gate = path_gate
+    client.threads = threads
+    yield client
+    # Nhả request đang bị giữ để không chiếm chỗ của pool dùng chung sau test
+    path_gate.set()
+
+
+def test_all_parts_complete_with_progressive_partials(gated_llm):
+    # Learning path chỉ trả về sau khi partial có next_topics đã được ghi: thứ tự hoàn thành cố định
+    gated_llm.path_gate.clear()
+    partials = []
+
+    def on_partial(partial):
+        partials.append(partial)
+        if 'next_topics' in partial:
+            gated_llm.path_gate.set()
+
+    result = recommendations.get_personalized_recommendations(LEARNING_DATA, on_partial=on_partial)
+
+    assert result['next_topics'] == TOPICS['next_topics']
+    assert result['learning_path'] == PATH
+    assert 'difficulty_adjustment' in result
+    # Phần cục bộ (độ khó) có ngay, các phần AI được thêm dần
+    assert 'difficulty_adjustment' in partials[0]
+    assert 'next_topics' not in partials[0] and 'learning_path' not in partials[0]
+    assert len(partials) == 2
+    assert 'next_topics' in partials[1] and 'learning_path' not in partials[1]
+
+
+def test_straggler_is_abandoned_after_deadline(gated_llm):
+    gated_llm.path_gate.clear()
+
+    started = time.time()
+    result = recommendations.get_personalized_recommendations(LEARNING_DATA, deadline=0.2)
+
+    assert time.time() - started < 2
+    assert result['next_topics'] == TOPICS['next_topics']
+    assert result['learning_path']['fallback'] is True
+    assert result['learning_path']['milestones'] == []
+
+
+def test_default_deadline_is_read_at_call_time(gated_llm, monkeypatch):
+    monkeypatch.setattr(recommendations, 'RECOMMENDATIONS_DEADLINE', 0.2)
+    gated_llm.path_gate.clear()
+
+    started = time.time()
+    result = recommendations.get_personalized_recommendations(LEARNING_DATA)
+
+    assert time.time() - started < 2
+    assert result['learning_path']['fallback'] is True
+
+
+def test_ai_requests_run_on_shared_pool(gated_llm):
+    recommendations.get_personalized_recommendations(LEARNING_DATA)
+    recommendations.get_personalized_recommendations(LEARNING_DATA)
+
+    assert len(gated_llm.threads) == 4
+    assert all(name.startswith('recommendations') for name in gated_llm.threads)
+    assert len(set(gated_llm.threads)) <= recommendations.RECOMMENDATIONS_AI_WORKERS
+
+
+def test_job_record_carries_partial_result_until_completed(gated_llm, memory_store, monkeypatch):
+    storage = recommendations.recommendations_job_storage
+    snapshots = []
+    update = storage.update
+
+    def recording_update(job_id, **fields):
+        update(job_id, **fields)
+        snapshots.append(storage.get(job_id))
+        if 'next_topics' in (fields.get('partial_result') or {}):
+            gated_llm.path_gate.set()
+
+    monkeypatch.setattr(storage, 'update', recording_update)
+    storage.create('a', {'job_id': 'a', 'status': 'pending', 'result': None, 'error': None})
+    gated_llm.path_gate.clear()
+
+    recommendations.process_recommendations_job('a', LEARNING_DATA)
+
+    partial = [job['partial_result'] for job in snapshots if job.get('partial_result')]
+    assert len(partial) == 2
+    assert 'difficulty_adjustment' in partial[0] and 'next_topics' not in partial[0]
+    assert 'next_topics' in partial[1]
+    assert all(job['status'] == 'processing' for job in snapshots[:-1])
+    final = storage.get('a')
+    assert final['status'] == 'completed'
+    assert final['partial_result'] is None
+    assert final['result']['learning_path'] == PATH
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Test response_cache: chuẩn hóa cache key, hai tầng memory/disk, TTL và biến thể (variants)
+"""
+
+import sys
+import os
+from collections import OrderedDict
+
+import pytest
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import response_cache
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    """Cache riêng cho từng test (file SQLite tạm, tầng memory rỗng)"""
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_ENABLED', True)
+    monkeypatch.setattr(response_cache, '_memory', OrderedDict())
+    monkeypatch.setattr(response_cache, '_disk', response_cache._DiskTier(str(tmp_path / 'cache.db')))
+    monkeypatch.setattr(response_cache, '_stats', {})
+    return response_cache
+
+
+def messages(text):
+    return [{'role': 'user', 'content': text}]
+
+
+def test_key_normalizes_unicode_and_whitespace():
+    composed = 'Học máy'
+    decomposed = 'Học máy'
+    assert composed != decomposed
+
+    key = response_cache.make_key('model', messages(composed), temperature=0.7)
+    assert response_cache.make_key('model', messages(f'  {decomposed}\n')) != key
+    assert response_cache.make_key('model', messages(f'  {decomposed}\n'), temperature=0.7) == key
+    assert response_cache.make_key('model', messages('Học   máy'), temperature=0.7) == key
+
+
+def test_key_depends_on_model_messages_and_params():
+    key = response_cache.make_key('model', messages('Python'), job='quiz')
+    assert response_cache.make_key('other', messages('Python'), job='quiz') != key
+    assert response_cache.make_key('model', messages('Java'), job='quiz') != key
+    assert response_cache.make_key('model', messages('Python'), job='roadmap') != key
+    # Thứ tự key của dict không ảnh hưởng
+    assert response_cache.make_key('model', {'a': 1, 'b': 2}) == response_cache.make_key('model', {'b': 2, 'a': 1})
+
+
+def test_put_then_get_from_memory_and_disk():
+    key = response_cache.make_key('model', messages('roadmap'))
+    assert response_cache.get(key, namespace='roadmap') is None
+
+    response_cache.put(key, {'week 1': 'Tiếng Việt'}, namespace='roadmap')
+    assert response_cache.get(key, namespace='roadmap') == {'week 1': 'Tiếng Việt'}
+
+    # Worker khác (tầng memory rỗng) đọc được từ disk
+    response_cache._memory.clear()
+    assert response_cache.get(key, namespace='roadmap') == {'week 1': 'Tiếng Việt'}
+
+    stats = response_cache.get_metrics()['namespaces']['roadmap']
+    assert (stats['misses'], stats['memory_hits'], stats['disk_hits'], stats['stores']) == (1, 1, 1, 1)
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    key = response_cache.make_key('model', messages('ttl'))
+    response_cache.put(key, 'value')
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_TTL', -1)
+
+    assert response_cache.get(key) is None
+
+
+def test_memory_tier_is_bounded(monkeypatch):
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_MEMORY_ITEMS', 2)
+    keys = [response_cache.make_key('model', messages(str(i))) for i in range(3)]
+    for i, key in enumerate(keys):
+        response_cache.put(key, i)
+
+    assert list(response_cache._memory) == keys[1:]
+    assert response_cache.get(keys[0]) == 0
+
+
+def test_variants_miss_until_enough_results_then_rotate():
+    key = response_cache.make_key('model', messages('quiz'))
+    for i in range(3):
+        assert response_cache.get(key, namespace='quiz', variants=3) is None
+        response_cache.put(key, {'variant': i}, namespace='quiz', variants=3)
+
+    seen = {response_cache.get(key, namespace='quiz', variants=3)['variant'] for _ in range(200)}
+    assert seen == {0, 1, 2}
+
+    # Chỉ giữ N biến thể mới nhất
+    response_cache.put(key, {'variant': 3}, namespace='quiz', variants=3)
+    seen = {response_cache.get(key, namespace='quiz', variants=3)['variant'] for _ in range(200)}
+    assert seen == {1, 2, 3}
+
+
+def test_disabled_cache_never_hits(monkeypatch):
+    key = response_cache.make_key('model', messages('off'))
+    response_cache.put(key, 'value')
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_ENABLED', False)
+
+    assert response_cache.get(key) is None
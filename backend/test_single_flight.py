@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Test gộp job trùng đang chạy (single-flight) ở các module tạo job: roadmap, quiz, analytics
+Client LLM giả chặn lời gọi đầu tiên để các request trùng đến khi job gốc còn đang chạy
+"""
+
+import sys
+import os
+import json
+import threading
+
+import pytest
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import roadmap
+import quiz
+import analytics
+
+ROADMAP = {'tuần 1': {'chủ đề': 'Python', 'các chủ đề con': []}}
+QUIZ = {'questions': [{'question': '1 + 1?', 'options': ['1', '2', '3', '4'], 'answerIndex': 1, 'reason': ''}]}
+
+
+@pytest.fixture
+def blocked_llm(fake_llm, memory_store, isolated_cache):
+    """LLM giả chỉ trả lời sau khi release.set(); reply(kwargs) -> nội dung"""
+    release = threading.Event()
+
+    def install(content):
+        def reply(kwargs):
+            assert release.wait(5)
+            return content
+        return fake_llm(reply)
+
+    install.release = release
+    yield install
+    release.set()
+
+
+def wait_finished(get_job_status, job_id):
+    job = get_job_status(job_id, wait=5)
+    assert job['status'] in ('completed', 'failed')
+    return job
+
+
+def test_identical_roadmaps_share_one_llm_call(blocked_llm):
+    client = blocked_llm(json.dumps(ROADMAP, ensure_ascii=False))
+
+    leader = roadmap.create_roadmap('Python', '4 weeks', 'Beginner')
+    followers = [roadmap.create_roadmap('Python', '4 weeks', 'Beginner') for _ in range(3)]
+
+    assert all(roadmap.job_storage.get(job_id)['leader_job_id'] == leader for job_id in followers)
+    blocked_llm.release.set()
+
+    for job_id in [leader] + followers:
+        job = wait_finished(roadmap.get_job_status, job_id)
+        assert job['status'] == 'completed'
+        assert job['result'] == ROADMAP
+    assert len(client.calls) == 1
+
+
+def test_different_input_is_not_coalesced(blocked_llm):
+    client = blocked_llm(json.dumps(ROADMAP, ensure_ascii=False))
+
+    first = roadmap.create_roadmap('Python', '4 weeks', 'Beginner')
+    second = roadmap.create_roadmap('Python', '8 weeks', 'Beginner')
+
+    assert 'leader_job_id' not in roadmap.job_storage.get(second)
+    blocked_llm.release.set()
+    wait_finished(roadmap.get_job_status, first)
+    wait_finished(roadmap.get_job_status, second)
+    assert len(client.calls) == 2
+
+
+def test_follower_gets_leader_failure(blocked_llm):
+    blocked_llm('không phải JSON')
+
+    leader = quiz.get_quiz('Python', 'Cơ bản', 'Biến', 'Kiểu dữ liệu')
+    follower = quiz.get_quiz('Python', 'Cơ bản', 'Biến', 'Kiểu dữ liệu')
+    blocked_llm.release.set()
+
+    assert wait_finished(quiz.get_job_status, leader)['status'] == 'failed'
+    job = wait_finished(quiz.get_job_status, follower)
+    assert job['status'] == 'failed'
+    assert job['error']
+
+
+def test_finished_leader_releases_fingerprint(blocked_llm):
+    client = blocked_llm(json.dumps(QUIZ))
+    blocked_llm.release.set()
+
+    first = quiz.get_quiz('Python', 'Cơ bản', 'Biến', 'Kiểu dữ liệu')
+    wait_finished(quiz.get_job_status, first)
+    # Quiz giữ nhiều biến thể: lần tạo sau vẫn gọi AI nhưng không gộp vào job đã xong
+    second = quiz.get_quiz('Python', 'Cơ bản', 'Biến', 'Kiểu dữ liệu')
+
+    assert 'leader_job_id' not in quiz.job_storage.get(second)
+    wait_finished(quiz.get_job_status, second)
+    assert len(client.calls) == 2
+
+
+def test_analytics_jobs_coalesce_on_learning_data(blocked_llm):
+    client = blocked_llm(json.dumps({'strengths': [], 'weaknesses': [], 'recommendations': []}))
+    learning_data = {
+        'quiz_results': [{'topic': 'Python', 'score': 80, 'correct_answers': 4, 'total_questions': 5, 'date': '2026-01-01'}],
+        'learning_activities': [],
+    }
+
+    leader = analytics.create_analytics_insights_job(learning_data)
+    follower = analytics.create_analytics_insights_job(dict(learning_data))
+
+    assert analytics.analytics_job_storage.get(follower)['leader_job_id'] == leader
+    blocked_llm.release.set()
+    assert wait_finished(analytics.get_analytics_job_status, follower)['status'] == 'completed'
+    assert len(client.calls) == 1
@@ -148,20 +148,12 @@ const PDFAnalysis = () => {
           setProgress(100);
           setProgressMessage('Hoàn thành!');
 
-          // Decode base64 PDF content với UTF-8 support
-          const pdfBase64 = jobData.result.pdf_content;
-          
-          // Decode base64 thành binary string
-          const binaryString = atob(pdfBase64);
-          
-          // Chuyển binary string thành Uint8Array
-          const bytes = new Uint8Array(binaryString.length);
-          for (let i = 0; i < binaryString.length; i++) {
-            bytes[i] = binaryString.charCodeAt(i);
+          // Tải file PDF kết quả (bytes thô) từ download_url
+          const fileResponse = await fetch(`${API_CONFIG.baseURL}${jobData.result.download_url}`);
+          if (!fileResponse.ok) {
+            throw new Error('Không thể tải file PDF kết quả');
           }
-          
-          // Tạo Blob từ Uint8Array
-          const blob = new Blob([bytes], { type: 'application/pdf' });
+          const blob = await fileResponse.blob();
           const url = URL.createObjectURL(blob);
           
           setResultPdfUrl(url);